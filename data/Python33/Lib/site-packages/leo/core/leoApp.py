@@ -11,13 +11,20 @@
 #@+node:ekr.20120219194520.10463: ** << imports >> (leoApp)
 import leo.core.leoGlobals as g
 
+import hashlib
 import os
 import optparse
 import string
 import sys
+import time
 import traceback
 import zipfile
 
+if g.isPython3:
+    import pickle
+else:
+    import cPickle as pickle
+
 if g.isPython3:
     import io
     StringIO = io.StringIO
@@ -103,6 +110,7 @@ class LeoApp:
         self.nodeIndices = None         # The singleton nodeIndices instance.
         self.pluginsController = None   # The singleton PluginsManager instance.
         self.sessionManager = None      # The singleton SessionManager instance.
+        self.startupProfiler = None     # The StartupProfiler instance, while loading Leo.
 
         # Global status vars...
 
@@ -718,6 +726,17 @@ class LeoApp:
         """ Return list of currently active controllers """
 
         return [f.c for f in g.app.windowList]    
+    #@+node:ekr.20130413052322.10468: *3* app.findGnx
+    def findGnx (self,gnx):
+
+        '''Return (c,v) for the first open commander c containing a vnode v
+        with the given gnx (a string), or (None,None).'''
+
+        for c in g.app.commanders():
+            v = c.gnxIndex and c.gnxIndex.find(gnx)
+            if v:
+                return c,v
+        return None,None
     #@+node:ekr.20090717112235.6007: *3* app.computeSignon
     def computeSignon (self):
 
@@ -1821,7 +1840,9 @@ class LoadManager:
     #@+node:ekr.20120213081706.10382: *4* lm.readGlobalSettingsFiles (changed)
     def readGlobalSettingsFiles (self):
 
-        '''Read leoSettings.leo and myLeoSettings.leo using a null gui.'''
+        '''Read leoSettings.leo and myLeoSettings.leo using a null gui.
+
+        Load the settings snapshot instead if it is up to date.'''
 
         trace = (False or g.trace_startup) and not g.unitTesting
         verbose = False
@@ -1831,12 +1852,15 @@ class LoadManager:
         if trace and g.trace_startup:
             print('\n<<<<< %s' % tag)
 
+        paths = [lm.computeLeoSettingsPath(),lm.computeMyLeoSettingsPath()]
+        key = lm.computeSettingsSnapshotKey(paths)
+        if lm.readSettingsSnapshot(key):
+            return
+        t1 = time.time()
+
         # Open the standard settings files with a nullGui.
         # Important: their commanders do not exist outside this method!
-        commanders = [
-            lm.openSettingsFile(path) for path in (
-                lm.computeLeoSettingsPath(),
-                lm.computeMyLeoSettingsPath())]
+        commanders = [lm.openSettingsFile(path) for path in paths]
 
         settings_d,shortcuts_d = lm.createDefaultSettingsDicts()
 
@@ -1858,6 +1882,143 @@ class LoadManager:
 
         lm.globalSettingsDict = settings_d
         lm.globalShortcutsDict = shortcuts_d
+        lm.writeSettingsSnapshot(key,time.time()-t1)
+    #@+node:ekr.20130413052322.10312: *4* lm.Settings snapshot
+    #@+at The settings snapshot is a pickle of the global settings and shortcuts
+    # dicts, plus the g.app.config ivars set while parsing the settings files.
+    # Its key contains the path, modification time, size and md5 hash of each
+    # settings file and of the code that parses them, so any change to those
+    # files forces a full parse.
+    # 
+    # @buttons and @commands trees refer to nodes of the settings files, so
+    # Leo always parses settings files that contain them.
+    #@@c
+
+    # The g.app.config ivars set by the SettingsTreeParser class.
+    settingsSnapshotIvars = (
+        'context_menus','enabledPluginsFileName','enabledPluginsString',
+        'menusFileName','menusList','modeCommandsDict',
+    )
+
+    #@+others
+    #@+node:ekr.20130413052322.10313: *5* lm.computeSettingsSnapshotKey
+    def computeSettingsSnapshotKey (self,paths):
+
+        '''Return the key of the settings snapshot for the given settings files.'''
+
+        join = g.os_path_finalize_join
+        code = [join(g.app.loadDir,z) for z in ('leoApp.py','leoConfig.py')]
+        key = [sys.version_info[:2]]
+        for path in paths + code:
+            if path and g.os_path_exists(path):
+                try:
+                    f = open(path,'rb')
+                    s = f.read()
+                    f.close()
+                except IOError:
+                    return None
+                key.append((path,os.path.getmtime(path),len(s),
+                    hashlib.md5(s).hexdigest()))
+            else:
+                key.append((path,None))
+        return key
+    #@+node:ekr.20130413052322.10314: *5* lm.readSettingsSnapshot
+    def readSettingsSnapshot (self,key):
+
+        '''Set the global settings dicts from the settings snapshot.
+
+        Return False if the snapshot does not exist or is out of date.'''
+
+        trace = (False or g.trace_startup) and not g.unitTesting
+        lm = self
+        fn = lm.settingsSnapshotPath()
+        if not fn or not key or not g.os_path_exists(fn):
+            return False
+        t1 = time.time()
+        try:
+            f = open(fn,'rb')
+            try:
+                d = pickle.load(f)
+            finally:
+                f.close()
+        except Exception:
+            if trace: g.es_exception()
+            return False
+        if d.get('key') != key:
+            if trace: print('lm.readSettingsSnapshot: out of date')
+            return False
+        lm.globalSettingsDict = d.get('settings')
+        lm.globalShortcutsDict = d.get('shortcuts')
+        config = g.app.config
+        for ivar in lm.settingsSnapshotIvars:
+            if ivar == 'modeCommandsDict':
+                modes = d.get(ivar)
+                for modeName in modes.keys():
+                    config.modeCommandsDict[modeName] = modes.get(modeName)
+            else:
+                setattr(config,ivar,d.get(ivar))
+        elapsed = time.time() - t1
+        if trace or not (g.app.unitTesting or g.app.silentMode or g.app.batchMode):
+            g.blue('read settings snapshot in %2.3f sec. (saved %2.3f sec.)' % (
+                elapsed,max(0,d.get('elapsed') - elapsed)))
+        return True
+    #@+node:ekr.20130413052322.10315: *5* lm.settingsSnapshotPath
+    def settingsSnapshotPath (self):
+
+        '''Return the path to the settings snapshot, or None.'''
+
+        if not g.enableDB or not g.app.homeLeoDir:
+            return None
+        return g.os_path_finalize_join(g.app.homeLeoDir,'db',
+            'settings-snapshot-py%s.pickle' % sys.version_info[0])
+    #@+node:ekr.20130413052322.10316: *5* lm.writeSettingsSnapshot
+    def writeSettingsSnapshot (self,key,elapsed):
+
+        '''Write the settings snapshot for the global settings just parsed.
+
+        elapsed is the time taken to parse the settings files.'''
+
+        trace = (False or g.trace_startup) and not g.unitTesting
+        lm = self
+        fn = lm.settingsSnapshotPath()
+        if not fn or not key:
+            return
+        config = g.app.config
+        gs = lm.globalSettingsDict.get(
+            config.canonicalizeSettingName('use-settings-snapshot'))
+        enabled = not gs or gs.val in (True,None)
+        if not enabled or config.atCommonButtonsList or config.atCommonCommandsList:
+            # Never use an old snapshot for these settings files.
+            if g.os_path_exists(fn):
+                g.utils_remove(fn,verbose=False)
+            return
+        d = {
+            'key': key,
+            'elapsed': elapsed,
+            'settings': lm.globalSettingsDict,
+            'shortcuts': lm.globalShortcutsDict,
+        }
+        for ivar in lm.settingsSnapshotIvars:
+            d[ivar] = getattr(config,ivar)
+        tempName = fn + '.tmp'
+        try:
+            theDir = g.os_path_dirname(fn)
+            if not g.os_path_exists(theDir):
+                os.makedirs(theDir)
+            f = open(tempName,'wb')
+            try:
+                pickle.dump(d,f,pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            if g.os_path_exists(fn):
+                os.remove(fn) # Required on Windows.
+            os.rename(tempName,fn)
+            if trace: print('lm.writeSettingsSnapshot: %s' % fn)
+        except Exception:
+            if trace: g.es_exception()
+            if g.os_path_exists(tempName):
+                g.utils_remove(tempName,verbose=False)
+    #@-others
     #@+node:ekr.20120214165710.10838: *4* lm.traceSettingsDict
     def traceSettingsDict (self,d,verbose=False):
 
@@ -1890,21 +2051,32 @@ class LoadManager:
         # Scan options, set directories and read settings.
         if not lm.isValidPython(): return
 
+        g.app.startupProfiler = prof = StartupProfiler()
+        prof.enter('doPrePluginsInit')
         lm.doPrePluginsInit(fileName,pymacs)
             # sets lm.options and lm.files
+        prof.leave('doPrePluginsInit')
 
         if lm.options.get('version'):
             print(g.app.signon)
+            prof.finish()
             return
         if not g.app.gui:
+            prof.finish()
             return
 
         # Phase 2: load plugins: the gui has already been set.
+        prof.enter('start1')
         g.doHook("start1")
-        if g.app.killed: return
+        prof.leave('start1')
+        if g.app.killed:
+            prof.finish()
+            return
 
         # Phase 3: after loading plugins. Create one or more frames.
+        prof.enter('doPostPluginsInit')
         ok = lm.doPostPluginsInit()
+        prof.finish()
 
         if ok:
             g.es('') # Clears horizontal scrolling in the log pane.
@@ -1918,12 +2090,16 @@ class LoadManager:
 
         # trace = False
         lm = self
+        prof = g.app.startupProfiler
+        if prof: prof.step('computeStandardDirectories')
         lm.computeStandardDirectories()
         lm.adjustSysPath()
 
         # Scan the options as early as possible.
+        if prof: prof.step('scanOptions')
         lm.options = options = lm.scanOptions(fileName,pymacs)
             # also sets lm.files.
+        if prof: prof.fileName = options.get('startup_report')
 
         if options.get('version'):
             g.app.computeSignon()
@@ -1933,24 +2109,30 @@ class LoadManager:
         verbose = script is None
 
         # Init the app.
+        if prof: prof.step('initApp')
         lm.initApp(verbose)
         lm.reportDirectories(verbose)
 
         # Read settings *after* setting g.app.config and *before* opening plugins.
         # This means if-gui has effect only in per-file settings.
+        if prof: prof.step('readGlobalSettingsFiles')
         lm.readGlobalSettingsFiles()
             # reads only standard settings files, using a null gui.
             # uses lm.files[0] to compute the local directory
             # that might contain myLeoSettings.leo.
 
         # Read the recent files file.
+        if prof: prof.step('readRecentFiles')
         localConfigFile = lm.files[0] if lm.files else None
         g.app.recentFilesManager.readRecentFiles(localConfigFile)
 
+        if prof: prof.step('setGlobalDb')
         g.app.setGlobalDb()
 
         # Create the gui after reading options and settings.
+        if prof: prof.step('createGui')
         lm.createGui(pymacs)
+        if prof: prof.step('computeSignon')
 
         # We can't print the signon until we know the gui.
         g.app.computeSignon() # Set app.signon/signon2 for commanders.
@@ -2112,6 +2294,8 @@ class LoadManager:
             help = 'save session tabs on exit')
         add('--silent',       action="store_true", dest="silent",
             help = 'disable all log messages')
+        add('--startup-report',dest='startup_report',
+            help = 'write the times taken by each phase of startup to a json file')
         add('--version',      action="store_true", dest="version",
             help='print version number and exit')
         add('--window-size',  dest='window_size',
@@ -2238,6 +2422,7 @@ class LoadManager:
             'screenshot_fn':screenshot_fn,
             'script':script,
             'select':select,
+            'startup_report':options.startup_report,
             'version':versionFlag,
             'windowFlag':windowFlag,
             'windowSize':windowSize,
@@ -2314,9 +2499,13 @@ class LoadManager:
         c.setLog()
         # print('doPostPluginsInit: ***** set log')
 
+        prof = g.app.startupProfiler
+        if prof: prof.step('start2')
         g.doHook("start2",c=c,p=c.p,v=c.p,fileName=fileName)
         g.enableIdleTimeHook(idleTimeDelay=500)
+        if prof: prof.step('initFocusAndDraw')
         lm.initFocusAndDraw(c,fileName)
+        if prof: prof.leave('initFocusAndDraw')
 
         screenshot_fn = lm.options.get('screenshot_fn')
         if screenshot_fn:
@@ -2515,14 +2704,20 @@ class LoadManager:
                 if trace: g.trace('Already open: %s' % (fn))
                 return c
 
+        prof = g.app.startupProfiler
+        if prof: prof.enter('loadLocalFile: %s' % g.shortFileName(fn))
+
         # Step 1: get the previous settings.
         # For .leo files (and zipped .leo files) this pre-reads the file in a null gui.
         # Otherwise, get settings from leoSettings.leo, myLeoSettings.leo, or default settings.
+        if prof: prof.enter('getPreviousSettings')
         previousSettings = lm.getPreviousSettings(fn)
+        if prof: prof.leave('getPreviousSettings')
 
         # Step 2: open the outline in the requested gui.
         # For .leo files (and zipped .leo file) this opens the file a second time.
         c = lm.openFileByName(fn,gui,old_c,previousSettings)
+        if prof: prof.leave('loadLocalFile: %s' % g.shortFileName(fn))
         return c
     #@+node:ekr.20120223062418.10394: *5* LM.openFileByName & helpers
     def openFileByName (self,fn,gui,old_c,previousSettings):
@@ -2541,6 +2736,8 @@ class LoadManager:
         trace = (False or g.trace_startup) and not g.unitTesting
         if trace: print('lm.openFileByName: %s' % (g.shortFileName(fn)))   
         lm = self
+        prof = g.app.startupProfiler
+        if prof: prof.enter('openFileByName')
 
         # Disable the log.
         g.app.setLog(None)
@@ -2554,7 +2751,9 @@ class LoadManager:
         assert c
 
         # Open the file, if possible.
+        if prof: prof.enter('open0')
         g.doHook('open0')
+        if prof: prof.leave('open0')
         theFile = lm.openLeoOrZipFile(fn)
 
         # Enable the log.
@@ -2566,8 +2765,10 @@ class LoadManager:
         if theFile:
             readAtFileNodesFlag = bool(previousSettings)
             ### The log is not set properly here. ###
+            if prof: prof.enter('readOpenedLeoFile')
             ok = lm.readOpenedLeoFile(c,gui,fn,readAtFileNodesFlag,theFile)
                 # Call c.fileCommands.openLeoFile to read the .leo file.
+            if prof: prof.leave('readOpenedLeoFile')
             if not ok: return None
         else:
             # Create a wrapper .leo file if:
@@ -2579,8 +2780,11 @@ class LoadManager:
         # Phase 3: Complete the initialization.
         g.app.writeWaitingLog(c)
         c.setLog()
+        if prof: prof.step('createMenu')
         lm.createMenu(c,fn)
+        if prof: prof.step('finishOpen')
         lm.finishOpen(c)
+        if prof: prof.leave('openFileByName')
         return c
     #@+node:ekr.20120223062418.10405: *6* LM.createMenu
     def createMenu(self,c,fn=None):
@@ -2659,7 +2863,7 @@ class LoadManager:
         if not g.os_path_exists(fn):
             p = c.rootPosition()
             # Create an empty @edit node unless fn is an .leo file.
-            p.h = g.shortFileName(fn) if fn.endswith('.leo') else '@edit %s' % fn
+            p.h = g.shortFileName(fn) if fn.endswith(('.leo','.leob')) else '@edit %s' % fn
             c.selectPosition(p)
         elif c.looksLikeDerivedFile(fn):
             # 2011/10/10: Create an @file node.
@@ -2689,11 +2893,12 @@ class LoadManager:
     #@+node:ekr.20120223062418.10419: *6* LM.isLeoFile & LM.isZippedFile
     def isLeoFile(self,fn):
 
-        return fn and (zipfile.is_zipfile(fn) or fn.endswith('.leo'))
+        return fn and (zipfile.is_zipfile(fn) or fn.endswith(('.leo','.leob')))
 
     def isZippedFile(self,fn):
 
-        return fn and zipfile.is_zipfile(fn)
+        # Binary outlines may contain anything, including zip signatures.
+        return fn and not fn.endswith('.leob') and zipfile.is_zipfile(fn)
     #@+node:ekr.20120224161905.10030: *6* LM.openLeoOrZipFile
     def openLeoOrZipFile (self,fn):
 
@@ -3272,5 +3477,158 @@ class RecentFilesManager:
         else:
             return False
     #@-others
+#@+node:ekr.20130413052322.10319: ** class StartupProfiler
+class StartupProfiler:
+
+    '''A class recording the wall time, cpu time and memory blocks allocated
+    by each phase of LM.load and by each plugin loaded during startup.
+
+    The --startup-report=path command-line option writes these statistics to
+    path as json and prints a summary, also written to path + '.txt'.'''
+
+    #@+others
+    #@+node:ekr.20130413052322.10320: *3*  sp.ctor
+    def __init__ (self):
+
+        self.fileName = None
+            # The path to the json report, set from the --startup-report option.
+        self.phases = []
+            # A list of dicts, one per phase, in the order they were entered.
+        self.stack = []
+            # A stack of (phase,wall,cpu,blocks) tuples for unfinished phases.
+        self.clock = getattr(time,'process_time',None) or time.clock
+            # process_time does not exist before Python 3.3.
+        self.getBlocks = getattr(sys,'getallocatedblocks',None)
+            # getallocatedblocks does not exist before Python 3.4.
+        self.t0 = time.time()
+        self.enter('load')
+    #@+node:ekr.20130413052322.10321: *3* sp.enter, leave & step
+    def enter (self,name,kind='phase',step=False):
+
+        '''Start a phase within the innermost unfinished phase.'''
+
+        sp = self
+        t = time.time()
+        d = {
+            'name':name,
+            'kind':kind,
+            'depth':len(sp.stack),
+            'start':t - sp.t0,
+            'step':step,
+        }
+        sp.phases.append(d)
+        blocks = sp.getBlocks and sp.getBlocks()
+        sp.stack.append((d,t,sp.clock(),blocks),)
+
+    def leave (self,name):
+
+        '''Finish the named phase and all unfinished phases within it.'''
+
+        sp = self
+        if name not in [d.get('name') for d,wall,cpu,blocks in sp.stack]:
+            return
+        t,cpu2 = time.time(),sp.clock()
+        blocks2 = sp.getBlocks and sp.getBlocks()
+        while sp.stack:
+            d,wall,cpu,blocks = sp.stack.pop()
+            d['wall'] = t - wall
+            d['cpu'] = cpu2 - cpu
+            d['blocks'] = None if blocks is None else blocks2 - blocks
+            if d.get('name') == name:
+                break
+
+    def step (self,name):
+
+        '''Finish the previous step of the innermost phase and start another.'''
+
+        sp = self
+        if sp.stack:
+            d = sp.stack[-1][0]
+            if d.get('step'):
+                sp.leave(d.get('name'))
+        sp.enter(name,step=True)
+    #@+node:ekr.20130413052322.10322: *3* sp.finish & helpers
+    def finish (self):
+
+        '''Finish all phases and write the report if requested.
+
+        Statistics for later phases and plugins are not recorded.'''
+
+        sp = self
+        sp.leave('load')
+        if g.app.startupProfiler is sp:
+            g.app.startupProfiler = None
+        if not sp.fileName:
+            return
+        fn = g.os_path_finalize(sp.fileName)
+        summary = sp.summary()
+        print(summary)
+        try:
+            import json
+            f = open(fn,'w')
+            try:
+                json.dump(sp.report(),f,indent=1,sort_keys=True)
+            finally:
+                f.close()
+            f = open(fn + '.txt','w')
+            try:
+                f.write(summary + '\n')
+            finally:
+                f.close()
+        except Exception:
+            g.es_print('can not write startup report:',fn,color='red')
+            g.es_exception()
+    #@+node:ekr.20130413052322.10323: *4* sp.report
+    def report (self):
+
+        '''Return a dict describing all phases.'''
+
+        import leo.core.leoVersion as leoVersion
+        sp = self
+        phases = [dict([(key,val) for key,val in d.items() if key != 'step'])
+            for d in sp.phases]
+        return {
+            'leo':leoVersion.version,
+            'python':sys.version.split()[0],
+            'platform':sys.platform,
+            'gui':g.app.gui and g.app.gui.guiName(),
+            'total':phases[0].get('wall'),
+            'phases':phases,
+            'plugins':[d for d in phases if d.get('kind') == 'plugin'],
+        }
+    #@+node:ekr.20130413052322.10324: *4* sp.summary
+    def summary (self):
+
+        '''Return a printable summary of all phases.'''
+
+        sp = self
+
+        def line(d):
+            blocks = d.get('blocks')
+            return '%7.3f %7.3f %9s  %s%s' % (
+                d.get('wall'),d.get('cpu'),
+                '--' if blocks is None else blocks,
+                ' '*2*d.get('depth'),d.get('name'))
+
+        heading = '%7s %7s %9s  %s' % ('wall','cpu','blocks','phase')
+        lines = ['startup times in seconds',heading]
+        lines.extend([line(d) for d in sp.phases if d.get('kind') != 'plugin'])
+        # Combine all attempts to load each plugin.
+        plugins = {}
+        for d in sp.phases:
+            if d.get('kind') == 'plugin':
+                d2 = plugins.get(d.get('name'))
+                if d2:
+                    for key in ('wall','cpu','blocks'):
+                        if d2.get(key) is not None:
+                            d2[key] += d.get(key)
+                else:
+                    plugins[d.get('name')] = dict(d,depth=0)
+        if plugins:
+            aList = sorted(plugins.values(),key=lambda d: -d.get('wall'))
+            lines.extend(['','plugins in seconds',heading])
+            lines.extend([line(d) for d in aList])
+        return '\n'.join(lines)
+    #@-others
 #@-others
 #@-leo
@@ -143,9 +143,28 @@ class atFile:
             'check-python-code-on-write',default=True)
         self.underindentEscapeString = c.config.getString(
             'underindent-escape-string') or '\\-'
+        self.skipUnchangedFiles = c.config.getBool(
+            'skip-unchanged-external-files',default=True)
+        self.atomicWrites = c.config.getBool(
+            'atomic-external-file-writes',default=True)
 
         self.dispatch_dict = self.defineDispatchDict()
             # Define the dispatch dictionary used by scanText4.
+        self.tempBodyNodes = set()
+            # All vnodes that may have tempBodyString or tempBodyList attributes.
+            # Cleared by at.deleteAllTempBodyStrings, *not* by initCommonIvars.
+        self.skippedFilesCount = 0
+        self.writtenFilesCount = 0
+        self.writeAllStartTime = 0
+            # Set by at.writeAll, *not* by initCommonIvars.
+        self.pendingWrites = None
+            # A list of bunches describing output files while at.writeAll
+            # defers replacing target files, None otherwise.
+            # Set by at.writeAll, *not* by initCommonIvars.
+        self.parsedTrees = {}
+            # Keys are full paths, values are (key,aList) tuples
+            # for at.read, made by at.readInProcesses.
+            # Set by at.readAll, *not* by initCommonIvars.
     #@+node:ekr.20041005105605.9: *3* at.defineDispatchDict
     def defineDispatchDict(self):
 
@@ -547,6 +566,13 @@ class atFile:
             s,loaded,fileKey = fromString,False,None
         else:
             s,loaded,fileKey = c.cacher.readFile(fileName,root)
+            tree = not loaded and at.parsedTrees.pop(fileName,None)
+            if tree and tree[0] == fileKey:
+                # A worker of at.readInProcesses has read the unchanged file.
+                if trace: g.trace('read by a worker',fileName)
+                c.cacher.restoreTree(root,tree[1],fileName)
+                c.cacher.writeFile(root,fileKey)
+                loaded = True
         # Never read an external file with file-like sentinels from the cache.
         isFileLike = loaded and at.isFileLike(s)
         if not loaded or isFileLike:
@@ -613,11 +639,18 @@ class atFile:
     #@+node:ekr.20041005105605.25: *5* at.deleteAllTempBodyStrings
     def deleteAllTempBodyStrings(self):
 
-        for v in self.c.all_unique_nodes():
+        '''Delete the temp attributes of all vnodes in at.tempBodyNodes.
+
+        Scanning the entire outline here would make reading n external
+        files take time proportional to n times the size of the outline.'''
+
+        at = self
+        for v in at.tempBodyNodes:
             if hasattr(v,"tempBodyString"):
                 delattr(v,"tempBodyString")
             if hasattr(v,"tempBodyList"):
                 delattr(v,"tempBodyList")
+        at.tempBodyNodes = set()
     #@+node:ekr.20100122130101.6174: *5* at.deleteTnodeList
     def deleteTnodeList (self,p): # atFile method.
 
@@ -757,6 +790,10 @@ class atFile:
         if partialFlag: after = p.nodeAfterTree()    
         else: after = c.nullPosition()
 
+        n = not partialFlag and c.config.getInt('external-file-read-processes') or 0
+        if n > 1 and g.enableDB:
+            at.parsedTrees = at.readInProcesses(root,n)
+
         while p and p != after:
             gnx = p.gnx
             #skip clones
@@ -808,12 +845,66 @@ class atFile:
         #for v in c.all_unique_nodes():
         #    v.clearOrphan()
 
+        at.parsedTrees = {}
         if partialFlag and not anyRead and not g.unitTesting:
             g.es("no @<file> nodes in the selected tree")
 
         if use_tracer: tt.stop()
 
         c.raise_error_dialogs()  # 2011/12/17
+    #@+node:ekr.20130413052322.10516: *5* at.readInProcesses
+    def readInProcesses (self,root,n):
+
+        '''Read the external files of the @thin and @file nodes that at.readAll
+        will read and that are not in the cache, in n leoReadWorker.py processes.
+
+        The workers parse the files and return the trees in the format of
+        cacher.makeCacheList. at.read creates the trees on the main thread, in
+        outline order, just as it does for files in the cache, so clones are
+        handled as usual. Files changed since the workers read them, and files
+        the workers could not read, are read by at.read in the usual way.
+
+        Return a dict whose keys are full paths and whose values are (key,aList)
+        tuples, where key is the cacher's key for the file.'''
+
+        trace = False and not g.unitTesting
+        at = self ; c = at.c
+        t1 = time.time()
+        nodes = {}
+        scanned_tnodes = set()
+        p = root.copy()
+        # Visit the nodes that readAll visits.
+        while p:
+            if p.gnx in scanned_tnodes:
+                p.moveToNodeAfterTree()
+                continue
+            scanned_tnodes.add(p.gnx)
+            if not p.h.startswith('@'):
+                p.moveToThreadNext()
+            elif p.isAtIgnoreNode():
+                p.moveToNodeAfterTree()
+            elif p.isAtThinFileNode() or p.isAtFileNode():
+                fileName = at.fullPath(p)
+                if not p.isOrphan() and fileName not in nodes:
+                    s,e = g.readFileIntoString(fileName,raw=True,silent=True)
+                    key = s is not None and c.cacher.fileKey(
+                        p.h,s,requireEncodedString=True)
+                    if key and key not in c.cacher.db:
+                        encoding = (c.scanAllDirectives(p).get('encoding') or
+                            c.config.default_derived_file_encoding)
+                        nodes[fileName] = p.h,encoding
+                p.moveToNodeAfterTree()
+            elif p.isAtAutoNode() or p.isAtEditNode() or p.isAtShadowFileNode():
+                p.moveToNodeAfterTree()
+            else:
+                p.moveToThreadNext()
+        if len(nodes) < 2:
+            return {}
+        results = c.importCommands.runWorkerProcesses('leoReadWorker.py',
+            list(nodes.keys()),{'nodes':nodes},min(n,len(nodes)))
+        if trace: g.trace('%s of %s files in %0.2f sec.' % (
+            len(results),len(nodes),time.time()-t1))
+        return results
     #@+node:ekr.20080801071227.7: *4* at.readAtShadowNodes
     def readAtShadowNodes (self,p):
 
@@ -847,7 +938,7 @@ class atFile:
         # Fix bug 889175: Remember the full fileName.
         at.rememberReadPath(fileName,p)
 
-        s,ok,fileKey = c.cacher.readFile(fileName,p)
+        s,ok,fileKey = c.cacher.readFile(fileName,p,kind='@auto')
         if ok:
             g.doHook('after-auto',c=c,p=p)
                 # call after-auto callbacks
@@ -890,6 +981,14 @@ class atFile:
         # Fix bug 889175: Remember the full fileName.
         at.rememberReadPath(fn,p)
 
+        # readOneAtAutoNode also calls this method: cache only @edit trees.
+        useCache = p.isAtEditNode()
+        if useCache:
+            junk,ok,fileKey = c.cacher.readFile(fn,p,kind='@edit')
+            if ok:
+                g.doHook('after-edit',p=p)
+                return
+
         if not g.unitTesting:
             g.es("reading: @edit %s" % (g.shortFileName(fn)))
 
@@ -915,6 +1014,8 @@ class atFile:
 
         p.b = g.u(head) + g.toUnicode(s,encoding=encoding,reportErrors='True')
         if not changed: c.setChanged(False)
+        if useCache and fileKey:
+            c.cacher.writeFile(p,fileKey)
         g.doHook('after-edit',p=p)
     #@+node:ekr.20080711093251.7: *4* at.readOneAtShadowNode
     def readOneAtShadowNode (self,fn,p,force=False):
@@ -1040,6 +1141,7 @@ class atFile:
 
         # *Always* put the temp body text into at.v.tempBodyString.
         v.tempBodyString = s
+        at.tempBodyNodes.add(v)
         #@-<< handle first and last lines >>
 
         if trace: g.trace(at.encoding,fileName) # root.v.tempBodyString)
@@ -2396,6 +2498,7 @@ class atFile:
                 at.v.tempBodyList.append(s)
             else:
                 at.v.tempBodyList = [s]
+                at.tempBodyNodes.add(at.v)
         else:
             at.out.append(s)
 
@@ -2586,6 +2689,7 @@ class atFile:
 
         # Delete all of root's tree.
         self.root.v.children = []
+        self.c.invalidateOutlineIndex()
         self.root.setDirty()
             # 2010/10/22: the dirty bit gets cleared later, though.
         self.root.setOrphan()
@@ -2718,6 +2822,7 @@ class atFile:
 
         if at.importing:
             v._bodyString = new # Allowed use of _bodyString.
+            v.textChanged()
         elif middle: 
             pass # Middle sentinels never alter text.
         else:
@@ -2736,6 +2841,7 @@ class atFile:
                 at.reportCorrection(old,new,v)
                 v._bodyString = new # Allowed use of _bodyString.
                     # Just setting v.tempBodyString won't work here.
+                v.textChanged()
                 v.setDirty()
                     # Mark the node dirty. Ancestors will be marked dirty later.
                 c.setChanged(True)
@@ -2820,6 +2926,7 @@ class atFile:
 
         # *Always* put the new text into tempBodyString.
         v.tempBodyString = new
+        at.tempBodyNodes.add(v)
 
         if trace: g.trace(
             v.gnx,
@@ -3105,7 +3212,7 @@ class atFile:
                 root.v._p_changed = True
             else:
                 at.writeException() # Sets dirty and orphan bits.
-    #@+node:ekr.20041005105605.147: *4* at.writeAll & helper
+    #@+node:ekr.20041005105605.147: *4* at.writeAll & helpers
     def writeAll(self,
         writeAtFileNodesFlag=False,
         writeDirtyAtFileNodesFlag=False,
@@ -3119,6 +3226,8 @@ class atFile:
         if trace: scanAtPathDirectivesCount = c.scanAtPathDirectivesCount
         writtenFiles = [] # Files that might be written again.
         force = writeAtFileNodesFlag
+        at.writeAllStartTime = time.time()
+        at.skippedFilesCount = at.writtenFilesCount = 0
 
         if writeAtFileNodesFlag:
             # The Write @<file> Nodes command.
@@ -3131,17 +3240,27 @@ class atFile:
             after = c.nullPosition()
 
         at.clearAllOrphanBits(p)
-        while p and p != after:
-            if p.isAtIgnoreNode() and not p.isAtAsisFileNode():
-                if p.isAnyAtFileNode() :
-                    c.ignored_at_file_nodes.append(p.h)
-                # Note: @ignore not honored in @asis nodes.
-                p.moveToNodeAfterTree() # 2011/10/08: Honor @ignore!
-            elif p.isAnyAtFileNode():
-                self.writeAllHelper(p,force,toString,writeAtFileNodesFlag,writtenFiles)
-                p.moveToNodeAfterTree()
-            else:
-                p.moveToThreadNext()
+        if at.atomicWrites and not toString:
+            at.pendingWrites = [] # Tell at.replaceTargetFileIfDifferent to defer renames.
+        try:
+            while p and p != after:
+                if p.isAtIgnoreNode() and not p.isAtAsisFileNode():
+                    if p.isAnyAtFileNode() :
+                        c.ignored_at_file_nodes.append(p.h)
+                    # Note: @ignore not honored in @asis nodes.
+                    p.moveToNodeAfterTree() # 2011/10/08: Honor @ignore!
+                elif p.isAnyAtFileNode():
+                    self.writeAllHelper(p,force,toString,writeAtFileNodesFlag,writtenFiles)
+                    p.moveToNodeAfterTree()
+                else:
+                    p.moveToThreadNext()
+        except Exception:
+            # Don't change any file.
+            for b in at.pendingWrites or []:
+                at.remove(b.outputFileName)
+            at.pendingWrites = None
+            raise
+        at.commitPendingWrites()
 
         #@+<< say the command is finished >>
         #@+node:ekr.20041005105605.150: *5* << say the command is finished >>
@@ -3153,6 +3272,10 @@ class atFile:
                     g.es("no @<file> nodes in the selected tree")
                 else:
                     g.es("no dirty @<file> nodes")
+            if at.skippedFilesCount and not toString:
+                g.es('skipped %s unchanged, wrote %s in %2.2f sec' % (
+                    at.skippedFilesCount,at.writtenFilesCount,
+                    time.time()-at.writeAllStartTime))
         #@-<< say the command is finished >>
         if trace: g.trace('%s calls to c.scanAtPathDirectives()' % (
             c.scanAtPathDirectivesCount-scanAtPathDirectivesCount))
@@ -3180,9 +3303,11 @@ class atFile:
 
         if p.isAtIgnoreNode() and not p.isAtAsisFileNode():
             pathChanged = False
+            fileName = None
         else:
             oldPath = at.getPathUa(p).lower()
-            newPath = at.fullPath(p).lower()
+            fileName = at.fullPath(p)
+            newPath = fileName.lower()
             pathChanged = oldPath and oldPath != newPath
             # 2010/01/27: suppress this message during save-as and save-to commands.
             if pathChanged and not c.ignoreChangedPaths:
@@ -3211,18 +3336,220 @@ class atFile:
                 at.writeOneAtEditNode(p,toString=toString)
                 writtenFiles.append(p.v)
             elif p.isAtNoSentFileNode():
-                at.write(p,kind='@nosent',nosentinels=True,toString=toString)
+                at.writeUnlessUnchanged(p,fileName,kind='@nosent',nosentinels=True,toString=toString)
                 writtenFiles.append(p.v)
             elif p.isAtShadowFileNode():
                 at.writeOneAtShadowNode(p,toString=toString,force=force or pathChanged)
                 writtenFiles.append(p.v)
             elif p.isAtThinFileNode():
-                at.write(p,kind='@thin',thinFile=True,toString=toString)
+                at.writeUnlessUnchanged(p,fileName,kind='@thin',thinFile=True,toString=toString)
                 writtenFiles.append(p.v)
             elif p.isAtFileNode():
                 # Write old @file nodes using @thin format.
-                at.write(p,kind='@file',thinFile=True,toString=toString)
+                at.writeUnlessUnchanged(p,fileName,kind='@file',thinFile=True,toString=toString)
                 writtenFiles.append(p.v)
+    #@+node:ekr.20130413052322.10277: *5* at.writeUnlessUnchanged
+    def writeUnlessUnchanged (self,p,fileName,kind,
+        nosentinels=False,thinFile=False,toString=False
+    ):
+
+        '''Write p using at.write unless the external file already contains
+        the text that at.write would generate. fileName is at.fullPath(p).
+
+        The cacher remembers a fingerprint of the outline for each file
+        written. Nothing is generated or compared if the fingerprint is
+        unchanged and the file has not changed since it was written.'''
+
+        trace = False and not g.unitTesting
+        at = self ; c = at.c
+        fingerprint = None
+        if at.skipUnchangedFiles and fileName and not toString and not p.isOrphan():
+            fingerprint = c.cacher.writeFingerprint(p,kind,fileName)
+            if c.cacher.isUnchangedWrite(fileName,fingerprint):
+                if trace: g.trace('unchanged',fileName)
+                at.rememberReadPath(fileName,p)
+                p.clearDirty()
+                at.skippedFilesCount += 1
+                return
+        at.write(p,kind=kind,nosentinels=nosentinels,thinFile=thinFile,toString=toString)
+        at.writtenFilesCount += 1
+        if not fingerprint:
+            pass
+        elif at.pendingWrites and at.pendingWrites[-1].root == p:
+            # at.commitPendingWrites will remember the fingerprint.
+            b = at.pendingWrites[-1]
+            b.fileName,b.fingerprint = fileName,fingerprint
+        elif not p.isDirty() and not p.isOrphan():
+            c.cacher.rememberWrite(fileName,fingerprint)
+    #@+node:ekr.20130413052322.10280: *5* at.commitPendingWrites & helpers
+    def commitPendingWrites (self):
+
+        '''Replace the target files of all output files generated by
+        at.writeAll, or none of them.
+
+        Compare the output files with the target files, then rename all
+        changed output files in a single phase, keeping the original target
+        files until all renames have succeeded. If any rename fails, restore
+        all original target files and mark all written trees dirty.'''
+
+        trace = False and not g.unitTesting
+        at = self ; c = at.c
+        aList,at.pendingWrites = at.pendingWrites,None
+        if not aList: return
+        # Clones of @<file> nodes write the same output file more than once.
+        d = dict([(b.outputFileName,b) for b in aList])
+        aList = [b for b in aList if d.get(b.outputFileName) is b]
+        t1 = time.time()
+        at.comparePendingWrites(aList)
+        t2 = time.time()
+        at.doWriteHook('compare',n=len(aList),total=len(aList))
+        changed = [b for b in aList if b.changed]
+        for b in changed:
+            if b.exists and b.root and b.checkPythonCode:
+                s,e = g.readFileIntoString(b.outputFileName)
+                if s: at.checkPythonCode(b.root,s=s,targetFn=b.targetFileName)
+        ok = at.renamePendingWrites(changed)
+        t3 = time.time()
+        for b in aList:
+            if not b.changed:
+                at.remove(b.outputFileName)
+        if ok:
+            for b in aList:
+                at.finishPendingWrite(b)
+        else:
+            g.error('error writing %s files: no file was changed' % len(changed))
+            for b in aList:
+                if b.root:
+                    b.root.setDirty()
+                    b.root.setOrphan()
+        at.doWriteHook(g.choose(ok,'done','rollback'),n=len(changed),total=len(aList))
+        if trace: g.trace('compare: %2.3f sec, commit: %2.3f sec, %s of %s files changed' % (
+            t2-t1,t3-t2,len(changed),len(aList)))
+    #@+node:ekr.20130413052322.10281: *6* at.comparePendingWrites
+    def comparePendingWrites (self,aList):
+
+        '''Set b.changed and b.lineEndingsOnly for all bunches b in aList.'''
+
+        at = self
+        for b in aList:
+            b.changed,b.lineEndingsOnly = True,False
+            try:
+                b.exists = g.os_path_exists(b.targetFileName)
+                if b.exists:
+                    s1 = at.readRawFile(b.outputFileName)
+                    s2 = at.readRawFile(b.targetFileName)
+                    b.changed = not at.compareStrings(s1,s2,
+                        ignoreLineEndings=not b.explicitLineEnding,
+                        ignoreBlankLines=b.ignoreBlankLines,
+                        encoding=b.encoding)
+                    b.lineEndingsOnly = b.changed and b.explicitLineEnding and at.compareStrings(
+                        s1,s2,ignoreLineEndings=True,encoding=b.encoding)
+            except Exception:
+                g.error('can not compare %s: %s' % (b.targetFileName,sys.exc_info()[1]))
+    #@+node:ekr.20130413052322.10282: *6* at.renamePendingWrites
+    def renamePendingWrites (self,aList):
+
+        '''Rename the output files of all bunches in aList to their target
+        files, first renaming existing target files to backup files.
+
+        Return True if all went well. Otherwise, undo all renames.'''
+
+        at = self ; c = at.c
+        done = []
+        try:
+            for i,b in enumerate(aList):
+                head,junk = g.os_path_split(b.targetFileName)
+                if head:
+                    g.makeAllNonExistentDirectories(head,c=c)
+                if b.exists:
+                    b.mode = at.stat(b.targetFileName)
+                    b.backupFileName = b.targetFileName + '.leo-backup'
+                    if g.os_path_exists(b.backupFileName):
+                        os.remove(b.backupFileName)
+                    os.rename(b.targetFileName,b.backupFileName)
+                done.append(b)
+                os.rename(b.outputFileName,b.targetFileName)
+                b.renamed = True
+                at.doWriteHook('commit',root=b.root,n=i+1,total=len(aList),
+                    fileName=b.targetFileName)
+        except Exception:
+            g.es_exception()
+            for b in reversed(done):
+                try:
+                    if b.renamed:
+                        os.rename(b.targetFileName,b.outputFileName)
+                    if b.backupFileName:
+                        os.rename(b.backupFileName,b.targetFileName)
+                except Exception:
+                    g.error('can not restore:',b.targetFileName)
+                    g.es_exception()
+            for b in aList:
+                if g.os_path_exists(b.outputFileName):
+                    at.remove(b.outputFileName)
+            return False
+        for b in done:
+            if b.backupFileName:
+                at.remove(b.backupFileName)
+        return True
+    #@+node:ekr.20130413052322.10283: *6* at.finishPendingWrite
+    def finishPendingWrite (self,b):
+
+        '''Do what at.replaceTargetFileIfDifferent does after replacing
+        (or not replacing) a target file.'''
+
+        at = self ; c = at.c
+        if b.root:
+            b.root.clearOrphan()
+            b.root.clearDirty()
+        if not b.changed:
+            g.es('unchanged:',b.shortFileName)
+        else:
+            if b.mode is not None:
+                at.chmod(b.targetFileName,b.mode)
+            c.setFileTimeStamp(b.targetFileName)
+            if b.lineEndingsOnly:
+                g.warning("correcting line endings in:",b.targetFileName)
+            if b.exists:
+                g.es('wrote:',b.shortFileName)
+            else:
+                g.es('created:',b.targetFileName)
+                if b.root:
+                    at.rememberReadPath(b.targetFileName,b.root)
+        if b.fingerprint:
+            c.cacher.rememberWrite(b.fileName,b.fingerprint)
+    #@+node:ekr.20130413052322.10519: *6* at.addPendingWrite
+    def addPendingWrite (self,root,outputFileName,targetFileName,shortFileName,
+        explicitLineEnding,ignoreBlankLines=False,checkPythonCode=True
+    ):
+
+        '''Remember an output file that at.commitPendingWrites will compare
+        with its target file and rename.'''
+
+        at = self
+        at.pendingWrites.append(g.Bunch(
+            root=root and root.copy(),
+            outputFileName=outputFileName,
+            targetFileName=targetFileName,
+            shortFileName=shortFileName,
+            encoding=at.encoding,
+            explicitLineEnding=explicitLineEnding,
+            ignoreBlankLines=ignoreBlankLines,
+            checkPythonCode=checkPythonCode,
+            exists=False,changed=False,lineEndingsOnly=False,
+            mode=None,backupFileName=None,renamed=False,
+            fileName=None,fingerprint=None))
+        at.doWriteHook('generate',root=root,n=len(at.pendingWrites),
+            fileName=targetFileName)
+    #@+node:ekr.20130413052322.10284: *6* at.doWriteHook
+    def doWriteHook (self,phase,root=None,n=0,total=0,fileName=None):
+
+        '''Call the write-progress hook for the given phase of at.writeAll:
+        'generate', 'compare', 'commit', 'done' or 'rollback'.'''
+
+        at = self ; c = at.c
+        g.doHook('write-progress',c=c,p=root,v=root and root.v,
+            phase=phase,n=n,total=total,fileName=fileName,
+            elapsed=time.time()-at.writeAllStartTime)
     #@+node:ekr.20070806105859: *4* at.writeAtAutoNodes & writeDirtyAtAutoNodes & helpers
     def writeAtAutoNodes (self,event=None):
 
@@ -3463,8 +3790,8 @@ class atFile:
             # Write the public and private files.
             if trace: g.trace('writing',fn)
             x.makeShadowDirectory(fn) # makeShadowDirectory takes a *public* file name.
-            at.replaceFileWithString(private_fn,at.private_s)
-            at.replaceFileWithString(fn,at.public_s)
+            at.replaceFileWithString(private_fn,at.private_s,root=root)
+            at.replaceFileWithString(fn,at.public_s,root=root)
 
         self.checkPythonCode(root,s=at.private_s,targetFn=fn)
 
@@ -4669,7 +4996,7 @@ class atFile:
         else:
             return None
     #@+node:ekr.20041005105605.197: *4* compareFiles
-    def compareFiles (self,path1,path2,ignoreLineEndings,ignoreBlankLines=False):
+    def compareFiles (self,path1,path2,ignoreLineEndings,ignoreBlankLines=False,encoding=None):
 
         """Compare two text files."""
         at = self
@@ -4683,12 +5010,24 @@ class atFile:
         if s2 is None:
             g.internalError('empty compare file: %s' % path2)
             return False
+        return at.compareStrings(s1,s2,ignoreLineEndings,ignoreBlankLines,encoding)
+    #@+node:ekr.20130413052322.10496: *4* compareStrings & readRawFile
+    def compareStrings (self,s1,s2,ignoreLineEndings,ignoreBlankLines=False,encoding=None):
+
+        """Compare the raw contents of two text files.
+
+        Unlike at.compareFiles, this method never writes to the log,
+        so worker threads may call it."""
+
+        at = self
+        if not encoding: encoding = at.encoding
         equal = s1 == s2
 
         # 2010/03/29: Make sure both strings are unicode.
         # This is requred to handle binary files in Python 3.x.
-        s1 = g.toUnicode(s1,encoding=at.encoding)
-        s2 = g.toUnicode(s2,encoding=at.encoding)
+        # g.toUnicodeWithErrorCode never writes to the log.
+        s1,ok = g.toUnicodeWithErrorCode(s1,encoding)
+        s2,ok = g.toUnicodeWithErrorCode(s2,encoding)
 
         if ignoreBlankLines and not equal:
             s1 = g.removeBlankLines(s1)
@@ -4704,6 +5043,16 @@ class atFile:
             equal = s1 == s2
         # g.trace('equal',equal,'ignoreLineEndings',ignoreLineEndings,'encoding',at.encoding)
         return equal
+
+    def readRawFile (self,fileName):
+
+        """Return the raw contents of fileName. Raise IOError on failure."""
+
+        f = open(fileName,'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
     #@+node:ekr.20041005105605.198: *4* directiveKind4 (write logic)
     def directiveKind4(self,s,i):
 
@@ -5093,10 +5442,13 @@ class atFile:
                 if len(line)> 0:
                     self.putSentinel("@comment " + line)
     #@+node:ekr.20080712150045.1: *4* replaceFileWithString (atFile)
-    def replaceFileWithString (self,fn,s):
+    def replaceFileWithString (self,fn,s,root=None):
 
         '''Replace the file with s if s is different from theFile's contents.
 
+        While at.writeAll defers writing, write s to an output file and
+        remember it: at.commitPendingWrites replaces the file later.
+
         Return True if theFile was changed.
         '''
 
@@ -5104,6 +5456,26 @@ class atFile:
         at = self
         exists = g.os_path_exists(fn)
 
+        if at.pendingWrites is not None and s is not None:
+            theDir = g.os_path_dirname(fn)
+            if theDir and not g.os_path_exists(theDir):
+                if not g.unitTesting:
+                    g.error('not written: %s directory not found' % fn)
+                return False
+            outputFileName = fn + '.tmp'
+            try:
+                f = open(outputFileName,'wb')
+                f.write(g.toEncodedString(s,encoding=at.encoding))
+                f.close()
+            except IOError:
+                at.error('unexpected exception writing file: %s' % (outputFileName))
+                g.es_exception()
+                return False
+            # Compare the files exactly, as below.
+            at.addPendingWrite(root,outputFileName,fn,fn,
+                explicitLineEnding=True,checkPythonCode=False)
+            return False
+
         if exists: # Read the file.  Return if it is the same.
             s2,e = g.readFileIntoString(fn)
             if s is None:
@@ -5146,6 +5518,8 @@ class atFile:
         2. If target file is identical to output file, remove the output file.
         3. If target file is different from output file,
            remove target file, then rename output file to be target file.
+        4. While at.writeAll defers writing, remember the output file.
+           at.commitPendingWrites does steps 1-3 later.
 
         Return True if the original file was changed.
         '''
@@ -5160,6 +5534,15 @@ class atFile:
             self.fileChangedFlag = False
             return False
 
+        if self.pendingWrites is not None:
+            # at.commitPendingWrites will replace the target file.
+            self.addPendingWrite(root,self.outputFileName,
+                self.targetFileName,self.shortFileName,
+                explicitLineEnding=self.explicitLineEnding,
+                ignoreBlankLines=ignoreBlankLines)
+            self.fileChangedFlag = False
+            return False
+
         if root:
             # The default: may be changed later.
             root.clearOrphan()
@@ -0,0 +1,1578 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20130410071514.10001: * @file leoBenchmarks.py
+'''Benchmarks for Leo's core classes, run with the leoBridge module.
+
+Usage: python leoBenchmarks.py [--list] [--memory] <benchmark> [<arg> ...]
+
+Each benchmark prints a table of timings. With --memory, benchmarks also
+report memory use, when available (Python 3.4 and above). Tracing memory
+slows Python code down a lot, so times measured with --memory are only
+useful for comparing memory use.
+'''
+
+#@+<< imports >>
+#@+node:ekr.20130410071514.10002: ** << imports >> (leoBenchmarks.py)
+import gc
+import optparse
+import os
+import re
+import sys
+import time
+
+# Make sure the directory containing the leo package is on sys.path.
+path = os.path.abspath(os.path.join(os.path.dirname(__file__),'..','..'))
+if path not in sys.path:
+    sys.path.append(path)
+
+import leo.core.leoBridge as leoBridge
+
+try:
+    import tracemalloc # Python 3.4 and above.
+except ImportError:
+    tracemalloc = None
+#@-<< imports >>
+
+# Do not define g here.  Use the g returned by the bridge.
+
+#@+others
+#@+node:ekr.20130410071514.10003: ** Top-level
+#@+node:ekr.20130410071514.10004: *3* main & helpers
+def main ():
+
+    options,args = scanOptions()
+    Timer.traceMemory = bool(options.memory)
+    if options.list or not args:
+        print('benchmarks: %s' % ', '.join(sorted(benchmarksDict)))
+        return
+    name,args = args[0],args[1:]
+    func = benchmarksDict.get(name)
+    if not func:
+        print('unknown benchmark: %s' % name)
+        return
+    # loadPlugins=True keeps g.doHook: no plugins are enabled without settings.
+    bridge = leoBridge.controller(gui='nullGui',
+        loadPlugins=True,readSettings=False,silent=True,verbose=False)
+    if bridge.isOpen():
+        g = bridge.globals()
+        func(bridge,g,args)
+#@+node:ekr.20130410071514.10005: *4* scanOptions
+def scanOptions():
+
+    '''Handle all options and remove them from sys.argv.'''
+
+    parser = optparse.OptionParser(
+        usage='usage: %prog [--list] [--memory] <benchmark> [<arg> ...]')
+    parser.add_option('--list',action="store_true",dest="list",
+        help='list all benchmarks')
+    parser.add_option('--memory',action="store_true",dest="memory",
+        help='also measure memory use (slows Python code down)')
+
+    # Parse the options, and remove them from sys.argv.
+    options, args = parser.parse_args()
+    sys.argv = [sys.argv[0]] ; sys.argv.extend(args)
+    return options,args
+#@+node:ekr.20130410071514.10006: *3* Utils
+#@+node:ekr.20130410071514.10007: *4* class Timer
+class Timer:
+
+    '''Measure elapsed time and, if traceMemory is True and tracemalloc
+    exists, memory allocated: memory is the memory still allocated at the
+    end, peak the maximum. Otherwise, memory and peak are None.'''
+
+    traceMemory = False # Set by the --memory option.
+
+    def __init__ (self,tag):
+        self.tag = tag
+        self.elapsed = 0.0
+        self.memory = None
+        self.peak = None
+
+    def __enter__ (self):
+        gc.collect()
+        self.tracing = bool(tracemalloc and self.traceMemory)
+        if self.tracing:
+            tracemalloc.start()
+        self.t1 = time.time()
+        return self
+
+    def __exit__ (self,*args):
+        self.elapsed = time.time() - self.t1
+        if self.tracing:
+            current,peak = tracemalloc.get_traced_memory()
+            self.memory = current
+            self.peak = peak
+            tracemalloc.stop()
+        return False
+#@+node:ekr.20130413052322.10509: *4* bestOf
+def bestOf (n,f):
+
+    '''Call f n times and return the shortest time of a call.'''
+
+    times = []
+    for i in range(n):
+        with Timer('bestOf') as t:
+            f()
+        times.append(t.elapsed)
+    return min(times)
+#@+node:ekr.20130411052322.10192: *4* editLastTopLevel
+def editLastTopLevel (c,n=100):
+
+    '''Insert and delete n children of the last top-level node.'''
+
+    p = c.rootPosition()
+    while p.hasNext():
+        p.moveToNext()
+    for i in range(n):
+        p.insertAsLastChild().doDelete()
+#@+node:ekr.20130410071514.10008: *4* intArgs
+def intArgs (args,default):
+
+    '''Return a list of ints from args, or default if args is empty.'''
+
+    result = []
+    for arg in args:
+        arg = arg.lower().replace(',','')
+        if arg.endswith('k'):
+            result.append(int(arg[:-1]) * 1000)
+        elif arg.endswith('m'):
+            result.append(int(arg[:-1]) * 1000 * 1000)
+        else:
+            result.append(int(arg))
+    return result or default
+#@+node:ekr.20130410071514.10009: *4* makeSyntheticOutline
+def makeSyntheticOutline (c,g,n,fanout=10):
+
+    '''Replace c's outline with a synthetic outline of n nodes.
+
+    Each node has at most fanout children.'''
+
+    import leo.core.leoNodes as leoNodes
+    root = c.hiddenRootNode
+    root.children = []
+    c.invalidateOutlineIndex()
+    queue = [root] ; i = 0 ; count = 0
+    while count < n:
+        parent_v = queue[i] ; i += 1
+        for j in range(fanout):
+            if count >= n: break
+            v = leoNodes.vnode(context=c)
+            v._headString = g.u('node %s') % count
+            v._bodyString = g.u('body of node %s\n') % count
+            v._addLink(len(parent_v.children),parent_v)
+            queue.append(v)
+            count += 1
+    c.setCurrentPosition(c.rootPosition())
+    return count
+#@+node:ekr.20130410071514.10010: *4* printTable
+def printTable (title,headings,rows):
+
+    '''Print a table of results.'''
+
+    widths = [len(z) for z in headings]
+    rows = [[str(z) for z in row] for row in rows]
+    for row in rows:
+        widths = [max(w,len(z)) for w,z in zip(widths,row)]
+    print('\n%s\n' % title)
+    print('  '.join([z.rjust(w) for z,w in zip(headings,widths)]))
+    print('  '.join(['-' * w for w in widths]))
+    for row in rows:
+        print('  '.join([z.rjust(w) for z,w in zip(row,widths)]))
+#@+node:ekr.20130410071514.10011: ** Benchmarks
+#@+node:ekr.20130413052322.10359: *3* bench_auto
+def bench_auto (bridge,g,args):
+
+    '''Open times of a .leo file with @auto and @edit nodes for the largest
+    files in leo/core: before their trees are cached, when the files are
+    unchanged and when the files have been touched.
+
+    args: numbers of files (default: 20).'''
+
+    import glob
+    import os
+    import shutil
+    import tempfile
+    import time
+    sizes = intArgs(args,[20])
+    paths = glob.glob(g.os_path_finalize_join(g.app.loadDir,'*.py'))
+    paths.sort(key=lambda path: -os.path.getsize(path))
+    homeLeoDir = g.app.homeLeoDir
+    rows = []
+    for n in sizes:
+        row = [n]
+        tempDir = tempfile.mkdtemp()
+        g.app.homeLeoDir = os.path.join(tempDir,'home')
+        os.mkdir(g.app.homeLeoDir)
+        try:
+            path = makeAutoOutline(bridge,g,tempDir,paths[:n])
+            for tag in ('uncached','unchanged','touched'):
+                if tag == 'touched':
+                    t = time.time() + 10
+                    for z in glob.glob(os.path.join(tempDir,'*.py')):
+                        os.utime(z,(t,t))
+                with Timer(tag) as t:
+                    c = bridge.openLeoFile(path)
+                d = {'unread':0,'hits':0,'misses':0}
+                for d2 in c.cacher.stats.values():
+                    for key in d:
+                        d[key] += d2[key]
+                row.extend(['%5.2f' % t.elapsed,
+                    '%(unread)s/%(hits)s/%(misses)s' % d])
+                c.setChanged(False)
+                g.app.closeLeoWindow(c.frame)
+        finally:
+            g.app.homeLeoDir = homeLeoDir
+            shutil.rmtree(tempDir)
+        rows.append(row)
+    printTable('@auto and @edit nodes (times in seconds, unread/hits/misses)',
+        ['files','uncached','cache','unchanged','cache','touched','cache'],
+        rows)
+#@+node:ekr.20130413052322.10360: *4* makeAutoOutline
+def makeAutoOutline (bridge,g,directory,paths):
+
+    '''Copy the given files to directory, write a .leo file containing
+    an @auto and an @edit node for each file to directory and return the
+    path to the .leo file.'''
+
+    import os
+    import shutil
+    import leo.core.leoNodes as leoNodes
+    path = os.path.join(directory,'auto.leo')
+    c = bridge.openLeoFile(None)
+    c.mFileName = path
+    c.openDirectory = directory
+    c.hiddenRootNode.children = []
+    leoNodes.vnode(context=c)._addLink(0,c.hiddenRootNode)
+    p = c.rootPosition()
+    p.h = 'files'
+    for z in paths:
+        fileName = os.path.basename(z)
+        shutil.copy(z,os.path.join(directory,fileName))
+        for kind in ('@auto','@edit'):
+            p.insertAsLastChild().h = '%s %s' % (kind,fileName)
+    c.fileCommands.write_Leo_file(path,outlineOnlyFlag=False)
+    c.setChanged(False)
+    g.app.closeLeoWindow(c.frame)
+    return path
+#@+node:ekr.20130413052322.10246: *3* bench_binary
+def bench_binary (bridge,g,args):
+
+    '''Write and read times of .leo and .leob files.
+
+    args: outline sizes (default: 10k 100k).'''
+
+    import os
+    import tempfile
+    sizes = intArgs(args,[10*1000,100*1000])
+    c = bridge.openLeoFile(None)
+    fc = c.fileCommands
+    rows = []
+    for n in sizes:
+        makeSyntheticOutline(c,g,n)
+        row = [n]
+        for ext in ('.leo','.leob'):
+            fd,path = tempfile.mkstemp(suffix=ext)
+            os.close(fd)
+            try:
+                with Timer('write') as write:
+                    fc.write_Leo_file(path,outlineOnlyFlag=True)
+                c.hiddenRootNode.children = []
+                fc.gnxDict = {}
+                theFile = open(path,'rb')
+                try:
+                    with Timer('read') as read:
+                        if ext == '.leob':
+                            fc.readBinaryFile(theFile,path,silent=True)
+                        else:
+                            fc.readStreamingFile(theFile,path,
+                                silent=True,inClipboard=True)
+                finally:
+                    theFile.close()
+                assert len(fc.gnxDict) == n
+                with Timer('bodies') as bodies:
+                    for v in fc.gnxDict.values():
+                        v.b
+                if fc.lazyBodies:
+                    fc.lazyBodies.close()
+                    fc.lazyBodies = None
+                peak = '--' if read.peak is None else read.peak // 1024
+                row.extend([os.path.getsize(path) // 1024,
+                    '%5.2f' % write.elapsed,'%5.2f' % read.elapsed,peak,
+                    '%5.2f' % bodies.elapsed])
+            finally:
+                os.remove(path)
+        rows.append(row)
+    c.hiddenRootNode.children = []
+    fc.gnxDict = {}
+    printTable('.leo and .leob files (times in seconds, sizes in KB)',
+        ['nodes','.leo','write','read','peak','bodies',
+            '.leob','write','read','peak','bodies'],
+        rows)
+#@+node:ekr.20130413052322.10266: *3* bench_cache
+def bench_cache (bridge,g,args):
+
+    '''Open times of a .leo file whose @file nodes are (or are not) cached,
+    using the file-per-key and the sqlite cache.
+
+    args: numbers of @file nodes (default: 2000).'''
+
+    import os
+    import shutil
+    import tempfile
+    sizes = intArgs(args,[2000])
+    homeLeoDir = g.app.homeLeoDir
+    rows = []
+    for n in sizes:
+        row = [n]
+        for useSqlite in (False,True):
+            tempDir = tempfile.mkdtemp()
+            g.app.homeLeoDir = os.path.join(tempDir,'home')
+            os.mkdir(g.app.homeLeoDir)
+            try:
+                path = makeCachedOutline(bridge,g,tempDir,n,
+                    ['@bool use-sqlite-cache = %s' % useSqlite])
+                for tag in ('uncached','cached'):
+                    with Timer(tag) as t:
+                        c = bridge.openLeoFile(path)
+                    assert c.p.h.startswith('@file')
+                    row.append('%5.2f' % t.elapsed)
+                    c.setChanged(False)
+                    g.app.closeLeoWindow(c.frame)
+            finally:
+                g.app.homeLeoDir = homeLeoDir
+                shutil.rmtree(tempDir)
+        rows.append(row)
+    printTable('cached @file nodes (times in seconds)',
+        ['@file nodes','pickleshare','cached','sqlite','cached'],
+        rows)
+#@+node:ekr.20130413052322.10267: *4* makeCachedOutline
+def makeCachedOutline (bridge,g,directory,n,settings):
+
+    '''Write a .leo file containing n @file nodes to the given directory,
+    and return the path to the .leo file.
+
+    settings is a list of headlines of nodes in the @settings tree.'''
+
+    import os
+    import leo.core.leoNodes as leoNodes
+    path = os.path.join(directory,'cache.leo')
+    c = bridge.openLeoFile(None)
+    c.mFileName = path
+    c.openDirectory = directory
+    c.hiddenRootNode.children = []
+    leoNodes.vnode(context=c)._addLink(0,c.hiddenRootNode)
+    root = c.rootPosition()
+    for i in range(n):
+        p = root.insertAfter() if i else root
+        p.h = '@file file%s.py' % i
+        p.b = '@others\n'
+        for j in range(5):
+            child = p.insertAsLastChild()
+            child.h = 'def f%s' % j
+            child.b = 'def f%s():\n    return %s\n' % (j,i)
+    p = root.insertAfter()
+    p.h = '@settings'
+    for h in settings:
+        p.insertAsLastChild().h = h
+    c.atFileCommands.writeAll(writeAtFileNodesFlag=True)
+    c.fileCommands.write_Leo_file(path,outlineOnlyFlag=False)
+    c.setChanged(False)
+    g.app.closeLeoWindow(c.frame)
+    return path
+#@+node:ekr.20130413052322.10491: *3* bench_colorize
+def bench_colorize (bridge,g,args):
+
+    '''Latency of typing near the top of large Python and LaTeX bodies in
+    Qt's body pane, with full coloring (budget 0) and with incremental
+    coloring (a budget of 20 ms). The typed text opens and closes a string
+    or a math span, so the end states of all following lines change twice.
+
+    open: the full recolor done when a node is selected. key: the mean and
+    largest times of a keystroke before the body can repaint. lines: the
+    lines colored by keystrokes. idle: the time spent coloring deferred
+    lines at idle time. same: True if both modes give the same colors.
+
+    args: body sizes in lines (default: 10k). Requires PyQt.'''
+
+    try:
+        import leo.plugins.qtGui as qtGui
+        from PyQt4 import QtGui
+    except ImportError:
+        print('bench_colorize requires PyQt')
+        return
+    app = QtGui.QApplication.instance() or QtGui.QApplication([])
+    sizes = intArgs(args,[10*1000])
+    c = bridge.openLeoFile(None)
+    p = c.p
+    colorizer = makeBodyColorizer(c,g,qtGui)
+    highlighter = colorizer.highlighter
+    colorer = highlighter.colorer
+    w = c.frame.body.bodyCtrl
+    doc = w.widget.document()
+    rows = []
+    for n in sizes:
+        for language,typed in (('python',"s = '''doc'''\n"),('latex','$x$ and text\n')):
+            text = makeColoredBody(g,language,n)
+            formats = []
+            for budget in (0,20):
+                highlighter.budget = budget / 1000.0
+                p.b = text
+                w.setAllText(text)
+                with Timer('open') as t:
+                    colorizer.colorize(p,incremental=False)
+                idle = drainIdle(app,highlighter)
+                cursor = QtGui.QTextCursor(doc.findBlockByNumber(10))
+                times = [] ; lines = 0
+                for ch in typed:
+                    count = colorer.recolorCount
+                    t1 = time.time()
+                    cursor.insertText(ch)
+                    times.append(time.time()-t1)
+                    lines += colorer.recolorCount - count
+                    # Like a fast typist: at most one idle chunk per keystroke.
+                    t1 = time.time()
+                    app.processEvents()
+                    idle += time.time()-t1
+                idle += drainIdle(app,highlighter)
+                formats.append(dumpFormats(doc))
+                rows.append([n,language,budget,'%7.1f' % (t.elapsed*1000),
+                    '%6.1f' % (1000*sum(times)/len(times)),'%6.1f' % (1000*max(times)),
+                    lines,'%7.1f' % (idle*1000),formats[0] == formats[-1]])
+    printTable('typing into large bodies (times in milliseconds)',
+        ['size','language','budget','open','key: mean','max','lines','idle','same'],
+        rows)
+#@+node:ekr.20130413052322.10492: *4* makeBodyColorizer
+def makeBodyColorizer (c,g,qtGui):
+
+    '''Give c a body widget of the Qt gui, not shown,
+    and return the widget's leoQtColorizer.'''
+
+    from PyQt4 import QtGui
+    widget = QtGui.QTextBrowser()
+    c.frame.body.bodyCtrl = qtGui.leoQTextEditWidget(widget,'benchmark',c)
+    c.frame.tree.selecting = False # An ivar of Qt's trees.
+    c.frame.body.colorizer = colorizer = qtGui.leoQtColorizer(c,widget)
+    colorizer.enabled = True # There are no settings.
+    return colorizer
+#@+node:ekr.20130413052322.10493: *4* makeColoredBody, drainIdle & dumpFormats
+def makeColoredBody (g,language,n):
+
+    '''Return a body of n lines: Leo's sources for Python,
+    a synthetic document for LaTeX.'''
+
+    import glob
+    aList = ['@language %s\n' % language]
+    if language == 'python':
+        for fn in sorted(glob.glob(g.os_path_finalize_join(g.app.loadDir,'leo*.py'))):
+            f = open(fn,'rb')
+            aList.extend(g.splitLines(g.toUnicode(f.read())))
+            f.close()
+            if len(aList) >= n: break
+    else:
+        i = 0
+        while len(aList) < n:
+            i += 1
+            aList.extend([
+                '\\section{Section %s}\n' % i,
+                '\\label{sec:%s} %% A comment.\n' % i,
+                'Some text with $x_%s^2$ and \\emph{emphasis} and ``quotes\'\'.\n' % i,
+                '\\begin{equation}\n',
+                '  f(x) = \\sum_{k=0}^{%s} \\frac{x^k}{k!}\n' % i,
+                '\\end{equation}\n',
+                'See Section~\\ref{sec:%s} and \\cite{key%s}.\n' % (i,i),
+                '\n',
+            ])
+    return ''.join(aList[:n])
+
+def drainIdle (app,highlighter):
+
+    '''Process events until the highlighter has no deferred lines.
+    Return the elapsed time.'''
+
+    t1 = time.time()
+    while highlighter.pending:
+        app.processEvents()
+    return time.time()-t1
+
+def dumpFormats (doc):
+
+    '''Return the end states and colors of all lines of a QTextDocument.'''
+
+    result = []
+    block = doc.begin()
+    while block.isValid():
+        result.append((block.userState(),[
+            (r.start,r.length,str(r.format.foreground().color().name()))
+                for r in block.layout().additionalFormats()]))
+        block = block.next()
+    return result
+#@+node:ekr.20130413052322.10497: *3* bench_compare
+def bench_compare (bridge,g,args):
+
+    '''Times of saving all @file nodes of an outline atomically: all of
+    at.writeAll, and its compare (at.comparePendingWrites) and rename
+    (at.renamePendingWrites) phases. All files are written, and half of
+    them have changed.
+
+    args: numbers of @file nodes (default: 500).'''
+
+    import os
+    import shutil
+    import tempfile
+    sizes = intArgs(args,[500])
+    homeLeoDir = g.app.homeLeoDir
+    rows = []
+    for n in sizes:
+        row = [n]
+        tempDir = tempfile.mkdtemp()
+        g.app.homeLeoDir = os.path.join(tempDir,'home')
+        os.mkdir(g.app.homeLeoDir)
+        try:
+            path = makeCachedOutline(bridge,g,tempDir,n,[])
+            c = bridge.openLeoFile(path)
+            at = c.atFileCommands
+            at.skipUnchangedFiles = False
+            at.atomicWrites = True
+            times = {}
+            def timed(tag,f):
+                def timedPhase(aList):
+                    with Timer(tag) as t:
+                        result = f(aList)
+                    times[tag] = t.elapsed
+                    return result
+                return timedPhase
+            at.comparePendingWrites = timed('compare',at.comparePendingWrites)
+            at.renamePendingWrites = timed('rename',at.renamePendingWrites)
+            roots = [p.copy() for p in c.all_unique_positions() if p.isAnyAtFileNode()]
+            for i,p in enumerate(roots):
+                if i % 2: p.b = p.b + '# changed\n'
+                p.setDirty()
+            with Timer('save') as t:
+                at.writeAll(writeDirtyAtFileNodesFlag=True)
+            row.extend(['%5.2f' % z for z in (
+                t.elapsed,times['compare'],times['rename'])])
+            c.setChanged(False)
+            g.app.closeLeoWindow(c.frame)
+        finally:
+            g.app.homeLeoDir = homeLeoDir
+            shutil.rmtree(tempDir)
+        rows.append(row)
+    printTable('saving @file nodes atomically (times in seconds)',
+        ['@file nodes','writeAll','compare','rename'],
+        rows)
+#@+node:ekr.20130413052322.10272: *3* bench_external
+def bench_external (bridge,g,args):
+
+    '''Open times of a .leo file with @file nodes, without and with
+    the external files in the cache, and without the cache when 4 worker
+    processes read the external files.
+
+    args: numbers of @file nodes (default: 500).'''
+
+    import os
+    import shutil
+    import tempfile
+    sizes = intArgs(args,[500])
+    processes = 4
+    runs = (
+        ([],('uncached','cached')),
+        (['@int external-file-read-processes = %s' % processes],('processes',)),
+    )
+    homeLeoDir = g.app.homeLeoDir
+    rows = []
+    for n in sizes:
+        row = [n]
+        for settings,tags in runs:
+            # Each run starts with an empty cache.
+            tempDir = tempfile.mkdtemp()
+            g.app.homeLeoDir = os.path.join(tempDir,'home')
+            os.mkdir(g.app.homeLeoDir)
+            try:
+                path = makeCachedOutline(bridge,g,tempDir,n,settings)
+                for tag in tags:
+                    with Timer(tag) as t:
+                        c = bridge.openLeoFile(path)
+                    assert len(list(c.all_unique_nodes())) == 6 * n + 1 + len(settings)
+                    row.append('%5.2f' % t.elapsed)
+                    c.setChanged(False)
+                    g.app.closeLeoWindow(c.frame)
+            finally:
+                g.app.homeLeoDir = homeLeoDir
+                shutil.rmtree(tempDir)
+        rows.append(row)
+    printTable('reading @file nodes (times in seconds)',
+        ['@file nodes','uncached','cached','%s processes' % processes],
+        rows)
+#@+node:ekr.20130413052322.10296: *3* bench_find
+def bench_find (bridge,g,args):
+
+    '''Find All and c.find_b with and without the search index.
+
+    args: outline sizes (default: 10k 50k).'''
+
+    import leo.core.leoFind as leoFind
+    sizes = intArgs(args,[10*1000,50*1000])
+    searches = (
+        # find_text, ignore_case, whole_word, pattern_match.
+        ('setBodyString',False,False,False),
+        ('getbool',True,False,False),
+        ('p',False,True,False),
+        (r'def \w+Helper\(',False,False,True),
+        ('^#@\\+node',False,False,True),
+    )
+    c = bridge.openLeoFile(None)
+    ft = g.app.gui.createFindTab(c,None)
+    rows = []
+    for n in sizes:
+        c.searchIndex = None
+        c.hiddenRootNode.children = []
+        makeSyntheticOutline(c,g,n)
+        makeSourceBodies(c,g)
+        for s,ignore_case,whole_word,pattern_match in searches:
+            times,results = [],[]
+            for index in (None,leoFind.searchIndex(c)):
+                c.searchIndex = index
+                if index:
+                    with Timer('rebuild') as rebuild:
+                        index.rebuild()
+                with Timer('findAll') as t1:
+                    found = findAll(ft,s,ignore_case,whole_word,pattern_match)
+                with Timer('find_b') as t2:
+                    found_b = [p.v for p in c.find_b(s,flags=g.choose(
+                        ignore_case,re.IGNORECASE|re.MULTILINE,re.MULTILINE))]
+                times.extend([t1.elapsed,t2.elapsed])
+                results.append((found,found_b))
+            assert results[0] == results[1],s
+            rows.append([n,repr(s),len(results[0][0]),
+                '%5.2f' % times[0],'%5.2f' % times[2],
+                '%5.2f' % times[1],'%5.2f' % times[3]])
+        rows.append([n,'(rebuild)','','','%5.2f' % rebuild.elapsed,'',''])
+    c.searchIndex = None
+    c.hiddenRootNode.children = []
+    printTable('find all (times in seconds)',
+        ['nodes','find','found','findAll','indexed','find_b','indexed'],
+        rows)
+#@+node:ekr.20130413052322.10297: *4* findAll
+def findAll (ft,s,ignore_case,whole_word,pattern_match):
+
+    '''Do a Find All command with the given settings.
+    Return a list of (v,in_headline,line) tuples.'''
+
+    result = []
+    def printLine(line,allFlag=False,ft=ft):
+        result.append((ft.p.v,ft.in_headline,line))
+    ft.printLine = printLine
+    ft.find_text = s
+    ft.ignore_case,ft.whole_word,ft.pattern_match = (
+        ignore_case,whole_word,pattern_match)
+    ft.search_headline = ft.search_body = True
+    for ivar in ('batch','clone_find_all','clone_find_all_flattened',
+        'mark_finds','node_only','reverse','suboutline_only','wrap',
+    ):
+        setattr(ft,ivar,False)
+    ft.findAll()
+    return result
+#@+node:ekr.20130413052322.10298: *4* makeSourceBodies
+def makeSourceBodies (c,g,lines=20):
+
+    '''Replace the bodies of c's outline with pieces of Leo's sources.'''
+
+    import glob
+    aList = []
+    for fn in sorted(glob.glob(g.os_path_finalize_join(g.app.loadDir,'leo*.py'))):
+        f = open(fn,'rb')
+        aList.extend(g.splitLines(g.toUnicode(f.read())))
+        f.close()
+    i = 0
+    for v in c.all_unique_nodes():
+        if i + lines > len(aList): i = 0
+        v._bodyString = ''.join(aList[i:i+lines])
+        i += lines
+#@+node:ekr.20130413052322.10469: *3* bench_gnx
+def bench_gnx (bridge,g,args):
+
+    '''Times of finding vnodes by gnx and of c.vnode2position,
+    with and without the gnx index.
+
+    args: outline sizes (default: 10k 100k).
+    Each size is timed with 5 and 500 children per node. The vnode2position
+    columns give the best of 5 passes over the same 1000 vnodes.'''
+
+    import random
+    import leo.core.leoNodes as leoNodes
+    sizes = intArgs(args,[10*1000,100*1000])
+    c = bridge.openLeoFile(None)
+    rows = [] ; n_lookups = 1000
+    for n,fanout in [(n,fanout) for n in sizes for fanout in (5,500)]:
+        makeSyntheticOutline(c,g,n,fanout=fanout)
+        vnodes = list(c.all_unique_nodes())
+        random.seed(n)
+        targets = [random.choice(vnodes) for i in range(n_lookups)]
+        gnxs = [v.gnx for v in targets]
+        # A scan of the outline, like code that has no index.
+        c.gnxIndex = None
+        with Timer('scan') as scan:
+            for gnx in gnxs[:10]:
+                for v in c.all_unique_nodes():
+                    if v.gnx == gnx:
+                        break
+        plainPositions = bestOf(5,lambda: [c.vnode2position(v) for v in targets])
+        c.gnxIndex = leoNodes.gnxIndex(c)
+        with Timer('rebuild') as rebuild:
+            c.gnxIndex.rebuild()
+        with Timer('find') as find:
+            for gnx in gnxs:
+                assert c.gnxIndex.find(gnx)
+        positions = bestOf(5,lambda: [c.vnode2position(v) for v in targets])
+        p = c.vnode2position(targets[-1])
+        assert p.v is targets[-1] and c.positionExists(p)
+        with Timer('edits') as edits:
+            editLastTopLevel(c)
+        rows.append([n,fanout,
+            '%8.1f' % (scan.elapsed * 1000000 / 10),
+            '%8.1f' % (plainPositions * 1000000 / n_lookups),
+            '%5.3f' % rebuild.elapsed,
+            '%8.1f' % (find.elapsed * 1000000 / n_lookups),
+            '%8.1f' % (positions * 1000000 / n_lookups),
+            '%5.2f' % edits.elapsed])
+    c.hiddenRootNode.children = []
+    c.invalidateOutlineIndex()
+    printTable('gnx index (times per lookup in microseconds, rebuild & 100 edits in seconds)',
+        ['nodes','fanout','scan','vnode2position','rebuild','find','indexed_vnode2position','indexed_edits'],
+        rows)
+#@+node:ekr.20130413052322.10339: *3* bench_hooks
+def bench_hooks (bridge,g,args):
+
+    '''Times of g.doHook for tags without handlers, with one handler and
+    with one handler while collecting handler statistics.
+
+    args: numbers of calls (default: 100k).'''
+
+    sizes = intArgs(args,[100*1000])
+    c = bridge.openLeoFile(None)
+    p = c.p # c.p creates a new position.
+    pc = g.app.pluginsController
+
+    def handler(tag,keywords):
+        return None
+
+    rows = []
+    for n in sizes:
+        for kind in ('no handlers','one handler','statistics'):
+            if kind == 'one handler':
+                pc.registerHandler('bodykey2',handler)
+            pc.setHandlerStatsEnabled(kind == 'statistics')
+            with Timer(kind) as t:
+                for i in range(n):
+                    g.doHook('bodykey2',c=c,p=p,v=p,ch='a',oldSel=None)
+            rows.append([kind,n,'%5.3f' % t.elapsed,'%5.2f' % (1000000*t.elapsed/n)])
+        pc.setHandlerStatsEnabled(False)
+        pc.unregisterHandler('bodykey2',handler)
+    printTable('g.doHook (times in seconds)',
+        ['handlers','calls','time','usec/call'],
+        rows)
+#@+node:ekr.20130413052322.10382: *3* bench_http
+def bench_http (bridge,g,args):
+
+    '''Requests per second served by mod_http's threaded server to local
+    clients, and the time to read an entire outline with the JSON api.
+
+    args: outline sizes (default: 10k), then the number of server threads
+    and clients (default: 4).'''
+
+    import json
+    import threading
+    if g.isPython3:
+        import http.client as httplib
+    else:
+        import httplib
+    import leo.plugins.mod_http as mod_http
+    args = intArgs(args,[10*1000])
+    sizes = args[:1] if len(args) < 2 else args[:-1]
+    threads = 4 if len(args) < 2 else args[-1]
+    c = bridge.openLeoFile(None)
+    c.mFileName = 'http.leo'
+    g.app.windowList.append(c.frame) # mod_http serves the outlines in this list.
+    server = mod_http.ThreadedServer(('127.0.0.1',0),
+        mod_http.ThreadedRequestHandler,threads)
+    server.start()
+    port = server.server_address[1]
+
+    def serve(clients):
+        # Run the clients, running the server's calls on this (the gui) thread.
+        for t in clients:
+            t.start()
+        while [t for t in clients if t.is_alive()]:
+            server.caller.drain(0.01)
+
+    def readAll(limit,body):
+        # Read the outline in pages of limit nodes. Return the paths.
+        paths = []
+        conn = httplib.HTTPConnection('127.0.0.1',port)
+        url = '/_/json/http.leo?limit=%s&body=%s' % (limit,body)
+        start = ''
+        while start is not None:
+            conn.request('GET',url + (start and '&start=' + start))
+            d = json.loads(g.toUnicode(conn.getresponse().read()))
+            paths.extend([z['path'] for z in d['nodes']])
+            start = d['next']
+        conn.close()
+        return paths
+
+    def getPages(paths,keepAlive,revalidate,counts):
+        conn = httplib.HTTPConnection('127.0.0.1',port)
+        etags = {}
+        for path in paths:
+            headers = {}
+            if not keepAlive:
+                headers['Connection'] = 'close'
+            if revalidate and path in etags:
+                headers['If-None-Match'] = etags[path]
+            conn.request('GET','/http.leo/' + path,headers=headers)
+            response = conn.getresponse()
+            response.read()
+            assert response.status in (200,304),response.status
+            etags[path] = response.getheader('ETag')
+            if not keepAlive:
+                conn.close()
+                conn = httplib.HTTPConnection('127.0.0.1',port)
+        conn.close()
+        counts.append(len(paths))
+
+    rows,rows2 = [],[]
+    try:
+        for n in sizes:
+            makeSyntheticOutline(c,g,n)
+            row2 = [n]
+            for limit,body in ((100,1),(1000,1),(1000,0)):
+                result = []
+                t = threading.Thread(target=lambda: result.extend(readAll(limit,body)))
+                with Timer('json') as timer:
+                    serve([t])
+                assert len(result) == n,len(result)
+                row2.append('%5.2f' % timer.elapsed)
+            rows2.append(row2)
+            paths = result[:2000]
+            row = [n,threads]
+            for keepAlive,revalidate in ((False,False),(True,False),(True,True)):
+                counts = []
+                clients = [threading.Thread(target=getPages,
+                    args=(paths[i::threads] * 2,keepAlive,revalidate,counts))
+                        for i in range(threads)]
+                with Timer('pages') as timer:
+                    serve(clients)
+                row.append('%5.0f' % (sum(counts) / timer.elapsed))
+            rows.append(row)
+    finally:
+        server.stop()
+        g.app.windowList.remove(c.frame)
+    printTable('mod_http pages (requests per second)',
+        ['nodes','clients','new connection','keep-alive','If-None-Match'],
+        rows)
+    printTable('mod_http JSON api: reading entire outlines (times in seconds)',
+        ['nodes','100/page','1000/page','1000/page, no bodies'],
+        rows2)
+#@+node:ekr.20130413052322.10344: *3* bench_import
+def bench_import (bridge,g,args):
+
+    '''Times of @auto imports of the largest files in leo/core, and of
+    verifying trial writes of Python and xml files with the full
+    tokenizer and with checkTrialWrite.
+
+    args: numbers of files (default: 10).'''
+
+    import glob
+    import os
+    import leo.core.leoImport as leoImport
+    sizes = intArgs(args,[10])
+    c = bridge.openLeoFile(None)
+    makeSyntheticOutline(c,g,1)
+    ic = c.importCommands
+    corpus = (
+        ('python',leoImport.pythonScanner,'core/*.py'),
+        ('xml',leoImport.xmlScanner,'*/*.leo'),
+    )
+    rows,rows2 = [],[]
+    for n in sizes:
+        for language,scannerClass,pattern in corpus:
+            paths = glob.glob(g.os_path_finalize_join(g.app.loadDir,'..',pattern))
+            paths.sort(key=lambda path: -os.path.getsize(path))
+            paths = paths[:n]
+            texts = [g.readFileIntoString(z,silent=True)[0] for z in paths]
+            texts = [z.replace('\r','') for z in texts]
+            lines = sum([len(g.splitLines(z)) for z in texts])
+            if language == 'python':
+                row = [n,lines]
+                for checks in (False,True):
+                    c.config.set(None,'bool','full_import_checks',checks)
+                    with Timer('@auto') as t:
+                        for path in paths:
+                            p = c.rootPosition().insertAfter()
+                            p.h = '@auto %s' % path
+                            ic.createOutline(path,parent=p,atAuto=True)
+                    row.append('%5.2f' % t.elapsed)
+                rows.append(row)
+                # Trial writes of Python files add or remove blank lines.
+                pairs = [(z,z.replace(':\n',':\n\n')) for z in texts]
+            scanner = scannerClass(ic,atAuto=True)
+            if language == 'xml':
+                # Add trailing whitespace to one line in the middle of each file.
+                pairs = []
+                for s in texts:
+                    for kind,val,i,j in scanner.scanTokens(s,0):
+                        if kind == 'nl' and i > len(s)//2: break
+                    pairs.append((s,s[:i] + '  ' + s[i:]))
+            row = [language,n,lines]
+            with Timer('tokenize') as t:
+                for s1,s2 in pairs:
+                    s1 = ''.join(scanner.adjustTestLines(g.splitLines(s1)))
+                    s2 = ''.join(scanner.adjustTestLines(g.splitLines(s2)))
+                    tokens1 = scanner.stripTokens(scanner.filterTokens(scanner.tokenize(s1)))
+                    tokens2 = scanner.stripTokens(scanner.filterTokens(scanner.tokenize(s2)))
+                    assert tokens1 == tokens2,language
+            row.append('%5.2f' % t.elapsed)
+            with Timer('checkTrialWrite') as t:
+                for s1,s2 in pairs:
+                    assert scanner.checkTrialWrite(s1,s2)
+            row.append('%5.3f' % t.elapsed)
+            rows2.append(row)
+    printTable('@auto import of Python files (times in seconds)',
+        ['files','lines','no checks','full checks'],
+        rows)
+    printTable('verifying trial writes (times in seconds)',
+        ['language','files','lines','tokenize','checkTrialWrite'],
+        rows2)
+#@+node:ekr.20130411052322.10191: *3* bench_index
+def bench_index (bridge,g,args):
+
+    '''Full scans and edits with and without the outline index.
+
+    The edit columns give the time of one edit in microseconds. An edit
+    updates the index incrementally: without this, each edit would cost a
+    rebuild.
+
+    args: outline sizes (default: 10k 100k).'''
+
+    import leo.core.leoNodes as leoNodes
+    sizes = intArgs(args,[10*1000,100*1000])
+    c = bridge.openLeoFile(None)
+    rows = [] ; nEdits = 1000
+    for n in sizes:
+        c.outlineIndex = None
+        c.hiddenRootNode.children = []
+        makeSyntheticOutline(c,g,n)
+        with Timer('all_positions') as plain:
+            for p in c.all_positions():
+                pass
+        with Timer('all_unique_positions') as plainUnique:
+            for p in c.all_unique_positions():
+                pass
+        with Timer('edits') as plainEdits:
+            editLastTopLevel(c,nEdits)
+        c.outlineIndex = leoNodes.outlineIndex(c)
+        with Timer('rebuild') as rebuild:
+            c.outlineIndex.rebuild()
+        with Timer('all_positions') as indexed:
+            for p in c.all_positions():
+                pass
+        with Timer('all_unique_positions') as indexedUnique:
+            for p in c.all_unique_positions():
+                pass
+        with Timer('edits') as edits:
+            editLastTopLevel(c,nEdits)
+        rows.append([n,
+            '%5.2f' % plain.elapsed,
+            '%5.2f' % plainUnique.elapsed,
+            '%5.1f' % (1000000.0 * plainEdits.elapsed / nEdits),
+            '%5.2f' % rebuild.elapsed,
+            '%5.2f' % indexed.elapsed,
+            '%5.2f' % indexedUnique.elapsed,
+            '%5.1f' % (1000000.0 * edits.elapsed / nEdits)])
+    c.outlineIndex = None
+    c.hiddenRootNode.children = []
+    printTable('outline index (times in seconds, edits in microseconds)',
+        ['nodes','all_positions','all_unique','edit','rebuild',
+            'indexed','indexed_unique','indexed_edit'],
+        rows)
+#@+node:ekr.20130413052322.10483: *3* bench_modes
+def bench_modes (bridge,g,args):
+
+    '''Times of the first colorizing of each language: the time of
+    jEditColorizer.init_mode when it imports the mode module, builds the
+    precompiled table, reads the table file and finds the memoized table.
+
+    args: languages (default: all modes). Requires PyQt.'''
+
+    import glob
+    import os
+    import leo.core.leoModes as leoModes
+    try:
+        import leo.plugins.qtGui as qtGui
+    except ImportError:
+        print('bench_modes requires PyQt')
+        return
+    c = bridge.openLeoFile(None)
+    languages = args or sorted([g.shortFileName(z)[:-3]
+        for z in glob.glob(g.os_path_join(leoModes.modesDirectory(),'*.py'))
+            if not z.endswith('__init__.py')])
+    rows = [] ; totals = [0.0] * 4
+    for language in languages:
+        times = []
+        # import: no table, so init_mode imports the module.
+        leoModes.tablesDict[language] = None
+        # build: compute the table and write the table file.
+        # read: read the table file.
+        # memo: use the table in memory.
+        for kind in ('import','build','read','memo'):
+            if kind == 'build':
+                fn = leoModes.tableFileName(language)
+                if g.os_path_exists(fn):
+                    os.remove(fn)
+            if kind in ('build','read'):
+                del leoModes.tablesDict[language]
+            colorer = makeModeColorer(c,g,qtGui)
+            with Timer(kind) as t:
+                colorer.init_mode(language)
+            times.append(t.elapsed)
+        totals = [a+b for a,b in zip(totals,times)]
+        rows.append([language] + ['%7.2f' % (t*1000) for t in times])
+    rows.sort(key=lambda row: -float(row[1]))
+    rows.append(['total'] + ['%7.2f' % (t*1000) for t in totals])
+    printTable('first colorizing of each language (times in milliseconds)',
+        ['language','import','build','read','memo'],
+        rows)
+#@+node:ekr.20130413052322.10484: *4* makeModeColorer
+def makeModeColorer (c,g,qtGui):
+
+    '''Return a jEditColorizer without a body widget.
+    Only its init_mode method may be used.'''
+
+    colorer = qtGui.jEditColorizer.__new__(qtGui.jEditColorizer)
+    colorer.c = c
+    colorer.colorizer = g.Bunch(language=None)
+    colorer.importedRulesets = {}
+    colorer.modes = {}
+    colorer.word_chars = {}
+    colorer.word_re = None
+    return colorer
+#@+node:ekr.20130412052322.10209: *3* bench_read
+def bench_read (bridge,g,args):
+
+    '''Time and peak memory of the streaming and two-pass .leo readers.
+
+    args: outline sizes (default: 10k 100k).'''
+
+    import os
+    import tempfile
+    sizes = intArgs(args,[10*1000,100*1000])
+    c = bridge.openLeoFile(None)
+    fc = c.fileCommands
+    rows = []
+    for n in sizes:
+        makeSyntheticOutline(c,g,n)
+        fd,path = tempfile.mkstemp(suffix='.leo')
+        os.close(fd)
+        try:
+            fc.write_Leo_file(path,outlineOnlyFlag=True)
+            row = [n,os.path.getsize(path) // 1024]
+            for streaming in (False,True):
+                c.hiddenRootNode.children = []
+                fc.gnxDict = {}
+                theFile = open(path,'rb')
+                try:
+                    with Timer('read') as t:
+                        if streaming:
+                            fc.readStreamingFile(theFile,path,
+                                silent=True,inClipboard=True)
+                        else:
+                            saxRoot = fc.parse_leo_file(theFile,path,
+                                silent=True,inClipboard=True)
+                            fc.createSaxChildren(saxRoot,c.hiddenRootNode)
+                            del saxRoot
+                finally:
+                    theFile.close()
+                assert len(fc.gnxDict) == n
+                peak = '--' if t.peak is None else t.peak // 1024
+                row.extend(['%5.2f' % t.elapsed,peak])
+            rows.append(row)
+        finally:
+            os.remove(path)
+    c.hiddenRootNode.children = []
+    fc.gnxDict = {}
+    printTable('.leo readers (times in seconds, sizes in KB)',
+        ['nodes','file','two-pass','peak','streaming','peak'],
+        rows)
+#@+node:ekr.20130413052322.10439: *3* bench_redraw
+def bench_redraw (bridge,g,args):
+
+    '''Items drawn per redraw, and times of redraws after typical outline
+    changes, by full and incremental redraws of baseNativeTree. The trees
+    draw to in-memory items, so the times exclude the gui's work.
+
+    args: outline sizes, all nodes expanded (default: 1k 10k).'''
+
+    sizes = intArgs(args,[1000,10*1000])
+    c = bridge.openLeoFile(None)
+    rows = []
+    for n in sizes:
+        makeSyntheticOutline(c,g,n)
+        for v in c.all_unique_nodes():
+            v.expand()
+        full = makeFakeTree(c,incremental=False)
+        patch = makeFakeTree(c,incremental=True)
+        root = c.rootPosition()
+        middle = root.firstChild().firstChild()
+        for kind in ('redraw','headline','insert','move','clone','paste','delete','contract'):
+            if kind == 'headline':
+                middle.h = 'changed'
+            elif kind == 'insert':
+                middle.insertAfter().h = 'inserted'
+            elif kind == 'move':
+                root.next().moveAfter(root.next().next())
+            elif kind == 'clone':
+                middle.clone()
+            elif kind == 'paste':
+                root.firstChild().copyTreeAfter()
+            elif kind == 'delete':
+                root.firstChild().next().doDelete()
+            elif kind == 'contract':
+                root.contract()
+            row = [n,kind]
+            for tree in (full,patch):
+                with Timer(kind) as timer:
+                    tree.full_redraw(c.rootPosition())
+                row.extend([tree.nodeDrawCount,'%5.3f' % timer.elapsed])
+            row.insert(-1,patch.nodePatchCount)
+            row.append(full.dumpItems() == patch.dumpItems())
+            rows.append(row)
+    printTable('redraws of expanded outlines (times in seconds)',
+        ['nodes','change','full: drawn','time',
+            'incremental: drawn','patched','time','same'],
+        rows)
+#@+node:ekr.20130413052322.10440: *4* makeFakeTree
+def makeFakeTree (c,incremental):
+
+    '''Return a baseNativeTree whose items are in-memory objects.'''
+
+    import leo.core.leoGlobals as g
+    import leo.plugins.baseNativeTree as baseNativeTree
+
+    class fakeItem:
+        def __init__ (self):
+            self.children = []
+            self.expanded = False
+            self.icon = None
+            self.text = ''
+
+    class fakeTree (baseNativeTree.baseNativeTreeWidget):
+        def __init__ (self,c):
+            baseNativeTree.baseNativeTreeWidget.__init__(self,c,c.frame)
+            self.currentItem = None
+            self.top = fakeItem()
+            self.incremental_redraw = incremental
+        def drawTree (self,p,parent_item=None):
+            # The base class draws nothing with the nullGui.
+            item = self.drawNode(p,parent_item)
+            self.drawChildren(p,parent_item=item)
+        def dumpItems (self,item=None):
+            item = item or self.top
+            return [(z.text,z.icon,z.expanded,self.dumpItems(z)) for z in item.children]
+        # Widget-dependent helpers.
+        def childItems (self,parent_item):
+            return (parent_item or self.top).children[:]
+        def clear (self):
+            self.top = fakeItem()
+        def contractItem (self,item):
+            item.expanded = False
+        def createTreeItem (self,p,parent_item):
+            item = fakeItem()
+            (parent_item or self.top).children.append(item)
+            return item
+        def expandItem (self,item):
+            item.expanded = True
+        def getCurrentItem (self):
+            return self.currentItem
+        def getIcon (self,p):
+            p.v.iconVal = val = p.v.computeIcon()
+            return val + 1 # Icons must be true.
+        def getItemText (self,item):
+            return item.text
+        def insertItem (self,parent_item,n,item):
+            (parent_item or self.top).children.insert(n,item)
+        def removeItem (self,parent_item,item):
+            (parent_item or self.top).children.remove(item)
+        def repaint (self):
+            pass
+        def scrollToItem (self,item):
+            pass
+        def setCurrentItemHelper (self,item):
+            self.currentItem = item
+        def setItemIconHelper (self,item,icon):
+            item.icon = icon
+        def setItemText (self,item,s):
+            item.text = s
+
+    return fakeTree(c)
+#@+node:ekr.20130413052322.10334: *3* bench_plugins
+def bench_plugins (bridge,g,args):
+
+    '''Times of loading plugins at startup, with and without lazy loading.
+
+    Each run happens in a new process, so no plugin has been imported.
+    load is the time taken to load the plugins at startup, modules the
+    number of modules imported and use the time to load the deferred
+    plugins later.
+
+    args: plugin names (default: plugins containing lazy_load = True).'''
+
+    import os
+    import shutil
+    import subprocess
+    import tempfile
+    plugins = args or ['gitarchive.py','mime.py','screenshots.py','stickynotes.py']
+    tempDir = tempfile.mkdtemp()
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join([z for z in sys.path if z])
+    rows = []
+    try:
+        def run(lazy):
+            command = [sys.executable,'-c',pluginsScript,tempDir,str(lazy)]
+            command.extend(plugins)
+            proc = subprocess.Popen(command,env=env,stdout=subprocess.PIPE)
+            s = proc.communicate()[0]
+            return s.decode('utf-8').split()[-3:]
+        run(True) # Write the manifests.
+        for lazy in (False,True):
+            load,modules,use = run(lazy)
+            rows.append([g.choose(lazy,'lazy','eager'),load,modules,use])
+    finally:
+        shutil.rmtree(tempDir)
+    printTable('loading %s plugins (times in seconds)' % len(plugins),
+        ['mode','load','modules','use'],
+        rows)
+#@+node:ekr.20130413052322.10335: *4* pluginsScript
+# The script run by bench_plugins in a new process.
+# Arguments: homeLeoDir, lazy and the plugin names.
+
+pluginsScript = '''
+import sys,time
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False,readSettings=False,silent=True,verbose=False)
+g = bridge.globals()
+g.app.homeLeoDir = sys.argv[1]
+g.enableDB = True
+d = g.app.loadManager.globalSettingsDict
+d[g.app.config.canonicalizeSettingName('lazy-load-plugins')] = g.GeneralSetting(
+    kind='bool',val=sys.argv[2] == 'True',tag='setting')
+g.app.config.enabledPluginsString = '\\n'.join(sys.argv[3:])
+pc = g.app.pluginsController
+n = len(sys.modules)
+t1 = time.time()
+pc.loadHandlers('start1',{})
+t2 = time.time()
+modules = len(sys.modules) - n
+for moduleName in list(pc.deferredModules):
+    pc.loadDeferredPlugin(moduleName)
+t3 = time.time()
+print('%5.3f %s %5.3f' % (t2-t1,modules,t3-t2))
+'''
+#@+node:ekr.20130413052322.10278: *3* bench_save
+def bench_save (bridge,g,args):
+
+    '''Times of writing all @file nodes of an outline after marking them
+    dirty: without skipping unchanged files (replacing files one by one and
+    atomically), while remembering the fingerprints of the written files
+    and when skipping unchanged files.
+
+    args: numbers of @file nodes (default: 500).'''
+
+    import os
+    import shutil
+    import tempfile
+    sizes = intArgs(args,[500])
+    homeLeoDir = g.app.homeLeoDir
+    rows = []
+    for n in sizes:
+        row = [n]
+        tempDir = tempfile.mkdtemp()
+        g.app.homeLeoDir = os.path.join(tempDir,'home')
+        os.mkdir(g.app.homeLeoDir)
+        try:
+            path = makeCachedOutline(bridge,g,tempDir,n,[])
+            c = bridge.openLeoFile(path)
+            at = c.atFileCommands
+            for skip,atomic in ((False,False),(False,True),(True,True),(True,True)):
+                at.skipUnchangedFiles = skip
+                at.atomicWrites = atomic
+                for p in c.all_unique_positions():
+                    if p.isAnyAtFileNode():
+                        p.setDirty()
+                with Timer('save') as t:
+                    at.writeAll(writeDirtyAtFileNodesFlag=True)
+                row.append('%5.2f' % t.elapsed)
+            assert at.skippedFilesCount == n,at.skippedFilesCount
+            c.setChanged(False)
+            g.app.closeLeoWindow(c.frame)
+        finally:
+            g.app.homeLeoDir = homeLeoDir
+            shutil.rmtree(tempDir)
+        rows.append(row)
+    printTable('writing unchanged @file nodes (times in seconds)',
+        ['@file nodes','generate','atomic','remember','skip'],
+        rows)
+#@+node:ekr.20130413052322.10418: *3* bench_server
+def bench_server (bridge,g,args):
+
+    '''Times of small batch jobs (open an outline, change a node, save the
+    outline) run by starting a new leoBridge for each job and by clients of
+    leoServer.py.
+
+    Starting a bridge takes seconds, so only a few bridge jobs are run: the
+    table shows the estimated time of all jobs.
+
+    args: the number of jobs (default: 1000), then the number of bridge
+    jobs to run (default: 5).'''
+
+    import os
+    import shutil
+    import subprocess
+    import tempfile
+    import threading
+    import leo.core.leoServer as leoServer
+    args = intArgs(args,[1000,5])
+    jobs = args[0]
+    bridgeJobs = 5 if len(args) < 2 else args[1]
+    leoDir = g.os_path_finalize_join(g.app.loadDir,'..','..')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = env.get('PYTHONPATH','') + os.pathsep + leoDir
+    tempDir = tempfile.mkdtemp()
+    try:
+        # Create the outline.
+        path = os.path.join(tempDir,'server.leo')
+        c = bridge.openLeoFile(None)
+        makeSyntheticOutline(c,g,1000)
+        gnxs = [v.gnx for v in c.all_unique_nodes()]
+        c.fileCommands.write_Leo_file(path,outlineOnlyFlag=False)
+        c.setChanged(False)
+        g.app.closeLeoWindow(c.frame)
+        # Run the bridge jobs.
+        with Timer('bridge') as bridgeTimer:
+            for i in range(bridgeJobs):
+                subprocess.check_call([sys.executable,'-c',bridgeJob,
+                    path,gnxs[i % len(gnxs)]],env=env)
+        perJob = bridgeTimer.elapsed / bridgeJobs
+        # Start the server.
+        addressFile = leoServer.addressFileName()
+        if os.path.exists(addressFile):
+            os.remove(addressFile)
+        with Timer('start') as startTimer:
+            server = subprocess.Popen([sys.executable,leoServer.__file__],env=env)
+            while not os.path.exists(addressFile):
+                time.sleep(0.05)
+            client = leoServer.OutlineClient()
+            client.call('open',file=path)
+        def runJobs(aList):
+            for gnx in aList:
+                client = leoServer.OutlineClient()
+                b = client.call('read',file=path,gnx=gnx)['b']
+                client.call('write',file=path,gnx=gnx,b=b + 'x')
+                client.call('save',file=path)
+                client.close()
+        rows = [['new bridge',1,'%5.2f' % (perJob * jobs),'%6.4f' % perJob]]
+        try:
+            for threads in (1,4):
+                aList = [gnxs[i % len(gnxs)] for i in range(jobs)]
+                workers = [threading.Thread(target=runJobs,args=(aList[i::threads],))
+                    for i in range(threads)]
+                with Timer('server') as t:
+                    for w in workers: w.start()
+                    for w in workers: w.join()
+                rows.append(['leoServer.py',threads,'%5.2f' % t.elapsed,
+                    '%6.4f' % (t.elapsed / jobs)])
+        finally:
+            client.call('shutdown')
+            client.close()
+            server.wait()
+    finally:
+        shutil.rmtree(tempDir)
+    printTable('%s jobs (times in seconds, %5.2f to start the server)' % (
+        jobs,startTimer.elapsed),
+        ['jobs run by','clients','all jobs','per job'],
+        rows)
+#@+node:ekr.20130413052322.10419: *4* bridgeJob
+bridgeJob = '''\
+import sys
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False,readSettings=True,silent=True,verbose=False)
+c = bridge.openLeoFile(sys.argv[1])
+p = c.vnode2position(c.fileCommands.gnxDict[sys.argv[2]])
+p.b = p.b + 'x'
+c.save()
+'''
+#@+node:ekr.20130413052322.10318: *3* bench_settings
+def bench_settings (bridge,g,args):
+
+    '''Times of reading the global settings files: parsing leoSettings.leo
+    and myLeoSettings.leo, and loading the settings snapshot instead.
+
+    args: number of repetitions (default: 5).'''
+
+    import os
+    import shutil
+    import tempfile
+    n = intArgs(args,[5])[0]
+    lm = g.app.loadManager
+    homeLeoDir,enableDB = g.app.homeLeoDir,g.enableDB
+    settings_d,shortcuts_d = lm.globalSettingsDict,lm.globalShortcutsDict
+    tempDir = tempfile.mkdtemp()
+    g.app.homeLeoDir = tempDir
+    g.enableDB = True
+    rows = []
+    try:
+        for i in range(n):
+            fn = lm.settingsSnapshotPath()
+            if os.path.exists(fn):
+                os.remove(fn)
+            with Timer('parse') as parse:
+                lm.readGlobalSettingsFiles()
+            assert os.path.exists(fn),fn
+            d = lm.globalSettingsDict
+            with Timer('snapshot') as snapshot:
+                lm.readGlobalSettingsFiles()
+            assert len(lm.globalSettingsDict.keys()) == len(d.keys())
+            rows.append([i+1,len(d.keys()),
+                '%5.3f' % parse.elapsed,
+                '%5.3f' % snapshot.elapsed,
+                os.path.getsize(fn)])
+    finally:
+        g.app.homeLeoDir,g.enableDB = homeLeoDir,enableDB
+        lm.globalSettingsDict,lm.globalShortcutsDict = settings_d,shortcuts_d
+        shutil.rmtree(tempDir)
+    printTable('reading global settings (times in seconds)',
+        ['run','settings','parse','snapshot','bytes'],
+        rows)
+#@+node:ekr.20130413052322.10429: *3* bench_shadow
+def bench_shadow (bridge,g,args):
+
+    '''Times of propagating random edits of a public file to its private
+    file with the difflib and the fast @shadow engines. The private files
+    are pieces of Leo's sources.
+
+    args: file sizes in lines (default: 2k 20k).'''
+
+    import glob
+    import random
+    sizes = intArgs(args,[2*1000,20*1000])
+    c = bridge.openLeoFile(None)
+    x = c.shadowController
+    marker = x.markerClass(('#','',''))
+    sources = []
+    for fn in sorted(glob.glob(g.os_path_finalize_join(g.app.loadDir,'leo*.py'))):
+        f = open(fn,'rb')
+        sources.extend(g.splitLines(g.toUnicode(f.read())))
+        f.close()
+    rows = []
+    for n in sizes:
+        private = (sources * (1 + n // len(sources)))[:n]
+        public,mapping = x.strip_sentinels_with_map(private,marker)
+        for edits in (10,200):
+            rand = random.Random(n + edits)
+            new = public[:]
+            for i in range(edits):
+                j = rand.randrange(len(new))
+                kind = rand.choice(('insert','delete','replace'))
+                if kind == 'insert':
+                    new.insert(j,'    # inserted line %s\n' % i)
+                elif kind == 'delete':
+                    del new[j]
+                else:
+                    new[j] = '    # replaced line %s\n' % i
+            x.fast_diff = False
+            with Timer('difflib') as slow:
+                result1 = x.propagate_changed_lines(new,private,marker)
+            x.fast_diff = True
+            with Timer('fast') as fast:
+                result2 = x.propagate_changed_lines(new,private,marker)
+            rows.append([n,edits,
+                '%5.3f' % slow.elapsed,
+                '%5.3f' % fast.elapsed,
+                '%4.1f' % (slow.elapsed / max(fast.elapsed,0.001)),
+                result1 == result2])
+    printTable('@shadow propagation (times in seconds)',
+        ['lines','edits','difflib','fast','speedup','same'],
+        rows)
+#@+node:ekr.20130410071514.10012: *3* bench_nodes
+def bench_nodes (bridge,g,args):
+
+    '''Memory and traversal throughput of vnodes and positions.
+
+    args: outline sizes (default: 10k 100k 1m).'''
+
+    sizes = intArgs(args,[10*1000,100*1000,1000*1000])
+    c = bridge.openLeoFile(None)
+    rows = []
+    for n in sizes:
+        c.hiddenRootNode.children = []
+        gc.collect()
+        with Timer('create') as create:
+            makeSyntheticOutline(c,g,n)
+        with Timer('copy') as copy:
+            aList = [p.copy() for p in c.all_positions()]
+        del aList
+        with Timer('all_positions') as all_positions:
+            for p in c.all_positions():
+                pass
+        with Timer('all_unique_positions') as unique:
+            for p in c.all_unique_positions():
+                pass
+        with Timer('moveToThreadNext') as threadNext:
+            p = c.rootPosition()
+            while p:
+                p.moveToThreadNext()
+        if create.memory is None:
+            bytesPerNode = '--'
+            bytesPerPosition = '--'
+        else:
+            bytesPerNode = create.memory // n
+            bytesPerPosition = copy.memory // n
+        rows.append([n,
+            '%5.2f' % create.elapsed, bytesPerNode,
+            '%5.2f' % copy.elapsed, bytesPerPosition,
+            '%5.2f' % all_positions.elapsed,
+            '%5.2f' % unique.elapsed,
+            '%5.2f' % threadNext.elapsed])
+    c.hiddenRootNode.children = []
+    printTable('vnodes and positions (times in seconds)',
+        ['nodes','create','bytes/v','copy','bytes/p',
+            'all_positions','all_unique','threadNext'],
+        rows)
+#@-others
+
+benchmarksDict = {
+    'auto': bench_auto,
+    'binary': bench_binary,
+    'cache': bench_cache,
+    'colorize': bench_colorize,
+    'compare': bench_compare,
+    'external': bench_external,
+    'find': bench_find,
+    'gnx': bench_gnx,
+    'hooks': bench_hooks,
+    'http': bench_http,
+    'import': bench_import,
+    'index': bench_index,
+    'modes': bench_modes,
+    'nodes': bench_nodes,
+    'plugins': bench_plugins,
+    'read': bench_read,
+    'redraw': bench_redraw,
+    'save': bench_save,
+    'server': bench_server,
+    'settings': bench_settings,
+    'shadow': bench_shadow,
+}
+
+if __name__ == '__main__':
+    main()
+#@-leo
@@ -0,0 +1,530 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20130413052322.10215: * @file leoBinaryFile.py
+#@@language python
+#@@tabwidth -4
+#@@pagewidth 70
+
+'''Read and write binary Leo outlines (.leob files).
+
+A .leob file contains the same information as a .leo file, but the
+reader creates vnodes directly from fixed-size records and does not
+decode body text until it is needed. The reader keeps the file's
+contents in memory and closes the file, so the file is never locked.
+
+File layout (all integers are little-endian)::
+
+    header:   magic (4 bytes), version, then (offset,length) of each section.
+    meta:     a pickle of [metaDict,attrsList].
+    nodes:    one nodeStruct per unique vnode.
+    elements: one elementStruct per <v> element, in outline order.
+    strings:  gnx's and headlines, encoded once in utf-8.
+    bodies:   body text, encoded in utf-8, one body per written vnode.
+
+Elements correspond one-to-one to the <v> elements of a .leo file. Like
+<v> elements for clones, elements for clones after the first have no
+children. The attributes of elements and nodes are dicts in attrsList.
+Their keys and values are exactly the attributes of <v> and <t> elements,
+except that elements also retain v.tnodeList.'''
+
+#@+<< imports >>
+#@+node:ekr.20130413052322.10216: ** << imports >> (leoBinaryFile)
+import leo.core.leoGlobals as g
+import leo.core.leoNodes as leoNodes
+
+if g.isPython3:
+    import pickle
+else:
+    import cPickle as pickle
+
+import struct
+import sys
+#@-<< imports >>
+
+magic = b'LEOB'
+version = 1
+
+# The order of the sections in the header.
+sectionNames = ('meta','nodes','elements','strings','bodies')
+
+headerStruct = struct.Struct('<4sI' + 'QQ' * len(sectionNames))
+
+# gnxOffset,gnxLength,headOffset,headLength: character offsets into the strings section.
+# flags: bodyBit if the node has a body, that is, if a .leo file would contain a <t> element.
+# bodyOffset,bodyLength: byte offsets into the bodies section.
+# attrs: the index into attrsList of the <t> element's attributes, or -1.
+nodeStruct = struct.Struct('<IIIIIQQi')
+bodyBit = 1
+
+# nodeId,numberOfChildren,attrs.
+elementStruct = struct.Struct('<IIi')
+
+#@+others
+#@+node:ekr.20130413052322.10217: ** class BadBinaryFile
+class BadBinaryFile(Exception):
+
+    '''An exception raised for malformed .leob files.'''
+
+    pass
+#@+node:ekr.20130413052322.10218: ** isBinaryFile
+def isBinaryFile (theFile):
+
+    '''Return True if theFile, an open file, is a .leob file.
+
+    Leaves the file positioned at its start.'''
+
+    try:
+        s = theFile.read(len(magic))
+        theFile.seek(0)
+    except Exception:
+        return False
+    return s == magic
+#@+node:ekr.20130413052322.10219: ** class binaryWriter
+class binaryWriter:
+
+    '''A class that creates the contents of a .leob file.
+
+    Like fc.putVnodes, this class writes only the <v> elements that
+    fc.putLeoFile would write, and sets the write bits of vnodes.'''
+
+    #@+others
+    #@+node:ekr.20130413052322.10220: *3*  ctor (binaryWriter)
+    def __init__ (self,c):
+
+        self.c = c
+        self.fc = c.fileCommands
+        self.attrsList = [] # Dicts of attributes of elements and nodes.
+        self.elements = [] # Lists [nodeId,numberOfChildren,attrs].
+        self.ids = {} # Keys are vnodes, values are node ids.
+        self.nodes = [] # Pairs (v,gnx), in order of node ids.
+    #@+node:ekr.20130413052322.10221: *3* write
+    def write (self):
+
+        '''Return the contents (bytes) of a .leob file for the outline.'''
+
+        c,fc = self.c,self.fc
+        fc.updateFixedStatus()
+        meta = self.getMeta()
+
+        # Like fc.putVnodes.
+        c.clearAllVisited()
+        fc.currentPosition = c.p
+        fc.rootPosition = c.rootPosition()
+        fc.vnodesDict = {}
+        for p in c.rootPosition().self_and_siblings():
+            self.putElement(p,isIgnore=p.isAtIgnoreNode())
+
+        return self.pack(meta)
+    #@+node:ekr.20130413052322.10222: *3* getMeta
+    def getMeta (self):
+
+        '''Return a dict describing the <globals> element and the stylesheet.
+
+        Like fc.putGlobals, put fixed values if the cacher remembers them.'''
+
+        c = self.c
+        use_db = g.enableDB and c.mFileName
+        if use_db:
+            c.cacher.setCachedGlobalsElement(c.mFileName)
+
+        if c.fixed or use_db:
+            ratio,ratio2 = '0.5','0.5'
+            width,height,left,top = 700,500,50,50
+        else:
+            ratio = '%1.2f' % (c.frame.ratio)
+            ratio2 = '%1.2f' % (c.frame.secondary_ratio)
+            width,height,left,top = c.frame.get_window_info()
+
+        return {
+            'globals': {
+                'body_outline_ratio':ratio,
+                'body_secondary_ratio':ratio2},
+            'global_window_position': {
+                'top':str(top),'left':str(left),
+                'height':str(height),'width':str(width)},
+            'stylesheet': c.frame.stylesheet or c.config.stylesheet,
+        }
+    #@+node:ekr.20130413052322.10223: *3* getNodeId
+    def getNodeId (self,v,gnx):
+
+        n = self.ids.get(v)
+        if n is None:
+            n = len(self.nodes)
+            self.ids[v] = n
+            self.nodes.append((v,gnx),)
+        return n
+    #@+node:ekr.20130413052322.10224: *3* putAttrs
+    def putAttrs (self,d):
+
+        '''Add d to attrsList and return its index, or -1 if d is empty.'''
+
+        if d:
+            self.attrsList.append(d)
+            return len(self.attrsList) - 1
+        else:
+            return -1
+    #@+node:ekr.20130413052322.10225: *3* putElement
+    def putElement (self,p,isIgnore=False):
+
+        '''Add the element for p, and the elements of its children
+        if fc.putVnode would write them.'''
+
+        fc = self.fc ; v = p.v
+        isAuto,isIgnore,forceWrite = fc.getVnodeWriteFlags(p,isIgnore)
+        gnx = g.app.nodeIndices.toString(v.fileIndex)
+        if forceWrite:
+            v.setWriteBit()
+
+        d = {}
+        attr = fc.getVnodeAttributeBits(v)
+        if attr:
+            d['a'] = attr
+        fc.updateArchivedPosition(p)
+        if p.hasChildren() and not forceWrite and not isAuto:
+            uaDict = fc.getDescendentVnodeUaDict(p)
+            s = uaDict and fc.hexlifiedPickle(p.v,uaDict,
+                tag='descendentVnodeUnknownAttributes')
+            if s:
+                d['descendentVnodeUnknownAttributes'] = s
+            for tag,s in fc.getDescendentAttributeStrings(p):
+                d[tag] = s
+        tnodeList = getattr(v,'tnodeList',None)
+        if tnodeList and gnx not in fc.vnodesDict:
+            # fc.resolveTnodeLists will recreate v.tnodeList.
+            d['tnodeList'] = ','.join([
+                g.app.nodeIndices.toString(z.fileIndex) for z in tnodeList])
+
+        element = [self.getNodeId(v,gnx),0,self.putAttrs(d)]
+        self.elements.append(element)
+        if gnx not in fc.vnodesDict:
+            fc.vnodesDict[gnx] = True
+            if p.hasChildren() and forceWrite:
+                element[1] = p.numberOfChildren()
+                child = p.firstChild()
+                while child:
+                    self.putElement(child,isIgnore)
+                    child.moveToNext()
+    #@+node:ekr.20130413052322.10226: *3* getBody & getNodeAttrs
+    def getBody (self,v):
+
+        '''Return v's body text as utf-8 encoded bytes.'''
+
+        if v.hasLazyBody():
+            # Copy the bytes without decoding them.
+            loader,n = v._lazyBody
+            return loader.getRawBody(n)
+        else:
+            return g.toEncodedString(v._bodyString,'utf-8',reportErrors=True)
+
+    def getNodeAttrs (self,v):
+
+        '''Return a dict of the attributes of the <t> element for v.'''
+
+        fc = self.fc ; d = {}
+        if hasattr(v,'unknownAttributes'):
+            attrDict = v.unknownAttributes
+            if type(attrDict) != type({}):
+                g.warning("ignoring non-dictionary unknownAttributes for",v)
+            else:
+                for key,val in attrDict.items():
+                    s = fc.uaToString(v,key,val)
+                    if s is not None:
+                        d[key] = s
+        return d
+    #@+node:ekr.20130413052322.10227: *3* pack
+    def pack (self,meta):
+
+        '''Return the bytes of the .leob file.'''
+
+        strings,nodeRecords,bodies = [],[],[]
+        stringOffset = bodyOffset = 0
+        for v,gnx in self.nodes:
+            h = v.headString() or ''
+            strings.append(gnx)
+            strings.append(h)
+            if v.isWriteBit():
+                # The equivalent of fc.putTnode.
+                flags = bodyBit
+                b = self.getBody(v)
+                attrs = self.putAttrs(self.getNodeAttrs(v))
+            else:
+                flags,b,attrs = 0,b'',-1
+            bodies.append(b)
+            nodeRecords.append(nodeStruct.pack(
+                stringOffset,len(gnx),stringOffset+len(gnx),len(h),
+                flags,bodyOffset,len(b),attrs))
+            stringOffset += len(gnx) + len(h)
+            bodyOffset += len(b)
+
+        sections = [
+            pickle.dumps([meta,self.attrsList],2),
+            b''.join(nodeRecords),
+            b''.join([elementStruct.pack(*z) for z in self.elements]),
+            g.toEncodedString(g.u('').join(strings),'utf-8',reportErrors=True),
+            b''.join(bodies),
+        ]
+        header = [magic,version]
+        offset = headerStruct.size
+        for s in sections:
+            header.extend([offset,len(s)])
+            offset += len(s)
+        sections.insert(0,headerStruct.pack(*header))
+        return b''.join(sections)
+    #@-others
+#@+node:ekr.20130413052322.10228: ** class binaryReader
+class binaryReader:
+
+    '''A class that creates vnodes from a .leob file.'''
+
+    #@+others
+    #@+node:ekr.20130413052322.10229: *3*  ctor (binaryReader)
+    def __init__ (self,c,fileName):
+
+        self.c = c
+        self.fc = c.fileCommands
+        self.fileName = fileName
+        self.clones = [] # (parent_v,v) for all elements that denote clones.
+        self.loader = None # The lazyBodyLoader for the file.
+        self.meta = {}
+    #@+node:ekr.20130413052322.10230: *3* read & helpers
+    def read (self,theFile):
+
+        '''Create vnodes from theFile, an open .leob file.
+
+        Return the list of top-level vnodes. The caller must link them
+        to the hidden root node. Raise BadBinaryFile for bad files.'''
+
+        self.loader = loader = self.openLoader(theFile)
+        data,sections = loader.data,loader.sections
+        try:
+            offset,length = sections['meta']
+            self.meta,attrsList = pickle.loads(data[offset:offset+length])
+            offset,length = sections['strings']
+            strings = g.toUnicode(data[offset:offset+length],'utf-8')
+            vnodes = [None] * loader.numberOfNodes
+            created = bytearray(loader.numberOfNodes)
+                # created[n] is 1 if this reader created the vnode for node n.
+            children = self.readElements(data,sections['elements'],
+                strings,attrsList,vnodes,created)
+            self.finishNodes(attrsList,vnodes,created)
+        except (EOFError,IndexError,KeyError,TypeError,ValueError,
+            struct.error,pickle.UnpicklingError):
+            junk,message,junk = sys.exc_info()
+            raise BadBinaryFile('%s: %s' % (self.fileName,message))
+        return children
+    #@+node:ekr.20130413052322.10244: *4* openLoader
+    def openLoader (self,theFile):
+
+        '''Return a lazyBodyLoader for theFile, an open .leob file.'''
+
+        data = self.readData(theFile)
+        sections = self.readHeader(data)
+        return lazyBodyLoader(self.fileName,data,sections)
+    #@+node:ekr.20130413052322.10231: *4* readData
+    def readData (self,theFile):
+
+        '''Return the file's contents (bytes).
+
+        The loader does not keep the file open: on Windows, an open file
+        or a memory map of it would prevent saving the outline.'''
+
+        return theFile.read()
+    #@+node:ekr.20130413052322.10232: *4* readHeader
+    def readHeader (self,data):
+
+        '''Check the file's header and return a dict describing its sections.
+
+        Keys are section names, values are pairs (offset,length).'''
+
+        if len(data) < headerStruct.size:
+            raise BadBinaryFile('%s: truncated header' % self.fileName)
+        header = headerStruct.unpack_from(data,0)
+        if header[0] != magic:
+            raise BadBinaryFile('%s: not a .leob file' % self.fileName)
+        if header[1] != version:
+            raise BadBinaryFile('%s: unknown .leob version: %s' % (
+                self.fileName,header[1]))
+        d = {}
+        for i,name in enumerate(sectionNames):
+            offset,length = header[2+2*i:4+2*i]
+            if offset + length > len(data):
+                raise BadBinaryFile('%s: truncated %s section' % (
+                    self.fileName,name))
+            d[name] = offset,length
+        return d
+    #@+node:ekr.20130413052322.10234: *4* readElements
+    def readElements (self,data,section,strings,attrsList,vnodes,created):
+
+        '''Create and link vnodes for all elements in the given section.
+
+        Like the streaming .leo reader, this method treats vnodes whose
+        gnx already exists in fc.gnxDict as clones.'''
+
+        c,fc = self.c,self.fc
+        getNode = self.loader.getNode
+        handleVnodeSaxAttributes = fc.handleVnodeSaxAttributes
+        offset,length = section
+        size = elementStruct.size
+        unpack_from = elementStruct.unpack_from
+        children = [] # The top-level vnodes.
+        stack = [] # Lists [v,remaining,skip], where skip is True for clones.
+        for i in range(offset,offset+length-size+1,size):
+            nodeId,n,attrs = unpack_from(data,i)
+            if stack and stack[-1][2]:
+                # Like fc.createSaxChildren, ignore the descendants of clones.
+                v,skip = None,True
+            else:
+                parent_v = stack and stack[-1][0]
+                v = vnodes[nodeId]
+                if v:
+                    skip = True
+                    self.clones.append((parent_v,v),)
+                else:
+                    gnxOffset,gnxLength,headOffset,headLength = getNode(nodeId)[:4]
+                    gnx = strings[gnxOffset:gnxOffset+gnxLength]
+                    v = fc.gnxDict.get(gnx)
+                    if v:
+                        skip = True
+                        self.clones.append((parent_v,v),)
+                    else:
+                        skip = False
+                        v = leoNodes.vnode(context=c)
+                        v.setHeadString(strings[headOffset:headOffset+headLength])
+                        v.fileIndex = g.app.nodeIndices.scanGnx(gnx,0)
+                        created[nodeId] = 1
+                    fc.gnxDict[fc.canonicalTnodeIndex(gnx)] = v
+                    vnodes[nodeId] = v
+                if attrs >= 0:
+                    handleVnodeSaxAttributes(g.Bunch(attributes=attrsList[attrs]),v)
+                if parent_v:
+                    parent_v.children.append(v)
+                else:
+                    children.append(v)
+            if n:
+                stack.append([v,n,skip])
+            else:
+                self.endElements(stack)
+        if stack:
+            raise BadBinaryFile('%s: truncated elements section' % self.fileName)
+        return children
+    #@+node:ekr.20130413052322.10235: *4* endElements
+    def endElements (self,stack):
+
+        '''An element without children has just been read.
+        Pop all completed elements from the stack.'''
+
+        while stack:
+            entry = stack[-1]
+            entry[1] -= 1
+            if entry[1] > 0:
+                break
+            stack.pop()
+            v,n,skip = entry
+            if not skip:
+                # As in fc.createSaxChildren, link the children to v
+                # after creating v's entire tree.
+                for child in v.children:
+                    child.parents.append(v)
+    #@+node:ekr.20130413052322.10236: *4* finishNodes
+    def finishNodes (self,attrsList,vnodes,created):
+
+        '''Set the body text and <t> attributes of all vnodes.
+
+        This is the equivalent of reading the <t> elements of a .leo file.'''
+
+        fc,loader = self.fc,self.loader
+        for n,v in enumerate(vnodes):
+            if not v: continue
+            flags,offset,length,attrs = loader.getNode(n)[4:]
+            if flags & bodyBit:
+                if not created[n]:
+                    # The body of the later node overrides the earlier.
+                    v.setBodyString(loader.loadBody(n))
+                elif length > 0:
+                    loader.addLazyBody(v,n)
+                if attrs >= 0:
+                    fc.handleTnodeSaxAttributes(
+                        g.Bunch(tnodeAttributes=attrsList[attrs]),v)
+    #@-others
+#@+node:ekr.20130413052322.10237: ** class lazyBodyLoader
+class lazyBodyLoader:
+
+    '''A class that loads the body text of vnodes from the contents of a
+    .leob file.
+
+    v._lazyBody is a tuple (loader,n) for vnodes whose body text is n's
+    body in the file.'''
+
+    #@+others
+    #@+node:ekr.20130413052322.10238: *3*  ctor (lazyBodyLoader)
+    def __init__ (self,fileName,data,sections):
+
+        self.data = data # The contents of the file (bytes).
+        self.fileName = fileName
+        self.bodiesOffset = sections['bodies'][0]
+        self.nodesOffset = sections['nodes'][0]
+        self.numberOfNodes = sections['nodes'][1] // nodeStruct.size
+        self.sections = sections # Keys are section names, values are (offset,length).
+        self.vnodes = [] # All vnodes whose bodies were lazy when the file was read.
+    #@+node:ekr.20130413052322.10239: *3* addLazyBody & unloadBody
+    def addLazyBody (self,v,n):
+
+        '''Make v's body text lazy, loaded from node n.'''
+
+        self.unloadBody(v,n)
+        self.vnodes.append(v)
+
+    def unloadBody (self,v,n):
+
+        '''Make v's body text lazy again.
+
+        v's body text must be the body text of node n.'''
+
+        v._bodyText = None
+        v._lazyBody = self,n
+    #@+node:ekr.20130413052322.10240: *3* close
+    def close (self,load=True):
+
+        '''Release the file's contents. If load is True, first load the body
+        text of all vnodes whose body text has not been loaded.'''
+
+        if load:
+            for v in self.vnodes:
+                if v.hasLazyBody() and v._lazyBody[0] is self:
+                    v._bodyString # Load the body text.
+        self.vnodes = []
+        self.data = None
+    #@+node:ekr.20130413052322.10233: *3* getNode
+    def getNode (self,n):
+
+        '''Return the record for node n.
+
+        Node records are not cached: unpacking them is faster than
+        keeping Python ints for all fields of all nodes.'''
+
+        if not 0 <= n < self.numberOfNodes:
+            raise IndexError('bad node id: %s' % n)
+        return nodeStruct.unpack_from(self.data,self.nodesOffset+n*nodeStruct.size)
+    #@+node:ekr.20130413052322.10241: *3* getRawBody & loadBody
+    def getRawBody (self,n):
+
+        '''Return the body text of node n as utf-8 encoded bytes.'''
+
+        offset,length = self.getNode(n)[5:7]
+        i = self.bodiesOffset + offset
+        return self.data[i:i+length]
+
+    def loadBody (self,n):
+
+        '''Return the body text of node n.'''
+
+        return g.toUnicode(self.getRawBody(n),'utf-8',reportErrors=True)
+    #@+node:ekr.20130413052322.10242: *3* lazyVnodes
+    def lazyVnodes (self):
+
+        '''Return the list of vnodes whose body text has not been loaded.'''
+
+        return [v for v in self.vnodes
+            if v.hasLazyBody() and v._lazyBody[0] is self]
+    #@-others
+#@-others
+#@-leo
@@ -23,6 +23,16 @@ import stat
 # import time
 import zlib
 
+try:
+    from collections import OrderedDict
+except ImportError: # Python 2.6.
+    OrderedDict = dict
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
 # try:
     # import marshal
 # except ImportError:
@@ -32,6 +42,7 @@ import zlib
 # Abbreviations used throughout.
 abspath     = g.os_path_abspath
 basename    = g.os_path_basename
+dirname     = g.os_path_dirname
 expanduser  = g.os_path_expanduser
 isdir       = g.os_path_isdir
 isfile      = g.os_path_isfile
@@ -61,6 +72,12 @@ class cacher:
             # When caching is enabled will be a PickleShareDB instance.
         self.dbdirname = None # A string.
         self.inited = False
+        self.readStamps = {}
+            # Keys are file keys, values are (fileName,headline,mtime,size)
+            # tuples for @auto and @edit files that are not yet in the cache.
+        self.stats = {}
+            # Keys are kinds of nodes ('@auto','@edit','@file').
+            # Values are dicts with keys 'hits','misses' and 'unread'.
 
     #@+node:ekr.20100208082353.5918: *4* initFileDB
     def initFileDB (self,fn):
@@ -83,12 +100,25 @@ class cacher:
             self.dbdirname = dbdirname = join(g.app.homeLeoDir,'db',
                 '%s_%s' % (bname,hashlib.md5(fn).hexdigest()))
 
-            self.db = PickleShareDB(dbdirname)
+            self.db = self.createFileDB(dbdirname)
             # Fixes bug 670108.
             self.c.db = self.db
             self.inited = True
 
             if trace: g.trace('self.c.db',self.db)
+    #@+node:ekr.20130413052322.10247: *5* createFileDB
+    def createFileDB (self,dbdirname):
+
+        '''Return the db for the file whose cache directory is dbdirname.'''
+
+        c = self.c
+        if sqlite3 and c and c.config.getBool('use-sqlite-cache',default=False):
+            try:
+                return SqlitePickleShareDB(dbdirname)
+            except Exception:
+                g.es_print('can not open sqlite cache:',dbdirname)
+                g.es_exception()
+        return PickleShareDB(dbdirname)
     #@+node:ekr.20100208082353.5920: *4* initGlobalDb
     def initGlobalDB (self):
 
@@ -109,6 +139,20 @@ class cacher:
 
         if changeName or not self.inited:
             self.initFileDB(fn)
+    #@+node:ekr.20130413052322.10248: *3* beginBatch & endBatch (cacher)
+    def beginBatch (self):
+
+        '''Start buffering writes to the file db, if the db supports batches.'''
+
+        if hasattr(self.db,'beginBatch'):
+            self.db.beginBatch()
+
+    def endBatch (self):
+
+        '''Write all writes buffered since the matching call to beginBatch.'''
+
+        if hasattr(self.db,'endBatch'):
+            self.db.endBatch()
     #@+node:ekr.20100209160132.5759: *3* clear/AllCache(s) (cacher)
     def clearCache (self):
         if self.db:
@@ -173,6 +217,7 @@ class cacher:
             v = parent_v
             v._headString = h    
             v._bodyString = b
+            v.textChanged()
 
         for z in children:
             h,b,gnx,grandChildren = z
@@ -316,34 +361,124 @@ class cacher:
         if trace: g.trace(fn,key,data)
         return d
     #@+node:ekr.20100208071151.5905: *4* readFile (cacher)
-    def readFile (self,fileName,root):
+    def readFile (self,fileName,root,kind='@file'):
+
+        '''Create root's tree from the cache if possible.
+
+        For @auto and @edit nodes (kind) the cache also remembers the
+        modification time and size of the file. If neither has changed, the
+        tree is restored without reading the file, and the returned string
+        is None.'''
 
         trace = False and not g.unitTesting
         verbose = True
         if not g.enableDB:
             if trace: g.trace('g.enableDB is False')
             return '',False,None
+        stamp = kind in ('@auto','@edit') and self.getReadStamp(fileName,root.h)
+        if stamp and stamp[0]:
+            key = stamp[0]
+            aList = self.db.get(key)
+            if aList is not None:
+                if trace: g.trace('unchanged',fileName,key)
+                self.countRead(kind,'unread')
+                self.restoreTree(root,aList,fileName)
+                return None,True,key
         s,e = g.readFileIntoString(fileName,raw=True,silent=True)
         if s is None:
             if trace: g.trace('empty file contents',fileName)
             return s,False,None
+        # There will be a bug if s is not already an encoded string.
+        key = self.fileKey(root.h,s,requireEncodedString=True)
+        aList = self.db.get(key) if self.db else None
         assert not g.isUnicode(s)
         if trace and verbose:
             for i,line in enumerate(g.splitLines(s)):
                 print('%3d %s' % (i,repr(line)))
 
-        # There will be a bug if s is not already an encoded string.
-        key = self.fileKey(root.h,s,requireEncodedString=True)
-        ok = self.db and key in self.db
+        ok = aList is not None
         if trace: g.trace('in cache',ok,fileName,key)
+        self.countRead(kind,g.choose(ok,'hits','misses'))
+        if stamp:
+            junk,mtime,size = stamp
+            if ok:
+                # The file was touched, but its contents have not changed.
+                self.setReadStamp(key,fileName,root.h,mtime,size)
+            else:
+                # writeFile remembers the stamp when it caches the tree.
+                self.readStamps[key] = (fileName,root.h,mtime,size)
         if ok:
-            # Delete the previous tree, regardless of the @<file> type.
-            while root.hasChildren():
-                root.firstChild().doDelete()
-            # Recreate the file from the cache.
-            aList = self.db.get(key)
-            self.createOutlineFromCacheList(root.v,aList,fileName=fileName)
+            self.restoreTree(root,aList,fileName)
         return s,ok,key
+    #@+node:ekr.20130413052322.10356: *5* restoreTree (cacher)
+    def restoreTree (self,root,aList,fileName):
+
+        '''Replace root's tree by the tree in aList.'''
+
+        # Delete the previous tree, regardless of the @<file> type.
+        while root.hasChildren():
+            root.firstChild().doDelete()
+        # Recreate the file from the cache.
+        self.createOutlineFromCacheList(root.v,aList,fileName=fileName)
+    #@+node:ekr.20130413052322.10357: *5* getReadStamp & setReadStamp (cacher)
+    def getReadStamp (self,fileName,headline):
+
+        '''Return (key,mtime,size) for fileName. key is the file key of the
+        tree last read from fileName, or None if the file has been changed
+        since then. Return None if the file does not exist.'''
+
+        try:
+            st = os.stat(fileName)
+        except OSError:
+            return None
+        aTuple = self.db.get(self.readStampKey(fileName,headline))
+        if aTuple and aTuple[1:] == (st.st_mtime,st.st_size):
+            key = aTuple[0]
+        else:
+            key = None
+        return key,st.st_mtime,st.st_size
+
+    def setReadStamp (self,key,fileName,headline,mtime,size):
+
+        '''Remember that fileName, whose modification time and size are
+        given, contains the file whose tree is cached under key.'''
+
+        stampKey = self.readStampKey(fileName,headline)
+        aTuple = (key,mtime,size)
+        if self.db.get(stampKey) != aTuple:
+            self.db[stampKey] = aTuple
+
+    def readStampKey (self,fileName,headline):
+
+        # Several nodes may read the same file.
+        return self.fileKey(fileName,'read-stamp\n%s' % headline)
+    #@+node:ekr.20130413052322.10358: *5* countRead & printStats (cacher)
+    def countRead (self,kind,what):
+
+        '''Count one cache hit, miss or unread file for the given kind of node.'''
+
+        d = self.stats.get(kind)
+        if d is None:
+            d = self.stats[kind] = {'hits':0,'misses':0,'unread':0}
+        d[what] += 1
+
+    def printStats (self):
+
+        '''Print the cache statistics for this outline.
+
+        unread: the file was unchanged, so the tree was restored without reading it.
+        hits:   the contents of the file were found in the cache.
+        misses: the file had to be read in the usual way.'''
+
+        c = self.c
+        g.es_print('cache statistics: %s' % (
+            c and c.shortFileName() or '<no file>'))
+        if not self.stats:
+            g.es_print('no external files read')
+        for kind in sorted(self.stats):
+            d = self.stats[kind]
+            g.es_print('%-6s unread: %4s hits: %4s misses: %4s' % (
+                kind,d['unread'],d['hits'],d['misses']))
     #@+node:ekr.20100208082353.5927: *3* Writing
     #@+node:ekr.20100208071151.5901: *4* makeCacheList
     def makeCacheList(self,p):
@@ -412,11 +547,103 @@ class cacher:
         elif not fileKey:
             g.trace(g.callers(5))
             g.internalError('empty fileKey')
-        elif self.db.get(fileKey):
-            if trace: g.trace('already cached',fileKey)
         else:
-            if trace: g.trace('caching ',p.h,fileKey)
-            self.db[fileKey] = self.makeCacheList(p)
+            if self.db.get(fileKey):
+                if trace: g.trace('already cached',fileKey)
+            else:
+                if trace: g.trace('caching ',p.h,fileKey)
+                self.db[fileKey] = self.makeCacheList(p)
+            stamp = self.readStamps.pop(fileKey,None)
+            if stamp:
+                self.setReadStamp(fileKey,*stamp)
+    #@+node:ekr.20130413052322.10274: *4* writeFingerprint (cacher)
+    def writeFingerprint (self,root,kind,fileName):
+
+        '''Return a hash of everything that affects the external file
+        written from root: the kind and path of the file, the settings used
+        when writing, the headlines and bodies of root's ancestors (the
+        directives they contain) and the outline structure, gnx's, headlines
+        and bodies of root's subtree.'''
+
+        c = self.c
+        aList = [repr(z) for z in (
+            'write-fingerprint-1',kind,fileName,
+            c.config.default_derived_file_encoding,
+            c.config.output_initial_comment,
+            c.config.getBool('force_newlines_in_at_nosent_bodies'),
+            c.config.getString('underindent-escape-string'),
+            g.getOutputNewline(c=c),
+            c.tab_width,c.page_width,
+        )]
+        for p in root.parents():
+            aList.extend([p.h,p.b])
+        level0 = root.level()
+        for p in root.self_and_subtree():
+            aList.extend([str(p.level()-level0),p.gnx,p.h,p.b])
+        s = g.toEncodedString('\x00'.join([g.toUnicode(z) for z in aList]))
+        return hashlib.md5(s).hexdigest()
+    #@+node:ekr.20130413052322.10275: *4* isUnchangedWrite (cacher)
+    def isUnchangedWrite (self,fileName,fingerprint):
+
+        '''Return True if fileName was last written from an outline whose
+        fingerprint matches the given fingerprint and the file has not
+        changed since then.'''
+
+        trace = False and not g.unitTesting
+
+        if not g.enableDB or not fingerprint:
+            return False
+        key = self.fileKey(fileName,'write-fingerprint')
+        aTuple = self.db.get(key)
+        if not aTuple or aTuple[0] != fingerprint:
+            if trace: g.trace('changed outline',fileName)
+            return False
+        try:
+            st = os.stat(fileName)
+        except OSError:
+            if trace: g.trace('missing',fileName)
+            return False
+        junk,contentHash,mtime,size = aTuple
+        if st.st_size != size:
+            if trace: g.trace('size changed',fileName)
+            return False
+        if st.st_mtime == mtime:
+            return True
+        # The file was touched: compare the contents.
+        if self.contentHash(fileName) != contentHash:
+            if trace: g.trace('contents changed',fileName)
+            return False
+        self.db[key] = (fingerprint,contentHash,st.st_mtime,size)
+        return True
+    #@+node:ekr.20130413052322.10276: *4* rememberWrite & contentHash (cacher)
+    def rememberWrite (self,fileName,fingerprint):
+
+        '''Remember that fileName now contains the file written
+        from an outline whose fingerprint is given.'''
+
+        if not g.enableDB or not fingerprint:
+            return
+        try:
+            st = os.stat(fileName)
+        except OSError:
+            return
+        key = self.fileKey(fileName,'write-fingerprint')
+        contentHash = self.contentHash(fileName)
+        if contentHash:
+            self.db[key] = (fingerprint,contentHash,st.st_mtime,st.st_size)
+
+    def contentHash (self,fileName):
+
+        '''Return the md5 hash of the contents of fileName or None.'''
+
+        try:
+            f = open(fileName,'rb')
+            try:
+                return hashlib.md5(f.read()).hexdigest()
+            finally:
+                f.close()
+        except IOError:
+            return None
     #@+node:ekr.20100208065621.5890: *3* test (cacher)
     def test(self):
 
@@ -801,5 +1028,216 @@ class PickleShareDB:
             self.cache.pop(it,None)
 
     #@-others
+#@+node:ekr.20130413052322.10249: ** class SqlitePickleShareDB
+class SqlitePickleShareDB:
+
+    """A PickleShareDB that keeps all entries in a single sqlite file.
+
+    The file for the root directory x is x.sqlite. Values are zlib-compressed
+    pickles, as in PickleShareDB. An LRU cache holds recently used values,
+    up to cacheSize bytes of compressed data.
+
+    Unlike PickleShareDB, this class does not check whether other processes
+    have changed values that are in its LRU cache. Values for fcache/ keys
+    never change: the keys contain hashes of the values."""
+
+    #@+others
+    #@+node:ekr.20130413052322.10250: *3*  Birth & special methods (SqlitePickleShareDB)
+    #@+node:ekr.20130413052322.10251: *4*  __init__ (SqlitePickleShareDB)
+    def __init__(self,root,cacheSize=8*1024*1024):
+
+        """
+        Init the SqlitePickleShareDB class.
+        root: The directory that would contain the data of a PickleShareDB.
+        """
+
+        trace = False and not g.unitTesting
+
+        self.root = abspath(expanduser(root))
+        self.dbfile = self.root + '.sqlite'
+
+        if trace: g.trace('SqlitePickleShareDB',self.dbfile)
+
+        parent = dirname(self.dbfile)
+        if not isdir(parent):
+            os.makedirs(parent)
+
+        self.batchLevel = 0 # > 0: between beginBatch and endBatch.
+        self.cache = OrderedDict()
+            # Keys are keys, values are tuples (obj,size)
+            # The least recently used keys come first.
+        self.cacheSize = cacheSize # The maximum of the sum of all sizes in self.cache.
+        self.cachedSize = 0 # The sum of all sizes in self.cache.
+
+        self.conn = sqlite3.connect(self.dbfile)
+        self.conn.execute(
+            'create table if not exists cachevalues'
+            '(key text primary key, data blob)')
+        self.conn.commit()
+
+        def loadz(data):
+            return pickle.loads(zlib.decompress(bytes(data)))
+
+        def dumpz(val):
+            return zlib.compress(pickle.dumps(val,pickle.HIGHEST_PROTOCOL))
+
+        self.loader = loadz
+        self.dumper = dumpz
+    #@+node:ekr.20130413052322.10252: *4* __contains__
+    def __contains__(self,key):
+
+        return self.has_key(key)
+    #@+node:ekr.20130413052322.10253: *4* __delitem__
+    def __delitem__(self,key):
+
+        """ del db["key"] """
+
+        self.uncache(key)
+        self.conn.execute('delete from cachevalues where key=?',(key,))
+        self.commit()
+    #@+node:ekr.20130413052322.10254: *4* __getitem__
+    def __getitem__(self,key):
+
+        """ db['key'] reading """
+
+        trace = False and not g.unitTesting
+
+        data = self.cache.pop(key,None)
+        if data:
+            self.cache[key] = data # Make key the most recently used key.
+            if trace: g.trace('(SqlitePickleShareDB: in cache)',key)
+            return data[0]
+
+        row = self.conn.execute(
+            'select data from cachevalues where key=?',(key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        try:
+            obj = self.loader(row[0])
+        except Exception:
+            if trace: g.trace('***Exception',key)
+            raise KeyError(key)
+
+        self.cacheValue(key,obj,len(row[0]))
+        return obj
+    #@+node:ekr.20130413052322.10255: *4* __iter__
+    def __iter__(self):
+
+        for k in list(self.keys()):
+            yield k
+    #@+node:ekr.20130413052322.10256: *4* __repr__
+    def __repr__(self):
+
+        return "SqlitePickleShareDB('%s')" % self.root
+    #@+node:ekr.20130413052322.10257: *4* __setitem__
+    def __setitem__(self,key,value):
+
+        """ db['key'] = 5 """
+
+        trace = False and not g.unitTesting
+        if trace: g.trace('(SqlitePickleShareDB)',key)
+
+        data = self.dumper(value)
+        self.conn.execute(
+            'insert or replace into cachevalues (key,data) values (?,?)',
+            (key,sqlite3.Binary(data)))
+        self.commit()
+        self.uncache(key)
+        self.cacheValue(key,value,len(data))
+    #@+node:ekr.20130413052322.10258: *3* beginBatch, endBatch & commit
+    def beginBatch (self):
+
+        """Start buffering writes until the matching call to endBatch.
+
+        sqlite writes all changes made between beginBatch and endBatch
+        in a single transaction."""
+
+        self.batchLevel += 1
+
+    def endBatch (self):
+
+        self.batchLevel = max(0,self.batchLevel-1)
+        self.commit()
+
+    def commit (self):
+
+        if not self.batchLevel:
+            self.conn.commit()
+    #@+node:ekr.20130413052322.10259: *3* cacheValue
+    def cacheValue (self,key,obj,size):
+
+        """Add obj to the LRU cache, removing the least recently used values
+        until the cache holds at most self.cacheSize bytes."""
+
+        if size > self.cacheSize:
+            return
+        self.cache[key] = obj,size
+        self.cachedSize += size
+        while self.cachedSize > self.cacheSize:
+            oldest = next(iter(self.cache))
+            self.uncache(oldest)
+    #@+node:ekr.20130413052322.10260: *3* clear
+    def clear (self,verbose=False):
+
+        if verbose:
+            g.red('clearing cache at file...\n')
+            g.es_print(self.dbfile)
+
+        self.uncache()
+        self.conn.execute('delete from cachevalues')
+        self.commit()
+        self.compact()
+    #@+node:ekr.20130413052322.10261: *3* compact
+    def compact (self):
+
+        """Reclaim the space used by deleted values.
+
+        sqlite's vacuum command rebuilds the file atomically: if it fails,
+        the file remains unchanged."""
+
+        if not self.batchLevel:
+            self.conn.commit()
+            self.conn.execute('vacuum')
+    #@+node:ekr.20130413052322.10262: *3* get, has_key & items
+    def get(self, key, default=None):
+
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def has_key(self, key):
+
+        if key in self.cache:
+            return True
+        row = self.conn.execute(
+            'select 1 from cachevalues where key=?',(key,)).fetchone()
+        return row is not None
+
+    def items(self):
+        return [z for z in self]
+    #@+node:ekr.20130413052322.10263: *3* keys
+    def keys(self, globpat = None):
+
+        """Return all keys in DB, or all keys matching a glob"""
+
+        result = [row[0] for row in
+            self.conn.execute('select key from cachevalues')]
+        if globpat is not None:
+            result = [z for z in result if fnmatch.fnmatchcase(z,globpat)]
+        return result
+    #@+node:ekr.20130413052322.10264: *3* uncache
+    def uncache(self,*items):
+
+        """Remove all, or specified items from the LRU cache."""
+
+        if not items:
+            self.cache = OrderedDict()
+            self.cachedSize = 0
+        for it in items:
+            data = self.cache.pop(it,None)
+            if data:
+                self.cachedSize -= data[1]
+    #@-others
 #@-others
 #@-leo
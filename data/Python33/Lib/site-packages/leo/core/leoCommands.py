@@ -183,6 +183,9 @@ class Commands (object):
             # List of nodes with conflicting read-time data.
         self.nodeConflictFileName = None
             # The fileName for c.nodeConflictList.
+        self.outlineGeneration = 0
+            # Incremented whenever any headline, body or link changes.
+            # The quicksearch plugin uses this to reuse previous hits.
         self.timeStampDict = {}
     #@+node:ekr.20120217070122.10467: *5* c.initEventIvars
     def initEventIvars(self):
@@ -274,6 +277,9 @@ class Commands (object):
         self.searchCommands = None
         self.spellCommands = None
         self.leoTestManager = None
+        self.outlineIndex = None # Set in initObjects.
+        self.searchIndex = None # Set in initObjects.
+        self.gnxIndex = None # Set in initObjects.
     #@+node:ekr.20120217070122.10470: *5* c.initObjects
     def initObjects(self,gui):
 
@@ -287,6 +293,13 @@ class Commands (object):
         self.hiddenRootNode = leoNodes.vnode(context=c)
         self.hiddenRootNode.setHeadString('<hidden root vnode>')
 
+        # An index of all vnodes by gnx. It is built when first needed.
+        self.gnxIndex = leoNodes.gnxIndex(c)
+
+        # An optional preorder index of all positions.
+        if c.config.getBool('use-outline-index',default=False):
+            self.outlineIndex = leoNodes.outlineIndex(c)
+
         # Create the gui frame.
         title = c.computeWindowTitle(c.mFileName)
 
@@ -309,6 +322,7 @@ class Commands (object):
         import leo.core.leoCache as leoCache
         import leo.core.leoChapters as leoChapters
         import leo.core.leoEditCommands as leoEditCommands
+        import leo.core.leoFind as leoFind
         import leo.core.leoKeys as leoKeys
         import leo.core.leoFileCommands as leoFileCommands
         import leo.core.leoImport as leoImport
@@ -335,6 +349,10 @@ class Commands (object):
         self.cacher.initFileDB(self.mFileName)
         self.undoer = leoUndo.undoer(self)
 
+        # An optional index used by the find commands.
+        if c.config.getBool('use-search-index',default=False):
+            self.searchIndex = leoFind.searchIndex(c)
+
         import leo.plugins.free_layout as free_layout
         self.free_layout = free_layout.FreeLayoutController(c)
     #@+node:ekr.20031218072017.2814: *4* c.__repr__ & __str__
@@ -1011,7 +1029,11 @@ class Commands (object):
         c = self
         pat = re.compile(regex, flags)
         res = leoNodes.poslist()
+        candidates = c.searchIndex and c.searchIndex.candidates(
+            pat.pattern,regexp=True,flags=pat.flags)
         for p in c.all_positions():
+            if candidates and p.v not in candidates[0]:
+                continue
             m = re.match(pat, p.h)
             if m:
                 pc = p.copy()
@@ -1029,7 +1051,11 @@ class Commands (object):
         c = self
         pat = re.compile(regex, flags)
         res = leoNodes.poslist()
+        candidates = c.searchIndex and c.searchIndex.candidates(
+            pat.pattern,regexp=True,flags=pat.flags)
         for p in c.all_positions():
+            if candidates and p.v not in candidates[1]:
+                continue
             m = re.finditer(pat, p.b)
             t1,t2 = itertools.tee(m,2)
             try:
@@ -1065,6 +1091,10 @@ class Commands (object):
     #@+node:ekr.20091001141621.6062: *4* c.all_unique_positions
     def all_unique_positions(self):
         c = self
+        if c.outlineIndex:
+            for p in c.outlineIndex.unique_positions():
+                yield p
+            raise StopIteration
         p = c.rootPosition() # Make one copy.
         seen = set()
         while p:
@@ -1082,6 +1112,10 @@ class Commands (object):
     #@+node:ekr.20091001141621.6044: *4* c.all_positions
     def all_positions (self):
         c = self
+        if c.outlineIndex:
+            for p in c.outlineIndex.positions():
+                yield p
+            raise StopIteration
         p = c.rootPosition() # Make one copy.
         while p:
             yield p
@@ -1091,6 +1125,19 @@ class Commands (object):
     # Compatibility with old code.
     all_positions_iter = all_positions
     allNodes_iter = all_positions
+    #@+node:ekr.20130411052322.10187: *4* c.invalidateOutlineIndex
+    def invalidateOutlineIndex (self):
+
+        '''Invalidate c.outlineIndex and c.gnxIndex, if they exist.
+
+        Code that changes v.children directly, rather than with the
+        position or vnode methods, must call this method.'''
+
+        c = self
+        if c.outlineIndex:
+            c.outlineIndex.invalidate()
+        if c.gnxIndex:
+            c.gnxIndex.invalidate()
     #@+node:ekr.20090130135126.1: *3* c.Properties
     def __get_p(self):
 
@@ -1239,6 +1286,7 @@ class Commands (object):
         if derived:
             ic.importDerivedFiles(parent=c.p,paths=derived)
 
+        files = []
         for fn in others:
             junk,ext = g.os_path_splitext(fn)
             if ext.startswith('.'): ext = ext[1:]
@@ -1250,11 +1298,18 @@ class Commands (object):
             elif ext == 'txt':
                 ic.importFlattenedOutline([fn])
             else:
-                ic.importFilesCommand([fn],"@file")
+                files.append(fn)
 
             # No longer supported.
             # c.importCommands.importFilesCommand (names,"@root")
 
+        if ic.getImportProcesses(files) > 1:
+            # Import all files at once in worker processes.
+            ic.importFilesCommand(files,"@file")
+        else:
+            for fn in files:
+                ic.importFilesCommand([fn],"@file")
+
         c.raise_error_dialogs(kind='read')
 
     # Compatibility
@@ -1334,6 +1389,7 @@ class Commands (object):
             # 2010/10/09: Fix an interface blunder. Show all files by default.
             ("All files","*"),
             ("Leo files","*.leo"),
+            ("Leo binary files","*.leob"),
             ("Python files","*.py"),]
 
         fileName = ''.join(c.k.givenArgs) or g.app.gui.runOpenFileDialog(
@@ -1344,7 +1400,7 @@ class Commands (object):
 
         ok = False
         if fileName:
-            if fileName.endswith('.leo'):
+            if fileName.endswith(('.leo','.leob')):
                 c2 = g.openWithFileName(fileName,old_c=c)
                 if c2:
                     g.chdir(fileName)
@@ -1739,14 +1795,15 @@ class Commands (object):
                 fileName = ''.join(c.k.givenArgs) or g.app.gui.runSaveFileDialog(
                     initialfile = c.mFileName,
                     title="Save",
-                    filetypes=[("Leo files", "*.leo")],
+                    filetypes=[("Leo files", "*.leo"),("Leo binary files", "*.leob")],
                     defaultextension=".leo")
 
             c.bringToFront()
 
             if fileName:
                 # Don't change mFileName until the dialog has suceeded.
-                c.mFileName = g.ensure_extension(fileName, ".leo")
+                c.mFileName = g.ensure_extension(fileName,
+                    ".leob" if fileName.endswith('.leob') else ".leo")
                 c.frame.title = c.mFileName
                 c.frame.setTitle(g.computeWindowTitle(c.mFileName))
                 c.openDirectory = c.frame.openDirectory = g.os_path_dirname(c.mFileName)
@@ -1806,7 +1863,7 @@ class Commands (object):
         fileName = ''.join(c.k.givenArgs) or g.app.gui.runSaveFileDialog(
             initialfile = c.mFileName,
             title="Save As",
-            filetypes=[("Leo files", "*.leo")],
+            filetypes=[("Leo files", "*.leo"),("Leo binary files", "*.leob")],
             defaultextension=".leo")
         c.bringToFront()
 
@@ -1815,7 +1872,8 @@ class Commands (object):
             if c.mFileName:
                 g.app.forgetOpenFile(c.mFileName)
             # Don't change mFileName until the dialog has suceeded.
-            c.mFileName = g.ensure_extension(fileName, ".leo")
+            c.mFileName = g.ensure_extension(fileName,
+                ".leob" if fileName.endswith('.leob') else ".leo")
             c.frame.title = c.mFileName
             c.frame.setTitle(g.computeWindowTitle(c.mFileName))
             c.openDirectory = c.frame.openDirectory = g.os_path_dirname(c.mFileName)
@@ -1863,12 +1921,13 @@ class Commands (object):
         fileName = ''.join(c.k.givenArgs) or g.app.gui.runSaveFileDialog(
             initialfile = c.mFileName,
             title="Save To",
-            filetypes=[("Leo files", "*.leo")],
+            filetypes=[("Leo files", "*.leo"),("Leo binary files", "*.leob")],
             defaultextension=".leo")
         c.bringToFront()
 
         if fileName:
-            fileName = g.ensure_extension(fileName, ".leo")
+            fileName = g.ensure_extension(fileName,
+                ".leob" if fileName.endswith('.leob') else ".leo")
             c.fileCommands.saveTo(fileName)
             g.app.recentFilesManager.updateRecentFiles(fileName)
             g.chdir(fileName)
@@ -4429,6 +4488,7 @@ class Commands (object):
 
         bunch = u.beforeSort(p,undoType,oldChildren,newChildren,sortChildren)
         parent_v.children = newChildren
+        c.invalidateOutlineIndex()
         if parent:
             dirtyVnodeList = parent.setAllAncestorAtFileNodesDirty()
         else:
@@ -6086,6 +6146,7 @@ class Commands (object):
         parent_v.children = parent_v.children[:n+1]
         # Add the moved nodes to p's children
         p.v.children.extend(followingSibs)
+        c.invalidateOutlineIndex()
         # Adjust the parent links in the moved nodes.
         # There is no need to adjust descendant links.
         for child in followingSibs:
@@ -6331,6 +6392,7 @@ class Commands (object):
         parent_v.children.extend(z[n:])
         # Remove v's children.
         p.v.children = []
+        c.invalidateOutlineIndex()
 
         # Adjust the parent links in the moved children.
         # There is no need to adjust descendant links.
@@ -7871,13 +7933,22 @@ class Commands (object):
         c = self
         context = v.context # v's commander.
         assert (c == context)
+        gi = c.gnxIndex
+        # The index is faster than list.index only for long lists of children.
+        minDictSize = gi and gi.minDictSize or -1
         stack = []
         while v.parents:
             parent = v.parents[0]
-            if v in parent.children:
-                n = parent.children.index(v)
+            children = parent.children
+            if len(children) < minDictSize or minDictSize == -1:
+                if v in children:
+                    n = children.index(v)
+                else:
+                    return None
             else:
-                return None
+                n = gi.childIndex(parent,v)
+                if n is None:
+                    return None
             stack.insert(0,(v,n),)
             v = parent
 
@@ -1254,6 +1254,7 @@ class GlobalConfigManager:
         self.inited = False
         self.menusList = []
         self.menusFileName = ''
+        self.recorder = None # A list of (setting,kind,val,local) tuples, used by pc.beginManifest.
         if g.new_modes:
             pass # Use k.ModeController instead.
         else:
@@ -1415,6 +1416,8 @@ class GlobalConfigManager:
             val,junk = self.getValFromDict(d,setting,kind)
             if trace:
                 print('g.app.config.get %30s %s' % (setting,val))
+            if self.recorder is not None:
+                self.recorder.append((setting,kind,val,False),)
             return val
         else:
             if trace:
@@ -1803,6 +1806,9 @@ class LocalConfigManager:
             if trace and verbose and val is not None:
                 # g.trace('%35s %20s %s' % (setting,val,g.callers(3)))
                 g.trace('%40s %s' % (setting,val))
+            recorder = g.app.config and g.app.config.recorder
+            if recorder is not None:
+                recorder.append((setting,kind,val,True),)
             return val
         else:
             if trace and lm.globalSettingsDict:
@@ -1146,7 +1146,9 @@ class controlCommandsClass (baseEditCommandsClass):
 
             # Plugin info.
             'print-plugin-handlers':    self.printPluginHandlers,
+            'print-plugin-handler-stats': self.printPluginHandlerStats,
             'print-plugins-info':       self.printPluginsInfo,
+            'toggle-plugin-handler-stats': self.togglePluginHandlerStats,
 
             # Shell commands.
             'shell-command':            self.shellCommand,
@@ -1179,6 +1181,14 @@ class controlCommandsClass (baseEditCommandsClass):
 
         g.app.pluginsController.printHandlers(self.c)
 
+    def printPluginHandlerStats (self,event=None):
+
+        '''Print the number of calls and the time taken by each plugin handler.
+
+        Use toggle-plugin-handler-stats to start collecting statistics.'''
+
+        g.app.pluginsController.printHandlerStats(self.c)
+
     def printPlugins (self,event=None):
 
         '''Print the file name responsible for loading a plugin.
@@ -1196,6 +1206,15 @@ class controlCommandsClass (baseEditCommandsClass):
         that enables the plugin.'''
 
         g.app.pluginsController.printPluginsInfo(self.c)
+
+    def togglePluginHandlerStats (self,event=None):
+
+        '''Start or stop collecting statistics for plugin handlers.'''
+
+        pc = g.app.pluginsController
+        pc.setHandlerStatsEnabled(not pc.handlerStatsEnabled)
+        g.es('plugin handler statistics:',
+            g.choose(pc.handlerStatsEnabled,'on','off'))
     #@+node:ekr.20060603161041: *3* setSilentMode
     def setSilentMode (self,event=None):
 
@@ -1713,6 +1732,7 @@ class editCommandsClass (baseEditCommandsClass):
             'previous-line':                        self.prevLine,
             'previous-line-extend-selection':       self.prevLineExtendSelection,
             'print-all-uas':                        self.printAllUas,
+            'print-cache-stats':                    self.printCacheStats,
             'print-node-uas':                       self.printUas,
             'remove-blank-lines':                   self.removeBlankLines,
             'remove-space-from-lines':              self.removeSpaceFromLines,
@@ -3377,6 +3397,15 @@ class editCommandsClass (baseEditCommandsClass):
         c = self.c
         if c.cacher:
             c.cacher.clearCache()
+
+    def printCacheStats (self,event=None):
+
+        '''Print the outline's file cache statistics: how many external files
+        were restored from the cache and how many had to be read.'''
+
+        c = self.c
+        if c.cacher:
+            c.cacher.printStats()
     #@+node:ekr.20050920084036.57: *3* capitalization & case
     #@+node:ekr.20051015114221: *4* capitalizeWord & up/downCaseWord
     def capitalizeWord (self,event):
@@ -13,6 +13,7 @@ import leo.core.leoGlobals as g
     # try: from psyco.classes import *
     # except ImportError: pass
 
+import leo.core.leoBinaryFile as leoBinaryFile
 import leo.core.leoNodes as leoNodes
 import binascii
 import difflib
@@ -35,8 +36,10 @@ import zipfile
 
 try:
     # IronPython has problems with this.
+    import xml.parsers.expat
     import xml.sax
     import xml.sax.saxutils
+    import xml.sax.xmlreader
 except Exception:
     pass
 
@@ -488,6 +491,110 @@ if sys.platform != 'cli':
                 else:
                     node.attributes[name] = val
         #@-others
+    #@+node:ekr.20130412052322.10201: *3* class streamingContentHandler (saxContentHandler)
+    class streamingContentHandler (saxContentHandler):
+
+        '''A content handler that creates vnodes directly from parser events.
+
+        Unlike saxContentHandler, this class creates no intermediate sax nodes.
+        All <t> elements follow the <vnodes> element, so endTnode sets the
+        body text of vnodes created earlier.'''
+
+        #@+others
+        #@+node:ekr.20130412052322.10202: *4*  __init__ (streamingContentHandler)
+        def __init__ (self,c,fileName,silent,inClipboard):
+
+            saxContentHandler.__init__(self,c,fileName,silent,inClipboard)
+
+            self.fc = c.fileCommands
+            self.children = [] # The vnodes that will become the children of the hidden root.
+            self.clones = [] # (parent_v,v) for all <v> elements that denote clones.
+            self.skipLevel = 0 # > 0: in a <v> element that denotes a clone.
+            self.tnodeDict = {} # The attributes of the present <t> element, except tx.
+            self.vnodeStack = [] # The vnodes of the enclosing <v> elements.
+        #@+node:ekr.20130412052322.10203: *4* endTnode
+        def endTnode (self):
+
+            fc = self.fc
+            b = ''.join(self.content)
+            for v in self.nodeList:
+                v.setBodyString(b)
+                if self.tnodeDict:
+                    fc.handleTnodeSaxAttributes(
+                        g.Bunch(tnodeAttributes=self.tnodeDict),v)
+
+            self.content = []
+        #@+node:ekr.20130412052322.10204: *4* endVnode
+        def endVnode (self):
+
+            if self.skipLevel:
+                self.skipLevel -= 1
+                if self.skipLevel:
+                    return # The end of a <v> element within a clone.
+            else:
+                # As in fc.createSaxChildren, link the children to v
+                # after creating v's entire tree.
+                v = self.vnodeStack[-1]
+                for child in v.children:
+                    child.parents.append(v)
+
+            self.vnodeStack.pop()
+        #@+node:ekr.20130412052322.10205: *4* endVH
+        def endVH (self):
+
+            if self.vnodeStack and not self.skipLevel:
+                self.vnodeStack[-1].setHeadString(''.join(self.content))
+
+            self.content = []
+        #@+node:ekr.20130412052322.10206: *4* startVnode
+        def startVnode (self,attrs):
+
+            if self.skipLevel:
+                # Like fc.createSaxChildren, ignore the descendants of clones.
+                self.skipLevel += 1
+                return
+
+            if not self.inElement('vnodes'):
+                self.error('<v> outside <vnodes>')
+
+            c,fc = self.c,self.fc
+            d = dict(attrs.items())
+            tnx = d.pop('t',None)
+            parent_v = self.vnodeStack and self.vnodeStack[-1]
+            v = fc.gnxDict.get(tnx)
+            if v:
+                # A clone. Ignore the <vh> element and all descendants.
+                self.skipLevel = 1
+                self.clones.append((parent_v,v),)
+            else:
+                v = leoNodes.vnode(context=c)
+                v.setHeadString('')
+                if tnx:
+                    v.fileIndex = g.app.nodeIndices.scanGnx(tnx,0)
+
+            fc.gnxDict[fc.canonicalTnodeIndex(tnx)] = v
+            aList = self.tnxToListDict.get(tnx,[])
+            if v not in aList:
+                aList.append(v)
+                self.tnxToListDict[tnx] = aList
+            fc.handleVnodeSaxAttributes(g.Bunch(attributes=d),v)
+
+            if parent_v:
+                parent_v.children.append(v)
+            else:
+                self.children.append(v)
+            self.vnodeStack.append(v)
+        #@+node:ekr.20130412052322.10207: *4* tnodeAttributes
+        def tnodeAttributes (self,attrs):
+
+            tx = attrs.get('tx')
+            self.nodeList = self.tnxToListDict.get(tx,[])
+            if self.nodeList:
+                self.tnodeDict = dict(
+                    [(name,val) for name,val in attrs.items() if name != 'tx'])
+            else:
+                self.error('Bad leo file: no node for <t tx=%s>' % (tx))
+        #@-others
     #@+node:ekr.20060919110638.15: *3* class saxNodeClass
     class saxNodeClass:
 
@@ -589,6 +696,8 @@ class baseFileCommands:
             # 2011/12/10: This dict is never re-inited.
         self.vnodesDict = {}
             # keys are gnx strings; values are ignored
+        self.lazyBodies = None
+            # The leoBinaryFile.lazyBodyLoader for the .leob file, if any.
     #@+node:ekr.20031218072017.3020: ** Reading
     #@+node:ekr.20060919104836: *3*  Top-level
     #@+node:ekr.20070919133659.1: *4* fc.checkLeoFile
@@ -668,6 +777,7 @@ class baseFileCommands:
 
         # Restore the hidden root's children
         c.hiddenRootNode.children = children
+        c.invalidateOutlineIndex()
 
         # Unlink v from the hidden root.
         v.parents.remove(c.hiddenRootNode)
@@ -690,7 +800,8 @@ class baseFileCommands:
                 # 2011/12/12: restore gnxDict.
             for p2 in p.self_and_subtree():
                 v = p2.v
-                v.fileIndex = index = g.app.nodeIndices.getNewIndex()
+                index = g.app.nodeIndices.getNewIndex()
+                v.setFileIndex(index)
                 self.gnxDict[index] = v
 
         if trace and verbose:
@@ -778,7 +889,10 @@ class baseFileCommands:
         c,fc = self.c,self
         try:
             ok = True
-            v = fc.readSaxFile(theFile,fileName,silent,inClipboard=False,reassignIndices=False)
+            if leoBinaryFile.isBinaryFile(theFile):
+                v = fc.readBinaryFile(theFile,fileName,silent)
+            else:
+                v = fc.readSaxFile(theFile,fileName,silent,inClipboard=False,reassignIndices=False)
             if v: # v is None for minimal .leo files.
                 c.setRootVnode(v)
                 fc.rootVnode = v
@@ -864,8 +978,16 @@ class baseFileCommands:
     def readExternalFiles(self,fileName):
 
         c,fc = self.c,self
+        prof = g.app.startupProfiler
 
-        c.atFileCommands.readAll(c.rootVnode(),partialFlag=False)
+        # Write all cache entries in a single batch.
+        if prof: prof.enter('readAll')
+        c.cacher.beginBatch()
+        try:
+            c.atFileCommands.readAll(c.rootVnode(),partialFlag=False)
+        finally:
+            c.cacher.endBatch()
+        if prof: prof.leave('readAll')
         recoveryNode = fc.handleNodeConflicts()
 
         # Do this after reading external files.
@@ -1116,6 +1238,7 @@ class baseFileCommands:
                 self.createSaxChildren(sax_child,v)
             children.append(v)
         parent_v.children = children
+        self.c.invalidateOutlineIndex()
         for child in children:
             child.parents.append(parent_v)
             if trace: g.trace(
@@ -1343,12 +1466,71 @@ class baseFileCommands:
             sax_node = None
 
         return sax_node
+    #@+node:ekr.20130413052322.10243: *4* readBinaryFile
+    def readBinaryFile (self,theFile,fileName,silent):
+
+        '''Read a .leob file. The body text of most vnodes is loaded lazily.
+
+        Return the first top-level vnode, or None if there are no vnodes.
+        On errors, raise BadLeoFile, leaving the outline unchanged.'''
+
+        fc = self ; c = fc.c
+        reader = leoBinaryFile.binaryReader(c,fileName)
+        gnxDict = fc.gnxDict.copy()
+        try:
+            children = reader.read(theFile)
+        except Exception:
+            # Unlink all clones from their new parents and forget all new vnodes.
+            for parent_v,v in reader.clones:
+                if parent_v and parent_v in v.parents:
+                    v.parents.remove(parent_v)
+            fc.gnxDict.clear()
+            fc.gnxDict.update(gnxDict)
+            if reader.loader:
+                reader.loader.close(load=False)
+            junk,message,junk = sys.exc_info()
+            raise BadLeoFile(str(message))
+
+        # Handle the equivalents of the <globals> element and the stylesheet.
+        handler = saxContentHandler(c,fileName,silent,inClipboard=False)
+        AttributesImpl = xml.sax.xmlreader.AttributesImpl
+        meta = reader.meta
+        if meta.get('stylesheet'):
+            handler.processingInstruction('xml-stylesheet',meta.get('stylesheet'))
+        handler.startGlobals(AttributesImpl(meta.get('globals',{})))
+        handler.startWinPos(AttributesImpl(meta.get('global_window_position',{})))
+        handler.startVnodes(None)
+
+        if fc.lazyBodies:
+            fc.lazyBodies.close(load=True)
+        fc.lazyBodies = reader.loader
+        if not children:
+            return None
+        parent_v = c.hiddenRootNode
+        parent_v.children = children
+        c.invalidateOutlineIndex()
+        for child in children:
+            child.parents.append(parent_v)
+        return children[0]
     #@+node:ekr.20060919110638.3: *4* readSaxFile
     def readSaxFile (self,theFile,fileName,silent,inClipboard,reassignIndices,s=None):
 
         dump = False and not g.unitTesting
         fc = self ; c = fc.c
 
+        if c.config.getBool('use-streaming-leo-reader',default=True):
+            try:
+                return fc.readStreamingFile(theFile,fileName,
+                    silent=silent,inClipboard=inClipboard,s=s)
+            except xml.parsers.expat.ExpatError:
+                # Not well-formed xml: the two-pass code below reports the error.
+                if theFile: theFile.seek(0)
+            except Exception:
+                # A bug in the streaming reader: report it and use the two-pass code.
+                g.error('streaming reader failed, using the two-pass reader:',fileName)
+                g.es_exception()
+                if theFile: theFile.seek(0)
+
         # Pass one: create the intermediate nodes.
         saxRoot = fc.parse_leo_file(theFile,fileName,
             silent=silent,inClipboard=inClipboard,s=s)
@@ -1364,6 +1546,58 @@ class baseFileCommands:
             return v
         else:
             return None
+    #@+node:ekr.20130412052322.10208: *4* readStreamingFile
+    def readStreamingFile (self,theFile,fileName,silent,inClipboard,s=None,chunkSize=1024*1024):
+
+        '''Read a .leo file in a single pass, creating vnodes directly from
+        expat events and cleaning the input in chunks of chunkSize bytes.
+
+        Return the first top-level vnode, or None if there are no vnodes.
+        On errors, raise an exception, leaving the outline unchanged.'''
+
+        fc = self ; c = fc.c
+        handler = streamingContentHandler(c,fileName,silent,inClipboard)
+        AttributesImpl = xml.sax.xmlreader.AttributesImpl
+
+        def startElement(name,attrs):
+            handler.startElement(name,AttributesImpl(attrs))
+
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = startElement
+        parser.EndElementHandler = handler.endElement
+        parser.CharacterDataHandler = handler.characters
+        parser.ProcessingInstructionHandler = handler.processingInstruction
+        gnxDict = fc.gnxDict.copy()
+        try:
+            if theFile:
+                # The cleaned characters are ascii,
+                # so cleaning a partial utf-8 sequence is safe.
+                while True:
+                    chunk = theFile.read(chunkSize)
+                    if not chunk: break
+                    parser.Parse(fc.cleanSaxInputString(chunk),False)
+            else:
+                parser.Parse(fc.cleanSaxInputString(s),False)
+            parser.Parse('',True)
+        except Exception:
+            # Unlink all clones from their new parents and forget all new vnodes.
+            for parent_v,v in handler.clones:
+                if parent_v and parent_v in v.parents:
+                    v.parents.remove(parent_v)
+            fc.gnxDict.clear()
+            fc.gnxDict.update(gnxDict)
+            raise
+
+        children = handler.children
+        if not children:
+            return None
+        parent_v = c.hiddenRootNode
+        parent_v.children = children
+        c.invalidateOutlineIndex()
+        for child in children:
+            child.parents.append(parent_v)
+        return children[0]
     #@+node:ekr.20060919110638.11: *4* resolveTnodeLists
     def resolveTnodeLists (self):
 
@@ -1809,7 +2043,64 @@ class baseFileCommands:
 
         """Write a <v> element corresponding to a vnode."""
 
-        fc = self ; c = fc.c ; v = p.v
+        fc = self ; v = p.v
+        isAuto,isIgnore,forceWrite = fc.getVnodeWriteFlags(p,isIgnore)
+
+        #@+<< Set gnx = vnode index >>
+        #@+node:ekr.20031218072017.1864: *5* << Set gnx = vnode index >>
+        gnx = g.app.nodeIndices.toString(v.fileIndex)
+
+        if forceWrite or self.usingClipboard:
+            v.setWriteBit() # 4.2: Indicate we wrote the body text.
+        #@-<< Set gnx = vnode index >>
+        attrs = []
+        #@+<< Append attribute bits to attrs >>
+        #@+node:ekr.20031218072017.1865: *5* << Append attribute bits to attrs >>
+        # These string catenations are benign because they rarely happen.
+        attr = fc.getVnodeAttributeBits(v)
+        if attr:
+            attrs.append(' a="%s"' % attr)
+
+        fc.updateArchivedPosition(p)
+        #@-<< Append attribute bits to attrs >>
+        #@+<< Append unKnownAttributes to attrs >>
+        #@+node:ekr.20040324082713: *5* << Append unKnownAttributes to attrs>>
+        # v.unknownAttributes are now put in <t> elements.
+
+        if p.hasChildren() and not forceWrite and not self.usingClipboard:
+            # We put the entire tree when using the clipboard, so no need for this.
+            if not isAuto: # Bug fix: 2008/8/7.
+                attrs.append(self.putDescendentVnodeUas(p)) # New in Leo 4.5.
+                attrs.append(self.putDescendentAttributes(p))
+        #@-<< Append unKnownAttributes to attrs >>
+        attrs = ''.join(attrs)
+        v_head = '<v t="%s"%s>' % (gnx,attrs)
+        if gnx in fc.vnodesDict:
+            fc.put(v_head+'</v>\n')
+        else:
+            fc.vnodesDict[gnx]=True
+            v_head += '<vh>%s</vh>' % (xml.sax.saxutils.escape(p.v.headString()or''))
+            # The string catentation is faster than repeated calls to fc.put.
+            # New in 4.2: don't write child nodes of @file-thin trees (except when writing to clipboard)
+            if p.hasChildren() and (forceWrite or self.usingClipboard):
+                fc.put('%s\n' % v_head)
+                # This optimization eliminates all "recursive" copies.
+                p.moveToFirstChild()
+                while 1:
+                    fc.putVnode(p,isIgnore)
+                    if p.hasNext(): p.moveToNext()
+                    else:           break
+                p.moveToParent() # Restore p in the caller.
+                fc.put('</v>\n')
+            else:
+                fc.put('%s</v>\n' % v_head) # Call put only once.
+    #@+node:ekr.20130413052322.10212: *4* getVnodeWriteFlags
+    def getVnodeWriteFlags (self,p,isIgnore=False):
+
+        '''Return (isAuto,isIgnore,forceWrite) for the <v> element for p.
+
+        forceWrite is True if the <v> element must contain p's entire tree.'''
+
         isAuto = p.isAtAutoNode() and p.atAutoNodeName().strip()
         isEdit = p.isAtEditNode() and p.atEditNodeName().strip() and not p.hasChildren()
             # 2010/09/02: @edit nodes must not have children.
@@ -1830,18 +2121,13 @@ class baseFileCommands:
         else:          forceWrite = True      # Write all other @<file> trees.
 
         # if p.h.startswith('@file'): g.trace('isOrphan',isOrphan,'forceWrite',forceWrite,p.h)
+        return isAuto,isIgnore,forceWrite
+    #@+node:ekr.20130413052322.10213: *4* getVnodeAttributeBits
+    def getVnodeAttributeBits (self,v):
 
-        #@+<< Set gnx = vnode index >>
-        #@+node:ekr.20031218072017.1864: *5* << Set gnx = vnode index >>
-        gnx = g.app.nodeIndices.toString(v.fileIndex)
+        '''Return the value of the "a" attribute of v's <v> elements.'''
 
-        if forceWrite or self.usingClipboard:
-            v.setWriteBit() # 4.2: Indicate we wrote the body text.
-        #@-<< Set gnx = vnode index >>
-        attrs = []
-        #@+<< Append attribute bits to attrs >>
-        #@+node:ekr.20031218072017.1865: *5* << Append attribute bits to attrs >>
-        # These string catenations are benign because they rarely happen.
+        c = self.c
         attr = ""
         # New in Leo 4.5: support fixed .leo files.
         if not c.fixed:
@@ -1849,10 +2135,13 @@ class baseFileCommands:
                 attr += "E"
             if v.isMarked():   attr += "M"
             if v.isOrphan():   attr += "O"
-            if attr:
-                attrs.append(' a="%s"' % attr)
+        return attr
+    #@+node:ekr.20130413052322.10214: *4* updateArchivedPosition
+    def updateArchivedPosition (self,p):
+
+        '''Put the archived *current* position in the *root* positions <v> element.'''
 
-        # Put the archived *current* position in the *root* positions <v> element.
+        c = self.c ; v = p.v
         if p == self.rootPosition:
             aList = [str(z) for z in self.currentPosition.archivedPosition()]
             d = v.u
@@ -1873,46 +2162,6 @@ class baseFileCommands:
                 # g.trace("clearing str_leo_pos",v)
                 del d['str_leo_pos']
                 v.unknownAttributes = d
-        #@-<< Append attribute bits to attrs >>
-        #@+<< Append unKnownAttributes to attrs >>
-        #@+node:ekr.20040324082713: *5* << Append unKnownAttributes to attrs>>
-        # v.unknownAttributes are now put in <t> elements.
-
-        if p.hasChildren() and not forceWrite and not self.usingClipboard:
-            # We put the entire tree when using the clipboard, so no need for this.
-            if not isAuto: # Bug fix: 2008/8/7.
-                attrs.append(self.putDescendentVnodeUas(p)) # New in Leo 4.5.
-                attrs.append(self.putDescendentAttributes(p))
-        #@-<< Append unKnownAttributes to attrs >>
-        attrs = ''.join(attrs)
-        v_head = '<v t="%s"%s>' % (gnx,attrs)
-        if gnx in fc.vnodesDict:
-            fc.put(v_head+'</v>\n')
-        else:
-            fc.vnodesDict[gnx]=True
-            v_head += '<vh>%s</vh>' % (xml.sax.saxutils.escape(p.v.headString()or''))
-            # The string catentation is faster than repeated calls to fc.put.
-            if not self.usingClipboard:
-                #@+<< issue informational messages >>
-                #@+node:ekr.20040702085529: *5* << issue informational messages >> (changed)
-                if 0: # It's strange to clear the orphan bit.
-                    if isOrphan and (isFile or isThin):
-                        g.warning("writing erroneous:",p.h)
-                        p.clearOrphan()
-                #@-<< issue informational messages >>
-            # New in 4.2: don't write child nodes of @file-thin trees (except when writing to clipboard)
-            if p.hasChildren() and (forceWrite or self.usingClipboard):
-                fc.put('%s\n' % v_head)
-                # This optimization eliminates all "recursive" copies.
-                p.moveToFirstChild()
-                while 1:
-                    fc.putVnode(p,isIgnore)
-                    if p.hasNext(): p.moveToNext()
-                    else:           break
-                p.moveToParent() # Restore p in the caller.
-                fc.put('</v>\n')
-            else:
-                fc.put('%s</v>\n' % v_head) # Call put only once.
     #@+node:ekr.20031218072017.1579: *4* putVnodes
     def putVnodes (self):
 
@@ -2038,7 +2287,11 @@ class baseFileCommands:
         try:
             # 2010/01/19: Do *not* signal failure here.
             # This allows Leo to quit properly.
-            c.atFileCommands.writeAll()
+            c.cacher.beginBatch()
+            try:
+                c.atFileCommands.writeAll()
+            finally:
+                c.cacher.endBatch()
             return True
         except Exception:
             g.es_error("exception writing external files")
@@ -2050,6 +2303,8 @@ class baseFileCommands:
         c = self.c ; toZip = c.isZipped
         ok,backupName = self.createBackupFile(fileName)
         if not ok: return False
+        if fileName.endswith('.leob') and not toOPML:
+            return self.writeBinaryFile(fileName,backupName)
         fileName,theActualFile = self.createActualFile(fileName,toOPML,toZip)
         if not theActualFile: return False
         self.mFileName = fileName
@@ -2079,6 +2334,48 @@ class baseFileCommands:
             self.handleWriteLeoFileException(
                 fileName,backupName,theActualFile)
             return False
+    #@+node:ekr.20130413052322.10245: *5* writeBinaryFile
+    def writeBinaryFile (self,fileName,backupName):
+
+        '''Write the outline to a .leob file.
+
+        Write a temporary file, then rename it to fileName, so that
+        fileName is never left partially written.'''
+
+        c = self.c ; theActualFile = None
+        self.mFileName = fileName
+        tempName = fileName + '.tmp'
+        # Writing may load lazy body text: fc.putVnode calls p.isAtIgnoreNode.
+        old = self.lazyBodies
+        lazy = old and [(v,v._lazyBody[1]) for v in old.lazyVnodes()] or []
+        ok = False
+        try:
+            s = leoBinaryFile.binaryWriter(c).write()
+            theActualFile = open(tempName,'wb')
+            theActualFile.write(s)
+            theActualFile.close()
+            theActualFile = None
+            mode = g.utils_stat(fileName)
+            if not g.utils_rename(c,tempName,fileName):
+                raise IOError('can not rename %s to %s' % (tempName,fileName))
+            g.utils_chmod(fileName,mode)
+            c.setFileTimeStamp(fileName)
+            ok = True
+        except Exception:
+            g.es("exception writing:",fileName)
+            g.es_exception(full=True)
+            if theActualFile:
+                theActualFile.close()
+            if g.os_path_exists(tempName):
+                self.deleteFileWithMessage(tempName,'temp')
+        # Unload the body text loaded above.
+        # The loader keeps the contents of the file it read.
+        for v,n in lazy:
+            old.unloadBody(v,n)
+        # fileName is either complete or unchanged: the backup is not needed.
+        if backupName and g.os_path_exists(backupName):
+            self.deleteFileWithMessage(backupName,'backup')
+        return ok
     #@+node:ekr.20100119145629.6106: *5* createActualFile
     def createActualFile (self,fileName,toOPML,toZip):
 
@@ -2274,7 +2571,17 @@ class baseFileCommands:
     #@+node:ekr.20080805085257.2: *3* fc.pickle
     def pickle (self,torv,val,tag):
 
-        '''Pickle val and return the hexlified result.'''
+        '''Pickle val and return the hexlified result as a tag="value" field.'''
+
+        s = self.hexlifiedPickle(torv,val,tag)
+        if s is None:
+            return ''
+        else:
+            return ' %s="%s"' % (tag,s)
+
+    def hexlifiedPickle (self,torv,val,tag):
+
+        '''Pickle val and return the hexlified result, or None on errors.'''
 
         trace = False and g.unitTesting
         try:
@@ -2284,21 +2591,31 @@ class baseFileCommands:
             if trace: g.trace('\n',
                 type(val),val,'\n',type(s),repr(s),'\n',
                 type(s2),s2,'\n',type(s3),s3)
-            field = ' %s="%s"' % (tag,s3)
-            return field
+            return s3
 
         except pickle.PicklingError:
             if tag: # The caller will print the error if tag is None.
                 g.warning("ignoring non-pickleable value",val,"in",torv)
-            return ''
+            return None
 
         except Exception:
             g.error("fc.pickle: unexpected exception in",torv)
             g.es_exception()
-            return ''
+            return None
     #@+node:ekr.20040701065235.2: *3* fc.putDescendentAttributes
     def putDescendentAttributes (self,p):
 
+        result = []
+        for tag,s in self.getDescendentAttributeStrings(p):
+            result.append('\n%s="%s"' % (tag,s))
+
+        return ''.join(result)
+
+    def getDescendentAttributeStrings (self,p):
+
+        '''Return a list of pairs (tag,s), where tag is "marks" or "expanded"
+        and s lists the gnx's of all marked or expanded vnodes of p's subtree.'''
+
         nodeIndices = g.app.nodeIndices
 
         # Create lists of all tnodes whose vnodes are marked or expanded.
@@ -2318,15 +2635,26 @@ class baseFileCommands:
                     sList.append("%s," % nodeIndices.toString(v.fileIndex))
                 s = ''.join(sList)
                 # g.trace(tag,[str(p.h) for p in theList])
-                result.append('\n%s="%s"' % (tag,s))
+                result.append((tag,s),)
 
-        return ''.join(result)
+        return result
     #@+node:ekr.20080805071954.2: *3* fc.putDescendentVnodeUas
     def putDescendentVnodeUas (self,p):
 
         '''Return the a uA field for descendent vnode attributes,
         suitable for reconstituting uA's for anonymous vnodes.'''
 
+        d = self.getDescendentVnodeUaDict(p)
+
+        # Pickle and hexlify d
+        return d and self.pickle(
+            torv=p.v,val=d,tag='descendentVnodeUnknownAttributes') or ''
+
+    def getDescendentVnodeUaDict (self,p):
+
+        '''Return a dict whose keys are archived positions relative to p and
+        whose values are the pickleable uA's of the corresponding vnodes.'''
+
         trace = False
         if trace: g.trace(p.h)
 
@@ -2340,7 +2668,7 @@ class baseFileCommands:
 
         # Create aList of pairs (v,d) where d contains only pickleable entries.
         if aList: aList = self.createUaList(aList)
-        if not aList: return ''
+        if not aList: return {}
 
         # Create d, an enclosing dict to hold all the inner dicts.
         d = {}
@@ -2351,10 +2679,7 @@ class baseFileCommands:
             d[key]=d2
 
         if trace: g.trace(p.h,g.dictToString(d))
-
-        # Pickle and hexlify d
-        return d and self.pickle(
-            torv=p.v,val=d,tag='descendentVnodeUnknownAttributes') or ''
+        return d
     #@+node:ekr.20050418161620.2: *3* fc.putUaHelper
     def putUaHelper (self,torv,key,val):
 
@@ -2362,16 +2687,28 @@ class baseFileCommands:
 
         # g.trace(key,repr(val),g.callers())
 
+        s = self.uaToString(torv,key,val)
+        if s is None:
+            return ''
+        elif key.startswith('str_'):
+            return ' %s="%s"' % (key,xml.sax.saxutils.escape(s))
+        else:
+            return ' %s="%s"' % (key,s)
+
+    def uaToString (self,torv,key,val):
+
+        '''Return the (unescaped) value of the attribute whose name is key
+        and whose value is val, or None if the attribute can not be written.'''
+
         # New in 4.3: leave string attributes starting with 'str_' alone.
         if key.startswith('str_'):
             if type(val) == type(''):
-                attr = ' %s="%s"' % (key,xml.sax.saxutils.escape(val))
-                return attr
+                return val
             else:
                 g.warning("ignoring non-string attribute",key,"in",torv)
-                return ''
+                return None
         else:
-            return self.pickle(torv=torv,val=val,tag=key)
+            return self.hexlifiedPickle(torv,val,tag=key)
     #@+node:EKR.20040526202501: *3* fc.putUnknownAttributes
     def putUnknownAttributes (self,torv):
 
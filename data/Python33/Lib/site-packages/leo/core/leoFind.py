@@ -7,8 +7,21 @@
 #@@pagewidth 70
 
 import leo.core.leoGlobals as g
+import array
+import bisect
 import re
 
+try:
+    import sre_constants
+    import sre_parse
+except ImportError:
+    sre_parse = None
+
+try:
+    unichr
+except NameError:
+    unichr = chr # Python 3.
+
 #@+<< Theory of operation of find/change >>
 #@+node:ekr.20031218072017.2414: ** << Theory of operation of find/change >>
 #@@nocolor-node
@@ -114,6 +127,248 @@ class searchWidget:
 
         return g.toPythonIndex(self.s,i)
     #@-others
+#@+node:ekr.20130413052322.10287: ** class searchIndex
+class searchIndex (object):
+
+    '''A compact copy of the text of all headlines and bodies.
+
+    The find commands use this index to skip nodes that can not possibly
+    match. The usual matchers then search the remaining nodes, so the
+    results are exactly the same as without the index.
+
+    heads and bodies contain the lower-case text of all headlines and
+    bodies, encoded as utf-8 and separated by null bytes. offsets give the
+    start of each vnode's text. si.candidates finds the literal text that
+    any match must contain with bytes.find, skipping to the next vnode
+    after each hit. Searching costs one pass over the text at C speed plus
+    a few steps per matching vnode. Building the index costs about as much
+    as converting all headlines and bodies to lower case once.
+
+    The index is built when first needed. v.textChanged and v._addLink
+    call si.touch(v) and si.touchTree(v). si.candidates searches the
+    present text of touched vnodes separately. The index is rebuilt when
+    more than 1/8 of its vnodes have been touched.
+
+    Filtering pays only if it excludes most nodes: building and testing a
+    large set of candidates costs more than it saves. si.candidates
+    returns None if every literal occurs in too many nodes.
+
+    Find All calls si.candidates once per match, so si.candidates caches
+    its results until the next change to the outline.
+    '''
+
+    #@+others
+    #@+node:ekr.20130413052322.10288: *3*  si.ctor
+    # Non-ascii characters that re's IGNORECASE matching treats as ascii letters.
+    foldDict = {0x130:g.u('i'),0x131:g.u('i'),0x17f:g.u('s'),0x212a:g.u('k')}
+    foldChars = set([unichr(n) for n in foldDict])
+
+    # si.candidates searches only for ascii literals at least this long.
+    minLiteral = 3
+
+    # Literals must exclude all but this fraction of all vnodes.
+    maxFraction = 0.25
+
+    nonAscii = re.compile(g.u('[^\\x00-\\x7f]+'))
+
+    def __init__ (self,c):
+
+        self.c = c
+        self.valid = False
+        self.dirty = set() # Touched vnodes.
+        self.ids = {} # Keys are vnodes, values are ids.
+        self.vnodes = [] # vnodes[id] is the vnode with the given id.
+        self.heads = self.bodies = g.toEncodedString('')
+        self.headOffsets = self.bodyOffsets = None
+        self.cache = {} # Keys are (pattern,regexp,flags), values are results.
+        # Statistics.
+        self.n_rebuilds = 0
+    #@+node:ekr.20130413052322.10289: *3* si.check, invalidate, rebuild & touch...
+    def check (self):
+
+        '''Make sure the index is up to date.'''
+
+        if not self.valid or len(self.dirty) * 8 > len(self.vnodes):
+            self.rebuild()
+
+    def invalidate (self):
+
+        '''Mark the index as invalid. It will be rebuilt when next needed.'''
+
+        self.valid = False
+        self.dirty = set()
+        self.cache = {}
+
+    def rebuild (self):
+
+        '''Copy the headlines and bodies of all vnodes of the outline.'''
+
+        self.vnodes = list(self.c.all_unique_nodes())
+        self.ids = dict(zip(self.vnodes,range(len(self.vnodes))))
+        self.heads,self.headOffsets = self.join(
+            [v._headString for v in self.vnodes])
+        self.bodies,self.bodyOffsets = self.join(
+            [v._bodyString for v in self.vnodes])
+        self.dirty,self.cache = set(),{}
+        self.valid = True
+        self.n_rebuilds += 1
+
+    def touch (self,v):
+
+        '''Remember that v's headline or body may have changed.'''
+
+        if self.valid:
+            self.dirty.add(v)
+            if self.cache: self.cache = {}
+
+    def touchTree (self,v):
+
+        '''Remember v and all its unindexed descendants after linking v.'''
+
+        if self.valid:
+            self.dirty.add(v)
+            if self.cache: self.cache = {}
+            aList = v.children[:]
+            while aList:
+                v = aList.pop()
+                if v not in self.ids and v not in self.dirty:
+                    self.dirty.add(v)
+                    aList.extend(v.children)
+    #@+node:ekr.20130413052322.10290: *3* si.encode & join
+    def encode (self,s):
+
+        '''Return the text that si.candidates searches for s: s.lower(),
+        encoded as utf-8.
+
+        re's IGNORECASE matching treats a few non-ascii characters as ascii
+        letters. These characters are replaced by the corresponding letters.'''
+
+        if not s:
+            return g.toEncodedString('')
+        s = g.toUnicode(s)
+        b = s.lower().encode('utf-8')
+        if len(b) != len(s) and not self.foldChars.isdisjoint(s):
+            b = s.translate(self.foldDict).lower().encode('utf-8')
+        return b
+
+    def join (self,aList):
+
+        '''Return (text,offsets) for the list of strings aList.'''
+
+        parts = [self.encode(s) for s in aList]
+        offsets = array.array('l',[0])
+        n = 0
+        for b in parts:
+            n += len(b) + 1
+            offsets.append(n)
+        return g.toEncodedString('\0').join(parts),offsets
+    #@+node:ekr.20130413052322.10291: *3* si.candidates & helpers
+    def candidates (self,pattern,regexp=False,flags=0):
+
+        '''Return (heads,bodies), the sets of vnodes whose headlines and
+        bodies may contain a match for pattern, or None if the index can not
+        exclude most nodes.
+
+        pattern is a regular expression if regexp is True, with the given
+        flags. Otherwise pattern is plain text. The result does not depend
+        on case or on whole-word matching, so it is valid for all searches.'''
+
+        key = pattern,regexp,flags
+        if self.valid and key in self.cache:
+            return self.cache[key] # Don't parse pattern again.
+        if regexp:
+            literals = self.regexLiterals(pattern,flags)
+        else:
+            literals = [pattern]
+        # Search only for the ascii parts of the literals.
+        pieces = set()
+        for s in literals:
+            for piece in self.nonAscii.split(g.toUnicode(s)):
+                if len(piece) >= self.minLiteral:
+                    pieces.add(piece.lower().encode('ascii'))
+        if not pieces:
+            if self.valid:
+                self.cache[key] = None
+            return None
+        self.check()
+        # Search for the longest literals first: they are usually the rarest.
+        pieces = sorted(pieces,key=len,reverse=True)
+        heads = self.find(self.heads,self.headOffsets,pieces,'_headString')
+        bodies = heads is not None and self.find(
+            self.bodies,self.bodyOffsets,pieces,'_bodyString')
+        if heads is None or bodies is None:
+            self.cache[key] = None
+        else:
+            self.cache[key] = heads,bodies
+        return self.cache[key]
+    #@+node:ekr.20130413052322.10292: *4* si.find & scan
+    def find (self,text,offsets,pieces,ivar):
+
+        '''Return the set of vnodes whose text contains all pieces, or None
+        if all pieces occur in more than maxFraction of all vnodes. text and
+        offsets are the index's copy of the ivar of all vnodes.'''
+
+        limit = self.maxFraction * len(self.vnodes)
+        ids = None
+        for piece in pieces:
+            aSet = self.scan(text,offsets,piece,limit)
+            if aSet is not None:
+                ids = aSet if ids is None else ids & aSet
+                if not ids: break
+        if ids is None:
+            return None # No literal is selective.
+        vnodes,dirty = self.vnodes,self.dirty
+        result = set([vnodes[n] for n in ids if vnodes[n] not in dirty])
+        # Search the present text of the touched vnodes.
+        for v in dirty:
+            b = self.encode(getattr(v,ivar))
+            for piece in pieces:
+                if piece not in b: break
+            else:
+                result.add(v)
+        return result
+
+    def scan (self,text,offsets,piece,limit):
+
+        '''Return the set of the ids of vnodes whose text contains piece,
+        or None if the set would contain more than limit ids.'''
+
+        ids = set()
+        find,i = text.find,0
+        while True:
+            i = find(piece,i)
+            if i == -1:
+                return ids
+            n = bisect.bisect_right(offsets,i) - 1
+            ids.add(n)
+            if len(ids) > limit:
+                return None
+            i = offsets[n+1] # Skip the rest of the vnode's text.
+    #@+node:ekr.20130413052322.10293: *3* si.regexLiterals
+    def regexLiterals (self,pattern,flags):
+
+        '''Return a list of strings, each of which must appear in any text
+        matched by the regular expression pattern.'''
+
+        if not sre_parse:
+            return []
+        try:
+            items = sre_parse.parse(pattern,flags)
+        except Exception:
+            return [] # The caller will report the error.
+        literals,chars = [],[]
+        for op,av in items:
+            if op == sre_constants.LITERAL:
+                chars.append(unichr(av))
+            elif op == sre_constants.AT:
+                pass # A zero-width assertion such as \b.
+            elif chars:
+                literals.append(''.join(chars))
+                chars = []
+        if chars:
+            literals.append(''.join(chars))
+        return literals
+    #@-others
 #@+node:ekr.20061212084717: ** class leoFind
 class leoFind:
 
@@ -701,7 +956,7 @@ class leoFind:
             self.restore(data)
         else:
             self.showSuccess(pos,newpos)
-    #@+node:ekr.20031218072017.3075: *4* findNextMatch (leoFind)
+    #@+node:ekr.20031218072017.3075: *4* findNextMatch & helper (leoFind)
     # Resumes the search where it left off.
     # The caller must call set_first_incremental_search or set_first_batch_search.
 
@@ -745,8 +1000,16 @@ class leoFind:
                 self.errors += 1 # Abort the search.
                 return None,None
 
+        candidates = self.getIndexCandidates()
+
         while p:
-            pos, newpos = self.search()
+            if (attempts > 0 and candidates and
+                p.v not in candidates[g.choose(self.in_headline,0,1)]
+            ):
+                # The index proves that there is no match in this text.
+                pos, newpos = None, None
+            else:
+                pos, newpos = self.search()
             if trace: g.trace('attempt','pos',pos,'p',p.h,'in_headline',self.in_headline)
             if pos is not None:
                 if self.mark_finds:
@@ -773,6 +1036,23 @@ class leoFind:
 
         if trace: g.trace('attempts',attempts,'backwardAttempts',self.backwardAttempts)
         return None, None
+    #@+node:ekr.20130413052322.10295: *5* getIndexCandidates (leoFind)
+    def getIndexCandidates (self):
+
+        """Return c.searchIndex.candidates for the present search, or None."""
+
+        index = self.c.searchIndex
+        if not index or len(self.find_text) < 3:
+            return None # Short patterns are not selective.
+        if self.pattern_match:
+            return index.candidates(self.re_obj.pattern,
+                regexp=True,flags=self.re_obj.flags)
+        else:
+            # Compute the pattern exactly as plainHelper does.
+            pattern = self.find_text
+            if self.ignore_case: pattern = pattern.lower()
+            pattern = self.replaceBackSlashes(pattern)
+            return index.candidates(pattern)
     #@+node:ekr.20031218072017.3076: *4* resetWrap (leoFind)
     def resetWrap (self,event=None):
 
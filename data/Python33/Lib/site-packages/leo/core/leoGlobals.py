@@ -2371,7 +2371,13 @@ def clearAllIvars (o):
     """Clear all ivars of o, a member of some class."""
 
     if o:
-        o.__dict__.clear()
+        # Slotted classes (vnode, position) keep most ivars outside __dict__.
+        for cls in type(o).__mro__:
+            for ivar in cls.__dict__.get('__slots__',()):
+                if ivar not in ('__dict__','__weakref__') and hasattr(o,ivar):
+                    delattr(o,ivar)
+        if hasattr(o,'__dict__'):
+            o.__dict__.clear()
 #@+node:ekr.20031218072017.1590: *3* collectGarbage
 def collectGarbage():
 
@@ -2709,8 +2715,15 @@ def doHook(tag,*args,**keywords):
     if trace and (verbose or tag != 'idle'):
         g.trace('tag',tag,'f',f and f.__name__)
 
+    pc = g.app.pluginsController
     if not f:
-        g.app.hookFunction = f = g.app.pluginsController.doPlugins
+        g.app.hookFunction = f = pc.doPlugins
+
+    # Return at once if doPlugins has no handler for tag.
+    if (pc and tag not in pc.dispatchDict and not pc.allHandlers and
+        tag not in ('open0','start1') and f == pc.doPlugins
+    ):
+        return None
 
     try:
         # Pass the hook to the hook handler.
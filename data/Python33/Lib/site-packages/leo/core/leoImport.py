@@ -100,14 +100,22 @@
 # Required so the unit test that simulates an @auto leoImport.py will work!
 import leo.core.leoGlobals as g
 
+import os
+import re
 import string
+import subprocess
+import sys
+import tempfile
+import time
 
 if g.isPython3:
     import io
     StringIO = io.StringIO
+    import pickle
 else:
     import StringIO
     StringIO = StringIO.StringIO
+    import cPickle as pickle
     
 try:
     import docutils
@@ -991,7 +999,7 @@ class leoImportCommands (scanUtility):
         if command: u.afterChangeGroup(p,command)
         c.redraw(current)
         return p
-    #@+node:ekr.20031218072017.3212: *4* importFilesCommand & helper
+    #@+node:ekr.20031218072017.3212: *4* importFilesCommand & helpers
     def importFilesCommand (self,files=None,treeType=None,redrawFlag=True):
         # Not a command.  It must *not* have an event arg.
         c = self.c ; current = c.p
@@ -1000,14 +1008,18 @@ class leoImportCommands (scanUtility):
         self.treeType = treeType
         if len(files) == 2:
             current = self.createImportParent(current,files)
-        for fn in files:
-            g.setGlobalOpenDir(fn)
-            p = self.createOutline(fn,current)
-            if p: # createOutline may fail.
-                if not g.unitTesting: g.blue("imported",fn)
-                p.contract()
-                p.setDirty()
-                c.setChanged(True)
+        n = self.getImportProcesses(files)
+        if n > 1:
+            self.importFilesInProcesses(files,current,n)
+        else:
+            for fn in files:
+                g.setGlobalOpenDir(fn)
+                p = self.createOutline(fn,current)
+                if p: # createOutline may fail.
+                    if not g.unitTesting: g.blue("imported",fn)
+                    p.contract()
+                    p.setDirty()
+                    c.setChanged(True)
         c.validateOutline()
         current.expand()
         if redrawFlag:
@@ -1028,6 +1040,136 @@ class leoImportCommands (scanUtility):
             current.initHeadString(name)
 
         return current
+    #@+node:ekr.20130413052322.10346: *5* getImportProcesses
+    def getImportProcesses (self,files):
+
+        '''Return the number of worker processes to use when importing files.'''
+
+        c = self.c
+        n = c.config.getInt('import-files-processes') or 0
+        return min(n,len(files))
+    #@+node:ekr.20130413052322.10347: *5* importFilesInProcesses & helpers
+    def importFilesInProcesses (self,files,parent,n):
+
+        '''Import files as the last children of parent using n worker processes.
+
+        Each worker runs leoImportWorker.py, which imports its share of the
+        files with createOutline and returns the imported trees as plain
+        (headline,body,children) tuples. This method attaches all the trees
+        with a single undo group. Files that the workers could not import
+        are imported here in the usual way.'''
+
+        c = self.c ; u = c.undoer
+        t1 = time.time()
+        directory = g.setDefaultDirectory(c,parent,importing=False)
+        paths = [c.os_path_finalize_join(directory,fn).replace('\\','/') for fn in files]
+        self.setEncoding(p=parent)
+        job = {
+            'encoding': self.encoding,
+            'tab_width': self.getTabWidth(p=parent),
+            'treeType': self.treeType,
+        }
+        results = self.runWorkerProcesses('leoImportWorker.py',paths,job,n)
+        t2 = time.time()
+        command = 'Import Files'
+        u.beforeChangeGroup(parent,command)
+        for fn,path in zip(files,paths):
+            g.setGlobalOpenDir(fn)
+            tree,elapsed,messages = results.get(path) or (None,None,[])
+            for s,color in messages:
+                g.es(s,color=color,newline=False)
+            if tree:
+                undoData = u.beforeInsertNode(parent)
+                p = self.attachImportedTree(parent,tree)
+                u.afterInsertNode(p,'Import',undoData)
+            else:
+                t = time.time()
+                p = self.createOutline(fn,parent)
+                elapsed = time.time() - t
+            if p: # createOutline may fail.
+                if not g.unitTesting:
+                    g.blue('imported %s in %0.2f sec.' % (fn,elapsed))
+                p.contract()
+                p.setDirty()
+                c.setChanged(True)
+        u.afterChangeGroup(parent,command)
+        if not g.unitTesting:
+            g.blue('imported %s files in %0.2f sec. (%s processes: %0.2f sec.)' % (
+                len(files),time.time()-t1,n,t2-t1))
+    #@+node:ekr.20130413052322.10348: *6* attachImportedTree
+    def attachImportedTree (self,parent,tree):
+
+        '''Create the last child of parent and its descendants from tree,
+        a (headline,body,children) tuple. Return the new child.'''
+
+        h,b,children = tree
+        p = parent.insertAsLastChild()
+        p.initHeadString(h)
+        p.setBodyString(b)
+        for child in children:
+            self.attachImportedTree(p,child)
+        return p
+    #@+node:ekr.20130413052322.10349: *6* runWorkerProcesses
+    def runWorkerProcesses (self,worker,paths,job,n):
+
+        '''Handle paths in n processes running worker, a program in
+        leo/core such as leoImportWorker.py. Each process gets a copy of
+        the job dict whose 'paths' entry is its share of paths.
+
+        Return the union of the dicts returned by the workers. Their keys
+        are paths. Paths that the workers did not handle are missing.'''
+
+        trace = False and not g.unitTesting
+        # Give each worker about the same number of bytes to import.
+        shares = [[] for i in range(n)]
+        sizes = [0] * n
+        def size(path):
+            try:
+                return os.path.getsize(path)
+            except OSError:
+                return 0
+        for path in sorted(paths,key=size,reverse=True):
+            i = sizes.index(min(sizes))
+            shares[i].append(path)
+            sizes[i] += size(path)
+        worker = g.os_path_finalize_join(g.app.loadDir,worker)
+        leoDir = g.os_path_finalize_join(g.app.loadDir,'..','..')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = env.get('PYTHONPATH','') + os.pathsep + leoDir
+        tempDir = tempfile.mkdtemp()
+        results = {}
+        try:
+            procs = []
+            for i,share in enumerate(shares):
+                jobsPath = os.path.join(tempDir,'jobs%s.pickle' % i)
+                resultsPath = os.path.join(tempDir,'results%s.pickle' % i)
+                d = dict(job)
+                d['paths'] = share
+                f = open(jobsPath,'wb')
+                pickle.dump(d,f,pickle.HIGHEST_PROTOCOL)
+                f.close()
+                try:
+                    proc = subprocess.Popen(
+                        [sys.executable,worker,jobsPath,resultsPath],env=env)
+                    procs.append((proc,resultsPath),)
+                except OSError:
+                    g.es_exception()
+            for proc,resultsPath in procs:
+                proc.wait()
+                try:
+                    f = open(resultsPath,'rb')
+                    try:
+                        results.update(pickle.load(f))
+                    finally:
+                        f.close()
+                except Exception:
+                    if trace: g.es_exception()
+        finally:
+            for name in os.listdir(tempDir):
+                os.remove(os.path.join(tempDir,name))
+            os.rmdir(tempDir)
+        if trace: g.trace('%s handled %s of %s files' % (worker,len(results),len(paths)))
+        return results
     #@+node:ekr.20031218072017.3214: *4* importFlattenedOutline & allies
     #@+node:ekr.20031218072017.3215: *5* convertMoreString/StringsToOutlineAfter
     # Used by paste logic.
@@ -1804,6 +1946,7 @@ class baseScannerClass (scanUtility):
         self.startSigIndent = None
         self.tab_width = None # Set in run: the tab width in effect in the c.currentPosition.
         self.tab_ws = '' # Set in run: the whitespace equivalent to one tab.
+        self.tokenPattern = False # Set in iterTokens: None if a regex can not tokenize.
         self.trace = False or ic.trace # = c.config.getBool('trace_import')
         self.treeType = ic.treeType # '@root' or '@file'
         self.webType = ic.webType # 'cweb' or 'noweb'
@@ -1927,6 +2070,7 @@ class baseScannerClass (scanUtility):
             lines2 = self.adjustTestLines(lines2)
             s1 = ''.join(lines1)
             s2 = ''.join(lines2)
+            if s1 == s2: return True
 
         if 1: # Token-based comparison.
             bad_i1,bad_i2,ok = self.scanAndCompare(s1,s2)
@@ -2111,8 +2255,16 @@ class baseScannerClass (scanUtility):
         according to the ignoreBlankLines and ignoreLeadingWs ivars.
 
         Return (n,ok), where n is the first mismatched line in s1.
+
+        Most trial writes differ from the original in only a few lines, so
+        compareTokenRegions first compares lines and tokenizes only the
+        differing region. The full tokenization below is needed only to
+        report mismatches.
         '''
 
+        if self.compareTokenRegions(s1,s2):
+            return -1,-1,True
+
         tokens1 = self.tokenize(s1)
         tokens2 = self.tokenize(s2)
 
@@ -2175,6 +2327,164 @@ class baseScannerClass (scanUtility):
             n = min(len(tokens1),len(tokens2))
             if trace: g.trace('fail 2 at line: %s' % (n))
             return n,n
+    #@+node:ekr.20130413052322.10340: *5* compareTokenRegions
+    def compareTokenRegions (self,s1,s2):
+
+        '''Return True if s1 and s2 have the same filtered, stripped tokens,
+        tokenizing only the region between their common leading and trailing lines.
+
+        A return value of False means only that the caller must compare all
+        tokens. The method assumes that filterTokens drops or keeps each
+        token without looking at its neighbors.
+        '''
+
+        trace = False and not g.unitTesting
+        lines1,lines2 = g.splitLines(s1),g.splitLines(s2)
+        n1,n2 = len(lines1),len(lines2)
+        n = min(n1,n2)
+        # Skip the common leading and trailing lines.
+        i = 0
+        while i < n and lines1[i] == lines2[i]:
+            i += 1
+        if i == n1 == n2:
+            return True
+        k = 0
+        while k < n-i and lines1[n1-1-k] == lines2[n2-1-k]:
+            k += 1
+        prefix = len(''.join(lines1[:i]))
+        suffix = len(''.join(lines1[n1-k:]))
+        # Start at the last token of s1 that does not look into the differing lines.
+        # s1 and s2 have the same tokens before that point.
+        delims = (
+            self.lineCommentDelim,self.lineCommentDelim2,
+            self.blockCommentDelim1,self.blockCommentDelim1_2)
+        margin = max([len(z) for z in delims if z] + [3]) + 1
+        start = 0
+        for kind,val,j,end in self.iterTokens(s1,0):
+            if end + margin > prefix:
+                start = j
+                break
+        # Tokenize both regions up to a common synchronization point.
+        it1,it2 = self.iterTokens(s1,start),self.iterTokens(s2,start)
+        tokens1,tokens2 = [],[]
+        end1,end2 = len(s1)-suffix,len(s2)-suffix
+        k1 = self.skipToSyncPoint(s1,it1,end1,suffix,tokens1)
+        k2 = self.skipToSyncPoint(s2,it2,end2,suffix,tokens2)
+        while k1 != k2:
+            if k1 > k2: k1 = self.skipToSyncPoint(s1,it1,end1,k2,tokens1)
+            else:       k2 = self.skipToSyncPoint(s2,it2,end2,k1,tokens2)
+        tokens1 = self.stripTokens(self.filterTokens(tokens1))
+        tokens2 = self.stripTokens(self.filterTokens(tokens2))
+        if trace: g.trace('lines: %s..%s of %s, tokens: %s,%s' % (
+            i,n1-k,n1,len(tokens1),len(tokens2)))
+        return tokens1 == tokens2
+    #@+node:ekr.20130413052322.10341: *6* skipToSyncPoint
+    def skipToSyncPoint (self,s,it,end,limit,tokens):
+
+        '''Append tokens from iterator it to the tokens list up to the first
+        synchronization point within limit characters of the end of s.
+
+        A synchronization point is a token boundary in the common trailing
+        lines, s[end:], that follows a character that stops all look-behind
+        tests, such as the JavaScript regexp test in startsString.
+
+        Return the number of characters following the synchronization point.
+        '''
+
+        n = len(s)
+        for kind,val,j,i in it:
+            if val:
+                tokens.append((kind,val,0),)
+            if i > end and n-i <= limit and s[i-1] not in ' \t\n\\':
+                return n-i
+        return 0
+    #@+node:ekr.20130413052322.10342: *5* getTokenPattern & helpers
+    def getTokenPattern (self):
+
+        '''Return a compiled regex matching exactly the tokens that
+        scanTokens would find, or None if a subclass overrides any
+        tokenizing method that the regex does not know about.
+
+        Each alternative matches when the corresponding test in scanTokens
+        succeeds, and in the same order: nl, ws, comment, string, id, other.
+        Subclasses that override skipId or skipString must also override
+        getIdPattern or getStringPattern.
+        '''
+
+        names = [
+            'skipBlockComment','skipComment','skipId','skipString',
+            'startsComment','startsId','startsString',
+            'skipIdToken','skipNewlineToken',
+            'skipOtherToken','skipStringToken','skipWsToken',
+            'scanTokens',
+        ]
+        def overrides(name):
+            f1 = getattr(self.__class__,name)
+            f2 = getattr(baseScannerClass,name)
+            return getattr(f1,'__func__',f1) is not getattr(f2,'__func__',f2)
+        if overrides('getIdPattern'):
+            names.remove('skipId')
+            names.remove('startsId')
+        if overrides('getStringPattern'):
+            names.remove('skipString')
+        if [z for z in names if overrides(z)]:
+            return None
+        comments = []
+        for delim in (self.lineCommentDelim,self.lineCommentDelim2):
+            if delim:
+                comments.append(re.escape(delim) + r'[^\n]*')
+        for delim1,delim2 in (
+            (self.blockCommentDelim1,self.blockCommentDelim2),
+            (self.blockCommentDelim1_2,self.blockCommentDelim2_2),
+        ):
+            if delim1:
+                comments.append('%s(?:.*?%s|.*)' % (re.escape(delim1),re.escape(delim2)))
+        pattern = '|'.join([
+            r'(\n)',
+            r'([ \t][^\S\n]*)',
+            '(%s)' % ('|'.join(comments) or '(?!)'),
+            '(%s)' % self.getStringPattern(),
+            '(%s)' % self.getIdPattern(),
+            '(.)',
+        ])
+        return re.compile(pattern,re.DOTALL | re.UNICODE)
+
+    def getIdPattern (self):
+
+        '''Return a regex matching the ids found by skipId.'''
+
+        chars = self.extraIdChars and g.toUnicode(self.extraIdChars) or ''
+        return r'\w[\w%s]*' % re.escape(chars)
+
+    def getStringPattern (self):
+
+        '''Return a regex matching the strings found by skipString.'''
+
+        return r'''"[^"\\]*(?:\\.[^"\\]*)*"?|'[^'\\]*(?:\\.[^'\\]*)*'?'''
+    #@+node:ekr.20130413052322.10343: *5* iterTokens
+    def iterTokens (self,s,i):
+
+        '''Yield (kind,val,start,end) for all tokens of s starting at s[i].
+
+        Use the regex tokenizer if possible, falling back to scanTokens.
+        skipCommentToken computes the values of comment tokens.'''
+
+        if self.tokenPattern is False:
+            self.tokenPattern = self.getTokenPattern()
+        pattern = self.tokenPattern
+        if pattern:
+            kinds = (None,'nl','ws','comment','string','id','other')
+            for m in pattern.finditer(s,i):
+                kind = kinds[m.lastindex]
+                if kind == 'comment':
+                    j,val = self.skipCommentToken(s,m.start())
+                    assert j == m.end()
+                    yield kind,val,m.start(),j
+                else:
+                    yield kind,m.group(),m.start(),m.end()
+        else:
+            for token in self.scanTokens(s,i):
+                yield token
     #@+node:ekr.20111101052702.16722: *5* filterTokens & helpers
     def filterTokens (self,tokens):
 
@@ -3280,7 +3590,7 @@ class baseScannerClass (scanUtility):
             i += 1
         return i,s[j:i]
 
-    #@+node:ekr.20111030155153.16703: *4* tokenize
+    #@+node:ekr.20111030155153.16703: *4* tokenize & scanTokens
     def tokenize (self,s):
 
         '''Tokenize string s and return a list of tokens (kind,value,line_number)
@@ -3290,7 +3600,22 @@ class baseScannerClass (scanUtility):
         This is used only to verify the imported text.
         '''
 
-        result,i,line_number = [],0,0
+        result,line_number = [],0
+        for kind,val,j,i in self.scanTokens(s,0):
+            if val:
+                result.append((kind,val,line_number),)
+            # Use the raw token, s[j:i] to count newlines, not the munged val.
+            line_number += s.count('\n',j,i)
+            # g.trace('%3s %7s %s' % (line_number,kind,repr(val[:20])))
+
+        # g.trace(result)
+
+        return result
+
+    def scanTokens (self,s,i):
+
+        '''Yield (kind,val,start,end) for all tokens of s starting at s[i].'''
+
         while i < len(s):
             progress = j = i
             ch = s[i]
@@ -3314,15 +3639,7 @@ class baseScannerClass (scanUtility):
                 i,val = self.skipOtherToken(s,i)
 
             assert progress < i and j == progress
-            if val:
-                result.append((kind,val,line_number),)
-            # Use the raw token, s[j:i] to count newlines, not the munged val.
-            line_number += s[j:i].count('\n')
-            # g.trace('%3s %7s %s' % (line_number,kind,repr(val[:20])))
-
-        # g.trace(result)
-
-        return result
+            yield kind,val,j,i
     #@+node:ekr.20070707072749: *3* run (baseScannerClass)
     def run (self,s,parent):
 
@@ -4212,11 +4529,17 @@ class pythonScanner (baseScannerClass):
                 break
 
         return i,g.match(s,i,':')
-    #@+node:ekr.20070707073627.4: *4* skipString
+    #@+node:ekr.20070707073627.4: *4* skipString & getStringPattern
     def skipString (self,s,i):
 
         # Returns len(s) on unterminated string.
         return g.skip_python_string(s,i,verbose=False)
+
+    def getStringPattern (self):
+
+        '''Return a regex matching the strings found by skipString.'''
+
+        return "'''(?:.*?'''|.*)|" + '"""(?:.*?"""|.*)|' + baseScannerClass.getStringPattern(self)
     #@-others
 #@+node:ekr.20090501095634.41: *3* class rstScanner
 class rstScanner (baseScannerClass):
@@ -5116,6 +5439,20 @@ class xmlScanner (baseScannerClass):
             g.choose(found,'','not '),target_tag,s[start:i],target_tag))
 
         return i,found
+    #@+node:ekr.20130413052322.10345: *5* getIdPattern (xmlScanner)
+    def getIdPattern (self):
+
+        '''Return a regex matching the ids found by skipId.'''
+
+        char = g.isPython3 and chr or unichr
+        def ranges(table):
+            # Narrow builds represent characters past sys.maxunicode as surrogate pairs,
+            # which isWordChar1 and isWordChar2 also reject.
+            return ''.join(['%s-%s' % (char(n1),char(min(n2,sys.maxunicode)))
+                for n1,n2 in table if n1 <= sys.maxunicode])
+        chars1 = r'\w:' + ranges(self.word_char_table1)
+        chars2 = chars1 + r'\-.0-9' + ranges(self.word_char_table2)
+        return '[%s][%s]*' % (chars1,chars2)
     #@+node:ekr.20111103073536.16595: *5* startsId (xmlScanner)
     def startsId(self,s,i):
 
@@ -0,0 +1,92 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20130413052322.10350: * @file leoImportWorker.py
+'''A program that imports files for ic.importFilesInProcesses.
+
+Usage: python leoImportWorker.py <jobs file> <results file>
+
+The jobs file contains a pickled dict: 'paths' is the list of files to
+import; 'encoding', 'tab_width' and 'treeType' are the settings in effect
+in the importing outline.
+
+The results file receives a pickled dict. Keys are paths; values are
+tuples (tree,elapsed,messages), where tree is a (headline,body,children)
+tuple, or None if the file could not be imported, and messages is a list
+of (s,color) tuples that were sent to the log.
+'''
+
+#@+<< imports >>
+#@+node:ekr.20130413052322.10351: ** << imports >> (leoImportWorker.py)
+import sys
+import time
+import traceback
+
+if sys.version_info[0] >= 3:
+    import pickle
+else:
+    import cPickle as pickle
+
+import leo.core.leoBridge as leoBridge
+#@-<< imports >>
+# Do not define g here. Use the g returned by the bridge.
+
+#@+others
+#@+node:ekr.20130413052322.10352: ** main & helpers (leoImportWorker.py)
+def main ():
+
+    jobsPath,resultsPath = sys.argv[1:3]
+    f = open(jobsPath,'rb')
+    job = pickle.load(f)
+    f.close()
+    bridge = leoBridge.controller(gui='nullGui',
+        loadPlugins=False, # Plugins must not see the temporary commander.
+        readSettings=True, # The importers use many settings.
+        silent=True,
+        verbose=False)
+    results = {}
+    if bridge.isOpen():
+        g = bridge.globals()
+        c = bridge.openLeoFile(None)
+        c.frame.createFirstTreeNode()
+        # The importers find these directives in the parent of the imported nodes.
+        root = c.rootPosition()
+        root.setBodyString('@encoding %s\n@tabwidth %s\n' % (
+            job['encoding'],job['tab_width']))
+        for path in job['paths']:
+            results[path] = importFile(c,g,root,path,job)
+    f = open(resultsPath,'wb')
+    pickle.dump(results,f,pickle.HIGHEST_PROTOCOL)
+    f.close()
+#@+node:ekr.20130413052322.10353: *3* importFile
+def importFile (c,g,root,path,job):
+
+    '''Import path as the last child of root, convert the imported nodes
+    to nested tuples and delete them.
+
+    Return (tree,elapsed,messages).'''
+
+    ic = c.importCommands
+    g.app.logWaiting = []
+    t1 = time.time()
+    tree = None
+    try:
+        ic.tab_width = job['tab_width']
+        ic.treeType = job['treeType']
+        p = ic.createOutline(path,root)
+        if p:
+            tree = makeTree(p)
+            p.doDelete()
+    except Exception:
+        g.app.logWaiting.append((traceback.format_exc(),'red'),)
+    c.undoer.clearUndoState()
+    return tree,time.time()-t1,g.app.logWaiting
+#@+node:ekr.20130413052322.10354: *3* makeTree
+def makeTree (p):
+
+    '''Return (headline,body,children) for p and its descendants.'''
+
+    return p.h,p.b,[makeTree(child) for child in p.children()]
+#@-others
+
+if __name__ == '__main__':
+    main()
+#@-leo
@@ -0,0 +1,330 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20130413052322.10470: * @file leoModes.py
+#@@language python
+#@@tabwidth -4
+#@@pagewidth 70
+
+'''Precompiled tables of the jEdit modes in leo/modes.
+
+Each file in leo/modes is a large Python module: dicts of attributes and
+keywords, and one small function per rule that calls a matcher of the
+colorizer with constant arguments. Importing such a module compiles it,
+unless Python can write a .pyc file next to it.
+
+getModeTable(language) returns a modeTable containing the same data in a
+precompiled form:
+
+- The rules of the mode, as (matcher name, args, keyword args) tuples.
+- A first-character dispatch table for each ruleset: keys are characters,
+  values are lists of rule names. Rules that always fail are omitted.
+- The characters of the keywords of each ruleset, from which the colorizer
+  computes its word characters and the regex used by match_keywords.
+- The properties of the mode, including its initial delegate, and the
+  rulesets imported by each ruleset.
+
+Tables are memoized per process and written to ~/.leo/db/modes, so later
+sessions do not import the mode modules at all. A table is recomputed when
+its mode file changes. Modes with a pre_init_mode function, and modes whose
+rules do anything but call a single matcher, have no table.
+'''
+
+#@+<< imports >>
+#@+node:ekr.20130413052322.10471: ** << imports >> (leoModes)
+import leo.core.leoGlobals as g
+
+import marshal
+import os
+import re
+import sys
+
+if g.isPython3:
+    intern = sys.intern
+#@-<< imports >>
+
+formatVersion = 1 # Change this when the format of the tables changes.
+
+tablesDict = {} # Keys are languages, values are modeTables or None.
+wordRegexDict = {} # Keys are strings of word characters, values are regexes.
+
+#@+others
+#@+node:ekr.20130413052322.10472: ** getModeTable & helpers
+def getModeTable (language):
+
+    '''Return the modeTable for the given language, or None.'''
+
+    if language in tablesDict:
+        return tablesDict[language]
+    table = None
+    path = modeFileName(language)
+    if g.os_path_exists(path):
+        key = fileKey(path)
+        data = readTable(language,key)
+        if data is None:
+            data = compileMode(language)
+            writeTable(language,key,data)
+        if data.get('rules') is not None:
+            table = modeTable(language,data)
+    tablesDict[language] = table
+    return table
+#@+node:ekr.20130413052322.10473: *3* compileMode
+def compileMode (language):
+
+    '''Import the mode module for the language and return a dict describing
+    it. The 'rules' entry is None if the mode can not be precompiled.'''
+
+    module = g.importFromPath(language,modesDirectory())
+    if (not module or hasattr(module,'pre_init_mode') or
+        not hasattr(module,'rulesDictDict')
+    ):
+        return {'rules': None}
+    recorder = ruleRecorder()
+    rules = {} # Keys are rule names, values are (name,args,keys) or None.
+    dispatch = {}
+    for rulesetName,rulesDict in module.rulesDictDict.items():
+        if not isinstance(rulesDict,dict):
+            return {'rules': None} # A custom rules dict.
+        d = {}
+        for ch,aList in rulesDict.items():
+            names = []
+            for f in aList:
+                name = f.__name__
+                if name not in rules:
+                    call = recorder.record(f)
+                    if call is False:
+                        return {'rules': None}
+                    rules[name] = call
+                if rules[name] is not None:
+                    names.append(name)
+            if names:
+                d[ch] = names
+        dispatch[rulesetName] = d
+    keywordsDictDict = getattr(module,'keywordsDictDict',{})
+    keywordChars = {}
+    for rulesetName,keywordsDict in keywordsDictDict.items():
+        chars = set()
+        for key in keywordsDict:
+            chars.update(key)
+        keywordChars[rulesetName] = ''.join(sorted(chars))
+    data = {
+        'attributes':   getattr(module,'attributesDictDict',{}),
+        'dispatch':     dispatch,
+        'importDict':   getattr(module,'importDict',{}),
+        'keywordChars': keywordChars,
+        'keywords':     keywordsDictDict,
+        'properties':   getattr(module,'properties',{}),
+        'rules':        rules,
+    }
+    try:
+        marshal.dumps(data)
+    except ValueError:
+        return {'rules': None} # An unexpected argument.
+    return data
+#@+node:ekr.20130413052322.10474: *3* fileKey, modeFileName & modesDirectory
+def fileKey (path):
+
+    '''Return the key that a table file must contain to be up to date.'''
+
+    st = os.stat(path)
+    return [formatVersion,st.st_size,st.st_mtime]
+
+def modeFileName (language):
+
+    return g.os_path_join(modesDirectory(),'%s.py' % (language))
+
+def modesDirectory ():
+
+    return g.os_path_join(g.app.loadDir,'..','modes')
+#@+node:ekr.20130413052322.10475: *3* tableFileName, readTable & writeTable
+def tableFileName (language):
+
+    # marshal's format depends on the version of Python.
+    return g.os_path_join(g.app.homeLeoDir,'db','modes',
+        '%s.py%s%s.table' % (language,sys.version_info[0],sys.version_info[1]))
+
+def readTable (language,key):
+
+    '''Return the data in the table file for the language,
+    or None if the file does not exist or is out of date.'''
+
+    if not g.enableDB:
+        return None
+    fn = tableFileName(language)
+    if not g.os_path_exists(fn):
+        return None
+    try:
+        f = open(fn,'rb')
+        try:
+            # marshal.loads is much faster than marshal.load.
+            data = marshal.loads(f.read())
+        finally:
+            f.close()
+    except Exception:
+        return None
+    if isinstance(data,dict) and data.get('key') == key:
+        return data
+    else:
+        return None
+
+def writeTable (language,key,data):
+
+    '''Write data to the table file for the language.'''
+
+    if not g.enableDB:
+        return
+    fn = tableFileName(language)
+    data = internStrings(data)
+    data['key'] = key
+    try:
+        directory = g.os_path_dirname(fn)
+        if not g.os_path_exists(directory):
+            os.makedirs(directory)
+        # Write a temp file, so other processes never see a partial file.
+        tmp = '%s.%s' % (fn,os.getpid())
+        f = open(tmp,'wb')
+        try:
+            marshal.dump(data,f)
+        finally:
+            f.close()
+        if g.os_path_exists(fn):
+            os.remove(fn)
+        os.rename(tmp,fn)
+    except (IOError,OSError):
+        pass # The table will be recomputed in the next session.
+#@+node:ekr.20130413052322.10485: *3* internStrings
+def internStrings (obj):
+
+    '''Return a copy of obj, a marshallable object, with all strings interned.
+
+    marshal writes a reference to an object it has already written,
+    so the table files do not repeat keyword argument names.'''
+
+    if isinstance(obj,str):
+        return intern(obj)
+    elif isinstance(obj,dict):
+        return dict([(internStrings(key),internStrings(val)) for key,val in obj.items()])
+    elif isinstance(obj,list):
+        return [internStrings(z) for z in obj]
+    elif isinstance(obj,tuple):
+        return tuple([internStrings(z) for z in obj])
+    else:
+        return obj
+#@+node:ekr.20130413052322.10476: ** makeRule
+def makeRule (colorerClass,name,call):
+
+    '''Return a rule function that calls a matcher of colorerClass.'''
+
+    matcherName,args,keys = call
+    matcher = getattr(colorerClass,matcherName)
+    if not g.isPython3:
+        matcher = matcher.im_func
+    if args:
+        def rule(colorer,s,i):
+            return matcher(colorer,s,i,*args,**keys)
+    else:
+        def rule(colorer,s,i):
+            return matcher(colorer,s,i,**keys)
+    rule.__name__ = name
+    return rule
+#@+node:ekr.20130413052322.10477: ** wordRegex
+def wordRegex (chars):
+
+    '''Return a regex matching a run of the given word characters.'''
+
+    regex = wordRegexDict.get(chars)
+    if not regex:
+        regex = re.compile('[%s]+' % ''.join([re.escape(ch) for ch in chars]))
+        wordRegexDict[chars] = regex
+    return regex
+#@+node:ekr.20130413052322.10478: ** class modeTable
+class modeTable (object):
+
+    '''The precompiled data of one jEdit mode.
+
+    Like a mode module, a modeTable has attributesDictDict, importDict,
+    keywordsDictDict and properties ivars. getRulesDict replaces the
+    module's rulesDictDict.'''
+
+    #@+others
+    #@+node:ekr.20130413052322.10479: *3*  mt.ctor
+    def __init__ (self,language,data):
+
+        self.language = language
+        self.attributesDictDict = data['attributes']
+        self.dispatch = data['dispatch']
+        self.importDict = data['importDict']
+        self.keywordChars = data['keywordChars']
+        self.keywordsDictDict = data['keywords']
+        self.properties = data['properties']
+        self.rules = data['rules']
+        self.functionsDict = {} # Keys are classes, values are dicts of rule functions.
+    #@+node:ekr.20130413052322.10480: *3* mt.getKeywordsDict & getRulesDict
+    def getKeywordsDict (self,rulesetName):
+
+        '''Return a new keywords dict for the ruleset.'''
+
+        return dict(self.keywordsDictDict.get(rulesetName,{}))
+
+    def getRulesDict (self,rulesetName,colorerClass):
+
+        '''Return a new rules dict for the ruleset. Keys are characters,
+        values are lists of rule functions calling colorerClass's matchers.
+
+        The rule functions are created once per class, so the rules of
+        different rulesets may be compared as in the mode modules.'''
+
+        functions = self.functionsDict.get(colorerClass)
+        if functions is None:
+            functions = self.functionsDict[colorerClass] = {}
+        d = self.dispatch.get(rulesetName,{})
+        result = {}
+        for ch,names in d.items():
+            aList = []
+            for name in names:
+                f = functions.get(name)
+                if not f:
+                    f = functions[name] = makeRule(colorerClass,name,self.rules[name])
+                aList.append(f)
+            result[ch] = aList
+        return result
+    #@-others
+#@+node:ekr.20130413052322.10481: ** class ruleRecorder
+class ruleRecorder (object):
+
+    '''A fake colorizer that records the matcher called by a rule.'''
+
+    #@+others
+    #@+node:ekr.20130413052322.10482: *3* rr.ctor, __getattr__ & record
+    def __init__ (self):
+
+        self.calls = []
+
+    def __getattr__ (self,name):
+
+        if not name.startswith('match_'):
+            raise AttributeError(name)
+
+        def matcher(s,i,*args,**keys):
+            self.calls.append((name,args,keys),)
+            return self
+
+        return matcher
+
+    def record (self,f):
+
+        '''Return (name,args,keys) for the one matcher that rule f calls,
+        None if f always fails, or False if f does anything else.'''
+
+        self.calls = []
+        try:
+            result = f(self,'',0)
+        except Exception:
+            return False
+        if not self.calls and result == 0:
+            return None
+        elif len(self.calls) == 1 and result is self:
+            return self.calls[0]
+        else:
+            return False
+    #@-others
+#@-others
+#@-leo
@@ -151,6 +151,567 @@ class nodeIndices (object):
                 g.trace('double exception: returning original index')
                 return repr(index)
     #@-others
+#@+node:ekr.20130411052322.10171: ** class outlineIndex
+class outlineIndex (object):
+
+    '''A flattened preorder index of all the positions of an outline.
+
+    Entry i of the index describes the i'th position in outline order:
+
+    vnodes[i]:          the position's vnode.
+    childIndices[i]:    the position's child index.
+    levels[i]:          the position's level.
+    sizes[i]:           the number of entries in the position's tree,
+                        so i + sizes[i] is the index of the node after the tree.
+
+    v._addLink and v._cutLink update the index incrementally, in time
+    proportional to the size of the changed tree plus the depth and fanout
+    of its parent. Code that changes v.children in any other way must call
+    c.invalidateOutlineIndex.
+    '''
+
+    #@+others
+    #@+node:ekr.20130411052322.10172: *3*  oi.ctor
+    def __init__ (self,c):
+
+        self.c = c
+        self.valid = False
+        self.vnodes = []
+        self.childIndices = []
+        self.levels = []
+        self.sizes = []
+        self.version = 0 # Incremented whenever the index changes.
+        # Statistics.
+        self.n_rebuilds = 0
+        self.n_updates = 0
+    #@+node:ekr.20130411052322.10173: *3* oi.check, invalidate & rebuild
+    def check (self):
+
+        '''Rebuild the index if it is not valid.'''
+
+        if not self.valid:
+            self.rebuild()
+
+    def invalidate (self):
+
+        '''Mark the index as invalid. It will be rebuilt when next needed.'''
+
+        self.valid = False
+        self.version += 1
+
+    def rebuild (self):
+
+        '''Recompute the index from c.hiddenRootNode.'''
+
+        root = self.c.hiddenRootNode
+        vnodes,childIndices,levels,sizes = self.flatten(root,0,-1)
+        # Remove the entry for the hidden root node.
+        self.vnodes = vnodes[1:]
+        self.childIndices = childIndices[1:]
+        self.levels = levels[1:]
+        self.sizes = sizes[1:]
+        self.valid = True
+        self.version += 1
+        self.n_rebuilds += 1
+    #@+node:ekr.20130411052322.10174: *3* oi.flatten
+    def flatten (self,v,childIndex,level):
+
+        '''Return the lists (vnodes,childIndices,levels,sizes) describing the
+        preorder traversal of v's tree, with v at the given childIndex & level.'''
+
+        vnodes,childIndices,levels,sizes = [],[],[],[]
+        todo = [(v,childIndex,level)]
+        pending = [] # Indices of entries whose sizes are not yet known.
+        while todo:
+            v,n,level = todo.pop()
+            # The trees of all pending entries at this level or deeper are complete.
+            while pending and levels[pending[-1]] >= level:
+                i = pending.pop()
+                sizes[i] = len(vnodes) - i
+            pending.append(len(vnodes))
+            vnodes.append(v)
+            childIndices.append(n)
+            levels.append(level)
+            sizes.append(1)
+            children = v.children
+            n = len(children)
+            while n > 0:
+                n -= 1
+                todo.append((children[n],n,level+1),)
+        while pending:
+            i = pending.pop()
+            sizes[i] = len(vnodes) - i
+        return vnodes,childIndices,levels,sizes
+    #@+node:ekr.20130411052322.10175: *3* oi.Getters
+    #@+node:ekr.20130411052322.10176: *4* oi.find
+    def find (self,p):
+
+        '''Return the index of position p, or None if p does not exist.'''
+
+        self.check()
+        vnodes,childIndices,sizes = self.vnodes,self.childIndices,self.sizes
+        i,end,found = 0,len(vnodes),None
+        stack = p.stack
+        stack.append((p.v,p._childIndex),)
+        for v,n in stack:
+            # i is the index of the first child.  Skip n siblings.
+            while n > 0 and i < end:
+                i += sizes[i]
+                n -= 1
+            if i >= end or vnodes[i] is not v:
+                return None
+            found = i
+            end = i + sizes[i]
+            i += 1
+        return found
+    #@+node:ekr.20130411052322.10177: *4* oi.nodeAfterTree
+    def nodeAfterTree (self,i):
+
+        '''Return the index of the node after the tree at entry i.'''
+
+        self.check()
+        return i + self.sizes[i]
+    #@+node:ekr.20130411052322.10178: *4* oi.positions & unique_positions
+    def positions (self,i=None,chain=None):
+
+        '''Generate all positions of the outline, or all positions of the tree
+        at entry i. Like c.all_positions, this yields the *same* position
+        object, so callers must copy positions they want to keep.
+
+        chain is the parent chain of the position at entry i. If it is None,
+        it is computed from the index, in time proportional to i.
+
+        If the outline changes during the traversal, the traversal continues
+        from the last position yielded, like c.all_positions.'''
+
+        self.check()
+        vnodes,childIndices,levels,sizes = (
+            self.vnodes,self.childIndices,self.levels,self.sizes)
+        if i is None:
+            start,end,chain = 0,len(vnodes),None
+        else:
+            start,end = i,i+sizes[i]
+            if chain is None:
+                chain = self.chainAt(i)
+        if start >= end:
+            return
+        subtree = i is not None
+        top = None # The root of the subtree.
+        version = self.version
+        base = levels[start]
+        chains = [chain] # chains[k]: the chain of positions at level base+k.
+        p = position(None)
+        for i in range(start,end):
+            if self.version != version:
+                for p in self.followLinks(p,top):
+                    yield p
+                return
+            k = levels[i] - base
+            p.v = v = vnodes[i]
+            p._childIndex = n = childIndices[i]
+            p._chain = chain = chains[k]
+            if sizes[i] > 1:
+                del chains[k+1:]
+                chains.append((v,n,chain,levels[i]+1),)
+            if subtree and i == start:
+                top = p.copy()
+            yield p
+
+    def unique_positions (self):
+
+        '''Generate the positions of the outline with unique vnodes.'''
+
+        self.check()
+        vnodes,childIndices,levels,sizes = (
+            self.vnodes,self.childIndices,self.levels,self.sizes)
+        version = self.version
+        seen = set()
+        chains = [None]
+        p = position(None)
+        i,end = 0,len(vnodes)
+        while i < end:
+            if self.version != version:
+                for p in self.followLinks(p,None,seen):
+                    yield p
+                return
+            v = vnodes[i]
+            if v in seen:
+                i += sizes[i]
+                continue
+            seen.add(v)
+            k = levels[i]
+            p.v = v
+            p._childIndex = n = childIndices[i]
+            p._chain = chain = chains[k]
+            if sizes[i] > 1:
+                del chains[k+1:]
+                chains.append((v,n,chain,k+1),)
+            yield p
+            i += 1
+    #@+node:ekr.20130413052322.10495: *4* oi.followLinks
+    def followLinks (self,p,top,seen=None):
+
+        '''Generate the positions after p using the links of the outline:
+        all following positions if top is None, otherwise the following
+        positions of top's tree. If seen is a set, skip the trees of the
+        vnodes in it, and add the vnodes yielded to it.'''
+
+        after = top and top.nodeAfterTree()
+        p = p.copy()
+        p.moveToThreadNext()
+        while p and p != after:
+            if seen is None:
+                yield p
+            elif p.v in seen:
+                p.moveToNodeAfterTree()
+                continue
+            else:
+                seen.add(p.v)
+                yield p
+            p.moveToThreadNext()
+    #@+node:ekr.20130411052322.10179: *4* oi.chainAt
+    def chainAt (self,i):
+
+        '''Return the parent chain of the position at entry i.'''
+
+        vnodes,childIndices,levels = self.vnodes,self.childIndices,self.levels
+        level = levels[i] ; ancestors = []
+        while level > 0 and i > 0:
+            i -= 1
+            if levels[i] < level:
+                ancestors.append(i)
+                level = levels[i]
+        chain = None
+        for i in reversed(ancestors):
+            chain = (vnodes[i],childIndices[i],chain,levels[i]+1)
+        return chain
+    #@+node:ekr.20130411052322.10180: *3* oi.Incremental updates
+    # These methods change the index lists in place and increment
+    # self.version, so generators in progress can detect the change.
+    #@+node:ekr.20130411052322.10181: *4* oi.afterLink
+    def afterLink (self,parent_v,n,v):
+
+        '''Update the index after linking v as the n'th child of parent_v.'''
+
+        if not self.valid:
+            return
+        entries = self.occurrences(parent_v)
+        if entries is None:
+            self.invalidate() # Should never happen. Recover.
+            return
+        # Like list.insert, v._addLink links v as the last child if n is too large.
+        n = min(n,len(parent_v.children)-1)
+        # Work backwards, so the changes do not move the entries still to be done.
+        for j,ancestors in reversed(entries):
+            k,end = self.childEntry(j,n)
+            if j == -1:
+                level = 0
+            else:
+                level = self.levels[j] + 1
+            # Insert v's tree, then adjust the following siblings.
+            sub = self.flatten(v,n,level)
+            size = len(sub[0])
+            self.insert(k,sub)
+            self.adjustSiblings(k+size,end+size,1)
+            self.adjustAncestors(ancestors,size)
+        self.version += 1
+        self.n_updates += 1
+    #@+node:ekr.20130411052322.10182: *4* oi.beforeCut
+    def beforeCut (self,parent_v,n,v):
+
+        '''Update the index before cutting the link from parent_v to its n'th child v.'''
+
+        if not self.valid:
+            return
+        entries = self.occurrences(parent_v)
+        if entries is None:
+            self.invalidate() # Should never happen. Recover.
+            return
+        for j,ancestors in reversed(entries):
+            k,end = self.childEntry(j,n)
+            if k >= end or self.vnodes[k] is not v:
+                self.invalidate() # Should never happen. Recover.
+                return
+            # Delete v's tree, then adjust the following siblings.
+            size = self.sizes[k]
+            self.delete(k,k+size)
+            self.adjustSiblings(k,end-size,-1)
+            self.adjustAncestors(ancestors,-size)
+        self.version += 1
+        self.n_updates += 1
+    #@+node:ekr.20130411052322.10183: *4* oi.adjustAncestors & adjustSiblings
+    def adjustAncestors (self,ancestors,delta):
+
+        '''Add delta to the sizes of the given entries.'''
+
+        sizes = self.sizes
+        for j in ancestors:
+            sizes[j] += delta
+
+    def adjustSiblings (self,k,end,delta):
+
+        '''Add delta to the child indices of entry k and all following siblings.'''
+
+        childIndices,sizes = self.childIndices,self.sizes
+        while k < end:
+            childIndices[k] += delta
+            k += sizes[k]
+    #@+node:ekr.20130411052322.10184: *4* oi.childEntry
+    def childEntry (self,j,n):
+
+        '''Return (k,end): k is the entry of the n'th child of entry j, or end
+        if j has at most n children. end is the entry after j's tree.
+
+        Entry -1 is the hidden root node.'''
+
+        sizes = self.sizes
+        if j == -1:
+            end = len(sizes)
+        else:
+            end = j + sizes[j]
+        k = j + 1
+        while n > 0 and k < end:
+            k += sizes[k]
+            n -= 1
+        return min(k,end),end
+    #@+node:ekr.20130411052322.10185: *4* oi.occurrences
+    def occurrences (self,v,memo=None):
+
+        '''Return a sorted list of tuples (i,ancestors), one for each entry i
+        such that vnodes[i] is v. ancestors is the list of the entries of i and
+        of all its ancestors. The hidden root node occurs once, as (-1,[]).
+
+        The entries are found from v's parent links, in O(depth*fanout) time
+        for each entry. Return [] if v is not in the outline, and None if the
+        index does not match the outline.'''
+
+        root = self.c.hiddenRootNode
+        if v is root:
+            return [(-1,[])]
+        if memo is None:
+            memo = {} # Keys are vnodes, values are lists of entries.
+        result = memo.get(v)
+        if result is not None:
+            return result
+        result = [] ; vnodes = self.vnodes
+        for parent_v in set(v.parents):
+            entries = self.occurrences(parent_v,memo)
+            if entries is None:
+                return None
+            if entries:
+                ns = [n for n,child in enumerate(parent_v.children) if child is v]
+                for j,ancestors in entries:
+                    for n in ns:
+                        k,end = self.childEntry(j,n)
+                        if k >= end or vnodes[k] is not v:
+                            return None
+                        result.append((k,ancestors + [k]),)
+        result.sort()
+        memo[v] = result
+        return result
+    #@+node:ekr.20130411052322.10186: *4* oi.insert & delete
+    def insert (self,k,sub):
+
+        '''Insert the entries in sub, a tuple of lists, before entry k.'''
+
+        vnodes,childIndices,levels,sizes = sub
+        self.vnodes[k:k] = vnodes
+        self.childIndices[k:k] = childIndices
+        self.levels[k:k] = levels
+        self.sizes[k:k] = sizes
+
+    def delete (self,i,j):
+
+        '''Delete entries i through j-1.'''
+
+        del self.vnodes[i:j]
+        del self.childIndices[i:j]
+        del self.levels[i:j]
+        del self.sizes[i:j]
+    #@-others
+#@+node:ekr.20130413052322.10456: ** class gnxIndex
+class gnxIndex (object):
+
+    '''An index of the vnodes of an outline by gnx, and of the child indices
+    of vnodes with many children.
+
+    vnodes[gnx] is the vnode of the outline with the given gnx. The index is
+    built when first needed. v._addLink, v._cutLink and v.setFileIndex update
+    it incrementally. Code that changes v.children in any other way must call
+    c.invalidateOutlineIndex. Code that changes the fileIndex of a vnode in
+    the outline must call v.setFileIndex.
+
+    childIndices[parent_v] is a dict whose keys are the children of parent_v
+    and whose values are their child indices. Building such a dict costs
+    about as much as a dozen searches of parent_v.children, so gi.childIndex
+    builds it only when parent_v has been searched minSearches times since
+    parent_v.children last changed. c.vnode2position uses gi.childIndex for
+    long lists of children.
+
+    The version counter increases whenever the outline's structure or a gnx
+    changes. Clients may cache positions or lookups until it changes.
+    '''
+
+    #@+others
+    #@+node:ekr.20130413052322.10457: *3*  gi.ctor
+    minDictSize = 32 # gi.childIndex uses list.index for fewer children.
+    minSearches = 8 # gi.childIndex builds a dict on the minSearches'th search.
+
+    def __init__ (self,c):
+
+        self.c = c
+        self.valid = False
+        self.vnodes = {} # Keys are gnx strings, values are vnodes.
+        self.childIndices = {} # Keys are vnodes, values are dicts.
+        self.searches = {} # Keys are vnodes, values are numbers of searches.
+        self.version = 0
+        # Statistics.
+        self.n_rebuilds = 0
+        self.n_updates = 0
+    #@+node:ekr.20130413052322.10458: *3* gi.check, invalidate & rebuild
+    def check (self):
+
+        '''Rebuild the index if it is not valid.'''
+
+        if not self.valid:
+            self.rebuild()
+
+    def invalidate (self):
+
+        '''Mark the index as invalid. It will be rebuilt when next needed.'''
+
+        self.valid = False
+        self.vnodes = {}
+        self.childIndices = {}
+        self.searches = {}
+        self.version += 1
+
+    def rebuild (self):
+
+        '''Recompute the index from c.hiddenRootNode.'''
+
+        self.vnodes = {}
+        self.childIndices = {}
+        self.searches = {}
+        self.valid = True
+        self.addTree(self.c.hiddenRootNode,root=True)
+        self.n_rebuilds += 1
+    #@+node:ekr.20130413052322.10459: *3* gi.Getters
+    #@+node:ekr.20130413052322.10460: *4* gi.find
+    def find (self,gnx):
+
+        '''Return the vnode of the outline with the given gnx, or None.'''
+
+        self.check()
+        v = self.vnodes.get(gnx)
+        if v is not None and v.gnx != gnx:
+            # Some code changed v.fileIndex directly. Recover.
+            self.invalidate()
+            self.check()
+            v = self.vnodes.get(gnx)
+        return v
+    #@+node:ekr.20130413052322.10461: *4* gi.childIndex
+    def childIndex (self,parent_v,v):
+
+        '''Return the index of v in parent_v.children, or None.'''
+
+        children = parent_v.children
+        n = len(children)
+        if n < self.minDictSize:
+            # list.index is faster than a dict for short lists.
+            try:
+                return children.index(v)
+            except ValueError:
+                return None
+        d = self.childIndices.get(parent_v)
+        if d is not None:
+            i = d.get(v)
+            if i is not None and i < n and children[i] is v:
+                return i
+        else:
+            searches = self.searches.get(parent_v,0) + 1
+            if searches < self.minSearches:
+                self.searches[parent_v] = searches
+                try:
+                    return children.index(v)
+                except ValueError:
+                    return None
+            del self.searches[parent_v]
+        # Like list.index, use the first occurrence of clones.
+        d = {}
+        while n > 0:
+            n -= 1
+            d[children[n]] = n
+        self.childIndices[parent_v] = d
+        return d.get(v)
+    #@+node:ekr.20130413052322.10463: *3* gi.Incremental updates
+    #@+node:ekr.20130413052322.10464: *4* gi.afterLink & afterCut
+    def afterLink (self,parent_v,n,v):
+
+        '''Update the index after linking v as the n'th child of parent_v.'''
+
+        self.childIndices.pop(parent_v,None)
+        self.searches.pop(parent_v,None)
+        self.version += 1
+        if self.valid and len(v.parents) == 1 and parent_v.isInOutline():
+            self.addTree(v)
+            self.n_updates += 1
+
+    def afterCut (self,parent_v,n,v):
+
+        '''Update the index after cutting the link from parent_v to v.'''
+
+        self.childIndices.pop(parent_v,None)
+        self.searches.pop(parent_v,None)
+        self.version += 1
+        if self.valid and not v.parents:
+            self.removeTree(v)
+            self.n_updates += 1
+    #@+node:ekr.20130413052322.10465: *4* gi.addTree & removeTree
+    def addTree (self,v,root=False):
+
+        '''Add v and all its descendants to the index.'''
+
+        d = self.vnodes
+        todo = root and list(v.children) or [v]
+        while todo:
+            v = todo.pop()
+            gnx = v.gnx
+            if d.get(gnx) is not v:
+                # Otherwise, v's tree is already in the index.
+                d[gnx] = v
+                todo.extend(v.children)
+
+    def removeTree (self,v):
+
+        '''Remove v and all its descendants that are no longer in the outline.'''
+
+        # v._cutLink removes all parent links of such vnodes.
+        d = self.vnodes
+        todo = [v]
+        while todo:
+            v = todo.pop()
+            if v.parents:
+                continue # v is still in the outline.
+            gnx = v.gnx
+            if d.get(gnx) is v:
+                del d[gnx]
+            self.childIndices.pop(v,None)
+            self.searches.pop(v,None)
+            todo.extend(v.children)
+    #@+node:ekr.20130413052322.10466: *4* gi.changeGnx
+    def changeGnx (self,v,oldIndex):
+
+        '''Update the index after v's fileIndex changed from oldIndex.'''
+
+        self.version += 1
+        if not self.valid:
+            return
+        oldGnx = g.app.nodeIndices.toString(oldIndex)
+        if self.vnodes.get(oldGnx) is v:
+            del self.vnodes[oldGnx]
+            self.vnodes[v.gnx] = v
+    #@-others
 #@+node:ekr.20031218072017.889: ** class position
 #@+<< about the position class >>
 #@+node:ekr.20031218072017.890: *3* << about the position class >>
@@ -162,6 +723,11 @@ class nodeIndices (object):
 # each ancestor **at the spot in tree traversal. Positions p has a unique set of
 # parents.
 # 
+# Internally, the stack is a **parent chain**: an immutable linked list of
+# tuples (v,childIndex,parentChain,level), innermost ancestor first. Copies of
+# a position share the chain, so p.copy() and p.moveToX never copy the stack.
+# The p.stack property converts the chain to and from the old list format.
+# 
 # The p.moveToX methods may return a null (invalid) position p with p.v = None.
 # 
 # The tests "if p" or "if not p" are the _only_ correct way to test whether a
@@ -171,6 +737,11 @@ class nodeIndices (object):
 
 # Positions should *never* be saved by the ZOBD.
 class position (object):
+
+    # Positions are the most numerous temporary objects in Leo.
+    # __dict__ remains available to scripts and plugins.
+    __slots__ = ('v','_childIndex','_chain','txtOffset','__dict__','__weakref__')
+
     #@+others
     #@+node:ekr.20040228094013: *3*  p.ctor & other special methods...
     #@+node:ekr.20080416161551.190: *4*  p.__init__
@@ -185,10 +756,11 @@ class position (object):
         self.v = v
 
         # New in Leo 4.5: stack entries are tuples (v,childIndex).
+        # The chain is immutable, so it never has to be copied.
         if stack:
-            self.stack = stack[:] # Creating a copy here is safest and best.
+            self.stack = stack # Sets self._chain.
         else:
-            self.stack = []
+            self._chain = None
 
         g.app.positions += 1
 
@@ -207,9 +779,10 @@ class position (object):
         if p2 is None or p2.v is None:
             return p1.v is None
         else:
+            # Chains compare item by item, so shared chains compare quickly.
             return ( p1.v == p2.v and
                 p1._childIndex == p2._childIndex and
-                p1.stack == p2.stack )
+                p1._chain == p2._chain )
 
     def __ne__(self,p2):
 
@@ -303,7 +876,7 @@ class position (object):
             return "<pos %d childIndex: %d lvl: %d key: %s %s>" % (
                 id(p),p._childIndex,p.level(),p.key(),p.cleanHeadString())
         else:
-            return "<pos %d [%d] None>" % (id(p),len(p.stack))
+            return "<pos %d [%d] None>" % (id(p),p._chain and p._chain[3] or 0)
 
     __repr__ = __str__
     #@+node:ekr.20061006092649: *4* p.archivedPosition
@@ -334,7 +907,9 @@ class position (object):
 
         """"Return an independent copy of a position."""
 
-        return position(self.v,self._childIndex,self.stack,trace=False)
+        p = position(self.v,self._childIndex)
+        p._chain = self._chain # The chain is immutable: share it.
+        return p
     #@+node:ekr.20040310153624: *4* p.dump
     def dumpLink (self,link):
 
@@ -403,6 +978,32 @@ class position (object):
     gnx = property(
         __get_gnx, # __set_gnx,
         doc = "position gnx property")
+    #@+node:ekr.20130410061712.10151: *4* p.stack property
+    # The stack property converts between the parent chain and
+    # the old list format. It is *not* time-critical:
+    # the p.moveToX methods never use it.
+
+    def __get_stack(self):
+
+        p = self ; result = []
+        chain = p._chain
+        while chain:
+            result.append((chain[0],chain[1]),)
+            chain = chain[2]
+        result.reverse()
+        return result
+
+    def __set_stack(self,stack):
+
+        p = self ; chain = None ; level = 0
+        for v,childIndex in stack:
+            level += 1
+            chain = (v,childIndex,chain,level)
+        p._chain = chain
+
+    stack = property(
+        __get_stack, __set_stack,
+        doc = "position stack property: a list of (v,childIndex) tuples")
     #@+node:ekr.20040306212636: *3* p.Getters
     #@+node:ekr.20040306210951: *4* p.vnode proxies
     #@+node:ekr.20040306211032: *5* p.Comparisons
@@ -557,7 +1158,7 @@ class position (object):
 
     def hasParent(self):
         p = self
-        return p.v and len(p.stack) > 0
+        return p.v and p._chain is not None
 
     def hasThreadBack(self):
         p = self
@@ -570,18 +1171,17 @@ class position (object):
 
         if p.hasChildren() or p.hasNext(): return True
 
-        n = len(p.stack) -1
-        while n >= 0:
-            v,childIndex = p.stack[n]
+        chain = p._chain
+        while chain:
+            v,childIndex,chain,junk = chain
             # See how many children v's parent has.
-            if n == 0:
-                parent_v = v.context.hiddenRootNode
+            if chain:
+                parent_v = chain[0]
             else:
-                parent_v,junk = p.stack[n-1]
+                parent_v = v.context.hiddenRootNode
             if len(parent_v.children) > childIndex+1:
                 # v has a next sibling.
                 return True
-            n -= 1
         return False
     #@+node:ekr.20060920203352: *4* p.findRootPosition
     def findRootPosition (self):
@@ -595,10 +1195,11 @@ class position (object):
 
         p = self ; v = p.v
 
-        for z in p2.stack:
-            v2,junk = z
-            if v2 == v:
+        chain = p2._chain
+        while chain:
+            if chain[0] == v:
                 return True
+            chain = chain[2]
 
         return False
     #@+node:ekr.20040306215056: *4* p.isCloned
@@ -623,11 +1224,9 @@ class position (object):
             return limitIsVisible
 
         # It's much easier with a full stack.
-        n = len(p.stack)-1
-        while n >= 0:
-            progress = n
-            # v,n = p.vParentWithStack(v,p.stack,n)
-            v,junk = p.stack[n]
+        chain = p._chain
+        while chain:
+            v,junk,chain,n = chain
             if v == limit_v:  # We are at a descendant of limit.
                 if trace: g.trace('*** descendant of limit',
                     'limitIsVisible',limitIsVisible,
@@ -639,8 +1238,6 @@ class position (object):
             if not v.isExpanded():
                 if trace: g.trace('*** non-limit parent is not expanded:',v._headString,p.h)
                 return False
-            n -= 1
-            assert progress > n
 
         return True
     #@+node:ekr.20080416161551.197: *4* p.level & simpleLevel
@@ -649,7 +1246,7 @@ class position (object):
         '''Return the number of p's parents.'''
 
         p = self
-        return p.v and len(p.stack) or 0
+        return p.v and p._chain and p._chain[3] or 0
 
     simpleLevel = level
     #@+node:ekr.20111005152227.15566: *4* p.positionAfterDeletedTree
@@ -1031,6 +1628,11 @@ class position (object):
         '''Return p's entire subtree, including p.'''
 
         p = self
+        i = p._outlineIndexEntry()
+        if i is not None:
+            for p in p.v.context.outlineIndex.positions(i,p._chain):
+                yield p
+            raise StopIteration
         p = p.copy()
         after = p.nodeAfterTree()
         while p and p != after:
@@ -1046,6 +1648,14 @@ class position (object):
         '''Return all descendants of p, not including p.'''
 
         p = self
+        i = p._outlineIndexEntry()
+        if i is not None:
+            for p in p.v.context.outlineIndex.positions(i,p._chain):
+                if i is not None:
+                    i = None # Skip p itself.
+                else:
+                    yield p
+            raise StopIteration
         p = p.copy()
         after = p.nodeAfterTree()
         p.moveToThreadNext()
@@ -1120,6 +1730,7 @@ class position (object):
         p = self
         p2.v._headString = p.h
         p2.v._bodyString = p.b
+        p2.v.textChanged()
 
         # 2009/10/02: no need to copy arg to iter
         for child in p.children():
@@ -1365,7 +1976,7 @@ class position (object):
         p = self
 
         if p.v and p.v.children:
-            p.stack.append((p.v,p._childIndex),)
+            p._pushParent()
             p.v = p.v.children[0]
             p._childIndex = 0
         else:
@@ -1380,7 +1991,7 @@ class position (object):
         p = self
 
         if p.v and p.v.children:
-            p.stack.append((p.v,p._childIndex),)
+            p._pushParent()
             n = len(p.v.children)
             p.v = p.v.children[n-1]
             p._childIndex = n-1
@@ -1440,7 +2051,7 @@ class position (object):
         p = self
 
         if p.v and len(p.v.children) > n:
-            p.stack.append((p.v,p._childIndex),)
+            p._pushParent()
             p.v = p.v.children[n]
             p._childIndex = n
         else:
@@ -1454,8 +2065,8 @@ class position (object):
 
         p = self
 
-        if p.v and p.stack:
-            p.v,p._childIndex = p.stack.pop()
+        if p.v and p._chain:
+            p.v,p._childIndex,p._chain,junk = p._chain
         else:
             p.v = None
 
@@ -1635,8 +2246,9 @@ class position (object):
 
         # Adjust p's stack.
         stack = [] ; changed = False ; i = 0
-        while i < len(p.stack):
-            v,childIndex = p.stack[i]
+        old_stack = p.stack
+        while i < len(old_stack):
+            v,childIndex = old_stack[i]
             p3 = position(v=v,childIndex=childIndex,stack=stack[:i])
             while p3:
                 if p2 == p3:
@@ -1664,7 +2276,7 @@ class position (object):
             # Returns None if p.v is None
 
         # Init the ivars.
-        p.stack = p_after.stack[:]
+        p._chain = p_after._chain
         p._childIndex = p_after._childIndex + 1
 
         # Set the links.
@@ -1678,8 +2290,7 @@ class position (object):
         parent_v = parent.v
 
         # Init the ivars.
-        p.stack = parent.stack[:]
-        p.stack.append((parent_v,parent._childIndex),)
+        p._chain = parent._chainWithSelf()
         p._childIndex = n
 
         child = p.v
@@ -1694,14 +2305,40 @@ class position (object):
         p = self
 
         if p.v:
-            data = p.stack and p.stack[-1]
-            if data:
-                v, junk = data
-                return v
+            if p._chain:
+                return p._chain[0]
             else:
                 return p.v.context.hiddenRootNode
         else:
             return None
+    #@+node:ekr.20130410061712.10152: *4* p._pushParent & p._chainWithSelf
+    def _chainWithSelf (self):
+
+        '''Return the parent chain of p's children.'''
+
+        p = self ; chain = p._chain
+        if chain:
+            return (p.v,p._childIndex,chain,chain[3]+1)
+        else:
+            return (p.v,p._childIndex,None,1)
+
+    def _pushParent (self):
+
+        '''Make p's present spot the innermost entry of p's parent chain.'''
+
+        p = self
+        p._chain = p._chainWithSelf()
+    #@+node:ekr.20130411052322.10188: *4* p._outlineIndexEntry
+    def _outlineIndexEntry (self):
+
+        '''Return p's entry in c.outlineIndex, or None.'''
+
+        p = self
+        index = p.v and getattr(p.v.context,'outlineIndex',None)
+        if index:
+            return index.find(p)
+        else:
+            return None
     #@+node:ekr.20080416161551.216: *4* p._linkAsRoot
     def _linkAsRoot (self,oldRoot):
 
@@ -1714,7 +2351,7 @@ class position (object):
         # else:       oldRootNode = None
 
         # Init the ivars.
-        p.stack = []
+        p._chain = None
         p._childIndex = 0
         parent_v = hiddenRootNode
         child = p.v
@@ -1857,7 +2494,7 @@ if use_zodb and ZODB:
         pass
 else:
     class baseVnode (object):
-        pass
+        __slots__ = () # Allow slots in vnode.
 
 class vnode (baseVnode):
     #@+<< vnode constants >>
@@ -1879,6 +2516,19 @@ class vnode (baseVnode):
     dirtyBit    = 0x200
     writeBit    = 0x400
     #@-<< vnode constants >>
+
+    if not (use_zodb and ZODB):
+        # Big outlines contain hundreds of thousands of vnodes.
+        # Rarely-used ivars (set by plugins and scripts) live in __dict__,
+        # which Python creates only when first needed.
+        __slots__ = (
+            '_headString','_bodyText','children','parents',
+            'fileIndex','iconVal','statusBits','context',
+            'insertSpot','scrollBarSpot','selectionLength','selectionStart',
+            'unknownAttributes','tempBodyString','tempBodyList','_p_changed',
+            '_lazyBody','__dict__','__weakref__',
+        )
+
     #@+others
     #@+node:ekr.20031218072017.3342: *3* v.Birth & death
     #@+node:ekr.20031218072017.3344: *4* v.__init
@@ -1889,7 +2539,8 @@ class vnode (baseVnode):
 
         # The primary data: headline and body text.
         self._headString = g.u('newHeadline')
-        self._bodyString = g.u('')
+        self._bodyText = g.u('') # Use the v._bodyString property.
+        self._lazyBody = None
 
         # Structure data...
         self.children = [] # Ordered list of all children of this node.
@@ -1919,6 +2570,35 @@ class vnode (baseVnode):
         return "<vnode %d:'%s'>" % (id(self),self.cleanHeadString())
 
     __str__ = __repr__
+    #@+node:ekr.20130413052322.10211: *4* v._bodyString property & v.hasLazyBody (lazy body text)
+    # Binary outlines (.leob files) may defer loading body text.
+    # For such vnodes, v._lazyBody is a tuple (loader,n) that describes
+    # where the body text is. Otherwise, v._lazyBody is None.
+
+    def __get_bodyString (self):
+
+        v = self
+        if v._lazyBody is not None:
+            loader,n = v._lazyBody
+            v._bodyText = loader.loadBody(n)
+            v._lazyBody = None
+        return v._bodyText
+
+    def __set_bodyString (self,s):
+
+        v = self
+        v._bodyText = s
+        v._lazyBody = None
+
+    _bodyString = property(
+        __get_bodyString, __set_bodyString,
+        doc = "vnode body text property: loads lazy body text")
+
+    def hasLazyBody (self):
+
+        '''Return True if v's body text has not been loaded yet.'''
+
+        return self._lazyBody is not None
     #@+node:ekr.20040312145256: *4* v.dump
     def dumpLink (self,link):
         return g.choose(link,link,"<none>")
@@ -2106,12 +2786,13 @@ class vnode (baseVnode):
     #@+node:ekr.20031218072017.3378: *4* v.bodyString
     def bodyString (self):
 
+        s = self._bodyString # A property: get it only once.
         # This message should never be printed and we want to avoid crashing here!
-        if g.isUnicode(self._bodyString):
-            return self._bodyString
+        if g.isUnicode(s):
+            return s
         else:
-            g.internalError('not unicode:',repr(self._bodyString))
-            return g.toUnicode(self._bodyString)
+            g.internalError('not unicode:',repr(s))
+            return g.toUnicode(s)
 
     getBody = bodyString
     #@+node:ekr.20031218072017.3360: *4* v.Children
@@ -2157,11 +2838,29 @@ class vnode (baseVnode):
 
         v = self
         return v.parents
+    #@+node:ekr.20130413052322.10494: *4* v.isInOutline
+    def isInOutline (self):
+
+        '''Return True if v is the hidden root node or one of its descendants.'''
+
+        root = self.context.hiddenRootNode
+        seen = set() ; todo = [self]
+        while todo:
+            v = todo.pop()
+            if v is root:
+                return True
+            if v not in seen:
+                seen.add(v)
+                todo.extend(v.parents)
+        return False
     #@+node:ekr.20080429053831.6: *4* v.hasBody
     def hasBody (self):
 
         '''Return True if this vnode contains body text.'''
 
+        if self.hasLazyBody():
+            return True # Lazy body text is never empty.
+
         s = self._bodyString
 
         return s and len(s) > 0
@@ -2443,19 +3142,37 @@ class vnode (baseVnode):
                 # v.h, len(v._bodyString),len(s),g.callers(5),
                 # v._bodyString,s))
         v._bodyString = g.toUnicode(s,reportErrors=True)
+        v.textChanged()
 
     def setHeadString (self,s):
         v = self
         v._headString = g.toUnicode(s,reportErrors=True)
+        v.textChanged()
 
     initBodyString = setBodyString
     initHeadString = setHeadString
     setHeadText = setHeadString
     setTnodeText = setBodyString
+    #@+node:ekr.20130413052322.10521: *4* v.textChanged
+    def textChanged (self):
+
+        '''Tell the commander that v's headline or body has changed.
+        Code that sets v._headString or v._bodyString must call this.'''
+
+        c = self.context
+        c.outlineGeneration += 1
+        index = getattr(c,'searchIndex',None)
+        if index:
+            index.touch(self)
     #@+node:ekr.20080429053831.13: *4* v.setFileIndex
     def setFileIndex (self, index):
 
-        self.fileIndex = index
+        v = self
+        oldIndex = v.fileIndex
+        v.fileIndex = index
+        gnxIndex = getattr(v.context,'gnxIndex',None)
+        if gnxIndex:
+            gnxIndex.changeGnx(v,oldIndex)
     #@+node:ekr.20031218072017.3402: *4* v.setSelection
     def setSelection (self, start, length):
 
@@ -2493,6 +3210,17 @@ class vnode (baseVnode):
             if len(v.parents) == 1:
                 for child in v.children:
                     child._addParentLinks(parent=v)
+
+        v.context.outlineGeneration += 1
+        index = getattr(v.context,'outlineIndex',None)
+        if index:
+            index.afterLink(parent_v,childIndex,v)
+        index = getattr(v.context,'searchIndex',None)
+        if index:
+            index.touchTree(v)
+        index = getattr(v.context,'gnxIndex',None)
+        if index:
+            index.afterLink(parent_v,childIndex,v)
     #@+node:ekr.20090804184658.6129: *5* v._addParentLinks
     def _addParentLinks(self,parent): 
 
@@ -2513,6 +3241,10 @@ class vnode (baseVnode):
 
         parent_v.childrenModified()    
         assert parent_v.children[childIndex]==v
+        v.context.outlineGeneration += 1
+        index = getattr(v.context,'outlineIndex',None)
+        if index:
+            index.beforeCut(parent_v,childIndex,v)
         del parent_v.children[childIndex]
         v.parents.remove(parent_v)
         v._p_changed = 1
@@ -2524,6 +3256,10 @@ class vnode (baseVnode):
         if len(v.parents) == 0:
             for child in v.children:
                 child._cutParentLinks(parent=v)
+
+        index = getattr(v.context,'gnxIndex',None)
+        if index:
+            index.afterCut(parent_v,childIndex,v)
     #@+node:ekr.20090804190529.6133: *5* v._cutParentLinks
     def _cutParentLinks(self,parent):
 
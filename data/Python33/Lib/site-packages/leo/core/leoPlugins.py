@@ -8,7 +8,14 @@
 
 import leo.core.leoGlobals as g
 # import bisect
+import os
 import sys
+import time
+
+if g.isPython3:
+    import pickle
+else:
+    import cPickle as pickle
 
 #@+others
 #@+node:ekr.20100908125007.6041: ** Top-level functions
@@ -277,6 +284,15 @@ class LeoPluginsController:
         # g.trace('LeoPluginsController',g.callers())
 
         self.handlers = {}
+        self.dispatchDict = {}
+            # Keys are tags, values are tuples of the bunches in self.handlers.
+            # Contains only tags having handlers, so g.doHook can skip other tags.
+        self.allHandlers = ()
+            # A tuple of the bunches of handlers for the 'all' tag.
+        self.handlerStats = {}
+            # Keys are (tag,moduleName,handlerName), values are [calls,seconds].
+        self.handlerStatsEnabled = False
+            # True: callTagHandler updates self.handlerStats.
         self.loadedModulesFilesDict = {}
             # Keys are regularized module names, values are the names of .leo files
             # containing @enabled-plugins nodes that caused the plugin to be loaded
@@ -286,6 +302,12 @@ class LeoPluginsController:
             # The stack of module names.
             # The top is the module being loaded.
         self.signonModule = None # A hack for plugin_signon.
+        self.deferredModules = {}
+            # Keys are regularized module names, values are g.Bunches
+            # describing the stubs of plugins that will be loaded on first use.
+        self.manifests = None
+            # Keys are regularized module names, values are plugin manifests.
+            # Read from the manifests file when first needed.
 
         # Settings.  Set these here in case finishCreate is never called.
         self.warn_on_failure = True
@@ -305,7 +327,7 @@ class LeoPluginsController:
             setting='warn_when_plugins_fail_to_load',
             default=True)
     #@+node:ekr.20100909065501.5952: *3* Event handlers
-    #@+node:ekr.20100908125007.6016: *4* callTagHandler
+    #@+node:ekr.20100908125007.6016: *4* callTagHandler & updateHandlerStats
     def callTagHandler (self,bunch,tag,keywords):
 
         trace = False and not g.unitTesting
@@ -332,14 +354,27 @@ class LeoPluginsController:
 
         # Calls to registerHandler from inside the handler belong to moduleName.
         self.loadingModuleNameStack.append(moduleName)
+        t1 = self.handlerStatsEnabled and time.time()
         try:
             result = handler(tag,keywords)
         except Exception:
             g.es("hook failed: %s, %s, %s" % (tag, handler, moduleName))
             g.es_exception()
             result = None
+        if t1:
+            self.updateHandlerStats(tag,moduleName,handler,time.time()-t1)
         self.loadingModuleNameStack.pop()
         return result
+
+    def updateHandlerStats (self,tag,moduleName,handler,seconds):
+
+        key = tag,moduleName,handler.__name__
+        stats = self.handlerStats.get(key)
+        if stats:
+            stats[0] += 1
+            stats[1] += seconds
+        else:
+            self.handlerStats[key] = [1,seconds]
     #@+node:ekr.20100908125007.6017: *4* doHandlersForTag
     def doHandlersForTag (self,tag,keywords):
 
@@ -356,8 +391,10 @@ class LeoPluginsController:
         if trace and (traceIdle or tag != 'idle'):
             g.trace(tag,g.callers(6))
 
-        if tag in self.handlers:
-            bunches = self.handlers.get(tag)
+        # The dispatch tables are tuples: handlers may be registered
+        # or unregistered while iterating over them.
+        bunches = self.dispatchDict.get(tag)
+        if bunches:
             # Execute hooks in some random order.
             # Return if one of them returns a non-None result.
             for bunch in bunches:
@@ -365,10 +402,8 @@ class LeoPluginsController:
                 if val is not None:
                     return val
 
-        if 'all' in self.handlers:
-            bunches = self.handlers.get('all')
-            for bunch in bunches:
-                self.callTagHandler(bunch,tag,keywords)
+        for bunch in self.allHandlers:
+            self.callTagHandler(bunch,tag,keywords)
 
         return None
     #@+node:ekr.20100908125007.6018: *4* doPlugins
@@ -414,6 +449,33 @@ class LeoPluginsController:
     def isLoaded (self,fn):
 
         return self.regularizeName(fn) in self.loadedModules
+    #@+node:ekr.20130413052322.10336: *4* printHandlerStats
+    def printHandlerStats (self,c):
+
+        '''Print the number of calls and the time taken by each handler.'''
+
+        tabName = 'Plugins'
+        c.frame.log.selectTab(tabName)
+
+        if not self.handlerStatsEnabled and not self.handlerStats:
+            g.es('no handler statistics: use toggle-plugin-handler-stats',
+                tabName=tabName)
+            return
+
+        data = [] ; n = 4
+        items = sorted(self.handlerStats.items(),key=lambda z: -z[1][1])
+        for (tag,moduleName,handlerName),(calls,seconds) in items:
+            name = '%s.%s' % (moduleName,handlerName)
+            n = max(n,len(tag))
+            data.append((tag,calls,1000*seconds,1000000*seconds/calls,name),)
+
+        s = 'plugin handler statistics%s...\n' % (
+            g.choose(self.handlerStatsEnabled,'',' (disabled)'))
+        lines = ['%*s %7s %9s %9s %s\n' % (-n,'tag','calls','msec','usec/call','handler')]
+        lines.extend(['%*s %7s %9.1f %9.1f %s\n' % (-n,tag,calls,msec,usec,name)
+            for (tag,calls,msec,usec,name) in data])
+        g.es(s+'\n',tabName=tabName)
+        g.es('',''.join(lines),tabName=tabName)
     #@+node:ekr.20100908125007.6025: *4* printHandlers
     def printHandlers (self,c,moduleName=None):
 
@@ -492,6 +554,14 @@ class LeoPluginsController:
             fn = "leo.plugins." + fn [:-3]
 
         return fn
+    #@+node:ekr.20130413052322.10337: *4* setHandlerStatsEnabled
+    def setHandlerStatsEnabled (self,enabled):
+
+        '''Enable or disable statistics for handlers, clearing them when enabled.'''
+
+        if enabled:
+            self.handlerStats = {}
+        self.handlerStatsEnabled = enabled
     #@+node:ekr.20100909104341.5979: *4* setLoaded
     def setLoaded (self,fn,m):
 
@@ -518,7 +588,9 @@ class LeoPluginsController:
 
         for plugin in s.splitlines():
             if plugin.strip() and not plugin.lstrip().startswith('#'):
-                self.loadOnePlugin(plugin.strip(), tag = tag)
+                moduleName = g.toUnicode(self.regularizeName(plugin.strip()))
+                if self.isLoaded(moduleName) or not self.deferPlugin(moduleName):
+                    self.loadOnePlugin(plugin.strip(), tag = tag)
     #@+node:ekr.20100908125007.6024: *4* loadOnePlugin
     def loadOnePlugin (self,moduleOrFileName,tag='open0',verbose=False):
 
@@ -547,10 +619,17 @@ class LeoPluginsController:
 
         moduleName = g.toUnicode(moduleName)
 
+        # Load deferred plugins when explicitly requested.
+        self.removeStubs(moduleName)
+
         # This import will typically result in calls to registerHandler.
         # if the plugin does _not_ use the init top-level function.
         self.loadingModuleNameStack.append(moduleName)
 
+        prof = g.app.startupProfiler
+        if prof: prof.enter(moduleName,kind='plugin')
+        manifestData = self.beginManifest()
+
         try:
             __import__(moduleName)
             # need to look up through sys.modules, __import__ returns toplevel package
@@ -616,6 +695,9 @@ class LeoPluginsController:
                     self.loadedModules[moduleName] = result
             self.loadingModuleNameStack.pop()
 
+        self.endManifest(moduleName,result,manifestData)
+        if prof: prof.leave(moduleName)
+
         if g.app.batchMode or g.app.inBridge: # or g.unitTesting
             pass
         elif result:
@@ -647,6 +729,8 @@ class LeoPluginsController:
 
         moduleName = self.regularizeName(moduleOrFileName)
 
+        self.removeStubs(moduleName)
+
         if self.isLoaded(moduleName):
             if verbose:
                 g.pr('unloading',moduleName)
@@ -656,6 +740,257 @@ class LeoPluginsController:
             bunches = self.handlers.get(tag)
             bunches = [bunch for bunch in bunches if bunch.moduleName != moduleName]
             self.handlers[tag] = bunches
+        self.updateDispatchDict()
+    #@+node:ekr.20130413052322.10325: *3* Lazy loading
+    #@+at Plugins containing a top-level lazy_load = True statement may be loaded
+    # when first used, rather than at startup.
+    # 
+    # The first time Leo loads such a plugin it writes a **manifest**, listing
+    # the hooks the plugin handles, the global commands (@g.command) it
+    # defines and the values of the settings it reads while loading.
+    # g.app.config.get and c.config.get record these reads in g.app.config.recorder.
+    # Plugins that read per-outline (c.config) settings while loading are never
+    # deferred: their values can change from one outline to the next.
+    # Thereafter, if the plugin file, the gui and the settings are unchanged,
+    # Leo registers stubs for these hooks and commands instead of loading the
+    # plugin. The first stub to be called loads the plugin.
+    # 
+    # Leo loads all plugins at startup if @bool lazy-load-plugins is False.
+    #@@c
+
+    #@+others
+    #@+node:ekr.20130413052322.10326: *4* pc.beginManifest & endManifest
+    def beginManifest (self):
+
+        '''Start recording the hooks, commands and settings of a plugin.'''
+
+        config = g.app.config
+        if g.app.unitTesting or not config:
+            return None
+        d = g.Bunch(
+            commands=g.app.global_commands_dict.copy(),
+            nActOnNode=len(g.act_on_node.chain),
+            nPopups=len(g.tree_popup_handlers),
+            nVisitTreeItem=len(g.visit_tree_item.chain),
+            recorder=config.recorder,
+            settings=[])
+        config.recorder = d.settings
+        return d
+
+    def endManifest (self,moduleName,module,d):
+
+        '''Stop recording and update the plugin's manifest if it may be loaded lazily.'''
+
+        if not d: return
+        config = g.app.config
+        config.recorder = d.recorder
+        if d.recorder is not None:
+            # A plugin loaded while loading another plugin.
+            d.recorder.extend(d.settings)
+        if not module or not getattr(module,'lazy_load',False):
+            return
+        if moduleName not in self.loadedModules:
+            return
+        path = getattr(module,'__file__',None)
+        if not path:
+            return
+        if path.endswith(('.pyc','.pyo')):
+            path = path[:-1]
+        tags = []
+        for tag in sorted(self.handlers):
+            for bunch in self.handlers.get(tag):
+                if bunch.moduleName == moduleName and tag not in tags:
+                    tags.append(tag)
+        commands = [name for name in sorted(g.app.global_commands_dict)
+            if g.app.global_commands_dict.get(name) != d.commands.get(name)]
+        types = (bool,float,int,list,tuple,type(None),type(''),type(g.toUnicode('')))
+        # Do not defer plugins with side effects that Leo can not delay.
+        lazy = (
+            bool(tags or commands) and 'all' not in tags and
+            len(g.act_on_node.chain) == d.nActOnNode and
+            len(g.tree_popup_handlers) == d.nPopups and
+            len(g.visit_tree_item.chain) == d.nVisitTreeItem and
+            not [z for z in d.settings if z[3]] and
+            all([isinstance(val,types) for setting,kind,val,local in d.settings]))
+        manifest = {
+            'commands':commands,
+            'key':self.computeManifestKey(path),
+            'lazy':lazy,
+            'path':path,
+            'settings':[(setting,kind,val) for setting,kind,val,local in d.settings],
+            'tags':tags,
+        }
+        manifests = self.getManifests()
+        if manifests.get(moduleName) != manifest:
+            manifests[moduleName] = manifest
+            self.writeManifests()
+    #@+node:ekr.20130413052322.10327: *4* pc.callDeferredCommand & callDeferredHandlers
+    def callDeferredCommand (self,moduleName,commandName,event):
+
+        '''Load a deferred plugin and execute its command.'''
+
+        stubs = self.deferredModules.get(moduleName)
+        stub = stubs and stubs.commands.get(commandName)
+        self.loadDeferredPlugin(moduleName)
+        func = g.app.global_commands_dict.get(commandName)
+        if func and func != stub:
+            return func(event)
+        else:
+            g.error('can not load plugin for %s command: %s' % (
+                commandName,moduleName))
+            return None
+
+    def callDeferredHandlers (self,moduleName,tag,keywords):
+
+        '''Load a deferred plugin and call its handlers for tag.'''
+
+        self.loadDeferredPlugin(moduleName)
+        for bunch in self.handlers.get(tag,[]):
+            if bunch.moduleName == moduleName:
+                val = self.callTagHandler(bunch,tag,keywords)
+                if val is not None:
+                    return val
+        return None
+    #@+node:ekr.20130413052322.10328: *4* pc.computeManifestKey
+    def computeManifestKey (self,path):
+
+        '''Return the key of the manifest of the plugin whose file is path.'''
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return [
+            sys.version_info[:2],
+            g.app.gui and g.app.gui.guiName(),
+            stat.st_mtime,
+            stat.st_size,
+        ]
+    #@+node:ekr.20130413052322.10329: *4* pc.deferPlugin
+    def deferPlugin (self,moduleName):
+
+        '''Register stubs for the plugin if it may be loaded when first used.
+
+        Return True if the stubs exist.'''
+
+        pc = self
+        if moduleName in pc.deferredModules:
+            return True
+        if g.app.unitTesting or not g.app.enablePlugins or not g.app.config:
+            return False
+        if not g.app.config.getBool('lazy-load-plugins',default=True):
+            return False
+        d = pc.getManifests().get(moduleName)
+        if not d or not d.get('lazy') or not pc.isValidManifest(d):
+            return False
+
+        def lazyHandler(tag,keywords,pc=pc,moduleName=moduleName):
+            return pc.callDeferredHandlers(moduleName,tag,keywords)
+
+        stubs = g.Bunch(commands={},handler=lazyHandler,manifest=d)
+        pc.loadingModuleNameStack.append(moduleName)
+        for tag in d.get('tags'):
+            pc.registerOneHandler(tag,lazyHandler)
+        pc.loadingModuleNameStack.pop()
+        for commandName in d.get('commands'):
+
+            def lazyCommand(event=None,pc=pc,moduleName=moduleName,commandName=commandName):
+                return pc.callDeferredCommand(moduleName,commandName,event)
+
+            stubs.commands[commandName] = lazyCommand
+            g.app.global_commands_dict[commandName] = lazyCommand
+            for c in g.app.commanders():
+                c.k.registerCommand(commandName,
+                    shortcut=None,func=lazyCommand,pane='all',verbose=False)
+        pc.deferredModules[moduleName] = stubs
+        return True
+    #@+node:ekr.20130413052322.10330: *4* pc.getManifests & writeManifests
+    def getManifests (self):
+
+        '''Return the dict of plugin manifests, reading it if necessary.'''
+
+        if self.manifests is None:
+            self.manifests = {}
+            fn = self.manifestsPath()
+            if fn and g.os_path_exists(fn):
+                try:
+                    f = open(fn,'rb')
+                    try:
+                        self.manifests = pickle.load(f)
+                    finally:
+                        f.close()
+                except Exception:
+                    self.manifests = {}
+        return self.manifests
+
+    def manifestsPath (self):
+
+        '''Return the path to the plugin manifests file, or None.'''
+
+        if not g.enableDB or not g.app.homeLeoDir:
+            return None
+        return g.os_path_finalize_join(g.app.homeLeoDir,'db',
+            'plugin-manifests-py%s.pickle' % sys.version_info[0])
+
+    def writeManifests (self):
+
+        '''Write the dict of plugin manifests.'''
+
+        fn = self.manifestsPath()
+        if not fn: return
+        tempName = fn + '.tmp'
+        try:
+            theDir = g.os_path_dirname(fn)
+            if not g.os_path_exists(theDir):
+                os.makedirs(theDir)
+            f = open(tempName,'wb')
+            try:
+                pickle.dump(self.manifests,f,pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            if g.os_path_exists(fn):
+                os.remove(fn) # Required on Windows.
+            os.rename(tempName,fn)
+        except Exception:
+            if g.os_path_exists(tempName):
+                g.utils_remove(tempName,verbose=False)
+    #@+node:ekr.20130413052322.10331: *4* pc.isValidManifest
+    def isValidManifest (self,d):
+
+        '''Return True if the plugin file, the gui and the settings
+        recorded in the manifest d are unchanged.'''
+
+        if d.get('key') != self.computeManifestKey(d.get('path')):
+            return False
+        for setting,kind,val in d.get('settings'):
+            if g.app.config.get(setting,kind) != val:
+                return False
+        return True
+    #@+node:ekr.20130413052322.10332: *4* pc.loadDeferredPlugin & removeStubs
+    def loadDeferredPlugin (self,moduleName):
+
+        '''Remove the stubs of a deferred plugin and load it.'''
+
+        if moduleName in self.deferredModules:
+            self.removeStubs(moduleName)
+            self.loadOnePlugin(moduleName,tag='lazy')
+
+    def removeStubs (self,moduleName):
+
+        '''Remove the stubs of a deferred plugin.'''
+
+        stubs = self.deferredModules.get(moduleName)
+        if not stubs: return
+        del self.deferredModules[moduleName]
+        # Create new lists: doHandlersForTag may be iterating over the old lists.
+        for tag in stubs.manifest.get('tags'):
+            self.handlers[tag] = [bunch for bunch in self.handlers.get(tag,[])
+                if bunch.fn != stubs.handler]
+        self.updateDispatchDict()
+        for commandName in stubs.commands:
+            if g.app.global_commands_dict.get(commandName) == stubs.commands.get(commandName):
+                del g.app.global_commands_dict[commandName]
+    #@-others
     #@+node:ekr.20100909065501.5951: *3* Registration
     #@+node:ekr.20100908125007.6028: *4* registerExclusiveHandler
     def registerExclusiveHandler(self,tags, fn):
@@ -687,7 +1022,8 @@ class LeoPluginsController:
             g.es("*** Two exclusive handlers for","'%s'" % (tag))
         else:
             bunch = g.Bunch(fn=fn,moduleName=moduleName,tag='handler')
-            self.handlers = [bunch]
+            self.handlers[tag] = [bunch]
+            self.updateDispatchDict()
     #@+node:ekr.20100908125007.6029: *4* registerHandler
     def registerHandler(self,tags,fn):
 
@@ -713,11 +1049,12 @@ class LeoPluginsController:
             g.pr('%6s %15s %25s %s' % (g.app.unitTesting,moduleName,tag,fn.__name__))
 
         items = self.handlers.get(tag,[])
-        if fn not in items:
+        if fn not in [bunch.fn for bunch in items]:
             bunch = g.Bunch(fn=fn,moduleName=moduleName,tag='handler')
             items.append(bunch)
 
         self.handlers[tag] = items
+        self.updateDispatchDict()
     #@+node:ekr.20100908125007.6031: *4* unregisterHandler
     def unregisterHandler(self,tags,fn):
 
@@ -729,9 +1066,21 @@ class LeoPluginsController:
 
     def unregisterOneHandler (self,tag,fn):
 
-        bunches = self.handlers.get(tag)
+        bunches = self.handlers.get(tag,[])
         bunches = [bunch for bunch in bunches if bunch.fn != fn]
         self.handlers[tag] = bunches
+        self.updateDispatchDict()
+    #@+node:ekr.20130413052322.10338: *4* updateDispatchDict
+    def updateDispatchDict (self):
+
+        '''Recompute the dispatch tables from self.handlers.
+
+        Call this whenever self.handlers changes.'''
+
+        self.dispatchDict = dict([(tag,tuple(bunches))
+            for tag,bunches in self.handlers.items()
+                if bunches and tag != 'all'])
+        self.allHandlers = tuple(self.handlers.get('all',[]))
     #@-others
 #@-others
 #@-leo
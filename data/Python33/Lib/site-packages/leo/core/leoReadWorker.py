@@ -0,0 +1,92 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20130413052322.10512: * @file leoReadWorker.py
+'''A program that reads external files for at.readInProcesses.
+
+Usage: python leoReadWorker.py <jobs file> <results file>
+
+The jobs file contains a pickled dict: 'paths' is the list of files to
+read; 'nodes' maps each path to a tuple (headline,encoding): the headline
+of its @thin or @file node and the encoding in effect at that node.
+
+The results file receives a pickled dict. Keys are paths; values are
+tuples (key,aList), where key is the cacher's key for the headline and
+the contents of the file, and aList is the tree read from the file, in
+the format of cacher.makeCacheList. Files that could not be read without
+errors, and files with file-like sentinels, are missing from the dict.
+'''
+
+#@+<< imports >>
+#@+node:ekr.20130413052322.10513: ** << imports >> (leoReadWorker.py)
+import sys
+
+if sys.version_info[0] >= 3:
+    import pickle
+else:
+    import cPickle as pickle
+
+import leo.core.leoBridge as leoBridge
+#@-<< imports >>
+# Do not define g here. Use the g returned by the bridge.
+
+#@+others
+#@+node:ekr.20130413052322.10514: ** main & helpers (leoReadWorker.py)
+def main ():
+
+    jobsPath,resultsPath = sys.argv[1:3]
+    f = open(jobsPath,'rb')
+    job = pickle.load(f)
+    f.close()
+    bridge = leoBridge.controller(gui='nullGui',
+        loadPlugins=False, # Plugins must not see the temporary commander.
+        readSettings=True, # Reading uses the default encoding.
+        silent=True,
+        verbose=False)
+    results = {}
+    if bridge.isOpen():
+        g = bridge.globals()
+        # The reading outline owns the cache.
+        g.enableDB = False
+        c = bridge.openLeoFile(None)
+        c.frame.createFirstTreeNode()
+        root = c.rootPosition()
+        for path in job['paths']:
+            headline,encoding = job['nodes'][path]
+            # at.read finds this directive in the parent of the @<file> node.
+            root.setBodyString('@encoding %s\n' % encoding)
+            result = readFile(c,g,root,path,headline)
+            if result:
+                results[path] = result
+    f = open(resultsPath,'wb')
+    pickle.dump(results,f,pickle.HIGHEST_PROTOCOL)
+    f.close()
+#@+node:ekr.20130413052322.10515: *3* readFile
+def readFile (c,g,root,path,headline):
+
+    '''Read path into a new child of root, convert the tree to a cache list
+    and delete it.
+
+    Return (key,aList), or None if the file could not be read.'''
+
+    at = c.atFileCommands
+    s,e = g.readFileIntoString(path,raw=True,silent=True)
+    if s is None or at.isFileLike(s):
+        return None
+    result = None
+    p = root.insertAsLastChild()
+    try:
+        kind = headline.split(' ',1)[0]
+        p.initHeadString('%s %s' % (kind,path))
+        if at.read(p):
+            aList = c.cacher.makeCacheList(p)
+            aList[0] = headline
+            result = c.cacher.fileKey(headline,s,requireEncodedString=True),aList
+    except Exception:
+        pass # The reading outline reads the file again and reports the error.
+    p.doDelete()
+    c.undoer.clearUndoState()
+    return result
+#@-others
+
+if __name__ == '__main__':
+    main()
+#@-leo
@@ -0,0 +1,339 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20130413052322.10394: * @file leoServer.py
+'''A headless, long-lived outline server for batch clients.
+
+Usage: python leoServer.py [--socket <path>] [--port <n>]
+
+The server initializes Leo once with the leoBridge module and keeps the
+commanders of all the .leo files its clients use open. Clients connect with
+the lproto protocol, either to a local socket (--socket, the default where
+available) or to a TCP port on 127.0.0.1 (--port, 0: any free port). The
+server writes its address to ~/.leo/leoserver_address. OutlineClient reads
+that file.
+
+Each request and each answer is a JSON object. Requests contain a 'cmd' key
+and usually a 'file' key, the path to a .leo file. The server opens the file
+when a request first uses it. Answers contain 'ok': false and 'error' if the
+request failed. Commands:
+
+open:     Open file. Answer 'file' (the full path) and 'nodes'.
+list:     Answer 'files', the open files, and 'changed', the changed files.
+query:    Find the nodes whose headlines (or bodies, if 'body' is true)
+          contain 'pattern' (a regular expression if 'regex' is true).
+          Answer 'nodes', a list of up to 'limit' (default 100) dicts with
+          'gnx' and 'h' keys.
+read:     Answer 'gnx', 'h', 'b' and 'children' (a list of gnx's) of the
+          node whose gnx is 'gnx'.
+write:    Set the headline ('h') and/or body ('b') of the node 'gnx'.
+save:     Save file.
+close:    Close file. Unsaved changes are an error unless 'force' is true.
+shutdown: Stop the server, which does not save any files.
+
+Only the server's main thread uses the commanders, one request at a time,
+so requests from concurrent clients can not interfere with each other.
+'''
+
+#@+<< imports >>
+#@+node:ekr.20130413052322.10395: ** << imports >> (leoServer.py)
+import leo.core.leoBridge as leoBridge
+from leo.external import lproto
+
+import json
+import optparse
+import os
+import re
+import socket
+import sys
+import traceback
+
+if sys.version_info[0] >= 3:
+    import queue as Queue
+else:
+    import Queue
+#@-<< imports >>
+# Do not define g here. Use the g returned by the bridge.
+
+#@+others
+#@+node:ekr.20130413052322.10396: ** main & helpers (leoServer.py)
+def main ():
+
+    options = scanOptions()
+    bridge = leoBridge.controller(gui='nullGui',
+        loadPlugins=False, # Plugins expect a real gui.
+        readSettings=True,
+        silent=True,
+        verbose=False)
+    if bridge.isOpen():
+        server = OutlineServer(bridge)
+        if options.port is not None or not hasattr(socket,'AF_UNIX'):
+            server.listen(('127.0.0.1',options.port or 0))
+        else:
+            server.listen(options.socket or
+                os.path.join(bridge.globals().app.homeLeoDir,'leoserver.sock'))
+        server.run()
+#@+node:ekr.20130413052322.10397: *3* scanOptions
+def scanOptions():
+
+    '''Handle all options and remove them from sys.argv.'''
+
+    parser = optparse.OptionParser(
+        usage='usage: %prog [--socket <path>] [--port <n>]')
+    parser.add_option('--socket',dest='socket',
+        help='the path to the local socket')
+    parser.add_option('--port',dest='port',type='int',
+        help='listen on a TCP port of 127.0.0.1 instead (0: any free port)')
+    options,args = parser.parse_args()
+    return options
+#@+node:ekr.20130413052322.10398: *3* addressFileName
+def addressFileName ():
+
+    '''Return the path to the file containing the server's address.'''
+
+    return os.path.join(os.path.expanduser('~'),'.leo','leoserver_address')
+#@+node:ekr.20130413052322.10399: ** class OutlineServer
+class OutlineServer:
+
+    '''Serve the requests of OutlineClients on the main thread.'''
+
+    #@+others
+    #@+node:ekr.20130413052322.10400: *3*  ctor (OutlineServer)
+    def __init__ (self,bridge):
+
+        self.bridge = bridge
+        self.g = bridge.globals()
+        self.commanders = {} # Keys are full paths, values are commanders.
+        self.requests = Queue.Queue() # Filled by the connection threads.
+        self.running = False
+        self.server = lproto.LProtoSocketServer()
+        self.server.set_receiver(self.receive)
+        self.commandsDict = {
+            'close':    self.doClose,
+            'list':     self.doList,
+            'open':     self.doOpen,
+            'query':    self.doQuery,
+            'read':     self.doRead,
+            'save':     self.doSave,
+            'shutdown': self.doShutdown,
+            'write':    self.doWrite,
+        }
+    #@+node:ekr.20130413052322.10401: *3* listen & run & receive
+    def listen (self,address):
+
+        '''Listen on address, a socket path or a (host,port) tuple,
+        and write the actual address to the address file.'''
+
+        self.server.listen(address)
+        f = open(addressFileName(),'w')
+        f.write(json.dumps(self.server.address))
+        f.close()
+
+    def run (self):
+
+        '''Handle requests until a client sends the shutdown command.'''
+
+        self.running = True
+        try:
+            while self.running:
+                request,ses = self.requests.get()
+                answer = self.dispatch(request)
+                try:
+                    lproto.send_msg(ses['_sock'],
+                        self.g.toEncodedString(json.dumps(answer),'utf-8'))
+                except socket.error:
+                    pass # The client has gone.
+        finally:
+            self.server.close()
+            fn = addressFileName()
+            if os.path.exists(fn):
+                os.remove(fn)
+
+    def receive (self,msg,ses):
+
+        '''Queue a request for the main thread. Called from the connection threads.'''
+
+        self.requests.put((msg,ses),)
+    #@+node:ekr.20130413052322.10402: *3* dispatch
+    def dispatch (self,msg):
+
+        '''Execute one request and return the answer.'''
+
+        g = self.g
+        try:
+            request = json.loads(g.toUnicode(msg,'utf-8'))
+            func = self.commandsDict.get(request.get('cmd'))
+            if not func:
+                raise ValueError('unknown command: %s' % request.get('cmd'))
+            answer = func(request)
+            answer['ok'] = True
+        except Exception:
+            typ,val,tb = sys.exc_info()
+            if not isinstance(val,(KeyError,ValueError)):
+                traceback.print_exc()
+            answer = {'ok': False,'error': '%s: %s' % (typ.__name__,val)}
+        return answer
+    #@+node:ekr.20130413052322.10403: *3* commands
+    #@+node:ekr.20130413052322.10404: *4* doClose
+    def doClose (self,request):
+
+        g = self.g
+        c = self.getCommander(request)
+        if c.isChanged() and not request.get('force'):
+            raise ValueError('unsaved changes: %s' % c.mFileName)
+        del self.commanders[self.fullPath(request)]
+        c.setChanged(False) # Don't ask to save.
+        g.app.closeLeoWindow(c.frame)
+        return {}
+    #@+node:ekr.20130413052322.10405: *4* doList
+    def doList (self,request):
+
+        paths = sorted(self.commanders)
+        return {
+            'files': paths,
+            'changed': [z for z in paths if self.commanders[z].isChanged()],
+        }
+    #@+node:ekr.20130413052322.10406: *4* doOpen
+    def doOpen (self,request):
+
+        c = self.getCommander(request)
+        return {
+            'file': c.mFileName,
+            'nodes': len(list(c.all_unique_nodes())),
+        }
+    #@+node:ekr.20130413052322.10407: *4* doQuery
+    def doQuery (self,request):
+
+        c = self.getCommander(request)
+        pattern = request['pattern']
+        if request.get('regex'):
+            match = re.compile(pattern).search
+        else:
+            match = lambda s: pattern in s
+        searchBody = request.get('body')
+        limit = request.get('limit',100)
+        nodes = []
+        for v in c.all_unique_nodes():
+            if len(nodes) >= limit:
+                break
+            if match(v.h) or searchBody and match(v.b):
+                nodes.append({'gnx': v.gnx,'h': v.h})
+        return {'nodes': nodes}
+    #@+node:ekr.20130413052322.10408: *4* doRead
+    def doRead (self,request):
+
+        c = self.getCommander(request)
+        v = self.findNode(c,request['gnx'])
+        return {
+            'gnx': v.gnx,
+            'h': v.h,
+            'b': v.b,
+            'children': [z.gnx for z in v.children],
+        }
+    #@+node:ekr.20130413052322.10409: *4* doSave
+    def doSave (self,request):
+
+        c = self.getCommander(request)
+        c.save()
+        if c.isChanged():
+            raise ValueError('can not save: %s' % c.mFileName)
+        return {}
+    #@+node:ekr.20130413052322.10410: *4* doShutdown
+    def doShutdown (self,request):
+
+        self.running = False
+        return {'changed': [z for z in sorted(self.commanders)
+            if self.commanders[z].isChanged()]}
+    #@+node:ekr.20130413052322.10411: *4* doWrite
+    def doWrite (self,request):
+
+        c = self.getCommander(request)
+        v = self.findNode(c,request['gnx'])
+        p = c.vnode2position(v)
+        if not p:
+            raise ValueError('not in the outline: %s' % request['gnx'])
+        changed = False
+        if 'h' in request and request['h'] != p.h:
+            p.h = request['h']
+            changed = True
+        if 'b' in request and request['b'] != p.b:
+            p.b = request['b']
+            changed = True
+        return {'changed': changed}
+    #@+node:ekr.20130413052322.10412: *3* helpers
+    #@+node:ekr.20130413052322.10413: *4* findNode
+    def findNode (self,c,gnx):
+
+        '''Return the vnode of c whose gnx is given.'''
+
+        v = c.gnxIndex.find(gnx)
+        if not v:
+            raise KeyError(gnx)
+        return v
+    #@+node:ekr.20130413052322.10414: *4* fullPath & getCommander
+    def fullPath (self,request):
+
+        return self.bridge.completeFileName(request['file'])
+
+    def getCommander (self,request):
+
+        '''Return the commander for request['file'], opening it if need be.'''
+
+        g = self.g
+        path = self.fullPath(request)
+        c = self.commanders.get(path)
+        if not c:
+            if not g.os_path_exists(path):
+                raise ValueError('file not found: %s' % path)
+            c = self.bridge.openLeoFile(path)
+            if not c:
+                raise ValueError('can not open: %s' % path)
+            self.commanders[path] = c
+        return c
+    #@-others
+#@+node:ekr.20130413052322.10415: ** class OutlineClient
+class OutlineClient:
+
+    '''A client of an OutlineServer.'''
+
+    #@+others
+    #@+node:ekr.20130413052322.10416: *3*  ctor (OutlineClient)
+    def __init__ (self,address=None):
+
+        '''Connect to the server at address, a socket path or a
+        (host,port) tuple. By default, read the address file.'''
+
+        if address is None:
+            f = open(addressFileName())
+            address = json.loads(f.read())
+            f.close()
+        if isinstance(address,list):
+            address = tuple(address)
+        self.client = lproto.LProtoClient(address)
+        if not self.client.is_connected:
+            raise socket.error('can not connect to %s' % (address,))
+    #@+node:ekr.20130413052322.10417: *3* call & close
+    def call (self,cmd,**keys):
+
+        '''Send a request and return the answer.
+        Raise ValueError if the request fails.'''
+
+        keys['cmd'] = cmd
+        msg = json.dumps(keys)
+        if not isinstance(msg,bytes):
+            msg = msg.encode('utf-8')
+        answer = self.client.request(msg)
+        if answer is None:
+            raise socket.error('the server closed the connection')
+        answer = json.loads(answer.decode('utf-8'))
+        if not answer.pop('ok'):
+            raise ValueError(answer['error'])
+        return answer
+
+    def close (self):
+
+        self.client.close()
+    #@-others
+#@-others
+
+if __name__ == '__main__':
+    main()
+#@-leo
@@ -29,12 +29,16 @@ Settings:
 - @string shadow_prefix (default: x): prefix of shadow files.
   This prefix allows the shadow file and the original file to have different names.
   This is useful for name-based tools like py.test.
+
+- @bool shadow_fast_diff (default: True): True: use a faster diff when propagating
+  changes from public files to private files. The private files are the same.
 '''
 #@-<< docstring >>
 #@+<< imports >>
 #@+node:ekr.20080708094444.52: ** << imports >> (leoShadow)
 import leo.core.leoGlobals as g
 
+import bisect
 import difflib
 import os
 import pprint
@@ -65,6 +69,8 @@ class shadowController:
         self.shadow_subdir = c.config.getString('shadow_subdir') or '.leo_shadow'
         self.shadow_prefix = c.config.getString('shadow_prefix') or ''
         self.shadow_in_home_dir = c.config.getBool('shadow_in_home_dir',default=False)
+        self.fast_diff = c.config.getBool('shadow_fast_diff',default=True)
+            # True: use x.fast_propagate_changed_lines.
 
         # Munch shadow_subdir
         self.shadow_subdir = g.os_path_normpath(self.shadow_subdir)
@@ -239,6 +245,8 @@ class shadowController:
         """
         new_public_lines2, new_sentinel_lines2 = self.separate_sentinels(
             new_private_lines, marker)
+        if sentinel_lines is None:
+            sentinel_lines = new_sentinel_lines2
 
         lines1 = new_public_lines
         lines2 = new_public_lines2
@@ -326,6 +334,9 @@ class shadowController:
         trace = False and g.unitTesting
         verbose = True
         x = self
+        if x.fast_diff and not trace:
+            return x.fast_propagate_changed_lines(
+                new_public_lines,old_private_lines,marker,p=p)
         # mapping tells which line of old_private_lines each line of old_public_lines comes from.
         old_public_lines, mapping = self.strip_sentinels_with_map(old_private_lines,marker)
 
@@ -517,6 +528,78 @@ class shadowController:
                 marker              = marker)
             #@-<< do final correctness check>>
         return result
+    #@+node:ekr.20130413052322.10422: *4* x.fast_propagate_changed_lines
+    def fast_propagate_changed_lines(self,new_public_lines,old_private_lines,marker,p=None):
+
+        '''A faster version of x.propagate_changed_lines.
+
+        The opcodes come from x.lineMatcher instead of difflib, and are
+        handled with list indices instead of sourcereader and sourcewriter
+        objects. The result is the same as the result of
+        x.propagate_changed_lines.'''
+
+        x = self
+        old_public_lines, mapping = x.strip_sentinels_with_map(old_private_lines,marker)
+        isSentinel = marker.isSentinel
+        delim1,delim2 = marker.getDelims()
+        verbatim = '%s@verbatim%s\n' % (delim1,delim2)
+        old = old_private_lines ; new = new_public_lines ; size = len(old)
+        result = [] ; put = result.append
+        i = 0 # The index of the next unwritten line of old.
+
+        def copy_sentinels(i,limit):
+            # Copy sentinels from old[i:limit], deleting non-sentinel lines.
+            while i < limit:
+                line = old[i] ; i += 1
+                if isSentinel(line):
+                    if marker.isVerbatimSentinel(line):
+                        # Delete the @verbatim sentinel and the next line.
+                        if i < size: i += 1
+                    else:
+                        put(line)
+            return i
+
+        def insert_lines(k,new_j):
+            # Copy new[k:new_j], protecting lines that look like sentinels.
+            for line in new[k:new_j]:
+                if isSentinel(line):
+                    put(verbatim)
+                put(line)
+
+        for tag,old_i,old_j,new_i,new_j in x.lineMatcher(old_public_lines,new).get_opcodes():
+            limit = mapping[old_i]
+            if tag == 'equal':
+                i = copy_sentinels(i,limit)
+                end = mapping[old_j-1] + 1
+                if i < end:
+                    result.extend(old[i:end])
+                    i = end
+            elif tag == 'insert':
+                if limit < size:
+                    i = copy_sentinels(i,limit)
+                insert_lines(new_i,new_j)
+            elif tag == 'replace':
+                # Replace old lines, preserving sentinels.
+                end = mapping[old_j-1] ; k = new_i
+                while i <= end and k < new_j:
+                    line = old[i] ; i += 1
+                    if isSentinel(line):
+                        put(line)
+                    else:
+                        put(new[k]) ; k += 1
+                # The replacement lines can be longer.
+                insert_lines(k,new_j)
+            else: # tag == 'delete'
+                i = copy_sentinels(i,limit)
+        copy_sentinels(i,size)
+        # Make sure *all* lines end with a newline, as sourcewriter.put does.
+        result = [z if z.endswith('\n') else z + '\n' for z in result]
+        x.check_the_final_output(
+            new_private_lines   = result,
+            new_public_lines    = new_public_lines,
+            sentinel_lines      = None, # The sentinels of result.
+            marker              = marker)
+        return result
     #@+node:ekr.20080708094444.36: *4* x.propagate_changes
     def propagate_changes(self, old_public_file, old_private_file):
 
@@ -976,6 +1059,222 @@ class shadowController:
             return self.p and self.p.h or '@test-shadow: no self.p'
         #@-others
 
+    #@+node:ekr.20130413052322.10423: *3* class lineMatcher
+    class lineMatcher:
+
+        '''A fast replacement for difflib.SequenceMatcher(None,a,b) for lists of lines.
+
+        The opcodes are exactly those of SequenceMatcher, including its
+        "popular line" heuristic, so @shadow files do not depend on the
+        matcher used. Lines are hashed to ints. SequenceMatcher finds each
+        matching block by scanning all matches of all lines in a range;
+        findLongestMatch usually looks only at the rare lines of the range.'''
+
+        #@+others
+        #@+node:ekr.20130413052322.10424: *4* __init__ (lineMatcher)
+        def __init__ (self,a,b):
+
+            ids = {}
+            self.a = a = [ids.setdefault(z,len(ids)) for z in a]
+            self.b = b = [ids.setdefault(z,len(ids)) for z in b]
+            # b2j: keys are lines of b, values are ascending lists of indices.
+            b2j = {}
+            for j,n in enumerate(b):
+                if n in b2j:
+                    b2j[n].append(j)
+                else:
+                    b2j[n] = [j]
+            # Remove popular lines, as SequenceMatcher does.
+            if len(b) >= 200:
+                ntest = len(b) // 100 + 1
+                for n in [n for n in b2j if len(b2j[n]) > ntest]:
+                    del b2j[n]
+            self.b2j = b2j
+            self.inB2j = [n in b2j for n in b]
+            # counts[i]: the number of matches of a[i] in b2j.
+            self.counts = [len(b2j.get(n,())) for n in a]
+            # rarest[w][k]: the i in range(k*w,k*w+w) with the smallest counts[i].
+            self.rarest = {}
+            self.windows = {} # Keys are w, values are (keys,rows).
+        #@+node:ekr.20130413052322.10426: *4* findLongestMatch & helpers
+        def findLongestMatch (self,alo,ahi,blo,bhi):
+
+            '''Return (i,j,k), the result of SequenceMatcher.find_longest_match.'''
+
+            a,b = self.a,self.b
+            # SequenceMatcher's best match is the longest run of lines in b2j.
+            # Ties go to the smallest (i,j). A run of 2*w-1 or more lines
+            # contains all lines of a window a[k*w:k*w+w], so it suffices to
+            # look for runs through the rarest line of each window.
+            w = 1
+            while 4 * w - 1 <= ahi - alo:
+                w *= 2
+            while w > 1:
+                besti,bestj,bestsize = self.findRuns(alo,ahi,blo,bhi,w)
+                if bestsize >= 2 * w - 1:
+                    break
+                if bestsize == 2 * w - 2:
+                    # No run is longer, but an earlier run may be as long.
+                    besti,bestj = self.findFirstRun(alo,ahi,blo,bhi,besti,bestj,bestsize)
+                    break
+                # Look for shorter runs.
+                w //= 2
+                while w > 1 and 2 * w - 1 > bestsize > 0:
+                    w //= 2
+            else:
+                besti,bestj,bestsize = self.scanRanges(alo,ahi,blo,bhi)
+            # Extend the match by popular lines, as SequenceMatcher does.
+            while besti > alo and bestj > blo and a[besti-1] == b[bestj-1]:
+                besti,bestj,bestsize = besti-1,bestj-1,bestsize+1
+            while (besti+bestsize < ahi and bestj+bestsize < bhi and
+                a[besti+bestsize] == b[bestj+bestsize]
+            ):
+                bestsize += 1
+            return besti,bestj,bestsize
+        #@+node:ekr.20130413052322.10425: *5* findRuns
+        def findRuns (self,alo,ahi,blo,bhi,w):
+
+            '''Return the longest run (i,j,n) in the ranges through the rarest
+            line of the windows of w lines that lie in the a range.'''
+
+            a,b,b2j,inB2j = self.a,self.b,self.b2j,self.inB2j
+            besti,bestj,bestsize = alo,blo,0
+            ends = {} # Keys are j-i, values are the ends of the runs found.
+            keys,rows = self.getWindows(w)
+            k1 = bisect.bisect_left(keys,(alo+w-1)//w)
+            k2 = bisect.bisect_left(keys,ahi//w)
+            for i in rows[k1:k2]:
+                for j in b2j[a[i]]:
+                    if j < blo:
+                        continue
+                    if j >= bhi:
+                        break
+                    if ends.get(j-i,0) > i:
+                        continue # Already seen.
+                    i1,j1 = i,j
+                    while i1 > alo and j1 > blo and a[i1-1] == b[j1-1] and inB2j[j1-1]:
+                        i1 -= 1 ; j1 -= 1
+                    i2,j2 = i+1,j+1
+                    while i2 < ahi and j2 < bhi and a[i2] == b[j2] and inB2j[j2]:
+                        i2 += 1 ; j2 += 1
+                    ends[j-i] = i2
+                    n = i2 - i1
+                    if n > bestsize or (n == bestsize and (i1,j1) < (besti,bestj)):
+                        besti,bestj,bestsize = i1,j1,n
+            return besti,bestj,bestsize
+        #@+node:ekr.20130413052322.10430: *5* findFirstRun
+        def findFirstRun (self,alo,ahi,blo,bhi,besti,bestj,n):
+
+            '''Return the smallest (i,j) <= (besti,bestj) such that a run of
+            n lines starts at (i,j). No run is longer.'''
+
+            a,b,b2j,inB2j = self.a,self.b,self.b2j,self.inB2j
+            for i in range(alo,besti+1):
+                for j in b2j.get(a[i],()):
+                    if j < blo:
+                        continue
+                    if j >= bhi or (i,j) >= (besti,bestj):
+                        break
+                    if i > alo and j > blo and a[i-1] == b[j-1] and inB2j[j-1]:
+                        continue # Not the start of a run.
+                    k = 1
+                    while (k < n and i+k < ahi and j+k < bhi and
+                        a[i+k] == b[j+k] and inB2j[j+k]
+                    ):
+                        k += 1
+                    if k == n:
+                        return i,j
+            return besti,bestj
+        #@+node:ekr.20130413052322.10427: *5* getWindows
+        def getWindows (self,w):
+
+            '''Return (keys,rows) for windows of w lines, where w is a power of 2.
+            rows contains the rarest line of each window a[k*w:k*w+w] whose lines
+            all are in b2j. keys contains the corresponding k's.'''
+
+            if w not in self.windows:
+                counts = self.counts
+                if w == 1:
+                    aList = list(range(len(counts)))
+                else:
+                    self.getWindows(w//2)
+                    prev = self.rarest[w//2]
+                    aList = []
+                    for k in range(0,len(prev)-1,2):
+                        i1,i2 = prev[k],prev[k+1]
+                        aList.append(i2 if counts[i2] < counts[i1] else i1)
+                self.rarest[w] = aList
+                keys = [k for k,i in enumerate(aList) if counts[i]]
+                self.windows[w] = keys,[aList[k] for k in keys]
+            return self.windows[w]
+        #@+node:ekr.20130413052322.10431: *5* scanRanges
+        def scanRanges (self,alo,ahi,blo,bhi):
+
+            '''Find the longest run in the ranges as SequenceMatcher does.'''
+
+            a,b2j = self.a,self.b2j
+            besti,bestj,bestsize = alo,blo,0
+            j2len = {} ; nothing = []
+            for i in range(alo,ahi):
+                get = j2len.get
+                j2len2 = {}
+                for j in b2j.get(a[i],nothing):
+                    if j < blo:
+                        continue
+                    if j >= bhi:
+                        break
+                    k = j2len2[j] = get(j-1,0) + 1
+                    if k > bestsize:
+                        besti,bestj,bestsize = i-k+1,j-k+1,k
+                j2len = j2len2
+            return besti,bestj,bestsize
+        #@+node:ekr.20130413052322.10428: *4* get_matching_blocks & get_opcodes
+        def get_matching_blocks (self):
+
+            '''Return a list of the matching blocks (i,j,n), as SequenceMatcher does.'''
+
+            la,lb = len(self.a),len(self.b)
+            queue = [(0,la,0,lb)]
+            blocks = []
+            while queue:
+                alo,ahi,blo,bhi = queue.pop()
+                i,j,k = self.findLongestMatch(alo,ahi,blo,bhi)
+                if k:
+                    blocks.append((i,j,k),)
+                    if alo < i and blo < j:
+                        queue.append((alo,i,blo,j),)
+                    if i+k < ahi and j+k < bhi:
+                        queue.append((i+k,ahi,j+k,bhi),)
+            blocks.sort()
+            # Merge adjacent blocks.
+            result = [] ; i1 = j1 = k1 = 0
+            for i2,j2,k2 in blocks:
+                if i1 + k1 == i2 and j1 + k1 == j2:
+                    k1 += k2
+                else:
+                    if k1: result.append((i1,j1,k1),)
+                    i1,j1,k1 = i2,j2,k2
+            if k1: result.append((i1,j1,k1),)
+            result.append((la,lb,0),)
+            return result
+
+        def get_opcodes (self):
+
+            '''Return a list of opcodes (tag,i1,i2,j1,j2), as SequenceMatcher does.'''
+
+            opcodes = [] ; i = j = 0
+            for ai,bj,n in self.get_matching_blocks():
+                if i < ai and j < bj:
+                    opcodes.append(('replace',i,ai,j,bj),)
+                elif i < ai:
+                    opcodes.append(('delete',i,ai,j,bj),)
+                elif j < bj:
+                    opcodes.append(('insert',i,ai,j,bj),)
+                i,j = ai+n,bj+n
+                if n:
+                    opcodes.append(('equal',ai,i,bj,j),)
+            return opcodes
+        #@-others
     #@+node:ekr.20090529061522.5727: *3* class marker
     class markerClass:
 
@@ -991,6 +1290,8 @@ class shadowController:
             self.delim3 = delim3 # Block comment ending delim.
             if not delim1 and not delim2:
                 self.delim1 = g.app.language_delims_dict.get('unknown_language')
+            # All sentinels contain one of these strings.
+            self.sentinelPrefixes = tuple([z + '@' for z in (self.delim1,self.delim2) if z])
 
         def __repr__ (self):
 
@@ -1011,6 +1312,11 @@ class shadowController:
         def isSentinel(self,s,suffix=''):
             '''Return True is line s contains a valid sentinel comment.'''
 
+            for prefix in self.sentinelPrefixes:
+                if prefix in s:
+                    break
+            else:
+                return False
             s = s.strip()
             if self.delim1 and s.startswith(self.delim1):
                 return s.startswith(self.delim1+'@'+suffix)
@@ -1802,7 +1802,7 @@ class TestManager:
             try:
                 theId,time,n = p.v.fileIndex
             except TypeError:
-                p.v.fileIndex = nodeIndices.getNewIndex()
+                p.v.setFileIndex(nodeIndices.getNewIndex())
 
         # Write the file to a string.
         df.write(input,thinFile=True,nosentinels= not sentinels,toString=True)
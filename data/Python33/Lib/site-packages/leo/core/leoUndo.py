@@ -1464,6 +1464,8 @@ class undoer:
         c.endEditing()
         if u.redoHelper:
             u.redoHelper()
+            # The helpers may change v.children directly.
+            c.invalidateOutlineIndex()
         else:
             g.trace('no redo helper for %s %s' % (u.kind,u.undoType))
 
@@ -1830,6 +1832,8 @@ class undoer:
         c.endEditing()
         if u.undoHelper:
             u.undoHelper()
+            # The helpers may change v.children directly.
+            c.invalidateOutlineIndex()
         else:
             g.trace('no undo helper for %s %s' % (u.kind,u.undoType))
 
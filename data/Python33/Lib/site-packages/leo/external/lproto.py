@@ -8,14 +8,22 @@
 
 Author: Ville M. Vainio <vivainio@gmail.com>
 
+LProtoSocketServer speaks the same protocol without Qt, using a thread for
+each connection. Servers may answer each message with a message of their own:
+see send_msg, recv_msg and LProtoClient.request.
+
 """
 #@-<< docstring >>
 #@+<< imports >>
 #@+node:ville.20091009234538.1373: ** << imports >>
-# todo move out qt dep
-from PyQt4 import QtCore, QtNetwork
+# LProtoServer needs Qt. Everything else works without it.
+try:
+    from PyQt4 import QtCore, QtNetwork
+except ImportError:
+    QtCore = QtNetwork = None
 import socket
 import struct
+import threading
 
 import os
 
@@ -50,6 +58,32 @@ def mk_send_bytes(msg):
     lendesc = struct.pack('I', len(msg))
     return lendesc + msg
 
+def send_msg(sock, msg):
+    """ send one message (bytes) on a connected socket """
+    sock.sendall(mk_send_bytes(msg))
+
+#@+node:ekr.20130413052322.10386: ** recv_msg
+def recv_msg(sock):
+    """ read one message from a connected socket
+
+    Return the message (bytes), or None if the connection was closed.
+    """
+    lendesc = recv_exactly(sock, 4)
+    if lendesc is None:
+        return None
+    return recv_exactly(sock, struct.unpack('I', lendesc)[0])
+
+def recv_exactly(sock, n):
+
+    chunks = []
+    while n > 0:
+        byts = sock.recv(min(n, 65536))
+        if not byts:
+            return None
+        chunks.append(byts)
+        n -= len(byts)
+    return b''.join(chunks)
+
 #@+node:ville.20091010205847.1362: ** class LProtoBuf
 class LProtoBuf:
     def __init__(self):
@@ -156,6 +190,103 @@ class LProtoServer:
     def readyread(self):
         pass
     #@-others
+#@+node:ekr.20130413052322.10387: ** class LProtoSocketServer
+class LProtoSocketServer:
+
+    """ A server for LProtoClients that does not need Qt
+
+    Each connection has its own thread, which calls the receiver with
+    each message and the connection's session dict, just like LProtoServer.
+    The receiver may be called from several threads at once.
+    """
+
+    #@+others
+    #@+node:ekr.20130413052322.10388: *3* __init__ (LProtoSocketServer)
+    def __init__(self):
+
+        self.receiver = None
+        self.sock = None
+        self.address = None # The address clients connect to.
+        self.ses = {}
+        self.lock = threading.Lock() # Protects self.ses.
+    #@+node:ekr.20130413052322.10389: *3* listen
+    def listen(self, name):
+        """ listen on the socket file name, or on a (host, port) tuple
+
+        Use port 0 to listen on a free port. Connections are accepted on a
+        new thread.
+        """
+        if isinstance(name, tuple):
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        else:
+            # pylint: disable=E1101
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            if os.path.exists(name):
+                os.remove(name) # Left over by a server that did not stop.
+        self.sock.bind(name)
+        self.sock.listen(128)
+        self.address = self.sock.getsockname()
+        lprint("lproto.py: listen on", self.address)
+        t = threading.Thread(target=self.accept_connections)
+        t.daemon = True
+        t.start()
+    #@+node:ekr.20130413052322.10390: *3* set_receiver
+    def set_receiver(self, receiver):
+
+        self.receiver = receiver
+    #@+node:ekr.20130413052322.10391: *3* accept_connections & serve_connection
+    def accept_connections(self):
+
+        while 1:
+            try:
+                lsock, addr = self.sock.accept()
+            except (socket.error, AttributeError):
+                return # close() was called.
+            if isinstance(self.address, tuple):
+                lsock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            ses_ent = {'_sock': lsock}
+            self.lock.acquire()
+            self.ses[lsock] = ses_ent
+            self.lock.release()
+            t = threading.Thread(target=self.serve_connection,
+                args=(lsock, ses_ent))
+            t.daemon = True
+            t.start()
+
+    def serve_connection(self, lsock, ses_ent):
+
+        try:
+            while 1:
+                msg = recv_msg(lsock)
+                if msg is None:
+                    break
+                if self.receiver:
+                    self.receiver(msg, ses_ent)
+        except socket.error:
+            pass
+        self.lock.acquire()
+        self.ses.pop(lsock, None)
+        self.lock.release()
+        lsock.close()
+    #@+node:ekr.20130413052322.10392: *3* close
+    def close(self):
+        """ stop accepting connections and close all open connections """
+
+        sock, self.sock = self.sock, None
+        if sock:
+            sock.close()
+            if not isinstance(self.address, tuple) and os.path.exists(self.address):
+                os.remove(self.address)
+        self.lock.acquire()
+        socks = list(self.ses)
+        self.lock.release()
+        for lsock in socks:
+            try:
+                lsock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+    #@-others
 #@+node:ville.20091010205847.1360: ** (ignore) class LProtoObsoleteClient
 if 0:
     class LProtoObsoleteClient:
@@ -192,7 +323,18 @@ class LProtoClient:
 
         if trace: g.trace(fname,socket)
 
-        if hasattr(socket,'AF_UNIX'):
+        if isinstance(fname,tuple):
+            # A (host,port) tuple: see LProtoSocketServer.listen.
+            try:
+                self.socket = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+                self.socket.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+                self.socket.connect(fname)
+                return True
+            except Exception:
+                g.es_print('lproto.py: failed to connect!',fname)
+                g.es_exception(full=False,c=None)
+                return False
+        elif hasattr(socket,'AF_UNIX'):
             try:
                 # pylint: disable=E1101
                 # E1101:LProtoClient.connect: Module 'socket' has no 'AF_UNIX' member
@@ -221,6 +363,24 @@ class LProtoClient:
 
         byts = mk_send_bytes(msg)
         self.socket.sendall(byts)
+    #@+node:ekr.20130413052322.10393: *3* recv & request & close
+    def recv(self):
+
+        '''Wait for the server's next message. Return None if the server
+        closed the connection.'''
+
+        return recv_msg(self.socket)
+
+    def request(self,msg):
+
+        '''Send msg and return the server's answer.'''
+
+        self.send(msg)
+        return self.recv()
+
+    def close(self):
+
+        self.socket.close()
     #@-others
 
 
@@ -565,10 +565,10 @@ class backlinkController(object):
         idsSeen = set()  # just the vnodes with link info.
 
         # make map from linked node's ids to their vnodes
-        for p in c.all_positions():
-            v = p.v
-            self.vnode[v.gnx] = v
+        # c.gnxIndex finds the other ends of links
+        for v in c.all_unique_nodes():
             if v.u and '_bklnk' in v.u:
+                self.vnode[v.gnx] = v
                 idsSeen.add(v.gnx)
 
         for vnode in idsSeen:  # just the vnodes with link info.
@@ -579,7 +579,8 @@ class backlinkController(object):
             newlinks = []  # start with empty list and include only good links
             for link in links:
 
-                if link[1] not in self.vnode:
+                other = self.vnode.get(link[1]) or c.gnxIndex.find(link[1])
+                if not other:
                     # other end if missing
                     lt = ('to', 'from')
                     if link[0] == 'S':
@@ -590,7 +591,6 @@ class backlinkController(object):
                     continue
 
                 # check other end has link
-                other = self.vnode[link[1]]
                 if '_bklnk' not in other.u or 'links' not in other.u['_bklnk']:
                     self.initBacklink(other)
                 if not [i for i in other.u['_bklnk']['links']
@@ -13,6 +13,8 @@
 #@+node:ekr.20120219194520.10465: ** << imports >> (baseNativeTree.py)
 import leo.core.leoGlobals as g
 
+import bisect
+
 import leo.core.leoFrame as leoFrame
 import leo.core.leoNodes as leoNodes
 
@@ -64,6 +66,7 @@ class baseNativeTreeWidget (leoFrame.leoTree):
 
         # Debugging...
         self.nodeDrawCount = 0
+        self.nodePatchCount = 0
         self.traceCallersFlag = False # Enable traceCallers method.
 
         # Associating items with position and vnodes...
@@ -73,6 +76,10 @@ class baseNativeTreeWidget (leoFrame.leoTree):
         self.vnode2itemsDict = {} # values are lists of items.
         self.editWidgetsDict = {} # keys are native edit widgets, values are wrappers.
 
+        # Remembering the drawn items for incremental redraws...
+        self.drawnItems = None # The records of the top-level items, or None.
+        self.item2iconDict = {} # keys are item hashes, values are icons.
+
         self.setConfigIvars()
         self.setEditPosition(None) # Set positions returned by leoTree.editPosition()
     #@+node:ekr.20110605121601.17866: *3* get_name (nativeTree)
@@ -133,6 +140,7 @@ class baseNativeTreeWidget (leoFrame.leoTree):
         self.enable_drag_messages = c.config.getBool("enable_drag_messages")
         self.select_all_text_when_editing_headlines = c.config.getBool(
             'select_all_text_when_editing_headlines')
+        self.incremental_redraw = c.config.getBool('incremental_redraw',default=True)
         self.stayInTree     = c.config.getBool('stayInTreeAfterSelect')
         self.use_chapters   = c.config.getBool('use_chapters')
     #@+node:ekr.20110605121601.17872: ** Drawing... (nativeTree)
@@ -172,9 +180,14 @@ class baseNativeTreeWidget (leoFrame.leoTree):
         if trace: t1 = g.getTime()
         self.initData()
         self.nodeDrawCount = 0
+        self.nodePatchCount = 0
         try:
             self.redrawing = True
-            self.drawTopTree(p)
+            # Plugins that decorate new items may depend on anything.
+            if self.incremental_redraw and not g.visit_tree_item.chain:
+                self.patchTopTree(p)
+            else:
+                self.drawTopTree(p)
         finally:
             self.redrawing = False
 
@@ -183,8 +196,9 @@ class baseNativeTreeWidget (leoFrame.leoTree):
 
         if trace:
             theTime = g.timeSince(t1)
-            g.trace('*** %s: scroll %5s drew %3s nodes in %s' % (
-                self.redrawCount,scroll,self.nodeDrawCount,theTime),g.callers())
+            g.trace('*** %s: scroll %5s drew %3s nodes, patched %3s in %s' % (
+                self.redrawCount,scroll,self.nodeDrawCount,self.nodePatchCount,
+                theTime),g.callers())
 
         return p # Return the position, which may have changed.
 
@@ -246,6 +260,8 @@ class baseNativeTreeWidget (leoFrame.leoTree):
         c = self.c
         hPos,vPos = self.getScroll()
         self.clear()
+        self.drawnItems = None # The next incremental redraw must start afresh.
+        self.item2iconDict = {}
         # Draw all top-level nodes and their visible descendants.
         if c.hoistStack:
             bunch = c.hoistStack[-1]
@@ -314,6 +330,165 @@ class baseNativeTreeWidget (leoFrame.leoTree):
         else:
             aList.append(item)
         d[v] = aList
+    #@+node:ekr.20130413052322.10433: *3* patchTopTree & helpers
+    def patchTopTree (self,p):
+
+        '''Update the items drawn by the previous redraw so that they show
+        all visible nodes, creating, removing and moving as few items as
+        possible. This is the incremental counterpart of drawTopTree.'''
+
+        trace = False and not g.unitTesting
+        hPos,vPos = self.getScroll()
+        old = self.drawnItems
+        if old is None or self.childItems(None) != [z[1] for z in old]:
+            # Nothing to patch, or something else has changed the tree.
+            if trace: g.trace('*** clearing the tree')
+            self.clear()
+            old = []
+        icons = self.item2iconDict
+        self.item2iconDict = {}
+        self.drawnItems = self.patchChildren(
+            self.topLevelPositions(),None,old,icons,visible=True)
+
+        # This method always retains previous scroll position.
+        self.setHScroll(hPos)
+        self.setVScroll(vPos)
+
+        self.repaint()
+    #@+node:ekr.20130413052322.10434: *4* patchChildren
+    def patchChildren (self,positions,parent_item,old,icons,visible):
+
+        '''Make the children of parent_item (the top-level items if
+        parent_item is None) show the given positions. old is the list of
+        records of the present children: [v,item,childRecords] lists.
+        icons contains the icons set by the previous redraw.
+
+        If visible is True, the positions are visible and their children
+        are drawn as in drawChildren. Otherwise, the positions are the
+        hidden children of a collapsed node and get no child items.
+
+        Return the records of the new children.'''
+
+        trace = False and not g.unitTesting
+
+        if [p.v for p in positions] == [z[0] for z in old]:
+            # The usual case: the children have not changed.
+            matches = list(range(len(old)))
+            keep = set(matches)
+        else:
+            # Reuse the old items in order: clones may appear several times.
+            d = {}
+            for i,record in enumerate(old):
+                aList = d.get(record[0])
+                if aList: aList.append(i)
+                else:     d[record[0]] = [i]
+            matches = []
+            for p in positions:
+                aList = d.get(p.v)
+                matches.append(aList.pop(0) if aList else -1)
+            keep = self.keepInPlace(matches)
+
+        # Remove the unused items, and the reused items that must move.
+        for i,record in enumerate(old):
+            if i not in keep:
+                self.removeItem(parent_item,record[1])
+                self.nodePatchCount += 1
+
+        # Insert the new and moved items.
+        records,created = [],[]
+        n = len(keep) # The number of child items.
+        for i,p in zip(matches,positions):
+            if i == -1:
+                item = self.createTreeItem(p,parent_item)
+                if n > len(records):
+                    # The new item is not the last child.
+                    self.removeItem(parent_item,item)
+                    self.insertItem(parent_item,len(records),item)
+                records.append([p.v,item,[]])
+                n += 1
+                self.nodeDrawCount += 1
+            else:
+                record = old[i]
+                if i not in keep:
+                    self.insertItem(parent_item,len(records),record[1])
+                    n += 1
+                records.append(record)
+            created.append(i == -1)
+
+        # Update the items and their children.
+        for p,record,isNew in zip(positions,records,created):
+            item,childRecords = record[1],record[2]
+            self.rememberItem(p,item)
+            if isNew or self.getItemText(item) != p.h:
+                self.setItemText(item,p.h)
+                if not isNew: self.nodePatchCount += 1
+            icon = self.getIcon(p)
+            if icon:
+                itemHash = self.itemHash(item)
+                if isNew or icon is not icons.get(itemHash):
+                    self.setItemIcon(item,icon)
+                    if not isNew: self.nodePatchCount += 1
+                else:
+                    self.item2iconDict[itemHash] = icon
+            if not visible:
+                if childRecords:
+                    record[2] = self.patchChildren([],item,childRecords,icons,False)
+                    self.contractItem(item)
+            elif p.hasChildren():
+                children = [z.copy() for z in p.children()]
+                if p.isExpanded():
+                    self.expandItem(item)
+                    record[2] = self.patchChildren(children,item,childRecords,icons,True)
+                else:
+                    record[2] = self.patchChildren(children,item,childRecords,icons,False)
+                    self.contractItem(item)
+            else:
+                if childRecords:
+                    record[2] = self.patchChildren([],item,childRecords,icons,False)
+                self.contractItem(item)
+
+        if trace and parent_item is None: g.trace('drew %s patched %s' % (
+            self.nodeDrawCount,self.nodePatchCount))
+        return records
+    #@+node:ekr.20130413052322.10435: *4* keepInPlace
+    def keepInPlace (self,matches):
+
+        '''matches is a list of indices into the old children, or -1 for
+        new children. Return the set of the old indices whose items can
+        stay where they are: the longest increasing subsequence.'''
+
+        tails = [] # tails[k] is the smallest last index of runs of length k+1.
+        where = [] # where[k] is the index of tails[k] in matches.
+        prev = [-1] * len(matches)
+        for j,i in enumerate(matches):
+            if i == -1: continue
+            k = bisect.bisect_left(tails,i)
+            if k > 0: prev[j] = where[k-1]
+            if k == len(tails):
+                tails.append(i) ; where.append(j)
+            else:
+                tails[k] = i ; where[k] = j
+        keep = set()
+        j = where[-1] if where else -1
+        while j != -1:
+            keep.add(matches[j])
+            j = prev[j]
+        return keep
+    #@+node:ekr.20130413052322.10436: *4* topLevelPositions
+    def topLevelPositions (self):
+
+        '''Return a list of the positions drawn at the top level.'''
+
+        c = self.c
+        if c.hoistStack:
+            bunch = c.hoistStack[-1]
+            p = bunch.p ; h = p.h
+            if len(c.hoistStack) == 1 and h.startswith('@chapter') and p.hasChildren():
+                return [z.copy() for z in p.children()]
+            else:
+                return [p.copy()]
+        else:
+            return [z.copy() for z in c.rootPosition().self_and_siblings()]
     #@+node:ekr.20110605121601.17880: *3* redraw_after_contract
     def redraw_after_contract (self,p=None):
 
@@ -931,7 +1106,7 @@ class baseNativeTreeWidget (leoFrame.leoTree):
                     g.warning("truncating headline to",limit,"characters")
             #@-<< truncate s if it has multiple lines >>
             p.initHeadString(s)
-            item.setText(0,s) # Required to avoid full redraw.
+            self.setItemText(item,s) # Required to avoid full redraw.
             undoData = u.beforeChangeNodeContents(p,oldHead=oldHead)
             if not c.changed: c.setChanged(True)
             # New in Leo 4.4.5: we must recolor the body because
@@ -1123,6 +1298,20 @@ class baseNativeTreeWidget (leoFrame.leoTree):
 
         '''Return the text of the item.'''
 
+        self.oops()
+    #@+node:ekr.20130413052322.10437: *4* insertItem & removeItem
+    def insertItem (self,parent_item,n,item):
+
+        '''Insert item, which has no parent, as the n'th child of parent_item,
+        or as the n'th top-level item if parent_item is None.'''
+
+        self.oops()
+
+    def removeItem (self,parent_item,item):
+
+        '''Remove item, and all its descendants, from parent_item,
+        or from the top-level items if parent_item is None.'''
+
         self.oops()
     #@+node:ekr.20110605121601.17931: *4* getParentItem
     def getParentItem (self,item):
@@ -1283,6 +1472,7 @@ class baseNativeTreeWidget (leoFrame.leoTree):
             # This will generate changed events,
             # but there is no itemChanged event handler.
             self.setItemIconHelper(item,icon)
+            self.item2iconDict[self.itemHash(item)] = icon
         elif trace:
             # Apparently, icon can be None due to recent icon changes.
             if icon:
@@ -9,6 +9,7 @@
 #@-<< docstring >>
 
 __version__ = '0.0'
+lazy_load = True # Load this plugin when one of its commands is first used.
 #@+<< version history >>
 #@+node:ville.20110121075405.6321: ** << version history >>
 #@@killcolor
@@ -35,41 +35,29 @@ def all_positions_global():
             yield (c,p)
 
 class GnxCache:
-    """ map gnx => vnode """
+    """ map gnx => vnode, using the gnx indices of the commanders """
     def __init__(self):
         self.clear()
     def update_new_cs(self):
-        for c in g.app.commanders():
-            if c.hash() not in self.cs:
-                for p in c.all_unique_positions():
-                    k = p.gnx
-                    self.ps[k] = c, p.v
-                self.cs.add(c.hash())
+        # c.gnxIndex keeps itself up to date.
+        pass
         
     def get(self, gnx):
-        if not self.ps:
-            self.update_new_cs()
-        res = self.ps.get(gnx, None)                               
-        return res
+        c, v = g.app.findGnx(gnx)
+        if c:
+            return c, v
+        return None
     def get_p(self,gnx):
         r = self.get(gnx)
         if r:
             c,v = r
-            for p in c.all_unique_positions():
-                if p.v is v:
-                    return c,p.copy()
-        
-        print("Not in gnx cache, slow!")
-        
-        for c,p in all_positions_global():
-            
-            if p.gnx == gnx:
-                return c,p.copy()
+            p = c.vnode2position(v)
+            if p:
+                return c,p
         return None
         
     def clear(self):
-        self.ps = {}
-        self.cs = set()
+        pass
 
 class LeoFts:    
     def __init__(self, idx_dir):
@@ -42,6 +42,7 @@ filename string as its only argument and set as open_func.
 #@@tabwidth -4
 
 __version__ = '0.2'
+lazy_load = True # Load this plugin when an icon is first double-clicked.
 
 #@+<< version history >>
 #@+node:dan.20090203174248.28: ** << version history >>
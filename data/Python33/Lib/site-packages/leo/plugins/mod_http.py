@@ -55,6 +55,27 @@ The browser may or may not be able to close the bookmark form window for you,
 depending on settings - set ``dom.allow_scripts_to_close_windows`` to true in
 ``about:config`` in Firefox.
 
+By default, the server runs in Leo's idle-time handler, one request at a time.
+Set ``@bool http_threaded = True`` to serve requests on a pool of threads
+instead (``@int http_threads`` sets the size of the pool, 4 by default). In
+this mode the server supports keep-alive connections, sends an ETag with each
+page and answers If-None-Match requests with 304 (Not Modified) while the
+node's contents do not change. Only Leo's gui thread touches outlines: the
+server threads ask it to run the code that reads them.
+
+The threaded server also serves subtrees as JSON, so that scripts can read
+large outlines quickly. For example::
+
+    http://localhost:8080/_/json/leoPy.leo/0/2?limit=100&body=0
+
+returns up to 100 nodes of the subtree of the third child of the first
+top-level node of leoPy.leo in outline order. Omit the node numbers to get
+the entire outline. Each node has a path (the numbers in its url), a level
+(relative to the subtree), a gnx, a headline, a body (unless body=0) and the
+number of its children. To get the next page, pass the returned "next" path as
+the start argument: ``?start=0/2/7/1&limit=100``. "next" is null on the last
+page.
+
 '''
 #@-<< docstring >>
 
@@ -64,7 +85,7 @@ depending on settings - set ``dom.allow_scripts_to_close_windows`` to true in
 # Adapted and extended from the Python Cookbook:
 # http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/259148
 
-__version__ = "0.99"
+__version__ = "1.00"
 
 # This encoding must match the character encoding used in your browser.
 # If it does not, non-ascii characters will look very strange.
@@ -77,13 +98,26 @@ import leo.core.leoGlobals as g
 import asynchat
 import asyncore
 import cgi
+import hashlib
+import json
+import threading
 
 if g.isPython3:
     import http.server
     SimpleHTTPRequestHandler = http.server.SimpleHTTPRequestHandler
+    BaseHTTPRequestHandler = http.server.BaseHTTPRequestHandler
 else:
+    import BaseHTTPServer
     import SimpleHTTPServer
     SimpleHTTPRequestHandler = SimpleHTTPServer.SimpleHTTPRequestHandler
+    BaseHTTPRequestHandler = BaseHTTPServer.BaseHTTPRequestHandler
+
+if g.isPython3:
+    import queue as Queue
+    import socketserver as SocketServer
+else:
+    import Queue
+    import SocketServer
     
 if g.isPython3:
     import io
@@ -128,16 +162,22 @@ from xml.sax.saxutils import quoteattr
 # - Removed the old @page line from the docstring.
 # 0.98 EKR: Handle unicode characters properly.
 # 0.99 Lauri Ojansivu <lauri.ojansivu@gmail.com>: Many change for better html generation.
+# 1.00: Added the threaded server (@bool http_threaded), keep-alive connections,
+#       ETags and the JSON api for subtrees.
 #@-<< version history >>
 
 sockets_to_close = []
 
+threaded_server = None # Set by startThreadedServer.
+
 #@+<< config >>
 #@+node:bwmulder.20050326191345: ** << config >>
 class config:
     http_active = False
     http_timeout = 0
     http_port = 8080
+    http_threaded = False
+    http_threads = 4
     rst2_http_attributename = 'rst_http_attribute'
 #@-<< config >>
 #@+others
@@ -149,7 +189,18 @@ def init ():
         g.registerHandler("open2", onFileOpen)
     else:
         getGlobalConfiguration()
-        if config.http_active:
+        if config.http_active and config.http_threaded:
+
+            try:
+                startThreadedServer('',config.http_port,config.http_threads)
+            except socket.error:
+                g.es("mod_http port already in use")
+                return False
+
+            g.es("http serving enabled on port %s, version %s, %s threads" % (
+                config.http_port, __version__, config.http_threads), color="purple")
+
+        elif config.http_active:
             
             try:
                 s=Server('',config.http_port,RequestHandler)
@@ -183,6 +234,17 @@ def onFileOpen(tag, keywords):
 
         g.es("http serving enabled on port %s, version %s" % (
             config.http_port, __version__), color="purple")
+#@+node:ekr.20130413052322.10361: *3* startThreadedServer
+def startThreadedServer(ip, port, threads):
+    """
+    Serve requests on a pool of threads. Return the server.
+    """
+    global threaded_server
+    server = ThreadedServer((ip, port), ThreadedRequestHandler, threads)
+    server.caller.connectToGui()
+    server.start()
+    threaded_server = server
+    return server
 #@+node:ekr.20110522152535.18252: *3* escape
 def escape(s):
 
@@ -488,7 +550,7 @@ class leo_interface(object):
         if len(path) >= 2:
             for i in range(int(path[1])):
                 node = node.next()
-                if node is None:
+                if not node:
                     raise nodeNotFound
             # go to the i'th child for each path element.
             for i in path[2:]:
@@ -498,7 +560,7 @@ class leo_interface(object):
                     # No Leo path
                     raise noLeoNodePath
                 node = node.nthChild(int(i))
-                if node is None:
+                if not node:
                     raise nodeNotFound
         else:
             node = None
@@ -1089,6 +1151,370 @@ class LeoActions:
         return f
     #@-others
     
+#@+node:ekr.20130413052322.10362: ** class callTimeout
+class callTimeout(Exception):
+    """
+    Raised if the gui thread does not run a function in time.
+    """
+    pass
+#@+node:ekr.20130413052322.10363: ** class mainThreadCaller
+class mainThreadCaller:
+    """
+    Run functions on Leo's gui thread on behalf of the server's threads.
+
+    Leo's outlines may only be used from the gui thread, the thread that
+    creates the caller.
+    """
+    #@+others
+    #@+node:ekr.20130413052322.10364: *3* __init__
+    def __init__(self, timeout=30.0):
+
+        self.queue = Queue.Queue()
+        self.thread = threading.current_thread()
+        self.timeout = timeout # Seconds to wait for the gui thread.
+        self.wakeup = None # A function that makes the gui thread call drain.
+        self.qtObject = None # Keeps the Qt object alive.
+    #@+node:ekr.20130413052322.10365: *3* call
+    def call(self, func, *args):
+        """
+        Run func(*args) on the gui thread and return its result.
+        Exceptions raised by func are raised again in the calling thread.
+        """
+        if threading.current_thread() is self.thread:
+            return func(*args)
+        item = [func, args, threading.Event(), None, None]
+        self.queue.put(item)
+        if self.wakeup:
+            self.wakeup()
+        event = item[2]
+        event.wait(self.timeout)
+        if not event.is_set():
+            raise callTimeout
+        if item[4]:
+            raise item[4]
+        return item[3]
+    #@+node:ekr.20130413052322.10366: *3* connectToGui
+    def connectToGui(self):
+        """
+        Arrange for the gui thread to run the waiting functions.
+
+        The Qt gui runs them as soon as possible. Other guis run them at
+        idle time.
+        """
+        if g.app.gui.guiName() == 'qt':
+            self.wakeup, self.qtObject = makeQtWakeup(self.drain)
+        else:
+            g.registerHandler("idle", self.onIdle)
+    #@+node:ekr.20130413052322.10367: *3* drain
+    def drain(self, timeout=None):
+        """
+        Run all waiting functions on this (the gui) thread. If timeout is
+        given, wait up to timeout seconds for the first function.
+
+        Return the number of functions run.
+        """
+        n = 0
+        block = timeout is not None
+        while 1:
+            try:
+                item = self.queue.get(block, timeout)
+            except Queue.Empty:
+                return n
+            block = False
+            func, args, event = item[:3]
+            try:
+                item[3] = func(*args)
+            except Exception as e:
+                item[4] = e
+            event.set()
+            n += 1
+    #@+node:ekr.20130413052322.10368: *3* onIdle
+    def onIdle(self, tag, keywords):
+
+        if not g.app.killed:
+            self.drain()
+    #@-others
+#@+node:ekr.20130413052322.10369: ** makeQtWakeup
+def makeQtWakeup(callback):
+    """
+    Return (wakeup, obj). Calling wakeup from any thread makes Qt's event
+    loop call callback on the gui thread. The caller must keep obj alive.
+    """
+    from PyQt4 import QtCore
+
+    class wakeupObject(QtCore.QObject):
+        wake = QtCore.pyqtSignal()
+
+    obj = wakeupObject()
+    obj.wake.connect(callback, QtCore.Qt.QueuedConnection)
+    return obj.wake.emit, obj
+#@+node:ekr.20130413052322.10370: ** class ThreadedRequestHandler
+class ThreadedRequestHandler(leo_interface, BaseHTTPRequestHandler):
+    """
+    Serve pages and JSON data on one of the threads of a ThreadedServer.
+
+    The methods that use the outline (get_page and get_json) run on the gui
+    thread. Everything else, including encoding the results, happens on
+    the server's thread.
+    """
+
+    protocol_version = 'HTTP/1.1' # Keep connections alive.
+    server_version = 'LeoHTTP/' + __version__
+    timeout = 15 # Close connections that are idle for this many seconds.
+    json_limit = 500 # The default number of nodes in a JSON page.
+    json_max_limit = 10000
+
+    #@+others
+    #@+node:ekr.20130413052322.10371: *3* do_GET & do_HEAD
+    def do_GET(self):
+
+        self.respond(True)
+
+    def do_HEAD(self):
+
+        self.respond(False)
+    #@+node:ekr.20130413052322.10383: *3* setup
+    def setup(self):
+        """
+        Send small responses at once: the headers and the body of a
+        response are written separately.
+        """
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    #@+node:ekr.20130413052322.10372: *3* log_message
+    def log_message(self, format, *args):
+        """
+        Don't log requests: only the gui thread may write to Leo's log.
+        """
+        pass
+    #@+node:ekr.20130413052322.10373: *3* respond
+    def respond(self, sendBody):
+        """
+        Send the response to a GET or HEAD request.
+        """
+        parsed = urlparse.urlparse(self.path)
+        path = self.split_leo_path(parsed.path or '/')
+        call = self.server.caller.call
+        try:
+            if path[:2] == ['_', 'json']:
+                data = call(self.get_json, path[2:],
+                    urlparse.parse_qs(parsed.query))
+                data = g.toEncodedString(json.dumps(data), 'utf-8')
+                ctype = 'application/json'
+                etag = '"%s"' % hashlib.md5(data).hexdigest()
+                if self.is_cached(etag):
+                    data = None
+            else:
+                etag, data = call(self.get_page, path, self.is_cached)
+                ctype = 'text/html; charset=utf-8'
+                if data is not None:
+                    data = g.toEncodedString(data, 'utf-8')
+        except (nodeNotFound, noLeoNodePath):
+            self.send_error(404, "Node not found")
+            return
+        except ValueError:
+            self.send_error(400, "Bad request")
+            return
+        except callTimeout:
+            self.send_error(503, "Leo is busy")
+            return
+        except Exception:
+            self.server.handle_error(self.request, self.client_address)
+            self.send_error(500, "Internal error")
+            return
+        if data is None:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        if sendBody:
+            self.wfile.write(data)
+    #@+node:ekr.20130413052322.10374: *3* is_cached
+    def is_cached(self, etag):
+        """
+        Return True if the request's If-None-Match header matches etag.
+        """
+        s = self.headers.get('If-None-Match')
+        if not s or not etag:
+            return False
+        tags = [z.strip() for z in s.split(',')]
+        return etag in tags or '*' in tags
+    #@+node:ekr.20130413052322.10375: *3* get_page & node_etag (gui thread)
+    def get_page(self, path, is_cached):
+        """
+        Return (etag, html) for the page at path. html is None if
+        is_cached(etag) is True.
+        """
+        if path[0] == '_':
+            f = LeoActions(self).get_response()
+            return None, f.getvalue()
+        if path == '/':
+            parts = ['/'] + [w.shortFileName() for w in g.app.windowList]
+            etag = self.make_etag(parts)
+            if is_cached(etag):
+                return etag, None
+            return etag, self.get_leo_windowlist().getvalue()
+        window, node = self.get_leo_node(path)
+        if window is None:
+            raise nodeNotFound
+        etag = self.node_etag(window, node)
+        if is_cached(etag):
+            return etag, None
+        return etag, self.format_leo_node(window, node).getvalue()
+
+    def node_etag(self, window, node):
+        """
+        Return an ETag for everything that format_leo_node shows.
+        """
+        parts = [window.shortFileName()]
+        if node:
+            parts.extend([node.h, node.b, repr(get_http_attribute(node))])
+            parts.extend([z.h for z in node.parents()])
+            parts.extend([z.h for z in node.children()])
+            for z in (node.threadNext(), node.next(), node.parent()):
+                parts.append(self.create_leo_h_reference(window, z))
+        else:
+            parts.extend([z.h for z in window.c.rootPosition().self_and_siblings()])
+        return self.make_etag(parts)
+
+    def make_etag(self, parts):
+
+        s = '\x00'.join([g.toUnicode(z) for z in parts])
+        return '"%s"' % hashlib.md5(g.toEncodedString(s, 'utf-8')).hexdigest()
+    #@+node:ekr.20130413052322.10376: *3* get_json & helpers (gui thread)
+    def get_json(self, path, query):
+        """
+        Return a dict describing one page of the nodes in the subtree at
+        path, in outline order. path[0] is the outline's short file name.
+        Without node numbers, the subtree is the entire outline.
+
+        query keys: start (the path of the first node, default: the root of
+        the subtree), limit (the number of nodes) and body (0: omit bodies).
+        """
+        if not path or not path[0]:
+            raise nodeNotFound
+        window, node = self.get_leo_node(path)
+        if window is None:
+            raise nodeNotFound
+        limit = int(query.get('limit', [self.json_limit])[0])
+        limit = max(1, min(limit, self.json_max_limit))
+        withBody = query.get('body', ['1'])[0] != '0'
+        root = [int(z) for z in self.get_leo_nameparts(node)]
+        level0 = g.choose(node, len(root), 1) # The length of the top paths.
+        if 'start' in query:
+            parts = [int(z) for z in query['start'][0].split('/')]
+            if len(parts) < level0 or parts[:len(root)] != root:
+                raise ValueError # Not in the subtree.
+            junk, p = self.get_leo_node([path[0]] + parts)
+        elif node:
+            p, parts = node.copy(), root[:]
+        else:
+            p, parts = window.c.rootPosition(), [0]
+        nodes = []
+        done = False
+        while not done and len(nodes) < limit:
+            d = {
+                'path': '/'.join([str(z) for z in parts]),
+                'level': len(parts) - level0,
+                'gnx': p.gnx,
+                'h': p.h,
+                'children': p.numberOfChildren(),
+            }
+            if withBody:
+                d['b'] = p.b
+            nodes.append(d)
+            done = not self.json_next(p, parts, len(root))
+        return {
+            'file': window.shortFileName(),
+            'path': '/'.join([str(z) for z in root]),
+            'nodes': nodes,
+            'next': g.choose(done, None, '/'.join([str(z) for z in parts])),
+        }
+    #@+node:ekr.20130413052322.10377: *4* json_next
+    def json_next(self, p, parts, n):
+        """
+        Move p to the next node of the subtree in outline order, updating
+        parts, the child numbers of p. The root of the subtree has n parts.
+
+        Return False if there are no more nodes.
+        """
+        if p.hasChildren():
+            p.moveToFirstChild()
+            parts.append(0)
+            return True
+        while len(parts) > n:
+            if p.hasNext():
+                p.moveToNext()
+                parts[-1] += 1
+                return True
+            p.moveToParent()
+            parts.pop()
+        return False
+    #@-others
+#@+node:ekr.20130413052322.10378: ** class ThreadedServer
+class ThreadedServer(SocketServer.TCPServer):
+    """
+    A server that handles each connection on one of a pool of threads.
+    """
+
+    allow_reuse_address = True
+
+    #@+others
+    #@+node:ekr.20130413052322.10379: *3* __init__
+    def __init__(self, address, handler, threads):
+
+        SocketServer.TCPServer.__init__(self, address, handler)
+        self.caller = mainThreadCaller()
+        self.connections = Queue.Queue()
+        self.threads = []
+        for i in range(max(1, threads)):
+            t = threading.Thread(target=self.work)
+            t.daemon = True
+            self.threads.append(t)
+        self.serverThread = threading.Thread(target=self.serve_forever)
+        self.serverThread.daemon = True
+    #@+node:ekr.20130413052322.10380: *3* process_request & work
+    def process_request(self, request, client_address):
+        """
+        Queue the connection for the next free thread.
+        """
+        self.connections.put((request, client_address))
+
+    def work(self):
+
+        while 1:
+            item = self.connections.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            self.close_request(request)
+    #@+node:ekr.20130413052322.10381: *3* start & stop
+    def start(self):
+
+        for t in self.threads:
+            t.start()
+        self.serverThread.start()
+
+    def stop(self):
+        """
+        Stop accepting connections and stop all threads.
+        Connections that are still open are closed when their thread exits.
+        """
+        self.shutdown()
+        for t in self.threads:
+            self.connections.put(None)
+        self.server_close()
+    #@-others
 #@+node:EKR.20040517080250.40: ** poll
 def poll(timeout=0.0):
     global sockets_to_close
@@ -1178,6 +1604,14 @@ def getConfiguration(c):
     if newport:
         config.http_port = newport
 
+    # threads.
+    newthreaded = c.config.getBool("http_threaded")
+    if newthreaded is not None:
+        config.http_threaded = newthreaded
+    newthreads = c.config.getInt("http_threads")
+    if newthreads:
+        config.http_threads = newthreads
+
     # active.
     newactive = c.config.getBool("http_active")
     if newactive is not None:
@@ -1202,6 +1636,14 @@ def getGlobalConfiguration():
     if newport:
         config.http_port = newport
 
+    # threads.
+    newthreaded = g.app.config.getBool("http_threaded")
+    if newthreaded is not None:
+        config.http_threaded = newthreaded
+    newthreads = g.app.config.getInt("http_threads")
+    if newthreads:
+        config.http_threads = newthreads
+
     # active.
     newactive = g.app.config.getBool("http_active")
     if newactive is not None:
@@ -25,6 +25,7 @@ import leo.core.leoFrame as leoFrame
 import leo.core.leoFind as leoFind
 import leo.core.leoGui as leoGui
 import leo.core.leoMenu as leoMenu
+import leo.core.leoModes as leoModes
 import leo.core.leoPlugins as leoPlugins
     # Uses leoPlugins.TryNext.
 
@@ -1655,7 +1656,7 @@ class leoQtHeadlineWidget (leoQtBaseTextWidget):
 
         trace = False and not g.unitTesting
         tree = self.c.frame.tree
-        e = tree.treeWidget.itemWidget(self.item,0)
+        e = tree.getTreeEditorForItem(self.item)
         valid = tree.isValidItem(self.item)
         result = valid and e == self.widget
         if trace: g.trace('result %s self.widget %s itemWidget %s' % (
@@ -2370,7 +2371,11 @@ class DynamicWindow(QtGui.QMainWindow):
 
         c = self.leo_c
         # w = QtGui.QTreeWidget(parent)
-        w = LeoQTreeWidget(c,parent)
+        if c.config.getBool('qt-lazy-tree',default=False):
+            w = QtGui.QTreeView(parent) # A leoQtLazyTree.
+            w.setUniformRowHeights(True) # The view need not measure every row.
+        else:
+            w = LeoQTreeWidget(c,parent)
         self.setSizePolicy(w)
 
         # 12/01/07: add new config setting.
@@ -3946,7 +3951,10 @@ class leoQtFrame (leoFrame.leoFrame):
 
         f = self ; c = f.c
 
-        f.tree  = leoQtTree(c,f)
+        if c.config.getBool('qt-lazy-tree',default=False):
+            f.tree = leoQtLazyTree(c,f)
+        else:
+            f.tree = leoQtTree(c,f)
         f.log   = leoQtLog(f,None)
         f.body  = leoQtBody(f,None)
 
@@ -6525,7 +6533,7 @@ class leoQtTree (baseNativeTree.baseNativeTreeWidget):
         if e:
             # g.trace(g.callers(5))
             w.closeEditor(e,QtGui.QAbstractItemDelegate.NoHint)
-            w.setCurrentItem(item)
+            self.setCurrentItemHelper(item)
     #@+node:ekr.20110605121601.18418: *6* connectEditorWidget & helper
     def connectEditorWidget(self,e,item):
 
@@ -6537,9 +6545,8 @@ class leoQtTree (baseNativeTree.baseNativeTreeWidget):
         def editingFinishedCallback(e=e,item=item,self=self,wrapper=wrapper):
             # g.trace(wrapper,g.callers(5))
             c = self.c
-            w = self.treeWidget
             self.onHeadChanged(p=c.p,e=e)
-            w.setCurrentItem(item)
+            self.setCurrentItemHelper(item)
 
         e.connect(e,QtCore.SIGNAL(
             "editingFinished()"),
@@ -6562,10 +6569,9 @@ class leoQtTree (baseNativeTree.baseNativeTreeWidget):
 
         trace = False and not g.unitTesting
 
-        w = self.treeWidget
-        w.setCurrentItem(item) # Must do this first.
-        w.editItem(item)
-        e = w.itemWidget(item,0)
+        self.setCurrentItemHelper(item) # Must do this first.
+        self.editItemHelper(item)
+        e = self.getTreeEditorForItem(item)
         e.setObjectName('headline')
         wrapper = self.connectEditorWidget(e,item)
 
@@ -6596,13 +6602,12 @@ class leoQtTree (baseNativeTree.baseNativeTreeWidget):
         gui-specific stuff.'''
 
         trace = False and not g.unitTesting
-        w = self.treeWidget
-        w.setCurrentItem(item)
+        self.setCurrentItemHelper(item)
             # Must do this first.
             # This generates a call to onTreeSelect.
-        w.editItem(item)
+        self.editItemHelper(item)
             # Generates focus-in event that tree doesn't report.
-        e = w.itemWidget(item,0) # A QLineEdit.
+        e = self.getTreeEditorForItem(item) # A QLineEdit.
         if e:
             s = e.text() ; len_s = len(s)
             if s == 'newHeadline': selectAll=True
@@ -6619,6 +6624,13 @@ class leoQtTree (baseNativeTree.baseNativeTreeWidget):
             wrapper = self.connectEditorWidget(e,item) # Hook up the widget.
         if trace: g.trace(e,wrapper)
         return e,wrapper # 2011/02/11
+    #@+node:ekr.20130413052322.10442: *6* editItemHelper (leoQtTree)
+    def editItemHelper (self,item):
+
+        '''Open the editor of the given item.'''
+
+        w = self.treeWidget
+        w.editItem(item)
     #@+node:ekr.20110605121601.18423: *6* getCurrentItem
     def getCurrentItem (self):
 
@@ -6633,6 +6645,21 @@ class leoQtTree (baseNativeTree.baseNativeTreeWidget):
             return g.u(item.text(0))
         else:
             return '<no item>'
+    #@+node:ekr.20130413052322.10438: *6* insertItem & removeItem (leoQtTree)
+    def insertItem (self,parent_item,n,item):
+
+        if parent_item:
+            parent_item.insertChild(n,item)
+        else:
+            self.treeWidget.insertTopLevelItem(n,item)
+
+    def removeItem (self,parent_item,item):
+
+        if parent_item:
+            parent_item.removeChild(item)
+        else:
+            w = self.treeWidget
+            w.takeTopLevelItem(w.indexOfTopLevelItem(item))
     #@+node:ekr.20110605121601.18425: *6* getParentItem
     def getParentItem(self,item):
 
@@ -6787,6 +6814,403 @@ class leoQtTree (baseNativeTree.baseNativeTreeWidget):
         menu.popup(menuPos)
         self._contextmenu = menu
     #@-others
+#@+node:ekr.20130413052322.10443: *3* class leoQtLazyTree (leoQtTree)
+class leoQtLazyTree (leoQtTree):
+
+    """An outline pane that shows the outline in a QTreeView.
+
+    The view's model, a leoQtTreeModel, creates no item for visible nodes:
+    it asks the outline for the rows the view paints. The "items" of the
+    base classes are leoQtTreeNodes, created only for expanded nodes and
+    for the positions that Leo's core asks about.
+
+    Enabled by @bool qt-lazy-tree."""
+
+    #@+others
+    #@+node:ekr.20130413052322.10444: *4*  Birth (leoQtLazyTree)
+    def __init__(self,c,frame):
+
+        # Init the base class.
+        leoQtTree.__init__(self,c,frame)
+
+        w = self.treeWidget # A QTreeView.
+        self.model = leoQtTreeModel(self)
+        w.setModel(self.model)
+        w.setHeaderHidden(True)
+
+    def initAfterLoad (self):
+
+        '''Do late-state inits.'''
+
+        c = self.c
+        w = c.frame.top
+        tw = self.treeWidget
+
+        if not leoQtTree.callbacksInjected:
+            leoQtTree.callbacksInjected = True
+            self.injectCallbacks() # A base class method.
+
+        for signal,func in (
+            ("clicked(QModelIndex)",        self.onIndexClicked),
+            ("doubleClicked(QModelIndex)",  self.onIndexDoubleClicked),
+            ("collapsed(QModelIndex)",      self.onIndexCollapsed),
+            ("expanded(QModelIndex)",       self.onIndexExpanded),
+            ("customContextMenuRequested(QPoint)",self.onContextMenu),
+        ):
+            w.connect(tw,QtCore.SIGNAL(signal),func)
+        w.connect(tw.selectionModel(),QtCore.SIGNAL(
+                "currentChanged(QModelIndex,QModelIndex)"),
+            self.onCurrentIndexChanged)
+
+        self.ev_filter = leoQtEventFilter(c,w=self,tag='tree')
+        tw.installEventFilter(self.ev_filter)
+    #@+node:ekr.20130413052322.10445: *4* Drawing (leoQtLazyTree)
+    def drawTopTree (self,p):
+
+        '''Show all top-level nodes and their visible descendants.'''
+
+        hPos,vPos = self.getScroll()
+        self.model.resetNodes(self.topLevelPositions())
+        self.expandNodes(self.model.root)
+
+        # This method always retains previous scroll position.
+        self.setHScroll(hPos)
+        self.setVScroll(vPos)
+
+        self.repaint()
+
+    patchTopTree = drawTopTree # The model never creates more than it must.
+
+    def expandNodes (self,node):
+
+        '''Expand the rows of all expanded nodes below node.'''
+
+        w = self.treeWidget
+        for row in range(node.childCount()):
+            v = node.childVnode(row)
+            if v.children and v.isExpanded():
+                child = node.child(row)
+                self.nodeDrawCount += 1
+                w.setExpanded(self.model.indexForNode(child),True)
+                self.expandNodes(child)
+
+    def clear (self):
+        '''Clear all rows of the tree.'''
+        self.model.resetNodes([])
+
+    def repaint (self):
+        '''Repaint the rows in the viewport.'''
+        self.treeWidget.viewport().update()
+    #@+node:ekr.20130413052322.10446: *4* Event handlers (leoQtLazyTree)
+    # The base class handlers expect items, not indices.
+
+    def onIndexClicked (self,index):
+        self.onItemClicked(self.model.nodeForIndex(index),0)
+
+    def onIndexDoubleClicked (self,index):
+        self.onItemDoubleClicked(self.model.nodeForIndex(index),0)
+
+    def onIndexCollapsed (self,index):
+        self.onItemCollapsed(self.model.nodeForIndex(index))
+
+    def onIndexExpanded (self,index):
+        self.onItemExpanded(self.model.nodeForIndex(index))
+
+    def onCurrentIndexChanged (self,current,previous):
+        self.onTreeSelect()
+    #@+node:ekr.20130413052322.10447: *4* Icons & headlines (leoQtLazyTree)
+    # The model gets headlines and icons from the outline when painting rows.
+
+    def drawIcon (self,p):
+        '''Redraw the icon at p.'''
+        self.updateIcon(p,force=True)
+
+    def redraw_after_icons_changed (self):
+
+        if self.busy(): return
+        self.redrawCount += 1 # To keep a unit test happy.
+        self.repaint()
+
+    def setItemIconHelper (self,item,icon):
+        self.model.updateNode(item)
+
+    def setItemText (self,item,s):
+        self.model.updateNode(item)
+
+    def updateIcon (self,p,force=False):
+
+        '''Update p's icon.'''
+
+        if p:
+            p.v.iconVal = p.v.computeIcon()
+            self.repaint()
+    #@+node:ekr.20130413052322.10448: *4* Items (leoQtLazyTree)
+    def childIndexOfItem (self,item):
+        return item.row
+
+    def childItems (self,parent_item):
+        node = parent_item or self.model.root
+        return [node.child(i) for i in range(node.childCount())]
+
+    def contractItem (self,item):
+        self.treeWidget.collapse(self.model.indexForNode(item))
+
+    def editItemHelper (self,item):
+        self.treeWidget.edit(self.model.indexForNode(item))
+
+    def expandItem (self,item):
+        self.treeWidget.expand(self.model.indexForNode(item))
+
+    def getCurrentItem (self):
+        return self.model.nodeForIndex(self.treeWidget.currentIndex())
+
+    def getItemText (self,item):
+        if item:
+            return g.u(item.v.h)
+        else:
+            return '<no item>'
+
+    def getParentItem(self,item):
+        parent = item and item.parent
+        return parent if parent is not self.model.root else None
+
+    def getSelectedItems(self):
+        rows = self.treeWidget.selectionModel().selectedRows()
+        return [self.model.nodeForIndex(z) for z in rows]
+
+    def getTreeEditorForItem(self,item):
+        return self.treeWidget.indexWidget(self.model.indexForNode(item))
+
+    def nthChildItem (self,n,parent_item):
+        node = parent_item or self.model.root
+        return node.child(n) if n < node.childCount() else None
+
+    def scrollToItem (self,item):
+        w = self.treeWidget
+        w.scrollTo(self.model.indexForNode(item),w.PositionAtCenter)
+        self.setHScroll(0)
+
+    def setCurrentItemHelper(self,item):
+        self.treeWidget.setCurrentIndex(self.model.indexForNode(item))
+    #@+node:ekr.20130413052322.10449: *4* Associating items and positions (leoQtLazyTree)
+    def item2position(self,item):
+        return item and self.isValidItem(item) and item.p.copy() or None
+
+    def item2vnode (self,item):
+        return item and self.isValidItem(item) and item.v or None
+
+    def position2item(self,p):
+        return self.model.nodeForPosition(p)
+
+    def vnode2items(self,v):
+        return self.model.nodesForVnode(v)
+
+    def isValidItem (self,item):
+        return bool(item) and item.generation == self.model.generation
+    #@-others
+#@+node:ekr.20130413052322.10450: *3* class leoQtTreeModel (QAbstractItemModel)
+class leoQtTreeModel (QtCore.QAbstractItemModel):
+
+    '''The model of a leoQtLazyTree.
+
+    The internal pointer of an index is the leoQtTreeNode of the index's
+    parent, so rows need no objects of their own. Finding the vnode, the
+    parent and the row of an index takes constant time.'''
+
+    #@+others
+    #@+node:ekr.20130413052322.10451: *4*  ctor (leoQtTreeModel)
+    def __init__ (self,tree):
+
+        QtCore.QAbstractItemModel.__init__(self)
+        self.tree = tree
+        self.generation = 0
+        self.root = leoQtTreeNode(self,None,0,None,[])
+    #@+node:ekr.20130413052322.10452: *4* Overrides (leoQtTreeModel)
+    def columnCount (self,parent=QtCore.QModelIndex()):
+
+        return 1
+
+    def data (self,index,role=QtCore.Qt.DisplayRole):
+
+        node = index.isValid() and index.internalPointer()
+        v = node and node.childVnode(index.row())
+        if not v:
+            return None
+        elif role in (QtCore.Qt.DisplayRole,QtCore.Qt.EditRole):
+            return v.h
+        elif role == QtCore.Qt.DecorationRole:
+            return self.tree.getIcon(node.childPosition(index.row()))
+        else:
+            return None
+
+    def flags (self,index):
+
+        if index.isValid():
+            return (QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable |
+                QtCore.Qt.ItemIsEditable)
+        else:
+            return QtCore.Qt.NoItemFlags
+
+    def hasChildren (self,parent=QtCore.QModelIndex()):
+
+        if parent.isValid():
+            v = parent.internalPointer().childVnode(parent.row())
+            return bool(v and v.children)
+        else:
+            return self.root.childCount() > 0
+
+    def index (self,row,column,parent=QtCore.QModelIndex()):
+
+        node = self.nodeForIndex(parent) if parent.isValid() else self.root
+        if node and column == 0 and 0 <= row < node.childCount():
+            return self.createIndex(row,0,node)
+        else:
+            return QtCore.QModelIndex()
+
+    def parent (self,index):
+
+        node = index.isValid() and index.internalPointer()
+        return self.indexForNode(node)
+
+    def rowCount (self,parent=QtCore.QModelIndex()):
+
+        if parent.column() > 0:
+            return 0
+        node = self.nodeForIndex(parent) if parent.isValid() else self.root
+        return node.childCount() if node else 0
+
+    def setData (self,index,value,role=QtCore.Qt.EditRole):
+
+        # onHeadChanged changes headlines when editing ends.
+        return False
+    #@+node:ekr.20130413052322.10453: *4* Nodes & indices (leoQtTreeModel)
+    def indexForNode (self,node):
+
+        '''Return the index of node's row.'''
+
+        if node and node.parent and node.generation == self.generation:
+            return self.createIndex(node.row,0,node.parent)
+        else:
+            return QtCore.QModelIndex()
+
+    def nodeForIndex (self,index):
+
+        '''Return the node of the index's row, or None.'''
+
+        if index.isValid():
+            return index.internalPointer().child(index.row())
+        else:
+            return None
+
+    def nodeForPosition (self,p):
+
+        '''Return the node for p if the tree shows p, or None.
+
+        Like baseNativeTree, the tree shows the children of collapsed nodes
+        whose ancestors are expanded.'''
+
+        if not p:
+            return None
+        chain = [z.copy() for z in p.self_and_parents()]
+        chain.reverse()
+        root = self.root
+        for i,z in enumerate(chain):
+            row = root.rowsDict.get(z.key())
+            if row is not None:
+                break
+        else:
+            return None
+        node = root.child(row)
+        for j in range(i+1,len(chain)):
+            # node is the parent of chain[j]: only p's parent may be collapsed.
+            if j < len(chain)-1 and not node.v.isExpanded():
+                return None
+            z = chain[j]
+            node = node.child(z.childIndex())
+            if not node or node.v is not z.v:
+                return None
+        return node
+
+    def nodesForVnode (self,v):
+
+        '''Return the nodes of v. Rows without nodes get repainted.'''
+
+        result = [] ; todo = [self.root]
+        while todo:
+            node = todo.pop()
+            for child in node.children.values():
+                if child.v is v:
+                    result.append(child)
+                todo.append(child)
+        return result
+
+    def resetNodes (self,positions):
+
+        '''Show the given top-level positions, forgetting all nodes.'''
+
+        old = self.root # Keep the nodes alive until the view forgets them.
+        self.beginResetModel()
+        self.generation += 1
+        self.root = leoQtTreeNode(self,None,0,None,positions)
+        self.endResetModel()
+        old.children = {}
+
+    def updateNode (self,node):
+
+        '''Repaint the row of node.'''
+
+        if node and node.generation == self.generation:
+            index = self.indexForNode(node)
+            self.emit(QtCore.SIGNAL(
+                "dataChanged(QModelIndex,QModelIndex)"),index,index)
+    #@-others
+#@+node:ekr.20130413052322.10454: *3* class leoQtTreeNode
+class leoQtTreeNode:
+
+    '''A row of a leoQtTreeModel that has been asked for its children, or
+    whose position Leo's core needs. The root node represents the
+    top-level positions.'''
+
+    def __init__ (self,model,parent,row,p,positions=None):
+
+        self.children = {} # Keys are rows, values are nodes.
+        self.generation = model.generation
+        self.model = model
+        self.p = p # None for the root.
+        self.parent = parent # None for the root.
+        self.positions = positions # The top-level positions, for the root.
+        self.row = row
+        self.v = p and p.v
+        if positions is not None:
+            self.rowsDict = dict([(z.key(),i) for i,z in enumerate(positions)])
+
+    def __repr__ (self):
+        return 'leoQtTreeNode: %s' % (self.v and self.v.h)
+
+    def childCount (self):
+        if self.v: return len(self.v.children)
+        else:      return len(self.positions)
+
+    def childVnode (self,row):
+        if self.v:
+            aList = self.v.children
+            return aList[row] if 0 <= row < len(aList) else None
+        else:
+            aList = self.positions
+            return aList[row].v if 0 <= row < len(aList) else None
+
+    def childPosition (self,row):
+        if self.v:
+            return self.p.copy().moveToNthChild(row)
+        else:
+            return self.positions[row].copy()
+
+    def child (self,row):
+        node = self.children.get(row)
+        if not node and self.childVnode(row):
+            node = leoQtTreeNode(self.model,self,row,self.childPosition(row))
+            self.children[row] = node
+        return node
 #@+node:ekr.20110605121601.18438: *3* class leoQtTreeTab
 class leoQtTreeTab:
 
@@ -9527,9 +9951,23 @@ class leoQtSyntaxHighlighter(QtGui.QSyntaxHighlighter):
         # Not all versions of Qt have the crucial currentBlock method.
         self.hasCurrentBlock = hasattr(self,'currentBlock')
 
+        # Incremental coloring: see colorPendingLines.
+        # rehighlightBlock exists in Qt 4.6 and above.
+        budget = c.config.getInt('qt_colorizer_budget') or 0
+        if budget > 0 and hasattr(self,'rehighlightBlock'):
+            self.budget = budget / 1000.0
+        else:
+            self.budget = 0
+        self.deadline = None # The time after which highlightBlock defers lines.
+        self.pending = None # Cursors in the first and last deferred lines.
+
         # Init the base class.
         QtGui.QSyntaxHighlighter.__init__(self,w)
 
+        self.idleTimer = timer = QtCore.QTimer(self)
+        timer.setSingleShot(True)
+        timer.connect(timer,QtCore.SIGNAL("timeout()"),self.colorPendingLines)
+
         self.colorizer = colorizer
 
         self.colorer = jEditColorizer(c,
@@ -9543,12 +9981,18 @@ class leoQtSyntaxHighlighter(QtGui.QSyntaxHighlighter):
         trace = False and not g.unitTesting
 
         if self.hasCurrentBlock and not self.colorizer.killColorFlag:
+            if self.budget and self.mustDefer():
+                self.deferBlock()
+                return
+
             if g.isPython3:
                 s = str(s)
             else:
                 s = unicode(s)
 
             self.colorer.recolor(s)
+            if self.pending:
+                self.advancePending()
 
             v = self.c.p.v
             if hasattr(v,'colorCache') and v.colorCache and not self.colorizer.changingText:
@@ -9569,6 +10013,7 @@ class leoQtSyntaxHighlighter(QtGui.QSyntaxHighlighter):
         # Call the base class method, but *only*
         # if the crucial 'currentBlock' method exists.
         n = self.colorer.recolorCount
+        self.deadline = self.pending = None
         if self.colorizer.enabled and self.hasCurrentBlock:
             # Lock out onTextChanged.
             old_selecting = tree.selecting
@@ -9590,6 +10035,96 @@ class leoQtSyntaxHighlighter(QtGui.QSyntaxHighlighter):
         if trace:
             g.trace('recolors: %4s %2.3f sec' % (
                 self.colorer.recolorCount-n,time.time()-t1))
+    #@+node:ekr.20130413052322.10487: *4* Incremental coloring (leoQtSyntaxHighlighter)
+    #@+at
+    # Qt keeps the end state of each line in its block's userState, and stops
+    # coloring the lines after an edit at the first line whose end state does
+    # not change. A change that does affect the end state, like opening a
+    # triple-quoted string near the top of a large body, recolors every
+    # following line before Qt returns to the event loop.
+    # 
+    # When @int qt_colorizer_budget is positive, highlightBlock colors lines
+    # until the budget is spent, then *defers* lines: it keeps their old colors
+    # and their old end states, so Qt stops after the deferred line unless the
+    # line is part of the edit. QTextCursors in the first and last deferred
+    # lines follow later edits. colorPendingLines colors the deferred lines in
+    # chunks of the same budget at idle time, and Qt continues from them as
+    # usual while end states change.
+    #@+node:ekr.20130413052322.10488: *5* mustDefer
+    def mustDefer (self):
+
+        '''Return True if highlightBlock should defer the current line.'''
+
+        if self.colorizer.changingText or not self.colorizer.flag:
+            return False
+        elif self.deadline is None:
+            # The first line of a pass: an edited line or the first line
+            # of a full recolor. Never defer it.
+            self.deadline = time.time() + self.budget
+            self.idleTimer.start(0) # Ends the pass.
+            return False
+        else:
+            return time.time() > self.deadline
+    #@+node:ekr.20130413052322.10489: *5* deferBlock & advancePending
+    def deferBlock (self):
+
+        '''Keep the old colors and end state of the current line,
+        and add the line to the pending lines.'''
+
+        block = self.currentBlock()
+        for r in block.layout().additionalFormats():
+            self.setFormat(r.start,r.length,r.format)
+        n = block.position()
+        if self.pending:
+            start,end = self.pending
+            if n < start.position():
+                start.setPosition(n)
+            if n > end.position():
+                end.setPosition(n)
+        else:
+            self.pending = QtGui.QTextCursor(block),QtGui.QTextCursor(block)
+
+    def advancePending (self):
+
+        '''Remove the current line, just colored, from the pending lines
+        if it is the first pending line.'''
+
+        start,end = self.pending
+        block = self.currentBlock()
+        if block == start.block():
+            if block.position() >= end.block().position():
+                self.pending = None
+            else:
+                start.setPosition(block.next().position())
+    #@+node:ekr.20130413052322.10490: *5* colorPendingLines
+    def colorPendingLines (self):
+
+        '''Color pending lines until the budget is spent, and call this
+        method again at idle time if pending lines remain.
+
+        This also ends the pass of Qt that started the idle timer.'''
+
+        tree = self.c.frame.tree
+        self.deadline = time.time() + self.budget
+        # Lock out onTextChanged.
+        old_selecting = tree.selecting
+        try:
+            tree.selecting = True
+            while self.pending and time.time() < self.deadline:
+                block = self.pending[0].block()
+                if (
+                    not self.colorizer.enabled or
+                    self.colorizer.killColorFlag or
+                    not block.isValid()
+                ):
+                    self.pending = None
+                else:
+                    self.rehighlightBlock(block)
+        finally:
+            tree.selecting = old_selecting
+            self.deadline = None
+        if self.pending:
+            self.idleTimer.start(0)
     #@+node:ekr.20121003051050.10201: *4* rehighlight_with_cache (leoQtSyntaxHighlighter)
     def rehighlight_with_cache (self,bunch):
 
@@ -9725,6 +10260,7 @@ class jEditColorizer:
         self.rulesDict = {}
         # self.defineAndExtendForthWords()
         self.word_chars = {} # Inited by init_keywords().
+        self.word_re = None # Matches a run of word_chars.
         self.setFontFromConfig()
         self.tags = [
 
@@ -10161,12 +10697,17 @@ class jEditColorizer:
                 return True
         else:
             if trace: g.trace(language,rulesetName)
-            path = g.os_path_join(g.app.loadDir,'..','modes')
-            # Bug fix: 2008/2/10: Don't try to import a non-existent language.
-            fileName = g.os_path_join(path,'%s.py' % (language))
-            if g.os_path_exists(fileName):
-                mode = g.importFromPath (language,path)
-            else: mode = None
+            # Use the precompiled table of the mode if possible.
+            table = leoModes.getModeTable(language)
+            if table:
+                mode = table
+            else:
+                path = g.os_path_join(g.app.loadDir,'..','modes')
+                # Bug fix: 2008/2/10: Don't try to import a non-existent language.
+                fileName = g.os_path_join(path,'%s.py' % (language))
+                if g.os_path_exists(fileName):
+                    mode = g.importFromPath (language,path)
+                else: mode = None
 
             if mode:
                 # A hack to give modes/forth.py access to c.
@@ -10184,6 +10725,7 @@ class jEditColorizer:
                     rulesDict       = {},
                     rulesetName     = rulesetName,
                     word_chars      = self.word_chars, # 2011/05/21
+                    word_re         = self.word_re,
                 )
                 if trace: g.trace('***** No colorizer file: %s.py' % language)
                 self.rulesetName = rulesetName
@@ -10192,12 +10734,19 @@ class jEditColorizer:
             self.colorizer.language = language
             self.rulesetName = rulesetName
             self.properties = hasattr(mode,'properties') and mode.properties or {}
-            self.keywordsDict = hasattr(mode,'keywordsDictDict') and mode.keywordsDictDict.get(rulesetName,{}) or {}
-            self.setKeywords()
+            if table:
+                self.keywordsDict = table.getKeywordsDict(rulesetName)
+                self.setKeywords(table.keywordChars.get(rulesetName))
+            else:
+                self.keywordsDict = hasattr(mode,'keywordsDictDict') and mode.keywordsDictDict.get(rulesetName,{}) or {}
+                self.setKeywords()
             self.attributesDict = hasattr(mode,'attributesDictDict') and mode.attributesDictDict.get(rulesetName) or {}
             # if trace: g.trace(rulesetName,self.attributesDict)
             self.setModeAttributes()
-            self.rulesDict = hasattr(mode,'rulesDictDict') and mode.rulesDictDict.get(rulesetName) or {}
+            if table:
+                self.rulesDict = table.getRulesDict(rulesetName,self.__class__)
+            else:
+                self.rulesDict = hasattr(mode,'rulesDictDict') and mode.rulesDictDict.get(rulesetName) or {}
             # if trace: g.trace(self.rulesDict)
             self.addLeoRules(self.rulesDict)
             self.defaultColor = 'null'
@@ -10212,6 +10761,7 @@ class jEditColorizer:
                 rulesDict       = self.rulesDict,
                 rulesetName     = self.rulesetName,
                 word_chars      = self.word_chars, # 2011/05/21
+                word_re         = self.word_re,
             )
             # Do this after 'officially' initing the mode, to limit recursion.
             self.addImportedRules(mode,self.rulesDict,rulesetName)
@@ -10248,42 +10798,47 @@ class jEditColorizer:
         # g.trace(name,language,rulesetName)
         return language,rulesetName
     #@+node:ekr.20110605121601.18583: *6* setKeywords
-    def setKeywords (self):
+    def setKeywords (self,keywordChars=None):
 
         '''Initialize the keywords for the present language.
 
          Set self.word_chars ivar to string.letters + string.digits
-         plus any other character appearing in any keyword.'''
+         plus any other character appearing in any keyword.
+
+         keywordChars, if given, contains all the characters of the
+         language's keywords. Set self.word_re to match a run of word_chars.'''
 
         # Add any new user keywords to leoKeywordsDict.
         d = self.keywordsDict
-        keys = list(d.keys())
-        for s in g.globalDirectiveList:
-            key = '@' + s
-            if key not in keys:
+        leoKeys = ['@' + s for s in g.globalDirectiveList]
+        for key in leoKeys:
+            if key not in d:
                 d [key] = 'leokeyword'
 
-        # Create a temporary chars list.  It will be converted to a dict later.
-        chars = [g.toUnicode(ch) for ch in (string.ascii_letters + string.digits)]
+        # Create a temporary chars set.  It will be converted to a dict later.
+        chars = set(string.ascii_letters + string.digits)
 
-        for key in list(d.keys()):
-            for ch in key:
-                if ch not in chars:
-                    chars.append(g.toUnicode(ch))
+        if keywordChars is None:
+            for key in d:
+                chars.update(key)
+        else:
+            chars.update(keywordChars)
+            for key in leoKeys:
+                chars.update(key)
 
         # jEdit2Py now does this check, so this isn't really needed.
         # But it is needed for forth.py.
-        for ch in (' ', '\t'):
-            if ch in chars:
-                # g.es_print('removing %s from word_chars' % (repr(ch)))
-                chars.remove(ch)
+        chars.discard(' ')
+        chars.discard('\t')
 
         # g.trace(self.colorizer.language,[str(z) for z in chars])
 
         # Convert chars to a dict for faster access.
         self.word_chars = {}
         for z in chars:
+            z = g.toUnicode(z)
             self.word_chars[z] = z
+        self.word_re = leoModes.wordRegex(''.join(sorted(self.word_chars)))
     #@+node:ekr.20110605121601.18584: *6* setModeAttributes
     def setModeAttributes (self):
 
@@ -10322,6 +10877,7 @@ class jEditColorizer:
         self.rulesDict      = bunch.rulesDict
         self.rulesetName    = bunch.rulesetName
         self.word_chars     = bunch.word_chars # 2011/05/21
+        self.word_re        = bunch.word_re
     #@+node:ekr.20110605121601.18586: *6* updateDelimsTables
     def updateDelimsTables (self):
 
@@ -10825,9 +11381,8 @@ class jEditColorizer:
             return 0
 
         # Get the word as quickly as possible.
-        j = i ; n = len(s) ; chars = self.word_chars
-        while j < n and s[j] in chars:
-            j += 1
+        m = self.word_re.match(s,i)
+        j = m and m.end() or i
 
         word = s[i:j]
         assert word
@@ -11471,7 +12026,9 @@ class jEditColorizer:
                 else:
                     g.trace('** restart fail',fname,s)
         else:
-            g.trace('**** no restart f')
+            # Not an error: a line deferred by the highlighter may
+            # keep a state from before the last call to init.
+            if traceMatch: g.trace('**** no restart f')
             i = 0
 
         return i
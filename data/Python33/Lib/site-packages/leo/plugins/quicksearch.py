@@ -20,6 +20,17 @@ syntax, as documented in
 
 http://docs.python.org/library/re.html#regular-expression-syntax
 
+While you type, a background thread searches all headlines and body text and
+adds the hits to the list as it finds them. Typing more characters cancels the
+previous search. If the new pattern just extends the previous one (foo -> foob),
+only the hits of the previous search are searched again.
+
+Settings
+========
+
+- @int quicksearch-max-hits = 1000
+  The search stops after finding this many nodes.
+
 Commands
 ========
 
@@ -74,8 +85,7 @@ from PyQt4 import QtCore
 from PyQt4 import QtGui
 from PyQt4.QtCore import Qt
 
-import fnmatch, re
-
+from leo.plugins import quicksearch_engine
 from leo.plugins import threadutil
     # Bug fix. See: https://groups.google.com/forum/?fromgroups=#!topic/leo-editor/PAZloEsuk7g
 from leo.plugins import qt_quicksearch
@@ -330,9 +340,9 @@ class LeoQuickSearchWidget(QtGui.QWidget):
             self.scon.doSearch(t)
 
         if self.scon.its:
-            self.ui.listWidget.blockSignals(True) # don't jump to first hit
-            self.ui.listWidget.setFocus()
-            self.ui.listWidget.blockSignals(False) # ok, respond if user moves
+            self.scon.focusHits()
+        elif self.scon.serial is not None:
+            self.scon.focusPending = True # Focus the first hit found.
 
     def selectAndDismiss(self):
         self.hide()
@@ -357,78 +367,37 @@ class LeoQuickSearchWidget(QtGui.QWidget):
             self.scon.doShowMarked()
             return
                     
-        self.scon.worker.set_input(t)
+        self.scon.bgSearch(t)
         
         
         
 
     #@-others
-#@+node:ekr.20111014074810.15659: ** matchLines
-def matchlines(b, miter):
-
-    res = []
-    for m in miter:
-        st, en = g.getLine(b, m.start())
-        li = b[st:en].strip()
-        res.append((li, (m.start(), m.end() )))
-    return res
-
 #@+node:ville.20090314215508.12: ** QuickSearchController
-class QuickSearchController:
+class QuickSearchController(quicksearch_engine.QuickSearchEngine):
     
     #@+others
     #@+node:ekr.20111015194452.15685: *3* __init__
     def __init__(self,c,listWidget):
 
+        quicksearch_engine.QuickSearchEngine.__init__(self,c)
 
-        self.c = c
         self.lw = w = listWidget # A QListWidget.
         self.its = {} # Keys are id(w),values are tuples (p,pos)
-        self.worker = threadutil.UnitWorker()
 
         self.frozen = False    
-        def searcher(inp):
-            #print("searcher", inp)
-            if self.frozen:
-                return
-            exp = inp.replace(" ", "*")
-            res =  self.bgSearch(exp)
-            
-            return res
-            
-            
-        def dumper():
-            # always run on ui thread
-            if self.frozen:
-                return
-            out = self.worker.output
-            #print("dumper")
-            self.throttler.add(out)
-            
-            
-            
-        def throttledDump(lst):
-            """ dumps the last output """
-            #print "Throttled dump"
-            # we do get called with empty list on occasion
-            
-            if not lst:
-                return
-            if self.frozen: 
-                return
-            hm,bm = lst[-1]
-            self.clear()
-            self.addHeadlineMatches(hm)
-            self.addBodyMatches(bm)
+        self.focusPending = False # True: focus the list when hits appear.
+        self.maxHits = c.config.getInt('quicksearch-max-hits') or 1000
 
-            
-        self.throttler = threadutil.NowOrLater(throttledDump)        
-        
-        self.worker.set_worker(searcher)
-        #self.worker.set_output_f(dumper)
-        self.worker.resultReady.connect(dumper)
+        # The state of the latest search, besides the ivars of QuickSearchEngine.
+        self.serial = None # The serial number of a running background search.
+        self.header = None # The item showing the number of hits.
+        self.nHeadItems = 0 # The number of headline hits, shown after the header.
+
+        self.worker = threadutil.BatchWorker()
+        self.worker.set_worker(self.searchBatches)
+        self.worker.batchReady.connect(self.onBatch)
         self.worker.start()
-        
 
         # we want both single-clicks and activations (press enter)
         w.connect(w,
@@ -458,7 +427,7 @@ class QuickSearchController:
             it.setFont(f)
 
             self.its[id(it)] = (p, None)
-            ms = matchlines(p.b, p.matchiter)
+            ms = quicksearch_engine.matchlines(p.b, p.matchiter)
             for ml, pos in ms:
                 #print "ml",ml,"pos",pos
                 it = QListWidgetItem(ml, self.lw)   
@@ -483,8 +452,14 @@ class QuickSearchController:
     #@+node:ekr.20111015194452.15691: *3* clear
     def clear(self):
 
+        if self.serial is not None:
+            self.worker.cancel()
+            self.serial = None
+        quicksearch_engine.QuickSearchEngine.clear(self)
         self.its = {}
         self.lw.clear()
+        self.header = None
+        self.nHeadItems = 0
 
     #@+node:ekr.20111015194452.15693: *3* doNodeHistory
     def doNodeHistory(self):
@@ -504,46 +479,97 @@ class QuickSearchController:
     #@+node:ekr.20111015194452.15692: *3* doSearch
     def doSearch(self, pat):
 
-        self.clear()
-
-        if not pat.startswith('r:'):
-            hpat = fnmatch.translate('*'+ pat + '*').replace(r"\Z(?ms)","")
-            bpat = fnmatch.translate(pat).rstrip('$').replace(r"\Z(?ms)","")
-            flags = re.IGNORECASE
-        else:
-            hpat = pat[2:]
-            bpat = pat[2:]
-            flags = 0
-
-        hm = self.c.find_h(hpat, flags)
-        self.addHeadlineMatches(hm)
-        bm = self.c.find_b(bpat, flags)
-        self.addBodyMatches(bm)
+        if pat == self.pattern and self.done:
+            return # The list already shows all hits.
 
-        self.lw.insertItem(0, "%d hits"%self.lw.count())
+        self.startSearch(pat)
     #@+node:ville.20121118193144.3620: *3* bgSearch
     def bgSearch(self, pat):
 
-        #self.clear()
-
         if self.frozen:
             return
-            
-        if not pat.startswith('r:'):
-            hpat = fnmatch.translate('*'+ pat + '*').replace(r"\Z(?ms)","")
-            bpat = fnmatch.translate(pat).rstrip('$').replace(r"\Z(?ms)","")
-            flags = re.IGNORECASE
+
+        pat = pat.replace(" ", "*")
+        if pat == self.pattern:
+            return
+
+        self.startSearch(pat)
+    #@+node:ekr.20130413052322.10306: *3* Background search
+    #@+node:ekr.20130413052322.10307: *4* startSearch
+    def startSearch(self, pat):
+
+        """ Clear the list and start a background search for pat. """
+
+        query = self.beginSearch(pat)
+        if query:
+            self.header = QListWidgetItem("searching...", self.lw)
+            self.serial = self.worker.set_input(query)
+    #@+node:ekr.20130413052322.10310: *4* onBatch & helpers
+    def onBatch(self, serial, batch):
+
+        """ Show a batch of hits from the worker, or finish the search. """
+
+        if serial != self.serial:
+            return # A stale batch of a cancelled search.
+
+        if batch is None:
+            self.finishSearch()
         else:
-            hpat = pat[2:]
-            bpat = pat[2:]
-            flags = 0
-
-        hm = self.c.find_h(hpat, flags)
-        #self.addHeadlineMatches(hm)
-        #bm = self.c.find_b(bpat, flags)
-        #self.addBodyMatches(bm)
-        return hm, []
-        #self.lw.insertItem(0, "%d hits"%self.lw.count())
+            self.addHits(batch)
+            if len(self.hits) >= self.maxHits:
+                self.worker.cancel()
+                self.truncated = True
+                self.finishSearch()
+
+    def addHits(self, hits):
+
+        c = self.c
+        self.lw.setUpdatesEnabled(False)
+        for v, hm, lines in hits:
+            p = c.vnode2position(v)
+            if not p:
+                continue # v was deleted after it was searched.
+            self.hits.append((v, hm, lines))
+            if hm:
+                # Insert the headline hits before all body hits.
+                it = QListWidgetItem(v.h)
+                f = it.font()
+                f.setBold(True)
+                it.setFont(f)
+                self.lw.insertItem(1 + self.nHeadItems, it)
+                self.its[id(it)] = (p, None)
+                self.nHeadItems += 1
+            if lines:
+                it = QListWidgetItem(v.h, self.lw)
+                f = it.font()
+                f.setBold(True)
+                it.setFont(f)
+                self.its[id(it)] = (p, None)
+                for ml, pos in lines:
+                    it = QListWidgetItem(ml, self.lw)   
+                    self.its[id(it)] = (p, pos)
+        self.lw.setUpdatesEnabled(True)
+        if self.focusPending and self.its:
+            self.focusPending = False
+            self.focusHits()
+
+    def finishSearch(self):
+
+        self.serial = None
+        self.done = True
+        self.focusPending = False
+        if self.header:
+            s = "%d hits" % (self.lw.count() - 1)
+            if self.truncated:
+                s = s + " (stopped after %d nodes)" % len(self.hits)
+            self.header.setText(s)
+    #@+node:ekr.20130413052322.10311: *4* focusHits
+    def focusHits(self):
+
+        lw = self.lw
+        lw.blockSignals(True) # don't jump to first hit
+        lw.setFocus()
+        lw.blockSignals(False) # ok, respond if user moves
     #@+node:ekr.20111015194452.15687: *3* doShowMarked
     def doShowMarked(self):
 
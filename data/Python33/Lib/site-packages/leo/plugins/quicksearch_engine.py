@@ -0,0 +1,155 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20130413052322.10503: * @file quicksearch_engine.py
+""" The gui-independent part of the quicksearch plugin.
+
+QuickSearchEngine searches headlines and bodies in batches. The quicksearch
+plugin runs these searches in a worker thread and shows the hits in the Nav
+tab. Unit tests can use QuickSearchEngine without a Qt gui. """
+
+#@@language python
+#@@tabwidth -4
+
+import leo.core.leoGlobals as g
+
+import fnmatch, re, time
+
+#@+others
+#@+node:ekr.20111014074810.15659: ** matchLines
+def matchlines(b, miter):
+
+    res = []
+    for m in miter:
+        st, en = g.getLine(b, m.start())
+        li = b[st:en].strip()
+        res.append((li, (m.start(), m.end() )))
+    return res
+#@+node:ekr.20130413052322.10504: ** class QuickSearchEngine
+class QuickSearchEngine:
+
+    """ The state of the latest quicksearch and the code that finds its hits. """
+
+    #@+others
+    #@+node:ekr.20130413052322.10505: *3* __init__ & clear
+    def __init__(self, c):
+
+        self.c = c
+
+        # The state of the latest search.
+        self.pattern = None # The pattern of the search shown in the list.
+        self.hits = [] # Tuples (v,headline matched,body lines) for all hits.
+        self.done = False # True: self.hits contains all hits.
+        self.truncated = False # True: the search stopped after maxHits hits.
+        self.generation = None # c.outlineGeneration when the search started.
+
+    def clear(self):
+
+        self.pattern = None
+        self.hits = []
+        self.done = self.truncated = False
+    #@+node:ekr.20130413052322.10506: *3* beginSearch
+    def beginSearch(self, pat):
+
+        """ Forget the previous search, except for its reusable hits, and
+        return the query for a search for pat, or None. """
+
+        query = self.makeQuery(pat, self.reusableNodes(pat))
+        self.clear()
+        self.pattern = pat
+        self.generation = self.c.outlineGeneration
+        return query
+    #@+node:ekr.20130413052322.10498: *3* reusableNodes
+    def reusableNodes(self, pat):
+
+        """ Return the nodes of all hits of the previous search if they
+        include all hits of pat, or None.
+
+        c.outlineGeneration changes whenever any headline, body or link
+        changes, so the previous hits are stale if it has changed. """
+
+        if (self.done and not self.truncated and self.pattern and
+            pat.startswith(self.pattern) and not pat.startswith('r:') and
+            '[' not in pat and
+            self.generation == self.c.outlineGeneration
+        ):
+            # Every hit of pat is also a hit of the previous pattern.
+            return [z[0] for z in self.hits]
+        else:
+            return None
+    #@+node:ekr.20130413052322.10308: *3* makeQuery
+    def makeQuery(self, pat, nodes=None):
+
+        """ Return a g.Bunch describing a search for pat,
+        or None if pat is not a valid regexp. """
+
+        if not pat.startswith('r:'):
+            hpat = fnmatch.translate('*'+ pat + '*').replace(r"\Z(?ms)","")
+            bpat = fnmatch.translate(pat).rstrip('$').replace(r"\Z(?ms)","")
+            flags = re.IGNORECASE
+        else:
+            hpat = pat[2:]
+            bpat = pat[2:]
+            flags = 0
+
+        try:
+            hre = re.compile(hpat, flags)
+            bre = re.compile(bpat, flags)
+        except Exception:
+            return None # The user has not finished typing the regexp.
+
+        # Compute the candidates here: the index is not thread safe.
+        candidates = None
+        index = self.c.searchIndex
+        if index and nodes is None:
+            heads = index.candidates(hre.pattern, regexp=True, flags=hre.flags)
+            bodies = index.candidates(bre.pattern, regexp=True, flags=bre.flags)
+            if heads and bodies:
+                candidates = heads[0] | bodies[1]
+
+        return g.Bunch(hre=hre, bre=bre, nodes=nodes, candidates=candidates)
+    #@+node:ekr.20130413052322.10309: *3* searchBatches & allNodes (worker thread)
+    def searchBatches(self, query):
+
+        """ Yield lists of hits (v, headline matched, body lines) for query.
+
+        Runs in the worker thread, so it must not change the outline. The
+        empty lists let the worker cancel the search. """
+
+        hre, bre, candidates = query.hre, query.bre, query.candidates
+        nodes = query.nodes
+        if nodes is None:
+            nodes = self.allNodes()
+        hits, n, t = [], 0, time.time()
+        for v in nodes:
+            if candidates is None or v in candidates:
+                b = v.b
+                lines = matchlines(b, bre.finditer(b))
+                hm = hre.match(v.h) is not None
+                if hm or lines:
+                    hits.append((v, hm, lines))
+            n += 1
+            if n % 100 == 0:
+                if hits and (len(hits) >= 100 or time.time() - t > 0.1):
+                    yield hits
+                    hits, t = [], time.time()
+                else:
+                    yield []
+        yield hits
+
+    def allNodes(self):
+
+        """ Yield all vnodes once, in outline order.
+
+        Unlike c.all_unique_nodes, this does not use positions, so changes
+        to the outline made by the ui thread can not break the traversal. """
+
+        seen = set()
+        stack = list(reversed(self.c.hiddenRootNode.children))
+        while stack:
+            v = stack.pop()
+            if v not in seen:
+                seen.add(v)
+                yield v
+                stack.extend(reversed(v.children))
+    #@-others
+#@-others
+#@-leo
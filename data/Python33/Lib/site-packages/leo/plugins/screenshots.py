@@ -315,6 +315,7 @@ the @slideshow tree whose sanitized name is
 #@-<< docstring >>
 # To do: create _static folder.
 __version__ = '1.0.3'
+lazy_load = True # Load this plugin when one of its commands is first used.
 #@+<< imports >>
 #@+node:ekr.20100908110845.5604: ** << imports >>
 import leo.core.leoGlobals as g
@@ -54,6 +54,7 @@ process for each one.
 #@-<< docstring >>
 
 __version__ = '0.0'
+lazy_load = True # Load this plugin when one of its commands is first used.
 
 #@+<< imports >>
 #@+node:vivainio2.20091008133028.5823: ** << imports >>
@@ -6,6 +6,7 @@
 from PyQt4 import QtCore, QtGui
 import logging
 import time
+import traceback
 #log = logging.getLogger("out")
 
 #@+others
@@ -221,6 +222,74 @@ class UnitWorker(QtCore.QThread):
 
 
         
+    #@-others
+#@+node:ekr.20130413052322.10300: ** class BatchWorker
+class BatchWorker(QtCore.QThread):
+    """ Stream the results for the latest input, cancelling stale work.
+
+    The worker function takes an input and returns an iterable of batches
+    (lists). Every non-empty batch is emitted with batchReady(serial, batch),
+    followed by batchReady(serial, None) when the iterable is exhausted.
+    set_input and cancel stop the current work at the next batch, so the
+    worker function should yield empty lists now and then during long scans.
+    """
+
+    batchReady = QtCore.pyqtSignal(object, object)
+
+    #@+others
+    #@+node:ekr.20130413052322.10301: *3* __init__
+    def __init__(self):
+        QtCore.QThread.__init__(self)
+        self.cond = QtCore.QWaitCondition()
+        self.mutex = QtCore.QMutex()
+        self.input = None
+        self.serial = 0
+        self.worker = None
+
+    #@+node:ekr.20130413052322.10302: *3* set_worker
+    def set_worker(self,f):
+        self.worker = f
+
+    #@+node:ekr.20130413052322.10303: *3* set_input & cancel
+    def set_input(self, inp):
+        """ Start work on inp, return the serial number of its batches """
+        m = self.mutex
+        m.lock()
+        self.serial += 1
+        self.input = inp
+        serial = self.serial
+        self.cond.wakeAll()
+        m.unlock()
+        return serial
+
+    def cancel(self):
+        m = self.mutex
+        m.lock()
+        self.serial += 1
+        self.input = None
+        m.unlock()
+
+    #@+node:ekr.20130413052322.10304: *3* run
+    def run(self):
+        m = self.mutex
+        while 1:
+            m.lock()
+            while self.input is None:
+                self.cond.wait(m)
+            inp, serial = self.input, self.serial
+            self.input = None
+            m.unlock()
+            try:
+                for batch in self.worker(inp):
+                    if serial != self.serial:
+                        break
+                    if batch:
+                        self.batchReady.emit(serial, batch)
+                else:
+                    self.batchReady.emit(serial, None)
+            except Exception:
+                traceback.print_exc()
+
     #@-others
 #@+node:ekr.20121126095734.12443: ** main
 def main():